@@ -118,7 +118,8 @@ def gis_update_location_tree(feature, user_id=None):
         Update the Location Tree for a feature
             - will normally be done Asynchronously if there is a worker alive
 
-        @param feature: the feature (in JSON format)
+        @param feature: the feature (in JSON format), or null to
+                        rebuild the whole tree (in bulk)
         @param user_id: calling request's auth.user.id or None
     """
     if user_id:
@@ -146,6 +147,51 @@ def org_site_check(site_id, user_id=None):
         customise(site_id)
         db.commit()
 
+# -----------------------------------------------------------------------------
+def s3_text_index_rebuild(tablename=None, user_id=None):
+    """
+        Rebuild full-text indexes
+
+        @param tablename: the indexed table, or null to rebuild the
+                          indexes of all configured tables
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+
+    from s3 import S3TextIndex
+    if tablename:
+        tablenames = [tablename]
+    else:
+        tablenames = list(S3TextIndex.config().keys())
+    for tablename in tablenames:
+        S3TextIndex(tablename).rebuild()
+        db.commit()
+
+# -----------------------------------------------------------------------------
+def s3_name_tokens_rebuild(tablename=None, user_id=None):
+    """
+        Rebuild the name token index for autocompletes
+
+        @param tablename: the indexed table, or null to rebuild the
+                          tokens for all indexed tables
+        @param user_id: calling request's auth.user.id or None
+    """
+    if user_id:
+        # Authenticate
+        auth.s3_impersonate(user_id)
+
+    from s3 import S3NameTokens
+    S3NameTokens.create_indexes()
+    if tablename:
+        tablenames = [tablename]
+    else:
+        tablenames = list(S3NameTokens.FIELDS.keys())
+    for tablename in tablenames:
+        S3NameTokens(tablename).rebuild()
+        db.commit()
+
 # -----------------------------------------------------------------------------
 tasks = {"dummy": dummy,
          "s3db_task": s3db_task,
@@ -154,6 +200,8 @@ tasks = {"dummy": dummy,
          "gis_download_kml": gis_download_kml,
          "gis_update_location_tree": gis_update_location_tree,
          "org_site_check": org_site_check,
+         "s3_text_index_rebuild": s3_text_index_rebuild,
+         "s3_name_tokens_rebuild": s3_name_tokens_rebuild,
          }
 
 # =============================================================================
@@ -289,6 +337,42 @@ if has_module("inv"):
 
     tasks["inv_req_add_from_template"] = inv_req_add_from_template
 
+    # -------------------------------------------------------------------------
+    def inv_stock_ledger_rebuild(user_id=None):
+        """
+            Rebuild (backfill) the Stock Movement Ledger
+        """
+        if user_id:
+            # Authenticate
+            auth.s3_impersonate(user_id)
+
+        # Run the Task & return the result
+        from s3db.inv import inv_stock_ledger_rebuild
+        result = inv_stock_ledger_rebuild()
+        db.commit()
+        return result
+
+    tasks["inv_stock_ledger_rebuild"] = inv_stock_ledger_rebuild
+
+    # -------------------------------------------------------------------------
+    def inv_stock_ledger_check(user_id=None):
+        """
+            Check the Stock Movement Ledger against the transactions
+        """
+        if user_id:
+            # Authenticate
+            auth.s3_impersonate(user_id)
+
+        # Run the Task & return the result
+        from s3db.inv import inv_stock_ledger_check
+        inconsistencies = inv_stock_ledger_check()
+        for inv_item_id, date, ledger, transactions in inconsistencies:
+            current.log.warning("Stock Ledger inconsistent for inv_item %s on %s: %s != %s" % \
+                                (inv_item_id, date, ledger, transactions))
+        return len(inconsistencies)
+
+    tasks["inv_stock_ledger_check"] = inv_stock_ledger_check
+
 # =============================================================================
 if has_module("msg"):
 
@@ -413,10 +497,12 @@ if has_module("msg"):
     # -------------------------------------------------------------------------
     def notify_notify(resource_id, user_id=None):
         """
-            Asynchronous task to notify a subscriber about resource
+            Asynchronous task to notify subscribers about resource
             updates. This task is created by notify_check_subscriptions.
 
-            @param resource_id: the pr_subscription_resource record ID
+            @param resource_id: the pr_subscription_resource record ID,
+                                or a list of record IDs of subscriptions
+                                to the same resource and filter
         """
         if user_id:
             auth.s3_impersonate(user_id)
@@ -407,6 +407,15 @@ if len(pop_list) > 0:
     field = "last_name"
     db.executesql("CREATE INDEX %s__idx on %s(%s);" % (field, tablename, field))
 
+    # Name tokens for autocompletes
+    if settings.get_search_name_tokens():
+        s3base.S3NameTokens.create_indexes()
+
+    # Stock movement ledger
+    if has_module("inv") and settings.get_inv_stock_ledger():
+        db.executesql("CREATE INDEX inv_stock_movement_item_idx on inv_stock_movement(inv_item_id,date);")
+        db.executesql("CREATE INDEX inv_stock_movement_site_idx on inv_stock_movement(site_id,item_id,date);")
+
     # GIS
     # Add extra index on search field
     # Should work for our 3 supported databases: sqlite, MySQL & PostgreSQL
@@ -67,6 +67,9 @@ from .s3task import *
 # Hierarchy Handling
 from .s3hierarchy import *
 
+# Full-Text Index
+from .s3textindex import *
+
 # Core Framework ==============================================================
 
 # Model Extensions
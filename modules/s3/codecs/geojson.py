@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+"""
+    S3 GeoJSON codec
+
+    @copyright: 2021 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__all__ = ("S3GeoJSON",)
+
+import json
+
+from gluon import current
+
+from ..s3codec import S3Codec
+from ..s3utils import s3_str
+
+SEPARATORS = (",", ":")
+
+# =============================================================================
+class S3GeoJSON(S3Codec):
+    """
+        Native GeoJSON encoder for feature layers, producing the same
+        output as S3XML + static/formats/geojson/export.xsl, but without
+        building (and transforming) an element tree
+    """
+
+    # Tables which require special handling in the XSLT stylesheet
+    SPECIAL = ("gis_cache",
+               "gis_feature_query",
+               "gis_location",
+               "gis_theme_data",
+               )
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def supported(cls, resource):
+        """
+            Check whether a resource can be exported with this codec,
+            or otherwise requires the XSLT stylesheet
+
+            @param resource: the S3Resource
+
+            @returns: True|False
+        """
+
+        tablename = resource.tablename
+        if tablename in cls.SPECIAL or \
+           tablename.startswith("gis_layer_shapefile"):
+            return False
+
+        return True
+
+    # -------------------------------------------------------------------------
+    def encode(self, resource, **attr):
+        """
+            Export a resource as GeoJSON
+
+            @param resource: the S3Resource
+            @param attr: export parameters, see iterencode
+
+            @returns: the GeoJSON as string
+        """
+
+        return "".join(self.iterencode(resource, **attr))
+
+    # -------------------------------------------------------------------------
+    def iterencode(self,
+                   resource,
+                   start = None,
+                   limit = None,
+                   orderby = None,
+                   location_data = None,
+                   map_data = None,
+                   ):
+        """
+            Export a resource as GeoJSON, producing the output in chunks
+            of one Feature at a time
+
+            @param resource: the S3Resource
+            @param start: index of the first record to export (slicing)
+            @param limit: maximum number of records to export (slicing)
+            @param orderby: orderby-expression for the records
+            @param location_data: dictionary of location data which has
+                                  been looked-up in bulk (default: from
+                                  gis.get_location_data)
+            @param map_data: dictionary of options which can be read by the map
+
+            @returns: generator of JSON strings
+        """
+
+        resource.load(start = start,
+                      limit = limit,
+                      orderby = orderby,
+                      )
+
+        if location_data is None:
+            location_data = current.gis.get_location_data(resource,
+                                                          count = resource.count(),
+                                                          )
+            if not location_data:
+                location_data = {}
+
+        rows = resource._rows
+        if not rows:
+            yield "{}"
+            return
+
+        pkey = resource._id.name
+        features = self.features(resource.tablename, location_data)
+
+        if len(rows) == 1:
+            # Single record with no more than one geometry is encoded
+            # as a single Feature rather than as a FeatureCollection
+            items = list(features(rows[0][pkey]))
+            if len(items) == 1:
+                yield items[0]
+                return
+            elif not items:
+                yield "{}"
+                return
+            items = iter(items)
+        else:
+            items = None
+
+        if map_data:
+            header = '{"type":"FeatureCollection","s3":%s,"features":[' % \
+                     json.dumps(map_data, separators=SEPARATORS)
+        else:
+            header = '{"type":"FeatureCollection","features":['
+        yield header
+
+        first = True
+        for row in rows:
+            for feature in items if items else features(row[pkey]):
+                if first:
+                    first = False
+                    yield feature
+                else:
+                    yield ",%s" % feature
+        yield "]}"
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def features(cls, tablename, location_data):
+        """
+            Get a function to encode the features for a record
+
+            @param tablename: the table name
+            @param location_data: the location data from
+                                  gis.get_location_data
+
+            @returns: function(record_id) returning a generator of
+                      Features (as JSON strings)
+        """
+
+        location_data_get = location_data.get
+
+        geojsons = location_data_get("geojsons", {}).get(tablename)
+        latlons = location_data_get("latlons", {}).get(tablename)
+        attributes = location_data_get("attributes", {}).get(tablename)
+        markers = location_data_get("markers", {}).get(tablename)
+        styles = location_data_get("styles", {}).get(tablename)
+
+        if geojsons is None and latlons is None:
+            raise RuntimeError("Bulk lookup of GeoJSON or Lat/Lon data failed for %s" % tablename)
+
+        marker = None
+        if markers and markers.get("image"):
+            # Single Marker for all features
+            marker = cls.marker(markers)
+            markers = None
+
+        encode_properties = cls.properties
+
+        def features(record_id):
+
+            attrs = attributes.get(record_id) if attributes else None
+            style = styles.get(record_id) if styles else None
+
+            if geojsons is not None:
+                geometries = geojsons.get(record_id)
+                if not geometries:
+                    return
+                if markers:
+                    m = markers.get(record_id)
+                    m = cls.marker(m) if m else None
+                else:
+                    m = marker
+                properties = encode_properties(record_id, attrs, m, style)
+                for geometry in geometries:
+                    if geometry and geometry != "null":
+                        yield '{"type":"Feature","geometry":%s,"properties":%s}' % \
+                              (geometry, properties)
+            else:
+                latlon = latlons.get(record_id)
+                if not latlon:
+                    return
+                lat, lon = latlon[:2]
+                if lat is None or lon is None:
+                    return
+                # Lat/Lon features have no per-feature marker
+                properties = encode_properties(record_id, attrs, None, style)
+                yield '{"type":"Feature","geometry":{"type":"Point","coordinates":[%.4f,%.4f]},"properties":%s}' % \
+                      (lon, lat, properties)
+
+        return features
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def marker(m):
+        """
+            Encode a marker as feature properties
+
+            @param m: the marker dict (image, height, width)
+
+            @returns: dict of properties
+        """
+
+        # Assume being used within the Sahana Mapping client
+        # so use local URLs to keep filesize down
+        return {"marker_url": "/%s/static/img/markers/%s" % (current.request.application,
+                                                             m["image"],
+                                                             ),
+                "marker_height": str(m["height"]),
+                "marker_width": str(m["width"]),
+                }
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def properties(record_id, attributes=None, marker=None, style=None):
+        """
+            Encode the properties of a feature
+
+            @param record_id: the record ID
+            @param attributes: the attributes dict from gis.get_location_data
+            @param marker: the marker properties
+            @param style: the style (JSON string)
+
+            @returns: the properties as JSON string
+        """
+
+        properties = dict(marker) if marker else {}
+        properties["id"] = record_id
+
+        if attributes:
+            for key, value in attributes.items():
+                if isinstance(value, str):
+                    pass
+                elif isinstance(value, bool) or value is None:
+                    # Not numeric => text representation of the JSON value
+                    value = json.dumps(value)
+                elif isinstance(value, (int, float)):
+                    if int(value) == value:
+                        value = int(value)
+                else:
+                    value = s3_str(value)
+                properties[key] = value
+
+        output = json.dumps(properties, separators=SEPARATORS)
+        if style:
+            # Use pre-prepared JSON
+            output = '%s,"style":%s}' % (output[:-1], style)
+        return output
+
+# End =========================================================================
@@ -31,7 +31,12 @@
 __all__ = ("S3XLS",
            )
 
+import datetime
+import re
+
+from copy import copy
 from io import BytesIO
+from tempfile import TemporaryFile
 
 from gluon import HTTP, current
 from gluon.contenttype import contenttype
@@ -40,6 +45,9 @@ from gluon.storage import Storage
 from ..s3codec import S3Codec
 from ..s3utils import s3_str, s3_strip_markup, s3_get_foreign_key
 
+# Characters not allowed in XLSX cells (same as openpyxl)
+ILLEGAL_CHARACTERS = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+
 # =============================================================================
 class S3XLS(S3Codec):
     """
@@ -48,6 +56,11 @@ class S3XLS(S3Codec):
 
     # The xlwt library supports a maximum of 182 characters in a single cell
     MAX_CELL_SIZE = 182
+    # ...XLSX up to 32767
+    MAX_CELL_SIZE_XLSX = 32767
+
+    # Number of rows to extract from the resource at a time
+    PAGE_SIZE = 1000
 
     # Customizable styles
     COL_WIDTH_MULTIPLIER = 310
@@ -65,6 +78,7 @@ class S3XLS(S3Codec):
     ERROR = Storage(
         XLRD_ERROR = "XLS export requires python-xlrd module to be installed on server",
         XLWT_ERROR = "XLS export requires python-xlwt module to be installed on server",
+        OPENPYXL_ERROR = "XLSX export requires python-openpyxl module to be installed on server",
         )
 
     # -------------------------------------------------------------------------
@@ -92,19 +106,17 @@ class S3XLS(S3Codec):
         # setting = {field_selector: [LevelLabel, LevelLabel, ...]}
         expand_hierarchy = resource.get_config("xls_expand_hierarchy")
 
-        data = resource.select(list_fields,
-                               left = left,
-                               limit = None,
-                               count = True,
-                               getids = True,
-                               orderby = orderby,
-                               represent = True,
-                               show_links = False,
-                               raw_data = True if expand_hierarchy else False,
-                               )
-
-        rfields = data.rfields
-        rows = data.rows
+        # Extract the rows page by page while writing them
+        rows = S3XLSPages(resource,
+                          list_fields,
+                          page_size = self.PAGE_SIZE,
+                          left = left,
+                          orderby = orderby,
+                          represent = True,
+                          show_links = False,
+                          raw_data = True if expand_hierarchy else False,
+                          )
+        rfields = rows.rfields
 
         types = []
         lfields = []
@@ -117,7 +129,7 @@ class S3XLS(S3Codec):
                     levels = None
                 if levels:
                     num_levels = len(levels)
-                    colnames = self.expand_hierarchy(rfield, num_levels, rows)
+                    colnames = rows.expand_hierarchy(rfield, num_levels)
                     lfields.extend(colnames)
                     types.extend(["string"] * num_levels)
                     T = current.T
@@ -166,6 +178,10 @@ class S3XLS(S3Codec):
             @keyword use_colour: True to add colour to the cells, default False
             @keyword evenodd: render different background colours
                               for even/odd rows ("stripes")
+            @keyword xlsx: produce an XLSX file (Office Open XML) rather
+                           than XLS, rows are written in streaming fashion
+                           to a temporary file, so that memory use remains
+                           bounded and up to 1,048,576 rows fit into a sheet
         """
 
         # Do not redirect from here!
@@ -185,9 +201,16 @@ class S3XLS(S3Codec):
             current.log.error(error)
             raise HTTP(503, body=error)
 
-        import datetime
+        xlsx = attr.get("xlsx", False)
+        if xlsx:
+            try:
+                import openpyxl
+            except ImportError:
+                error = self.ERROR.OPENPYXL_ERROR
+                current.log.error(error)
+                raise HTTP(503, body=error)
 
-        MAX_CELL_SIZE = self.MAX_CELL_SIZE
+        MAX_CELL_SIZE = self.MAX_CELL_SIZE_XLSX if xlsx else self.MAX_CELL_SIZE
         COL_WIDTH_MULTIPLIER = self.COL_WIDTH_MULTIPLIER
 
         # Get the attributes
@@ -221,12 +244,13 @@ class S3XLS(S3Codec):
 
         # Verify columns in items
         request = current.request
-        if len(rows) > 0 and len(lfields) > len(rows[0]):
+        first_row = next(iter(rows), None)
+        if first_row is not None and len(lfields) > len(first_row):
             msg = """modules/s3/codecs/xls: There is an error in the list items, a field doesn't exist
 requesting url %s
 Headers = %d, Data Items = %d
 Headers     %s
-List Fields %s""" % (request.url, len(lfields), len(rows[0]), headers, lfields)
+List Fields %s""" % (request.url, len(lfields), len(first_row), headers, lfields)
             current.log.error(msg)
 
         # Grouping
@@ -252,13 +276,20 @@ List Fields %s""" % (request.url, len(lfields), len(rows[0]), headers, lfields)
                               )
 
         # Create the workbook
-        book = xlwt.Workbook(encoding = "utf-8")
+        if xlsx:
+            book = openpyxl.Workbook(write_only = True)
+            add_sheet = lambda name: S3XLSXSheet(book.create_sheet(name))
+            # XLSX exports are limited to 1048576 rows per sheet
+            row_limit = 1048576
+        else:
+            book = xlwt.Workbook(encoding = "utf-8")
+            add_sheet = book.add_sheet
+            # XLS exports are limited to 65536 rows per sheet
+            row_limit = 65536
 
         # Add sheets
         sheets = []
-        # XLS exports are limited to 65536 rows per sheet, we bypass
-        # this by creating multiple sheets
-        row_limit = 65536
+        # We bypass the row limit by creating multiple sheets
         sheetnum = len(rows) / row_limit
         # Can't have a / in the sheet_name, so replace any with a space
         sheet_name = s3_str(title.replace("/", " "))
@@ -268,9 +299,15 @@ List Fields %s""" % (request.url, len(lfields), len(rows[0]), headers, lfields)
             sheet_name = sheet_name[:28]
         count = 1
         while len(sheets) <= sheetnum:
-            sheets.append(book.add_sheet("%s-%s" % (sheet_name, count)))
+            sheets.append(add_sheet("%s-%s" % (sheet_name, count)))
             count += 1
 
+        # Freeze the first row
+        # NB in XLSX, sheet settings must be applied before writing rows
+        for sheet in sheets:
+            sheet.panes_frozen = True
+            sheet.horz_split_pos = 1
+
         if callable(title_row):
             # Calling with sheet None to get the number of title rows
             title_row_length = title_row(None)
@@ -509,13 +546,15 @@ List Fields %s""" % (request.url, len(lfields), len(rows[0]), headers, lfields)
                     current_sheet.col(write_col_index).width = width
                 col_index += 1
 
-        # Additional sheet settings
-        for sheet in sheets:
-            sheet.panes_frozen = True
-            sheet.horz_split_pos = 1
-
         # Write output
-        output = BytesIO()
+        if xlsx:
+            for sheet in sheets:
+                sheet.close()
+            output = TemporaryFile()
+            extension = ".xlsx"
+        else:
+            output = BytesIO()
+            extension = ".xls"
         book.save(output)
         output.seek(0)
 
@@ -523,12 +562,17 @@ List Fields %s""" % (request.url, len(lfields), len(rows[0]), headers, lfields)
             return output
 
         # Response headers
-        filename = "%s_%s.xls" % (request.env.server_name, title)
+        filename = "%s_%s%s" % (request.env.server_name, title, extension)
         disposition = "attachment; filename=\"%s\"" % filename
         response = current.response
-        response.headers["Content-Type"] = contenttype(".xls")
+        response.headers["Content-Type"] = contenttype(extension)
         response.headers["Content-disposition"] = disposition
 
+        if xlsx:
+            # Stream the file rather than reading it into memory
+            from gluon.streamer import streamer
+            return streamer(output)
+
         return output.read()
 
     # -------------------------------------------------------------------------
@@ -591,19 +635,20 @@ List Fields %s""" % (request.url, len(lfields), len(rows[0]), headers, lfields)
 
     # -------------------------------------------------------------------------
     @staticmethod
-    def encode_pt(pt, title):
+    def encode_pt(pt, title, xlsx=False):
         """
             Encode a S3PivotTable as XLS sheet
 
             @param pt: the S3PivotTable
             @param title: the title for the report
+            @param xlsx: produce an XLSX file rather than XLS
 
             @returns: the XLS file as stream
         """
 
-        output = BytesIO()
+        output = TemporaryFile() if xlsx else BytesIO()
 
-        book = S3PivotTableXLS(pt).encode(title)
+        book = S3PivotTableXLS(pt).encode(title, xlsx=xlsx)
         book.save(output)
 
         output.seek(0)
@@ -763,11 +808,12 @@ class S3PivotTableXLS(object):
         self.valuemap = {}
 
     # -------------------------------------------------------------------------
-    def encode(self, title):
+    def encode(self, title, xlsx=False):
         """
             Convert this pivot table into an XLS file
 
             @param title: the title of the report
+            @param xlsx: produce an XLSX workbook rather than XLS
 
             @returns: the XLS workbook
         """
@@ -778,6 +824,13 @@ class S3PivotTableXLS(object):
             error = S3XLS.ERROR.XLWT_ERROR
             current.log.error(error)
             raise HTTP(503, body=error)
+        if xlsx:
+            try:
+                import openpyxl
+            except ImportError:
+                error = S3XLS.ERROR.OPENPYXL_ERROR
+                current.log.error(error)
+                raise HTTP(503, body=error)
 
         T = current.T
 
@@ -829,8 +882,16 @@ class S3PivotTableXLS(object):
         rows, cols = self.sortrepr()
 
         # Create workbook and sheet
-        book = xlwt.Workbook(encoding = "utf-8")
-        sheet = book.add_sheet(s3_str(title))
+        if xlsx:
+            book = openpyxl.Workbook(write_only = True)
+            # Buffer all rows, so that column widths can be adjusted
+            # while writing (the pivot table is in memory anyway)
+            sheet = S3XLSXSheet(book.create_sheet(s3_str(title)[:31]),
+                                buffered = True,
+                                )
+        else:
+            book = xlwt.Workbook(encoding = "utf-8")
+            sheet = book.add_sheet(s3_str(title))
 
         write = self.write
 
@@ -970,6 +1031,9 @@ class S3PivotTableXLS(object):
               numfmt = totfmt,
               )
 
+        if xlsx:
+            sheet.close()
+
         return book
 
     # -------------------------------------------------------------------------
@@ -1257,7 +1321,6 @@ class S3PivotTableXLS(object):
             elif isinstance(value, float):
                 numfmt = "double"
             else:
-                import datetime
                 if isinstance(value, datetime.datetime):
                     numfmt = "datetime"
                 elif isinstance(value, datetime.date):
@@ -1379,6 +1442,399 @@ class S3PivotTableXLS(object):
 
         return items
 
+# =============================================================================
+class S3XLSPages(object):
+    """
+        The rows of a resource for export, extracted page by page while
+        iterating over them, so that only one page is held in memory
+    """
+
+    def __init__(self, resource, fields, page_size=1000, **attr):
+        """
+            Constructor
+
+            @param resource: the S3Resource
+            @param fields: the fields to extract (selector strings)
+            @param page_size: the number of rows per page
+            @param attr: further parameters for S3Resource.select
+        """
+
+        self.resource = resource
+        self.fields = fields
+        self.page_size = page_size
+        self.attr = attr
+
+        # Extract the first page (and the total number of rows)
+        data = resource.select(fields,
+                               limit = page_size,
+                               count = True,
+                               seek = {},
+                               **attr)
+
+        self.rfields = data.rfields
+        self.numrows = data.numrows
+
+        self.first = data.rows
+        self.cursors = data.cursors
+
+        self.expand = []
+
+    # -------------------------------------------------------------------------
+    def __len__(self):
+
+        return self.numrows
+
+    # -------------------------------------------------------------------------
+    def __iter__(self):
+
+        rows = self.first
+        cursors = self.cursors
+
+        start = 0
+        page_size = self.page_size
+        while rows:
+            for row in rows:
+                yield row
+
+            start += page_size
+            if len(rows) < page_size or start >= self.numrows:
+                break
+
+            # Next page, by keyset if possible, otherwise by offset
+            if cursors:
+                data = self.resource.select(self.fields,
+                                            limit = page_size,
+                                            seek = {"after": cursors[1]},
+                                            **self.attr)
+            else:
+                data = self.resource.select(self.fields,
+                                            start = start,
+                                            limit = page_size,
+                                            **self.attr)
+            rows = data.rows
+            cursors = data.cursors
+
+            for rfield, num_levels in self.expand:
+                S3XLS.expand_hierarchy(rfield, num_levels, rows)
+
+    # -------------------------------------------------------------------------
+    def expand_hierarchy(self, rfield, num_levels):
+        """
+            Expand a hierarchical foreign key column into one column
+            per hierarchy level, in all pages (see S3XLS.expand_hierarchy)
+
+            @param rfield: the column (S3ResourceField)
+            @param num_levels: the number of levels (from root)
+
+            @returns: list of keys (column names) for the inserted columns
+        """
+
+        colnames = S3XLS.expand_hierarchy(rfield, num_levels, self.first)
+        if colnames:
+            self.expand.append((rfield, num_levels))
+        return colnames
+
+# =============================================================================
+class S3XLSXSheet(object):
+    """
+        Adapter to write a write-only openpyxl worksheet through the subset
+        of the xlwt Worksheet API used by the XLS encoders, so that XLSX can
+        be produced with the same code and (xlwt) styles
+
+        Rows are collected until a row beyond all pending rows gets written,
+        and then appended to the worksheet in order - which means that rows
+        can only be written top-down (except within the pending rows), and
+        column widths and frozen panes only take effect if they are set
+        before the first rows get appended. Therefore, the first PREVIEW
+        rows are held back, so that the column widths can be adjusted to
+        their contents.
+    """
+
+    # xlwt default dimensions
+    COL_WIDTH = 0x0B6D
+    ROW_HEIGHT = 0x00FF
+
+    # Number of rows to collect before appending the first rows
+    PREVIEW = 100
+
+    # xlwt alignment/border constants => openpyxl
+    HORZ = {1: "left", 2: "center", 3: "right", 5: "justify"}
+    VERT = {0: "top", 1: "center", 2: "bottom", 3: "justify"}
+    BORDERS = {1: "thin", 2: "medium", 3: "dashed", 4: "dotted",
+               5: "thick", 6: "double", 7: "hair",
+               }
+
+    def __init__(self, sheet, buffered=False):
+        """
+            Constructor
+
+            @param sheet: the openpyxl WriteOnlyWorksheet
+            @param buffered: keep all rows until the sheet is closed (to
+                             allow adjusting column widths while writing)
+        """
+
+        self.sheet = sheet
+        self.buffered = buffered
+
+        self.panes_frozen = False
+        self.horz_split_pos = 0
+
+        self.rows = {}
+        self.cols = {}
+        self.next_row = 0
+
+        self.styles = {}
+
+    # -------------------------------------------------------------------------
+    def row(self, rowindex):
+        """
+            Get a row for writing
+
+            @param rowindex: the row index (starting at 0)
+
+            @returns: S3XLSXRow
+        """
+
+        rows = self.rows
+
+        row = rows.get(rowindex)
+        if row is None:
+            if rowindex < self.next_row:
+                raise IndexError("Row %s already written" % rowindex)
+            if not self.buffered and rows and rowindex > max(rows) and \
+               (self.next_row or len(rows) >= self.PREVIEW):
+                self.flush(rowindex)
+            row = rows[rowindex] = S3XLSXRow(self, rowindex)
+
+        return row
+
+    # -------------------------------------------------------------------------
+    def col(self, colindex):
+        """
+            Get a column to set its width
+
+            @param colindex: the column index (starting at 0)
+        """
+
+        cols = self.cols
+
+        col = cols.get(colindex)
+        if col is None:
+            col = cols[colindex] = Storage(width=self.COL_WIDTH)
+
+        return col
+
+    # -------------------------------------------------------------------------
+    def write(self, rowindex, colindex, value, style=None):
+        """
+            Write a value into a cell
+
+            @param rowindex: the row index
+            @param colindex: the column index
+            @param value: the value
+            @param style: the xlwt XFStyle
+        """
+
+        self.row(rowindex).write(colindex, value, style)
+
+    # -------------------------------------------------------------------------
+    def write_merge(self, r1, r2, c1, c2, value, style=None):
+        """
+            Write a value into a range of merged cells
+
+            @param r1: the first row index
+            @param r2: the last row index
+            @param c1: the first column index
+            @param c2: the last column index
+            @param value: the value
+            @param style: the xlwt XFStyle
+        """
+
+        self.write(r1, c1, value, style)
+
+        from openpyxl.worksheet.cell_range import CellRange
+        self.sheet.merged_cells.add(CellRange(min_col = c1 + 1,
+                                              min_row = r1 + 1,
+                                              max_col = c2 + 1,
+                                              max_row = r2 + 1,
+                                              ))
+
+    # -------------------------------------------------------------------------
+    def flush(self, rowindex=None):
+        """
+            Append all pending rows before a row index to the worksheet
+
+            @param rowindex: the row index, None for all pending rows
+        """
+
+        sheet = self.sheet
+
+        if self.next_row == 0:
+            # Column widths and panes must be set before the first row
+            dimensions = sheet.column_dimensions
+            from openpyxl.utils import get_column_letter
+            for colindex, col in self.cols.items():
+                letter = get_column_letter(colindex + 1)
+                dimensions[letter].width = col.width / 256.0
+            if self.panes_frozen and self.horz_split_pos:
+                sheet.freeze_panes = "A%s" % (self.horz_split_pos + 1)
+
+        rows = self.rows
+        pending = sorted(i for i in rows if rowindex is None or i < rowindex)
+
+        for index in pending:
+            row = rows.pop(index)
+
+            # Fill gaps
+            while self.next_row < index:
+                sheet.append([])
+                self.next_row += 1
+
+            if row.height_mismatch:
+                dimensions = sheet.row_dimensions[index + 1]
+                dimensions.height = row.height / 20.0
+
+            cells = row.cells
+            values = [None] * (max(cells) + 1) if cells else []
+            for colindex, (value, style, numfmt) in cells.items():
+                values[colindex] = self.cell(value, style, numfmt)
+
+            sheet.append(values)
+            self.next_row += 1
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """
+            Append all pending rows, to be called when done writing
+        """
+
+        self.flush()
+
+    # -------------------------------------------------------------------------
+    def cell(self, value, style=None, numfmt=None):
+        """
+            Produce a cell for a value
+
+            @param value: the value
+            @param style: the xlwt XFStyle
+            @param numfmt: the number format
+
+            @returns: the value if unstyled, otherwise a WriteOnlyCell
+        """
+
+        if value is not None and \
+           not isinstance(value, (int, float, datetime.date, datetime.time)):
+            value = ILLEGAL_CHARACTERS.sub("", s3_str(value))
+
+        if style is None:
+            return value
+
+        if isinstance(value, (datetime.date, datetime.time)) and \
+           (not numfmt or numfmt == "General"):
+            # Dates are stored as numbers, so they need a date format
+            if isinstance(value, datetime.datetime):
+                numfmt = "yyyy-mm-dd h:mm:ss"
+            elif isinstance(value, datetime.date):
+                numfmt = "yyyy-mm-dd"
+            else:
+                numfmt = "h:mm:ss"
+
+        from openpyxl.cell import WriteOnlyCell
+        cell = WriteOnlyCell(self.sheet, value=value)
+        cell._style = copy(self.style(style, numfmt, cell))
+
+        return cell
+
+    # -------------------------------------------------------------------------
+    def style(self, style, numfmt, cell):
+        """
+            Convert an xlwt XFStyle into an openpyxl style array (cached)
+
+            @param style: the XFStyle
+            @param numfmt: the number format
+            @param cell: a cell to apply the style to
+
+            @returns: the style array of the cell
+        """
+
+        # NB encoders change the number format of styles on the fly,
+        #    so it is captured when writing, and part of the key
+        key = (style, numfmt)
+
+        styles = self.styles
+        if key in styles:
+            return styles[key]
+
+        from openpyxl.styles import Alignment, Border, Color, Font, PatternFill, Side
+
+        font = style.font
+        cell.font = Font(bold = bool(font.bold),
+                         italic = bool(font.italic),
+                         size = font.height / 20.0,
+                         )
+
+        pattern = style.pattern
+        if pattern.pattern and pattern.pattern_fore_colour < 64:
+            # xlwt colours are indices in the standard palette
+            colour = Color(indexed=pattern.pattern_fore_colour)
+            cell.fill = PatternFill(fill_type="solid", fgColor=colour)
+
+        alignment = style.alignment
+        cell.alignment = Alignment(horizontal = self.HORZ.get(alignment.horz),
+                                   vertical = self.VERT.get(alignment.vert),
+                                   wrap_text = bool(alignment.wrap),
+                                   )
+
+        borders = style.borders
+        sides = {}
+        for side in ("left", "right", "top", "bottom"):
+            line = getattr(borders, side)
+            if line:
+                sides[side] = Side(style=self.BORDERS.get(line, "thin"))
+        if sides:
+            cell.border = Border(**sides)
+
+        if numfmt:
+            cell.number_format = numfmt
+
+        styles[key] = cell._style
+        return cell._style
+
+# =============================================================================
+class S3XLSXRow(object):
+    """
+        Row in a S3XLSXSheet (xlwt Row API)
+    """
+
+    def __init__(self, sheet, rowindex):
+        """
+            Constructor
+
+            @param sheet: the S3XLSXSheet
+            @param rowindex: the row index
+        """
+
+        self.sheet = sheet
+        self.index = rowindex
+
+        self.cells = {}
+
+        self.height = sheet.ROW_HEIGHT
+        self.height_mismatch = 0
+
+    # -------------------------------------------------------------------------
+    def write(self, colindex, value, style=None):
+        """
+            Write a value into a cell of this row
+
+            @param colindex: the column index
+            @param value: the value
+            @param style: the xlwt XFStyle
+        """
+
+        numfmt = style.num_format_str if style is not None else None
+        self.cells[colindex] = (value, style, numfmt)
+
 # =============================================================================
 #class S3HTML2XLS(object):
 #    """
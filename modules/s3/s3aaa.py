@@ -4196,6 +4196,8 @@ Please go to %(url)s to approve this user."""
                                deleted = True,
                                )
 
+            self.permission.expire_acl_cache()
+
     # -------------------------------------------------------------------------
     def s3_assign_role(self, user_id, group_id, for_pe=None):
         """
@@ -4268,6 +4270,8 @@ Please go to %(url)s to approve this user."""
                 #membership_id = mtable.insert(**membership)
                 mtable.insert(**membership)
 
+        self.permission.expire_acl_cache()
+
         # Update roles for current user if required
         if self.user and str(user_id) == str(self.user.id):
             self.s3_set_roles()
@@ -4344,6 +4348,8 @@ Please go to %(url)s to approve this user."""
                             group_id = None,
                             )
 
+        self.permission.expire_acl_cache()
+
         # Update roles for current user if required
         if self.user and str(user_id) == str(self.user.id):
             self.s3_set_roles()
@@ -5746,6 +5752,12 @@ class S3Permission:
         "publish": PUBLISH,
     })
 
+    # Process-wide hit/miss counters for the shared ACL cache
+    ACL_CACHE_STATS = {"hits": 0, "misses": 0}
+
+    # Cache key for the version counter of the shared ACL cache
+    ACL_CACHE_VERSION = "s3_permission_version"
+
     # Lambda expressions for ACL handling
     required_acl = lambda self, methods: \
                           reduce(lambda a, b: a | b,
@@ -5823,6 +5835,16 @@ class S3Permission:
         self.permission_cache = {}
         self.query_cache = {}
 
+        # Shared ACL cache (across requests)
+        acl_cache = settings.get_security_acl_cache()
+        if acl_cache in ("ram", "disk"):
+            acl_cache = getattr(current.cache, acl_cache)
+        elif acl_cache and not callable(acl_cache):
+            acl_cache = None
+        self.acl_cache = acl_cache or None
+        self.acl_cache_expire = settings.get_security_acl_cache_expire()
+        self._acl_cache_version = None
+
         # Pages which never require permission:
         # Make sure that any data access via these pages uses
         # accessible_query explicitly!
@@ -5847,6 +5869,103 @@ class S3Permission:
         self.permission_cache = {}
         self.query_cache = {}
 
+    # -------------------------------------------------------------------------
+    def acl_cache_version(self):
+        """
+            Get the current version of the shared ACL cache (looked up
+            only once per request)
+
+            @returns: the version number
+        """
+
+        version = self._acl_cache_version
+        if version is None:
+            version = self.acl_cache(self.ACL_CACHE_VERSION,
+                                     lambda: 0,
+                                     time_expire = None,
+                                     )
+            self._acl_cache_version = version
+        return version
+
+    # -------------------------------------------------------------------------
+    def expire_acl_cache(self):
+        """
+            Invalidate all ACLs in the shared cache, to be called whenever
+            permission rules or role assignments are changed
+
+            @note: the changes only become visible to concurrent requests
+                   when the transaction is committed, so these could still
+                   cache the old rules under the new version - therefore
+                   the version is incremented again after the commit at
+                   the end of the request
+        """
+
+        self.clear_cache()
+
+        acl_cache = self.acl_cache
+        if acl_cache is not None:
+            acl_cache.increment(self.ACL_CACHE_VERSION)
+            self._acl_cache_version = None
+
+            # Increment again after commit
+            response = current.response
+            if response and not response.s3_acl_cache_expire:
+                response.s3_acl_cache_expire = True
+                custom_commit = response.custom_commit
+                def commit(adapter):
+                    if custom_commit:
+                        custom_commit(adapter)
+                    else:
+                        adapter.commit()
+                    if response.s3_acl_cache_expire:
+                        response.s3_acl_cache_expire = False
+                        acl_cache.increment(self.ACL_CACHE_VERSION)
+                response.custom_commit = commit
+
+    # -------------------------------------------------------------------------
+    def cached(self, key, lookup):
+        """
+            Look up a value in the shared ACL cache
+
+            @param key: the cache key (without version)
+            @param lookup: function to look up the value from the database,
+                           must return picklable data
+
+            @returns: the value
+        """
+
+        acl_cache = self.acl_cache
+        if acl_cache is None:
+            return lookup()
+
+        missed = []
+        def miss():
+            missed.append(True)
+            return lookup()
+
+        key = "%s:%s:%s" % (self.ACL_CACHE_VERSION,
+                            self.acl_cache_version(),
+                            key,
+                            )
+        value = acl_cache(key, miss, time_expire=self.acl_cache_expire)
+
+        self.ACL_CACHE_STATS["misses" if missed else "hits"] += 1
+        return value
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def acl_cache_stats(cls):
+        """
+            Hit/miss statistics of the shared ACL cache (this process)
+
+            @returns: dict {"hits": number, "misses": number, "ratio": hit ratio}
+        """
+
+        stats = dict(cls.ACL_CACHE_STATS)
+        lookups = stats["hits"] + stats["misses"]
+        stats["ratio"] = float(stats["hits"]) / lookups if lookups else None
+        return stats
+
     # -------------------------------------------------------------------------
     def check_settings(self):
         """
@@ -6039,6 +6158,8 @@ class S3Permission:
                     acl["group_id"] = group_id
                     success = table.insert(**acl)
 
+            self.expire_acl_cache()
+
         return success
 
     # -------------------------------------------------------------------------
@@ -7376,16 +7497,26 @@ class S3Permission:
         # Retrieve the ACLs
         if q is not None:
             query = q & query
-            rows = db(query).select(table.group_id,
-                                    table.controller,
-                                    table.function,
-                                    table.tablename,
-                                    table.unrestricted,
-                                    table.entity,
-                                    table.uacl,
-                                    table.oacl,
-                                    cacheable = True,
-                                    )
+            fields = (table.group_id,
+                      table.controller,
+                      table.function,
+                      table.tablename,
+                      table.unrestricted,
+                      table.entity,
+                      table.uacl,
+                      table.oacl,
+                      )
+            if self.acl_cache is not None:
+                key = "acls:%s:%s:%s:%s:%s" % (self.policy,
+                                               ",".join(str(r) for r in sorted(roles)),
+                                               c if page_restricted else "",
+                                               f if page_restricted and self.use_facls else "",
+                                               t if self.use_tacls else "",
+                                               )
+                lookup = lambda: db(query).select(*fields).as_list()
+                rows = [Storage(row) for row in self.cached(key, lookup)]
+            else:
+                rows = db(query).select(*fields, cacheable=True)
         else:
             rows = []
 
@@ -7574,10 +7705,11 @@ class S3Permission:
             query = (table.controller == None) & \
                     (table.function == None) & \
                     (table.deleted == False)
-            rows = current.db(query).select(table.tablename,
-                                            groupby = table.tablename,
-                                            )
-            s3.restricted_tables = [row.tablename for row in rows]
+            lookup = lambda: [row.tablename
+                              for row in current.db(query).select(table.tablename,
+                                                                  groupby = table.tablename,
+                                                                  )]
+            s3.restricted_tables = self.cached("restricted_tables", lookup)
 
         return str(t) in s3.restricted_tables
 
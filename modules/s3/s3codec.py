@@ -47,7 +47,8 @@ class S3Codec(object):
     # A list of fields which should be skipped from PDF/XLS exports
     indices = ["id", "pe_id", "site_id", "sit_id", "item_entity_id"]
 
-    CODECS = {"pdf": "S3RL_PDF",
+    CODECS = {"geojson": "S3GeoJSON",
+              "pdf": "S3RL_PDF",
               "shp": "S3SHP",
               "svg": "S3SVG",
               "xls": "S3XLS",
@@ -53,6 +53,7 @@ from gluon.languages import lazyT
 from gluon.storage import Storage
 from gluon.tools import callback
 
+from .s3data import S3DataTable
 from .s3datetime import S3DateTime, s3_decode_iso_datetime
 from .s3export import S3Exporter
 from .s3forms import S3SQLDefaultForm
@@ -829,10 +830,13 @@ class S3CRUD(S3Method):
             exporter = S3Exporter().svg
             output = exporter(resource, list_fields=list_fields, **attr)
 
-        elif representation == "xls":
+        elif representation in ("xls", "xlsx"):
             list_fields = resource.list_fields()
             exporter = S3Exporter().xls
-            output = exporter(resource, list_fields=list_fields)
+            output = exporter(resource,
+                              list_fields = list_fields,
+                              xlsx = representation == "xlsx",
+                              )
 
         elif representation == "json":
             exporter = S3Exporter().json
@@ -1376,8 +1380,11 @@ class S3CRUD(S3Method):
 
         elif representation == "csv":
 
+            # Stream unpaginated exports?
+            stream = current.deployment_settings.get_base_stream_export()
+
             exporter = S3Exporter().csv
-            return exporter(resource)
+            return exporter(resource, stream=stream)
 
         elif representation == "json":
 
@@ -1394,12 +1401,16 @@ class S3CRUD(S3Method):
             if represent and represent != "0":
                 represent = True
 
+            # Stream unpaginated exports?
+            stream = current.deployment_settings.get_base_stream_export()
+
             exporter = S3Exporter().json
             return exporter(resource,
                             start = start,
                             limit = limit,
                             represent = represent,
                             tooltip = tooltip,
+                            stream = stream,
                             )
 
         elif representation == "pdf":
@@ -1428,12 +1439,13 @@ class S3CRUD(S3Method):
                             list_fields = get_config("list_fields"),
                             **attr)
 
-        elif representation == "xls":
+        elif representation in ("xls", "xlsx"):
             report_groupby = get_config("report_groupby", None)
             exporter = S3Exporter().xls
             return exporter(resource,
                             list_fields = get_config("list_fields"),
                             report_groupby = report_groupby,
+                            xlsx = representation == "xlsx",
                             **attr)
 
         elif representation == "msg":
@@ -1550,12 +1562,15 @@ class S3CRUD(S3Method):
                 dt_pagination = "false"
 
             # Get the data table
+            settings = current.deployment_settings
+            approximate = settings.get_ui_datatables_approximate_count()
             dt, totalrows = resource.datatable(fields = list_fields,
                                                start = start,
                                                limit = limit,
                                                left = left,
                                                orderby = orderby,
                                                distinct = distinct,
+                                               approximate = approximate,
                                                )
             displayrows = totalrows
 
@@ -1602,30 +1617,72 @@ class S3CRUD(S3Method):
             # Apply datatable filters
             searchq, orderby, left = resource.datatable_filter(list_fields,
                                                                get_vars)
-            if searchq is not None:
-                totalrows = resource.count()
-                resource.add_filter(searchq)
-            else:
-                totalrows = None
 
             # Orderby fallbacks
             if orderby is None:
                 orderby = get_config("orderby", None)
 
+            settings = current.deployment_settings
+            approximate = settings.get_ui_datatables_approximate_count()
+
+            # Keyset pagination
+            if settings.get_ui_datatables_keyset():
+                signature = S3DataTable.signature(resource.get_query(),
+                                                  searchq,
+                                                  orderby,
+                                                  left,
+                                                  )
+                seek, numrows = S3DataTable.get_cursor(list_id,
+                                                       signature,
+                                                       start,
+                                                       limit,
+                                                       )
+                if seek is None:
+                    # Offset pagination, but determine the cursors
+                    seek = {}
+                if not approximate:
+                    # Numbers of records must be exact
+                    numrows = None
+            else:
+                seek = numrows = None
+
+            # Numbers of records (retain from previous page if possible)
+            if numrows:
+                totalrows, displayrows = numrows
+            elif searchq is not None:
+                totalrows = resource.count(approximate=approximate)
+            else:
+                totalrows = None
+            if searchq is not None:
+                resource.add_filter(searchq)
+
             # Get a data table
             if totalrows != 0:
-                dt, displayrows = resource.datatable(fields = list_fields,
-                                                     start = start,
-                                                     limit = limit,
-                                                     left = left,
-                                                     orderby = orderby,
-                                                     distinct = distinct,
-                                                     )
+                dt, count = resource.datatable(fields = list_fields,
+                                               start = start,
+                                               limit = limit,
+                                               left = left,
+                                               orderby = orderby,
+                                               distinct = distinct,
+                                               seek = seek,
+                                               approximate = approximate,
+                                               )
+                if count is not None:
+                    displayrows = count
+                elif not numrows:
+                    # Page extracted by seeking => count separately
+                    displayrows = resource.count(left = left,
+                                                 distinct = distinct,
+                                                 approximate = approximate,
+                                                 )
             else:
                 dt, displayrows = None, 0
             if totalrows is None:
                 totalrows = displayrows
 
+            if seek is not None and dt is not None:
+                dt.set_cursor(list_id, signature, start, (totalrows, displayrows))
+
             # Echo
             draw = int(get_vars.get("draw", 0))
 
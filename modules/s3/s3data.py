@@ -35,6 +35,7 @@ __all__ = ("S3DataTable",
            "S3DataListLayout",
            )
 
+import hashlib
 import re
 
 from itertools import islice
@@ -81,6 +82,9 @@ class S3DataTable:
         self.rfields = rfields
         self.empty = empty
 
+        # Keys of the first and last record (for keyset pagination)
+        self.cursors = None
+
         colnames = []
         heading = {}
 
@@ -357,6 +361,99 @@ class S3DataTable:
 
     # -------------------------------------------------------------------------
     # Extended API
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def signature(*items):
+        """
+            Compute a signature for the query, filters and orderby of
+            a datatable, to verify that a cursor applies to a request
+
+            @param items: the query, filters, orderby and joins
+
+            @returns: the signature (string)
+        """
+
+        strings = []
+        for item in items:
+            if isinstance(item, (list, tuple)):
+                strings.extend(str(i) for i in item)
+            else:
+                strings.append(str(item))
+
+        return hashlib.md5(s3_str("|".join(strings)).encode("utf-8")).hexdigest()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def get_cursor(list_id, signature, start, limit):
+        """
+            Look up the cursor for keyset pagination of an Ajax page
+            request, i.e. if the requested page immediately follows or
+            precedes the page last served for the same datatable
+
+            @param list_id: the datatable ID
+            @param signature: the signature of the query, filters and orderby
+            @param start: index of the first record of the requested page
+            @param limit: maximum number of records of the requested page
+
+            @returns: tuple (seek, numrows), with seek being the
+                      seek-parameter for S3Resource.datatable (None if
+                      the page must be extracted by start/limit), and
+                      numrows the numbers of records (totalrows, displayrows)
+                      determined for the previous page
+        """
+
+        cursors = current.session.s3.dt_cursors
+        cursor = cursors.get(list_id) if cursors else None
+
+        if not cursor or cursor["signature"] != signature or \
+           not start or not limit:
+            return None, None
+
+        if start == cursor["end"]:
+            # Next page
+            seek = {"after": cursor["last"]}
+        elif start + limit == cursor["start"]:
+            # Previous page
+            seek = {"before": cursor["first"]}
+        else:
+            # Random jump
+            return None, None
+
+        return seek, cursor["numrows"]
+
+    # -------------------------------------------------------------------------
+    def set_cursor(self, list_id, signature, start, numrows):
+        """
+            Remember the keys of the first and last record of this
+            datatable page, for keyset pagination of subsequent
+            page requests
+
+            @param list_id: the datatable ID
+            @param signature: the signature of the query, filters and orderby
+            @param start: index of the first record of this page
+            @param numrows: the numbers of records (totalrows, displayrows)
+        """
+
+        s3 = current.session.s3
+
+        cursors = s3.dt_cursors
+        if cursors is None:
+            cursors = s3.dt_cursors = {}
+
+        keys = self.cursors
+        if keys and None not in keys:
+            start = start if start else 0
+            first, last = keys
+            cursors[list_id] = {"signature": signature,
+                                "start": start,
+                                "end": start + len(self.data),
+                                "first": first,
+                                "last": last,
+                                "numrows": numrows,
+                                }
+        else:
+            cursors.pop(list_id, None)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def export_formats(rfields = None,
@@ -415,7 +512,7 @@ class S3DataTable:
                 if any(rfield.fname in kml_fields for rfield in rfields):
                     formats["kml"] = default_url
 
-            default_formats = ("xml", "rss", "xls", "pdf")
+            default_formats = ("xml", "rss", "xls", "xlsx", "pdf")
             EXPORT = T("Export in %(format)s format")
 
             append_icon = icons.append
@@ -33,7 +33,7 @@ import sys
 from gluon import current
 from gluon.tools import callback
 
-from s3dal import original_tablename, Row
+from s3dal import Expression, original_tablename, Row
 from .s3utils import s3_get_last_record_id, s3_has_foreign_key, s3_remove_last_record_id
 
 __all__ = ("S3Delete",
@@ -47,10 +47,14 @@ class S3Delete(object):
         Process to delete/archive records in a S3Resource
     """
 
+    # Maximum number of records per bulk update
+    CHUNK_SIZE = 500
+
     def __init__(self,
                  resource,
                  archive = None,
                  representation = None,
+                 bulk = None,
                  ):
         """
             Constructor
@@ -59,6 +63,8 @@ class S3Delete(object):
             @param archive: True|False to override global
                             security.archive_not_delete setting
             @param representation: the request format (for audit, optional)
+            @param bulk: True|False to override global
+                         security.bulk_delete setting
         """
 
         self.resource = resource
@@ -77,6 +83,11 @@ class S3Delete(object):
                 archive = False
         self.archive = archive
 
+        # Process records as set rather than one by one?
+        if bulk is None:
+            bulk = current.deployment_settings.get_security_bulk_delete()
+        self.bulk = bulk
+
         # Callbacks
         get_config = resource.get_config
         self.prepare = get_config("ondelete_cascade")
@@ -151,6 +162,12 @@ class S3Delete(object):
         has_permission = current.auth.s3_has_permission
         prepare = self.prepare
 
+        # Bulk deletion is only possible if the entire set can be
+        # rolled back, so not when skipping undeletable rows
+        bulk = self.bulk and not skip_undeletable
+        if bulk:
+            permitted = self.permitted(rows, joined=joined)
+
         records = []
         for row in rows:
 
@@ -158,7 +175,11 @@ class S3Delete(object):
             record_id = record[pkey]
 
             # Check permissions
-            if not has_permission("delete", table, record_id=record_id):
+            if bulk:
+                authorised = record_id in permitted
+            else:
+                authorised = has_permission("delete", table, record_id=record_id)
+            if not authorised:
                 self.permission_error = True
                 add_error(record_id, "not permitted")
                 continue
@@ -194,73 +215,90 @@ class S3Delete(object):
         ondelete = self.ondelete
         delete_super = current.s3db.delete_super
 
-        num_deleted = 0
-        for row in deletable:
-
-            record_id = row[pkey]
-            success = True
-
-            if self.archive:
-                # Run automatic deletion cascade
-                success = self.cascade(row, check_all=check_all)
-
-            if success:
-                # Unlink all super-records
-                success = delete_super(table, row)
-                if not success:
-                    add_error(record_id, "super-entity deletion failed")
+        if bulk:
+            # Delete all records at once
+            deleted = self.delete_bulk(deletable,
+                                       cascade = cascade,
+                                       replaced_by = replaced_by,
+                                       check_all = check_all,
+                                       )
+            num_deleted = len(deleted)
+        else:
+            num_deleted = 0
+            deleted = []
+            for row in deletable:
 
-            if success:
-                # Auto-delete linked record if appropriate
-                self.auto_delete_linked(row)
+                record_id = row[pkey]
+                success = True
 
-                # Archive/delete the row itself
                 if self.archive:
-                    success = self.archive_record(row, replaced_by=replaced_by)
-                else:
-                    success = self.delete_record(row)
-
-            if success:
-                # Postprocess delete
-
-                # Clear session
-                if s3_get_last_record_id(tablename) == record_id:
-                    s3_remove_last_record_id(tablename)
-
-                # Audit
-                audit("delete", prefix, name,
-                      record = record_id,
-                      representation = self.representation,
-                      )
-
-                # On-delete hook
-                if ondelete:
-                    callback(ondelete, row)
-
-                # Subsequent cascade errors would roll back successful
-                # deletions too => we want to prevent that when skipping
-                # undeletable rows, so commit here if this is the master
-                # process
-                if not cascade and skip_undeletable:
-                    db.commit()
-
-                num_deleted += 1
-
-            elif not cascade:
-                # Master process failure
-                db.rollback()
-                self.log_errors()
-
-                if skip_undeletable:
-                    # Try next row
-                    continue
+                    # Run automatic deletion cascade
+                    success = self.cascade(row, check_all=check_all)
+
+                if success:
+                    # Unlink all super-records
+                    success = delete_super(table, row)
+                    if not success:
+                        add_error(record_id, "super-entity deletion failed")
+
+                if success:
+                    # Auto-delete linked record if appropriate
+                    self.auto_delete_linked(row)
+
+                    # Archive/delete the row itself
+                    if self.archive:
+                        success = self.archive_record(row, replaced_by=replaced_by)
+                    else:
+                        success = self.delete_record(row)
+
+                if success:
+                    # Postprocess delete
+
+                    # Clear session
+                    if s3_get_last_record_id(tablename) == record_id:
+                        s3_remove_last_record_id(tablename)
+
+                    # Audit
+                    audit("delete", prefix, name,
+                          record = record_id,
+                          representation = self.representation,
+                          )
+
+                    # On-delete hook
+                    if ondelete:
+                        callback(ondelete, row)
+
+                    # Subsequent cascade errors would roll back successful
+                    # deletions too => we want to prevent that when skipping
+                    # undeletable rows, so commit here if this is the master
+                    # process
+                    if not cascade and skip_undeletable:
+                        db.commit()
+
+                    deleted.append(row)
+                    num_deleted += 1
+
+                elif not cascade:
+                    # Master process failure
+                    db.rollback()
+                    self.log_errors()
+
+                    if skip_undeletable:
+                        # Try next row
+                        continue
+                    else:
+                        # Exit immediately
+                        break
                 else:
-                    # Exit immediately
+                    # Cascade failure, no point to try any other row
+                    # - will be rolled back by master process
                     break
-            else:
-                # Cascade failure, no point to try any other row
-                # - will be rolled back by master process
-                break
+
+        # Update the text search indexes
+        if deleted:
+            from .s3textindex import S3TextIndex
+            record_ids = [row[pkey] for row in deleted if pkey in row]
+            S3TextIndex.update(tablename, record_ids)
 
         self.set_resource_error()
         return num_deleted
@@ -486,6 +524,514 @@ class S3Delete(object):
                     if delete.errors:
                         delete.log_errors()
 
+    # -------------------------------------------------------------------------
+    # Bulk Deletion
+    # -------------------------------------------------------------------------
+    def permitted(self, rows, joined=False):
+        """
+            Check the permission to delete a set of rows with a single
+            query (bulk alternative to s3_has_permission per record)
+
+            @param rows: the Rows to be deleted
+            @param joined: whether the rows are the result of a join
+
+            @returns: set of IDs of the records the user is permitted
+                      to delete
+
+            @note: the accessible query does not include unapproved
+                   records (even for ADMIN or with override), so any
+                   records not matching it are checked individually
+        """
+
+        tablename = self.tablename
+        table = self.table
+        pkey = table._id.name
+
+        auth = current.auth
+
+        record_ids = [(row[tablename] if joined else row)[pkey] for row in rows]
+
+        query = (table._id.belongs(record_ids)) & \
+                auth.s3_accessible_query("delete", table)
+        permitted = set(row[pkey] for row in current.db(query).select(table._id))
+
+        has_permission = auth.s3_has_permission
+        for record_id in record_ids:
+            if record_id not in permitted and \
+               has_permission("delete", table, record_id=record_id):
+                permitted.add(record_id)
+
+        return permitted
+
+    # -------------------------------------------------------------------------
+    def delete_bulk(self, rows, cascade=False, replaced_by=None, check_all=False):
+        """
+            Delete/archive a set of rows, processing the deletion cascade
+            as sets (i.e. one deletion process per referencing table
+            rather than per row); any error fails the entire set
+
+            @param rows: the deletable Rows
+            @param cascade: this is a cascade-action from another process
+            @param replaced_by: dict of {replaced_id: replacement_id},
+                                used by record merger to log which record
+                                has replaced which
+            @param check_all: process the entire cascade to reveal all
+                              errors (rather than breaking out of it after
+                              the first error)
+
+            @returns: list of the deleted Rows
+        """
+
+        if not rows:
+            return []
+
+        db = current.db
+
+        tablename = self.tablename
+        pkey = self.table._id.name
+
+        success = True
+
+        if self.archive:
+            # Run automatic deletion cascade
+            success = self.cascade_bulk(rows, check_all=check_all)
+
+        if success:
+            # Unlink all super-records
+            success = self.delete_super_bulk(rows)
+
+        if success:
+            # Auto-delete linked records if appropriate
+            self.auto_delete_linked_bulk(rows)
+
+            # Archive/delete the rows themselves
+            if self.archive:
+                success = self.archive_records(rows, replaced_by=replaced_by)
+            else:
+                success = self.delete_records(rows)
+
+        if not success:
+            if not cascade:
+                # Master process failure
+                db.rollback()
+                self.log_errors()
+            return []
+
+        # Postprocess delete
+        resource = self.resource
+        prefix, name = resource.prefix, resource.name
+
+        audit = current.audit
+        ondelete = self.ondelete
+
+        last_record_id = s3_get_last_record_id(tablename)
+        for row in rows:
+
+            record_id = row[pkey]
+
+            # Clear session
+            if last_record_id == record_id:
+                s3_remove_last_record_id(tablename)
+
+            # Audit
+            audit("delete", prefix, name,
+                  record = record_id,
+                  representation = self.representation,
+                  )
+
+            # On-delete hook
+            if ondelete:
+                callback(ondelete, row)
+
+        return list(rows)
+
+    # -------------------------------------------------------------------------
+    def cascade_bulk(self, rows, check_all=False):
+        """
+            Run the automatic deletion cascade for a set of rows: remove
+            or update records referencing these rows with ondelete!="RESTRICT",
+            one process per referencing table
+
+            @param rows: the Rows to delete
+            @param check_all: process the entire cascade to reveal all
+                              errors (rather than breaking out of it after
+                              the first error)
+        """
+
+        tablename = self.tablename
+        pkey = self.table._id.name
+        record_ids = [row[pkey] for row in rows]
+
+        success = True
+
+        db = current.db
+        define_resource = current.s3db.resource
+        add_error = self.add_error
+
+        references = self.references
+        for reference in references:
+
+            fn = reference.name
+            tn = reference.tablename
+            rtable = db[tn]
+
+            query = (reference.belongs(record_ids))
+            if tn == tablename:
+                query &= (reference != rtable._id)
+
+            ondelete = reference.ondelete
+            if ondelete == "CASCADE":
+                # NB permission check on target included, i.e. the right
+                #    to delete a record does not imply the right to remove
+                #    records referencing it
+                rresource = define_resource(tn,
+                                            filter = query,
+                                            unapproved = True,
+                                            )
+                delete = S3Delete(rresource,
+                                  archive = self.archive,
+                                  representation = self.representation,
+                                  bulk = True,
+                                  )
+                delete(cascade=True)
+                if delete.errors:
+                    success = False
+                    self.add_cascade_errors(reference, delete.errors, record_ids)
+                    if check_all:
+                        continue
+                    else:
+                        break
+            else:
+                # NB no permission check on target here, i.e. the right
+                #    to delete a record overrides the right to keep an
+                #    annullable reference to it
+                if ondelete == "SET NULL":
+                    default = None
+                elif ondelete == "SET DEFAULT":
+                    default = reference.default
+                else:
+                    continue
+
+                if DELETED in rtable.fields:
+                    query &= rtable[DELETED] == False
+                try:
+                    db(query).update(**{fn: default})
+                except Exception:
+                    success = False
+                    error = sys.exc_info()[1]
+                    for record_id in record_ids:
+                        add_error(record_id, error)
+                    if check_all:
+                        continue
+                    else:
+                        break
+
+        return success
+
+    # -------------------------------------------------------------------------
+    def add_cascade_errors(self, reference, errors, record_ids):
+        """
+            Add the errors of a cascade process to the records referenced
+            by the failing records
+
+            @param reference: the foreign key (Field) referencing this table
+            @param errors: the errors of the cascade process
+            @param record_ids: the IDs of the records in this process
+        """
+
+        rtable = reference.table
+
+        # Look up which record each failing record references
+        failed = set(record_id for tn, record_id in errors)
+        record_ids = set(record_ids)
+        rows = current.db(rtable._id.belongs(failed)).select(rtable._id,
+                                                             reference,
+                                                             )
+        referenced = dict((row[rtable._id], row[reference]) for row in rows)
+
+        collected = {}
+        for key, error in errors.items():
+            record_id = referenced.get(key[1])
+            if record_id in record_ids:
+                targets = [record_id]
+            else:
+                # Not directly referencing (e.g. failed super-entity)
+                targets = record_ids
+            for record_id in targets:
+                if record_id in collected:
+                    collected[record_id][key] = error
+                else:
+                    collected[record_id] = {key: error}
+
+        add_error = self.add_error
+        for record_id, errors_ in collected.items():
+            add_error(record_id, errors_)
+
+    # -------------------------------------------------------------------------
+    def delete_super_bulk(self, rows):
+        """
+            Remove the super-entity links of a set of rows, bulk
+            alternative to s3db.delete_super
+
+            @param rows: the Rows to delete
+
+            @returns: True if successful, otherwise False
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        table = self.table
+        pkey = table._id.name
+
+        supertables = s3db.get_config(self.tablename, "super_entity")
+        if not supertables:
+            return True
+        if not isinstance(supertables, (list, tuple)):
+            supertables = [supertables]
+
+        record_ids = [row[pkey] for row in rows]
+
+        for sname in supertables:
+            stable = s3db.table(sname) if isinstance(sname, str) else sname
+            if stable is None:
+                continue
+            key = stable._id.name
+            if key not in table.fields:
+                continue
+
+            # Super-keys of the rows
+            keys = {}
+            for row in rows:
+                value = row[key]
+                if value:
+                    if value in keys:
+                        keys[value].append(row[pkey])
+                    else:
+                        keys[value] = [row[pkey]]
+            if not keys:
+                continue
+
+            # Remove the super keys
+            db(table._id.belongs(record_ids)).update(**{key: None})
+            for row in rows:
+                row[key] = None
+
+            # Delete the super records
+            sresource = s3db.resource(stable, id=list(keys))
+            delete = S3Delete(sresource,
+                              representation = self.representation,
+                              bulk = True,
+                              )
+            deleted = delete(cascade=True)
+            delete.log_errors()
+
+            if deleted != len(keys) or sresource.error:
+                # Caller must roll back
+                failed = set(k[1] for k in delete.errors) if delete.errors else keys
+                for value in failed:
+                    for record_id in keys.get(value, ()):
+                        self.add_error(record_id, "super-entity deletion failed")
+                return False
+
+        return True
+
+    # -------------------------------------------------------------------------
+    def auto_delete_linked_bulk(self, rows):
+        """
+            Auto-delete linked records for which the rows are the last
+            links, bulk alternative to auto_delete_linked
+
+            @param rows: the Rows about to get deleted
+        """
+
+        resource = self.resource
+        linked = resource.linked
+
+        if linked and resource.autodelete and linked.autodelete:
+
+            table = self.table
+            pkey = table._id.name
+            rkey = linked.rkey
+
+            rkeys = set(row[rkey] for row in rows if rkey in row)
+            rkeys.discard(None)
+            if not rkeys:
+                return
+
+            # Check for other links to the same linked records
+            db = current.db
+            record_ids = [row[pkey] for row in rows]
+            query = (~(table._id.belongs(record_ids))) & \
+                    (table[rkey].belongs(rkeys))
+            if DELETED in table:
+                query &= (table[DELETED] != True)
+            remaining = db(query).select(table[rkey], distinct=True)
+            rkeys -= set(row[rkey] for row in remaining)
+
+            if rkeys:
+                # Try to delete the linked records
+                s3db = current.s3db
+                fkey = linked.fkey
+                linked_table = s3db.table(linked.tablename)
+                query = (linked_table[fkey].belongs(rkeys))
+                linked = s3db.resource(linked_table,
+                                       filter = query,
+                                       unapproved = True,
+                                       )
+                delete = S3Delete(linked,
+                                  archive = self.archive,
+                                  representation = self.representation,
+                                  bulk = True,
+                                  )
+                delete(cascade=True)
+                if delete.errors:
+                    delete.log_errors()
+
+    # -------------------------------------------------------------------------
+    def archive_records(self, rows, replaced_by=None):
+        """
+            Archive ("soft-delete") a set of records, bulk alternative
+            to archive_record
+
+            @param rows: the Rows to delete
+            @param replaced_by: dict of {replaced_id: replacement_id},
+                                used by record merger to log which record
+                                has replaced which
+
+            @returns: True for success, False on error
+        """
+
+        db = current.db
+
+        table = self.table
+        table_fields = table.fields
+        pkey = table._id.name
+
+        data = {"deleted": True}
+
+        # Reset foreign keys to resolve constraints
+        foreign_keys = self.foreign_keys
+        for fname in foreign_keys:
+            if not table[fname].notnull:
+                data[fname] = None
+
+        # Remember any deleted foreign keys
+        deleted_fk = {}
+        if "deleted_fk" in table_fields:
+            for row in rows:
+                fk = {}
+                for fname in foreign_keys:
+                    value = row[fname]
+                    if value:
+                        fk[fname] = value
+                if fk:
+                    deleted_fk[row[pkey]] = json.dumps(fk)
+
+        # Remember the replacement records (used by record merger)
+        deleted_rb = {}
+        if "deleted_rb" in table_fields and replaced_by:
+            for row in rows:
+                record_id = row[pkey]
+                rb = replaced_by.get(str(record_id))
+                if rb:
+                    deleted_rb[record_id] = rb
+
+        record_ids = [row[pkey] for row in rows]
+
+        chunk_size = self.CHUNK_SIZE
+        for i in range(0, len(record_ids), chunk_size):
+            chunk = record_ids[i:i + chunk_size]
+
+            update = dict(data)
+            values = dict((k, deleted_fk[k]) for k in chunk if k in deleted_fk)
+            if values:
+                update["deleted_fk"] = self.case(table.deleted_fk, values)
+            values = dict((k, deleted_rb[k]) for k in chunk if k in deleted_rb)
+            if values:
+                update["deleted_rb"] = self.case(table.deleted_rb, values)
+
+            try:
+                result = db(table._id.belongs(chunk)).update(**update)
+            except Exception:
+                # Integrity Error
+                error = sys.exc_info()[1]
+                for record_id in chunk:
+                    self.add_error(record_id, error)
+                return False
+
+            if result != len(chunk):
+                # Unknown Error
+                for record_id in chunk:
+                    self.add_error(record_id, "archiving failed")
+                return False
+
+        return True
+
+    # -------------------------------------------------------------------------
+    def delete_records(self, rows):
+        """
+            Delete a set of records, bulk alternative to delete_record
+
+            @param rows: the Rows to delete
+
+            @returns: True for success, False on error
+        """
+
+        db = current.db
+
+        table = self.table
+        pkey = table._id.name
+
+        record_ids = [row[pkey] for row in rows]
+
+        chunk_size = self.CHUNK_SIZE
+        for i in range(0, len(record_ids), chunk_size):
+            chunk = record_ids[i:i + chunk_size]
+
+            try:
+                result = db(table._id.belongs(chunk)).delete()
+            except Exception:
+                # Integrity Error
+                error = sys.exc_info()[1]
+                for record_id in chunk:
+                    self.add_error(record_id, error)
+                return False
+
+            if result != len(chunk):
+                # Unknown Error
+                for record_id in chunk:
+                    self.add_error(record_id, "deletion failed")
+                return False
+
+        return True
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def case(field, values):
+        """
+            Construct a SQL CASE expression to update a field with
+            individual values per record
+
+            @param field: the Field
+            @param values: dict {record_id: value}
+
+            @returns: an Expression
+        """
+
+        db = current.db
+        expand = db._adapter.expand
+
+        table = field.table
+        column = expand(table._id)
+
+        cases = " ".join("WHEN %s THEN %s" % (int(record_id), expand(value, field.type))
+                         for record_id, value in values.items()
+                         )
+        sql = "CASE %s %s ELSE %s END" % (column, cases, expand(field))
+
+        return Expression(db, sql, type=field.type)
+
     # -------------------------------------------------------------------------
     # Record Archiving/Deletion
     # -------------------------------------------------------------------------
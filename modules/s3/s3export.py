@@ -44,11 +44,16 @@ class S3Exporter(object):
     """
 
     # -------------------------------------------------------------------------
-    def csv(self, resource):
+    def csv(self, resource, stream=False):
         """
             Export resource as CSV
 
             @param resource: the resource to export
+            @param stream: stream the export in pages rather than
+                           building it in memory, True or the page size
+
+            @returns: the CSV as string, or a generator of CSV chunks
+                      (bytes) if streaming
 
             @note: export does not include components!
 
@@ -65,9 +70,31 @@ class S3Exporter(object):
             response.headers["Content-Type"] = contenttype(".csv")
             response.headers["Content-disposition"] = "attachment; filename=%s" % filename
 
+        if stream:
+            return self._csv_stream(resource, self.page_size(stream))
+
         rows = resource.select(None, as_rows=True)
         return str(rows)
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _csv_stream(cls, resource, page_size):
+        """
+            Generator for streamed CSV export
+
+            @param resource: the resource to export
+            @param page_size: the number of records per page
+        """
+
+        from io import StringIO
+
+        colnames = True
+        for rows in cls.pages(resource, None, page_size, as_rows=True):
+            output = StringIO()
+            rows.export_to_csv_file(output, write_colnames=colnames)
+            colnames = False
+            yield output.getvalue().encode("utf-8")
+
     # -------------------------------------------------------------------------
     def json(self, resource,
              start = None,
@@ -76,6 +103,7 @@ class S3Exporter(object):
              orderby = None,
              represent = False,
              tooltip = None,
+             stream = False,
              ):
         """
             Export a resource as JSON
@@ -95,6 +123,13 @@ class S3Exporter(object):
                             to return a dict {k:tooltip} => used by
                             filterOptionsS3 to extract onhover-tooltips for
                             Ajax-update of options
+            @param stream: stream the export in pages rather than building
+                           it in memory, True or the page size; ignored if
+                           start or limit are given, and records will be
+                           ordered by primary key (orderby is ignored)
+
+            @returns: the JSON as string, or a generator of JSON chunks
+                      (bytes) if streaming
         """
 
         if fields is None:
@@ -109,7 +144,7 @@ class S3Exporter(object):
         if orderby is None:
             orderby = resource.get_config("orderby", None)
 
-        tooltip_function = None
+        tooltip_function = kname = vname = None
         if tooltip:
             if type(tooltip) is list:
                 tooltip = tooltip[-1]
@@ -128,13 +163,71 @@ class S3Exporter(object):
                 if tooltip not in fields:
                     fields.append(tooltip)
 
+        tooltip = (tooltip, tooltip_function, kname, vname)
+
+        # Return as JSON
+        response = current.response
+        if response:
+            response.headers["Content-Type"] = "application/json"
+
+        from gluon.serializers import json as jsons
+
+        if stream and start is None and limit is None:
+            return self._json_stream(resource,
+                                     fields,
+                                     self.page_size(stream),
+                                     represent = represent,
+                                     tooltip = tooltip,
+                                     )
+
         # Get the data
-        _rows = resource.select(fields,
-                                start = start,
-                                limit = limit,
-                                orderby = orderby,
-                                represent = represent,
-                                ).rows
+        rows = resource.select(fields,
+                               start = start,
+                               limit = limit,
+                               orderby = orderby,
+                               represent = represent,
+                               ).rows
+
+        return jsons(self._json_rows(resource, rows, tooltip))
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _json_stream(cls, resource, fields, page_size, represent=False, tooltip=None):
+        """
+            Generator for streamed JSON export
+
+            @param resource: the resource to export from
+            @param fields: list of field selectors for fields to include
+            @param page_size: the number of records per page
+            @param represent: whether values should be represented
+            @param tooltip: the tooltip parameters, tuple
+                            (tooltip, tooltip_function, kname, vname)
+        """
+
+        from gluon.serializers import json as jsons
+
+        yield b"["
+        separator = ""
+        for data in cls.pages(resource, fields, page_size, represent=represent):
+            rows = cls._json_rows(resource, data.rows, tooltip)
+            chunk = ", ".join(jsons(row) for row in rows)
+            yield ("%s%s" % (separator, chunk)).encode("utf-8")
+            separator = ", "
+        yield b"]"
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _json_rows(resource, _rows, tooltip=None):
+        """
+            Simplify the rows of a JSON export, and add tooltips
+
+            @param resource: the resource exported from
+            @param _rows: the rows extracted from the resource
+            @param tooltip: the tooltip parameters, tuple
+                            (tooltip, tooltip_function, kname, vname)
+
+            @returns: list of dicts
+        """
 
         # Simplify to plain fieldnames for fields in this table
         tn = "%s." % resource.tablename
@@ -143,12 +236,18 @@ class S3Exporter(object):
         for _row in _rows:
             row = {}
             for f in _row:
+                if f == "_row":
+                    continue
                 v = _row[f]
                 if tn in f:
                     f = f.split(tn, 1)[1]
                 row[f] = v
             rappend(row)
 
+        if tooltip is None:
+            return rows
+        tooltip, tooltip_function, kname, vname = tooltip
+
         if tooltip:
             if tooltip_function:
                 # Resolve key and value names against the resource
@@ -207,13 +306,84 @@ class S3Exporter(object):
                         if value:
                             row["_tooltip"] = s3_str(value)
 
-        # Return as JSON
-        response = current.response
-        if response:
-            response.headers["Content-Type"] = "application/json"
+        return rows
 
-        from gluon.serializers import json as jsons
-        return jsons(rows)
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def page_size(stream):
+        """
+            Get the page size for a streamed export
+
+            @param stream: the stream parameter (True or the page size)
+        """
+
+        if stream is True or not isinstance(stream, int):
+            return 1000
+        return max(stream, 1)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def pages(resource, fields, page_size, **attr):
+        """
+            Generator to extract data from a resource page by page, with
+            keyset pagination on the primary key (=each page selects the
+            records after the last record ID of the previous page rather
+            than using an offset)
+
+            @param resource: the resource
+            @param fields: the fields to extract (selector strings)
+            @param page_size: the number of records per page
+            @param attr: further keyword arguments for resource.select
+
+            @returns: the S3ResourceData of each page, or the Rows if
+                      as_rows=True
+
+            @note: a streamed response is consumed only after the request
+                   has been committed and its DB connection released, so
+                   this re-connects if needed
+        """
+
+        adapter = current.db._adapter
+        reconnected = False
+
+        pkey = resource._id
+        colname = str(pkey)
+
+        if fields is not None and "id" not in fields and \
+           colname not in fields:
+            fields = ["id"] + list(fields)
+
+        as_rows = attr.get("as_rows")
+        attr["raw_data"] = not as_rows
+
+        last = None
+        try:
+            while True:
+                if getattr(adapter, "connection", None) is None:
+                    adapter.reconnect()
+                    reconnected = True
+
+                data = resource.select(fields,
+                                       limit = page_size,
+                                       orderby = pkey,
+                                       after = last,
+                                       **attr)
+                rows = data if as_rows else data.rows
+                if not rows:
+                    break
+
+                if as_rows:
+                    last = rows.last()[colname]
+                else:
+                    last = rows[-1]["_row"][colname]
+
+                yield data
+
+                if len(rows) < page_size:
+                    break
+        finally:
+            if reconnected:
+                adapter.close()
 
     # -------------------------------------------------------------------------
     def pdf(self, *args, **kwargs):
@@ -30,7 +30,11 @@
 """
 
 import datetime
+import inspect
 import sys
+import threading
+import time
+from collections import OrderedDict
 from itertools import chain
 from uuid import uuid4
 
@@ -49,6 +53,7 @@ from .s3widgets import S3CalendarWidget, S3DateWidget
 __all__ = ("s3_fieldmethod",
            "S3ReusableField",
            "S3Represent",
+           "S3RepresentCache",
            "S3RepresentLazy",
            "S3MetaFields",
            "s3_all_meta_field_names",
@@ -272,6 +277,8 @@ class S3Represent:
         self.slabels = None
         self.htemplate = None
 
+        self.cache_name = None
+
         # Attributes to simulate being a function for sqlhtml's count_expected_args()
         # Make sure we indicate only 1 position argument
         self.__code__ = Storage(co_argcount = 1)
@@ -631,8 +638,70 @@ class S3Represent:
         else:
             self.htemplate = "%s > %s"
 
+        # Use the shared cache?
+        # - not for hierarchical representations (depend on other rows)
+        # - not for links rendered from the looked-up rows
+        # - not for label functions that cannot be identified by name
+        table = self.table
+        if table is not None and not self.hierarchy and \
+           S3RepresentCache.enabled(table._tablename) and \
+           (not self.show_link or type(self).link is S3Represent.link):
+            self.cache_name = self._cache_name()
+            if self.cache_name and \
+               not getattr(table, "_represent_cache", False):
+                # Invalidate the cache when records are updated or deleted
+                tablename = table._tablename
+                invalidate = lambda *args: S3RepresentCache.invalidate(tablename)
+                table._after_update.append(invalidate)
+                table._after_delete.append(invalidate)
+                table._represent_cache = True
+
         self.setup = True
 
+    # -------------------------------------------------------------------------
+    def _cache_name(self):
+        """
+            Get the name of this representation method in the shared
+            cache, i.e. everything the representation depends on besides
+            the looked-up row
+
+            @returns: a tuple (lookup table, class, fields, labels,
+                               language, options), or None if the
+                      representation cannot be shared
+
+            @note: label functions are identified by their name, so only
+                   module-level functions can be shared - lambdas, closures,
+                   methods and other callables may produce different labels
+                   under the same name
+        """
+
+        labels = self.labels
+        if self.slabels:
+            template = labels.m if isinstance(labels, lazyT) else labels
+        elif self.clabels:
+            if not inspect.isfunction(labels) or \
+               labels.__closure__ or \
+               labels.__name__ == "<lambda>" or \
+               "<locals>" in labels.__qualname__:
+                return None
+            template = "%s.%s" % (labels.__module__, labels.__qualname__)
+        else:
+            template = None
+
+        # Scalar options of subclasses (e.g. show_link, none, etc.)
+        options = tuple(sorted((k, v) for k, v in self.__dict__.items()
+                               if k not in ("queries", "setup") and \
+                                  isinstance(v, (str, int, float, bool, type(None)))
+                               ))
+
+        return (self.table._tablename,
+                type(self).__name__,
+                tuple(self.fields) if self.fields else (),
+                template,
+                current.T.accepted_language,
+                options,
+                )
+
     # -------------------------------------------------------------------------
     def _lookup(self, values, rows=None):
         """
@@ -718,6 +787,17 @@ class S3Represent:
                 if pop(k, None):
                     items[keys.get(k, k)] = theset[k]
 
+        # Look up representations from the shared cache
+        cache_name = self.cache_name if not h else None
+        if lookup and cache_name:
+            cache = S3RepresentCache.instance()
+            found = cache.get(cache_name, list(lookup.keys()))
+            for k, v in found.items():
+                lookup.pop(k, None)
+                items[keys.get(k, k)] = theset[k] = v
+        else:
+            cache = None
+
         # Retrieve additional rows as needed
         if lookup:
             if not self.custom_lookup:
@@ -747,6 +827,13 @@ class S3Represent:
                     lookup.pop(k, None)
                     items[keys.get(k, k)] = theset[k] = represent_row(row)
 
+                if cache:
+                    # Share plain-text representations
+                    # (lazyT is language-specific, hence cache as str)
+                    cache.put(cache_name,
+                              {k: s3_str(theset[k]) for k in rows
+                               if isinstance(theset[k], (str, lazyT))})
+
         # Anything left gets set to default
         if lookup:
             for k in lookup:
@@ -788,6 +875,174 @@ class S3Represent:
         theset[value] = result
         return result
 
+# =============================================================================
+class S3RepresentCache:
+    """
+        Process-wide cache for foreign key representations, shared by
+        S3Represent instances across requests (bounded LRU with TTL)
+
+        - enabled per lookup table with settings.base.represent_cache
+        - entries of a table are invalidated when records in the table
+          are updated or deleted (DAL hooks), or expire after the TTL
+          (=the maximum delay for changes made in other processes)
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, size=10000, expire=300):
+        """
+            Constructor
+
+            @param size: the maximum number of cached representations
+            @param expire: the maximum lifetime of cached representations
+                           (seconds)
+        """
+
+        self.size = size
+        self.expire = expire
+
+        self.items = OrderedDict()
+        self.versions = {}
+        self.stats = {}
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def instance(cls):
+        """
+            Get the cache instance for this process
+
+            @returns: the S3RepresentCache instance
+        """
+
+        instance = cls._instance
+        if instance is None:
+            settings = current.deployment_settings
+            with cls._lock:
+                instance = cls._instance
+                if instance is None:
+                    instance = cls._instance = cls(
+                        size = settings.get_base_represent_cache_size(),
+                        expire = settings.get_base_represent_cache_expire(),
+                        )
+        return instance
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def enabled(tablename):
+        """
+            Check whether the shared cache is enabled for a lookup table
+
+            @param tablename: the name of the lookup table
+        """
+
+        tables = current.deployment_settings.get_base_represent_cache()
+        if tables is True:
+            return True
+        return bool(tables) and tablename in tables
+
+    # -------------------------------------------------------------------------
+    def get(self, name, values):
+        """
+            Look up representations
+
+            @param name: the cache name of the representation method
+                         (see S3Represent._cache_name)
+            @param values: the values (keys) to look up
+
+            @returns: dict {value: representation} for all values found
+        """
+
+        tablename = name[0]
+        found = {}
+
+        now = time.time()
+        items = self.items
+        with self._lock:
+            version = self.versions.get(tablename, 0)
+            for value in values:
+                key = (name, value)
+                item = items.get(key)
+                if item is None:
+                    continue
+                if item[0] != version or item[1] < now:
+                    del items[key]
+                    continue
+                items.move_to_end(key)
+                found[value] = item[2]
+
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = [0, 0]
+            stats[0] += len(found)
+            stats[1] += len(values) - len(found)
+
+        return found
+
+    # -------------------------------------------------------------------------
+    def put(self, name, representations):
+        """
+            Add representations to the cache
+
+            @param name: the cache name of the representation method
+            @param representations: dict {value: representation}
+        """
+
+        tablename = name[0]
+        expires = time.time() + self.expire
+
+        items = self.items
+        with self._lock:
+            version = self.versions.get(tablename, 0)
+            for value, representation in representations.items():
+                key = (name, value)
+                items[key] = (version, expires, representation)
+                items.move_to_end(key)
+            while len(items) > self.size:
+                items.popitem(last=False)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def invalidate(cls, tablename):
+        """
+            Invalidate all cached representations of records in a table
+
+            @param tablename: the table name
+        """
+
+        instance = cls._instance
+        if instance is not None:
+            with cls._lock:
+                versions = instance.versions
+                versions[tablename] = versions.get(tablename, 0) + 1
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def statistics(cls):
+        """
+            Hit rates of the shared cache per representation method
+
+            @returns: dict {name: {"hits": number,
+                                   "misses": number,
+                                   "ratio": hit ratio,
+                                   }}
+        """
+
+        instance = cls._instance
+        if instance is None:
+            return {}
+
+        output = {}
+        with cls._lock:
+            for name, (hits, misses) in instance.stats.items():
+                lookups = hits + misses
+                output[":".join(s3_str(n) for n in name)] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "ratio": float(hits) / lookups if lookups else None,
+                    }
+        return output
+
 # =============================================================================
 class S3RepresentLazy:
     """
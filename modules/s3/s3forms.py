@@ -767,6 +767,11 @@ class S3SQLDefaultForm(S3SQLForm):
                 # This is getting swallowed
                 raise
 
+            # Update the text search indexes
+            if form_vars.id:
+                from .s3textindex import S3TextIndex
+                S3TextIndex.update(tablename, [form_vars.id])
+
         else:
             success = False
 
@@ -1606,6 +1611,10 @@ class S3SQLCustomForm(S3SQLForm):
                 # This is getting swallowed
                 raise
 
+            # Update the text search indexes
+            from .s3textindex import S3TextIndex
+            S3TextIndex.update(tablename, [accept_id])
+
         if alias is None:
             # Return master_form_vars
             return accept_id, form.vars
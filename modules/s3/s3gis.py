@@ -70,7 +70,7 @@ from gluon.storage import Storage
 
 from s3dal import Rows
 from .s3datetime import s3_format_datetime, s3_parse_datetime
-from .s3fields import s3_all_meta_field_names
+from .s3fields import S3RepresentCache, s3_all_meta_field_names
 from .s3rest import S3Method
 from .s3rtb import S3ResourceTree
 from .s3track import S3Trackable
@@ -4796,7 +4796,8 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
             Update GIS Locations' Materialized path, Lx locations, Lat/Lon & the_geom
 
             @param feature: a feature dict to update the tree for
-            - if not provided then update the whole tree
+            - if not provided then update the whole tree (in bulk,
+              see rebuild_location_tree)
             @param all_locations: passed to recursive calls to indicate that this
             is an update of the whole tree. Used to avoid repeated attempts to
             update hierarchy locations with missing data (e.g. lacking some
@@ -4901,29 +4902,8 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
 
 
         if not feature:
-            # We are updating all locations.
-            all_locations = True
-            # Do in chunks to save memory and also do in correct order
-            all_fields = (table.id, table.name, table.gis_feature_type,
-                          table.L0, table.L1, table.L2, table.L3, table.L4,
-                          table.lat, table.lon, table.wkt, table.inherited,
-                          # Handle Countries which start with Bounds set, yet are Points
-                          table.lat_min, table.lon_min, table.lat_max, table.lon_max,
-                          table.path, table.parent)
-            for level in ("L0", "L1", "L2", "L3", "L4", "L5", None):
-                query = (table.level == level) & (table.deleted == False)
-                try:
-                    features = db(query).select(*all_fields)
-                except MemoryError:
-                    current.log.error("S3GIS: Unable to update Location Tree for level %s: MemoryError" % level)
-                else:
-                    for feature in features:
-                        feature["level"] = level
-                        wkt = feature["wkt"]
-                        if wkt and not wkt.startswith("POI"):
-                            # Polygons aren't inherited
-                            feature["inherited"] = False
-                        update_location_tree(feature)  # all_locations is False here
+            # We are updating all locations
+            GIS.rebuild_location_tree()
             # All Done!
             return
 
@@ -5935,6 +5915,246 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
 
         return _path
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def rebuild_location_tree(batch_size=500):
+        """
+            Rebuild Materialized path, Lx names, inherited Lat/Lon and
+            Bounds of all locations in bulk, rather than feature by feature:
+                - reads all locations in a single pass
+                - computes the tree in memory top-down, level by level
+                - writes back only the locations that have changed,
+                  in batches
+
+            @param batch_size: the maximum number of locations to update
+                               per database statement
+
+            @returns: the number of updated locations
+        """
+
+        if GIS.disable_update_location_tree:
+            return 0
+
+        db = current.db
+        table = current.s3db.gis_location
+        log = current.log
+
+        # Read all locations
+        fields = [table.id,
+                  table.parent,
+                  table.level,
+                  table.name,
+                  table.path,
+                  table.inherited,
+                  table.gis_feature_type,
+                  table.lat,
+                  table.lon,
+                  table.wkt,
+                  table.lat_min,
+                  table.lat_max,
+                  table.lon_min,
+                  table.lon_max,
+                  ]
+        levels = ("L0", "L1", "L2", "L3", "L4", "L5")
+        fields.extend(table[level] for level in levels)
+        query = (table.deleted == False)
+        rows = db(query).select(cacheable = True, *fields)
+
+        locations = {}
+        children = {}
+        for row in rows:
+            location_id = row.id
+            locations[location_id] = row
+            children.setdefault(row.parent, []).append(location_id)
+        total = len(locations)
+        log.info("S3GIS: rebuilding location tree for %s locations" % total)
+
+        # Start with the locations without (valid) parent
+        roots = [location_id for location_id, row in locations.items()
+                 if row.parent not in locations]
+
+        wkt_centroid = GIS.wkt_centroid
+
+        tree = {}
+        updates = {}
+        depth = 0
+        while roots:
+            depth += 1
+            leaves = []
+            for location_id in roots:
+
+                row = locations[location_id]
+                level = row.level
+
+                # Materialized path and Lx names from the parent
+                parent = tree.get(row.parent)
+                if parent:
+                    path = "%s/%s" % (parent[0], location_id)
+                    names = list(parent[1])
+                    parent_lat, parent_lon = parent[2:]
+                else:
+                    path = str(location_id)
+                    names = [None] * len(levels)
+                    parent_lat = parent_lon = None
+                if level in levels:
+                    index = levels.index(level)
+                    names[index] = row.name
+                    names[index + 1:] = [None] * (len(levels) - index - 1)
+
+                # Lat/Lon, inherited unless the feature has its own
+                inherited = row.inherited
+                lat = row.lat
+                lon = row.lon
+                wkt = row.wkt
+                polygon = wkt and not wkt.startswith("POI")
+                if polygon or level == "L0":
+                    # Polygons aren't inherited
+                    inherited = False
+                elif inherited or lat is None or lon is None:
+                    inherited = True
+                    lat, lon = parent_lat, parent_lon
+                    wkt = None
+
+                data = {"path": path,
+                        "inherited": inherited,
+                        "lat": lat,
+                        "lon": lon,
+                        "wkt": wkt or None,
+                        }
+                for index, key in enumerate(levels):
+                    data[key] = names[index]
+
+                # WKT, centroid and bounds
+                if polygon:
+                    if lat is None or lon is None or row.lon_min is None:
+                        form = Storage(vars = Storage(row.as_dict()),
+                                       errors = Storage(),
+                                       )
+                        form.vars.update(data)
+                        try:
+                            wkt_centroid(form)
+                        except ImportError:
+                            log.error("S3GIS: cannot compute centroid for location %s: Shapely not installed" % location_id)
+                        else:
+                            if form.errors:
+                                log.error("S3GIS: %s" % form.errors)
+                            else:
+                                form_vars = form.vars
+                                for key in ("gis_feature_type", "wkt", "the_geom",
+                                            "lat", "lon",
+                                            "lat_min", "lat_max", "lon_min", "lon_max",
+                                            ):
+                                    if key in form_vars:
+                                        data[key] = form_vars[key]
+                                lat, lon = data["lat"], data["lon"]
+                elif lat is not None and lon is not None:
+                    # Point
+                    data["wkt"] = "POINT (%s %s)" % (lon, lat)
+                    data["gis_feature_type"] = 1
+                    if row.lon_min is None or row.lat_min is None:
+                        data.update(lat_min = lat,
+                                    lat_max = lat,
+                                    lon_min = lon,
+                                    lon_max = lon,
+                                    )
+
+                tree[location_id] = (path, names, lat, lon)
+
+                # Collect the changes
+                if any(row[key] != value for key, value in data.items() if key in row):
+                    updates[location_id] = data
+
+                leaves.extend(children.get(location_id, ()))
+
+            log.info("S3GIS: location tree level %s: %s/%s locations processed, %s to update" % \
+                     (depth, len(tree), total, len(updates)))
+            roots = leaves
+
+        if len(tree) < total:
+            log.error("S3GIS: %s locations are not connected to the location tree (circular parent references?)" % \
+                      (total - len(tree)))
+
+        if updates:
+            if current.deployment_settings.get_gis_spatialdb():
+                for data in updates.values():
+                    if "wkt" in data and "the_geom" not in data:
+                        data["the_geom"] = data["wkt"]
+            GIS.update_locations(updates, batch_size=batch_size)
+        log.info("S3GIS: location tree rebuilt, %s locations updated" % len(updates))
+
+        return len(updates)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def update_locations(updates, batch_size=500):
+        """
+            Write updates of many locations with few database statements,
+            using one UPDATE with CASE-expressions per batch of locations
+
+            @param updates: the updates, a dict {location_id: {fieldname: value}}
+            @param batch_size: the maximum number of locations per statement
+
+            @note: this bypasses the DAL callbacks of the table, so callers
+                   must not update fields relevant for the location
+                   hierarchy (i.e. parent or deleted)
+        """
+
+        db = current.db
+        table = current.s3db.gis_location
+        represent = db._adapter.represent
+
+        # Set the update-defaults (e.g. modified_on) like DAL updates do,
+        # so that the changes are visible to synchronization
+        defaults = {}
+        for field in table:
+            value = field.update
+            if value is not None:
+                defaults[field.name] = value() if callable(value) else value
+
+        location_ids = list(updates.keys())
+        for index in range(0, len(location_ids), batch_size):
+            batch = location_ids[index:index + batch_size]
+
+            fieldnames = set()
+            for location_id in batch:
+                fieldnames.update(updates[location_id].keys())
+
+            assignments = ["%s=%s" % (fieldname,
+                                      represent(value, table[fieldname].type),
+                                      )
+                           for fieldname, value in sorted(defaults.items())
+                           if fieldname not in fieldnames
+                           ]
+            for fieldname in sorted(fieldnames):
+                field = table[fieldname]
+                cases = ["WHEN %s THEN %s" % (location_id,
+                                              represent(updates[location_id][fieldname],
+                                                        field.type,
+                                                        ),
+                                              )
+                         for location_id in batch
+                         if fieldname in updates[location_id]
+                         ]
+                assignments.append("%s=CASE id %s ELSE %s END" % (fieldname,
+                                                                  " ".join(cases),
+                                                                  fieldname,
+                                                                  ))
+            sql = "UPDATE %s SET %s WHERE id IN (%s);" % \
+                  (table._tablename,
+                   ", ".join(assignments),
+                   ",".join(str(location_id) for location_id in batch),
+                   )
+            db.executesql(sql)
+
+            current.log.info("S3GIS: updated %s/%s locations" % \
+                             (min(index + batch_size, len(location_ids)),
+                              len(location_ids),
+                              ))
+
+        if location_ids:
+            # Cached representations of the locations are outdated
+            S3RepresentCache.invalidate(table._tablename)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def wkt_centroid(form):
@@ -6211,18 +6431,21 @@ page.render('%(filename)s', {format: 'jpeg', quality: '100'});''' % \
         if SHAPELY:
             # Refine to those locations with a WKT field
             wkt_no_bounds = no_bounds & (table.wkt != None) & (table.wkt != "")
-            for location in db(wkt_no_bounds).select(table.wkt):
+            updates = {}
+            for location in db(wkt_no_bounds).select(table.id, table.wkt):
                 try :
                     shape = wkt_loads(location.wkt)
                 except:
                     current.log.error("Error reading WKT", location.wkt)
                     continue
                 bounds = shape.bounds
-                table[location.id] = {"lon_min": bounds[0],
-                                      "lat_min": bounds[1],
-                                      "lon_max": bounds[2],
-                                      "lat_max": bounds[3],
-                                      }
+                updates[location.id] = {"lon_min": bounds[0],
+                                        "lat_min": bounds[1],
+                                        "lon_max": bounds[2],
+                                        "lat_max": bounds[3],
+                                        }
+            # Write in batches
+            GIS.update_locations(updates)
 
         # Anything left, we assume is a Point, so set the bounds to be the same
         db(no_bounds).update(lon_min=table.lon,
@@ -34,6 +34,7 @@ __all__ = ("S3Hierarchy",
            )
 
 import json
+import threading
 
 from gluon import DIV, FORM, LI, UL, current
 from gluon.storage import Storage
@@ -46,8 +47,6 @@ from .s3widgets import SEPARATORS
 
 DEFAULT = lambda: None
 
-LABEL = "l"
-
 # =============================================================================
 class S3HierarchyCRUD(S3Method):
     """ Method handler for hierarchical CRUD """
@@ -507,10 +506,104 @@ class S3HierarchyCRUD(S3Method):
         # Reponse headers and file name are set in codec
         return result
 
+# =============================================================================
+class S3HierarchyNode:
+    """
+        Compact representation of a hierarchy node, can be accessed
+        like a dict with the keys "p" (parent ID), "c" (category) and
+        "s" (child node IDs)
+    """
+
+    __slots__ = ("p", "c", "s")
+
+    def __init__(self, p=None, c=None, s=None):
+        """
+            Constructor
+
+            @param p: the parent node ID
+            @param c: the category
+            @param s: the child node IDs (set)
+        """
+
+        self.p = p
+        self.c = c
+        # Leaf nodes share an empty tuple rather than an empty set each
+        self.s = s if s else ()
+
+    # -------------------------------------------------------------------------
+    def __getitem__(self, key):
+
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    # -------------------------------------------------------------------------
+    def __setitem__(self, key, value):
+
+        if key in self.__slots__:
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    # -------------------------------------------------------------------------
+    def __contains__(self, key):
+
+        return key in self.__slots__
+
+    # -------------------------------------------------------------------------
+    def keys(self):
+
+        return self.__slots__
+
+    # -------------------------------------------------------------------------
+    def get(self, key, default=None):
+
+        return getattr(self, key) if key in self.__slots__ else default
+
+    # -------------------------------------------------------------------------
+    def add_child(self, node_id):
+        """
+            Add a child node
+
+            @param node_id: the child node ID
+        """
+
+        if self.s:
+            self.s.add(node_id)
+        else:
+            self.s = {node_id}
+
+    # -------------------------------------------------------------------------
+    def remove_child(self, node_id):
+        """
+            Remove a child node
+
+            @param node_id: the child node ID
+        """
+
+        if self.s:
+            self.s.discard(node_id)
+
+    # -------------------------------------------------------------------------
+    def copy(self):
+        """ Return a copy of this node """
+
+        return S3HierarchyNode(self.p, self.c, set(self.s))
+
 # =============================================================================
 class S3Hierarchy:
     """ Class representing an object hierarchy """
 
+    # Number of stored node updates after which the stored
+    # hierarchy gets compacted into a new version
+    COMPACT = 500
+
+    # Process-wide cache for stored hierarchies, to avoid re-parsing
+    # them in every request, format:
+    #   {tablename: (version, IDs of applied node updates, nodes)}
+    CACHE = {}
+    LOCK = threading.Lock()
+
     # -------------------------------------------------------------------------
     def __init__(self,
                  tablename = None,
@@ -539,11 +632,11 @@ class S3Hierarchy:
         self.filter = filter
         self.leafonly = leafonly
 
-        self.__theset = None
-        self.__flags = None
+        self.__hierarchy = None
 
         self.__nodes = None
         self.__roots = None
+        self.__revision = None
 
         self.__pkey = None
         self.__fkey = None
@@ -563,22 +656,39 @@ class S3Hierarchy:
                              "c": <category>,
                              "s": set(child nodes)
                 }}
+
+            (nodes are S3HierarchyNode instances which can be accessed
+            like dicts; the dict must not be modified by the caller as
+            it may be shared with other requests)
         """
 
-        if self.__theset is None:
+        if self.__hierarchy is None:
             self.__connect()
         if self.__status("dirty"):
             self.read()
-        return self.__theset
+            self.save()
+        return self.__hierarchy["nodes"]
 
     # -------------------------------------------------------------------------
     @property
     def flags(self):
         """ Dict of status flags """
 
-        if self.__flags is None:
+        if self.__hierarchy is None:
             theset = self.theset
-        return self.__flags
+        return self.__hierarchy["flags"]
+
+    # -------------------------------------------------------------------------
+    @property
+    def labels(self):
+        """
+            The node labels in this request (kept separately from the
+            nodes as those can be shared with other requests)
+        """
+
+        if self.__hierarchy is None:
+            self.__connect()
+        return self.__hierarchy.setdefault("labels", {})
 
     # -------------------------------------------------------------------------
     @property
@@ -599,7 +709,8 @@ class S3Hierarchy:
         """ The nodes in the subset """
 
         theset = self.theset
-        if self.__nodes is None:
+        if self.__nodes is None or \
+           self.__revision != self.__status("revision"):
             self.__subset()
         return self.__nodes
 
@@ -676,21 +787,45 @@ class S3Hierarchy:
         if tablename :
             hierarchies = current.model["hierarchies"]
             if tablename in hierarchies:
-                hierarchy = hierarchies[tablename]
-                self.__theset = hierarchy["nodes"]
-                self.__flags = hierarchy["flags"]
+                self.__hierarchy = hierarchies[tablename]
             else:
-                self.__theset = {}
-                self.__flags = {}
+                hierarchy = {"nodes": {},
+                             "flags": {},
+                             }
+                self.__hierarchy = hierarchies[tablename] = hierarchy
                 self.load()
-                hierarchy = {"nodes": self.__theset,
-                             "flags": self.__flags}
-                hierarchies[tablename] = hierarchy
         else:
-            self.__theset = {}
-            self.__flags = {}
+            self.__hierarchy = {"nodes": {},
+                                "flags": {},
+                                }
         return
 
+    # -------------------------------------------------------------------------
+    def __writable(self):
+        """
+            Get the nodes dict for modification; copies the nodes if
+            they are shared with the process-wide cache
+
+            @returns: the nodes dict
+        """
+
+        if self.__hierarchy is None:
+            self.__connect()
+
+        hierarchy = self.__hierarchy
+        nodes = hierarchy["nodes"]
+
+        flags = hierarchy["flags"]
+        if flags.get("shared"):
+            nodes = {node_id: node.copy() for node_id, node in nodes.items()}
+            hierarchy["nodes"] = nodes
+            del flags["shared"]
+
+        # Invalidate the subsets of all instances
+        flags["revision"] = flags.get("revision", 0) + 1
+
+        return nodes
+
     # -------------------------------------------------------------------------
     def __status(self, flag=None, default=None, **attr):
         """
@@ -727,24 +862,59 @@ class S3Hierarchy:
             self.__status(dirty = True)
             return
 
+        db = current.db
         htable = current.s3db.s3_hierarchy
         query = (htable.tablename == tablename)
-        row = current.db(query).select(htable.dirty,
-                                       htable.hierarchy,
-                                       limitby = (0, 1),
-                                       ).first()
+        row = db(query).select(htable.id,
+                               htable.dirty,
+                               htable.version,
+                               limitby = (0, 1),
+                               ).first()
+        # Remember the version read, so that the hierarchy is only
+        # saved if no other process has saved it in the meantime
+        version = (row.version or 0) if row else None
+        self.__status(version = version)
+
         if row and not row.dirty:
-            data = row.hierarchy
-            theset = self.__theset
-            theset.clear()
-            for node_id, item in data["nodes"].items():
-                theset[int(node_id)] = {"p": item["p"],
-                                        "c": item["c"],
-                                        "s": set(item["s"]) \
-                                             if item["s"] else set()}
+            cached = self.CACHE.get(tablename)
+            if cached and cached[0] == version:
+                # Re-use the nodes parsed in a previous request
+                applied, nodes = cached[1:]
+            else:
+                query = (htable.id == row.id)
+                data = db(query).select(htable.hierarchy,
+                                        limitby = (0, 1),
+                                        ).first().hierarchy
+                nodes = {}
+                for node_id, item in data["nodes"].items():
+                    nodes[int(node_id)] = S3HierarchyNode(item["p"],
+                                                          item["c"],
+                                                          set(item["s"]),
+                                                          )
+                applied = frozenset()
+
+            self.__hierarchy["nodes"] = nodes
             self.__status(dirty = False,
                           dbupdate = None,
-                          dbstatus = True)
+                          dbstatus = True,
+                          shared = True,
+                          )
+
+            # Apply the node updates stored since
+            applied = self.__update(applied)
+            with self.LOCK:
+                self.CACHE[tablename] = (version,
+                                         applied,
+                                         self.__hierarchy["nodes"],
+                                         )
+            self.__status(shared = True,
+                          applied = applied,
+                          )
+
+            if len(applied) >= self.COMPACT:
+                # Store a new version
+                self.__status(dbupdate = True)
+                self.save()
             return
         else:
             self.__status(dirty = True,
@@ -772,40 +942,81 @@ class S3Hierarchy:
                                    "s": list(node["s"]) \
                                         if node["s"] else []}
 
+        db = current.db
+        s3db = current.s3db
+
+        # The version this hierarchy is based on
+        htable = s3db.s3_hierarchy
+        current_version = self.__status("version")
+        version = current_version + 1 if current_version is not None else 1
+
         # Generate record
         data = {"tablename": tablename,
                 "dirty": False,
-                "hierarchy": {"nodes": nodes_dict}
+                "hierarchy": {"nodes": nodes_dict},
+                "version": version,
                 }
 
-        # Get current entry
-        htable = current.s3db.s3_hierarchy
-        row = current.db(htable.tablename == tablename).select(htable.id,
-                                                               limitby = (0, 1),
-                                                               ).first()
-
-        if row:
-            # Update record
-            row.update_record(**data)
+        query = (htable.tablename == tablename)
+        if current_version is None:
+            # Create new record, unless another process has done so
+            if db(query).select(htable.id, limitby=(0, 1)).first():
+                updated = False
+            else:
+                htable.insert(**data)
+                updated = True
         else:
-            # Create new record
-            htable.insert(**data)
+            # Update record, unless another process has stored a newer
+            # version or marked it dirty since this hierarchy was read
+            if current_version == 0:
+                query &= (htable.version == 0) | (htable.version == None)
+            else:
+                query &= (htable.version == current_version)
+            updated = db(query).update(**data)
+
+        if not updated:
+            # Keep the nodes for this request, but leave the stored
+            # hierarchy and the node updates to the other process
+            self.__status(dbupdate = None,
+                          shared = None,
+                          )
+            return
+
+        # Remove the node updates included in this version
+        applied = self.__status("applied")
+        if applied:
+            dtable = s3db.s3_hierarchy_delta
+            db(dtable.id.belongs(applied)).delete()
+
+        # Share the nodes with subsequent requests
+        with self.LOCK:
+            self.CACHE[tablename] = (version, frozenset(), theset)
 
         # Update status
         self.__status(dirty = False,
                       dbupdate = None,
                       dbstatus = True,
+                      shared = True,
+                      applied = None,
+                      version = version,
                       )
         return
 
     # -------------------------------------------------------------------------
     @classmethod
-    def dirty(cls, tablename):
+    def dirty(cls, tablename, node_ids=None, record_ids=None):
         """
             Mark this hierarchy as dirty. To be called when the target
             table gets updated (can be called repeatedly).
 
             @param tablename: the tablename
+            @param node_ids: the IDs of the nodes which have been created,
+                             updated or deleted
+            @param record_ids: the record IDs of the nodes which have been
+                               created or updated
+
+            @note: if node_ids or record_ids are given, the hierarchy is
+                   updated incrementally rather than rebuilt from scratch
         """
 
         s3db = current.s3db
@@ -816,6 +1027,12 @@ class S3Hierarchy:
         if not config:
             return
 
+        if node_ids or record_ids:
+            if cls(tablename).refresh(node_ids = node_ids,
+                                      record_ids = record_ids,
+                                      ):
+                return
+
         hierarchies = current.model["hierarchies"]
         if tablename in hierarchies:
             hierarchy = hierarchies[tablename]
@@ -830,21 +1047,128 @@ class S3Hierarchy:
 
         dbstatus = flags.get("dbstatus", True)
         if dbstatus:
+            db = current.db
             htable = current.s3db.s3_hierarchy
             query = (htable.tablename == tablename)
-            row = current.db(query).select(htable.id,
-                                           htable.dirty,
-                                           limitby = (0, 1),
-                                           ).first()
+            row = db(query).select(htable.id,
+                                   limitby = (0, 1),
+                                   ).first()
             if not row:
                 htable.insert(tablename = tablename,
                               dirty = True,
                               )
-            elif not row.dirty:
-                row.update_record(dirty = True)
+            else:
+                # Increment the version, so that a rebuild which is
+                # in progress in another process will not be saved
+                version = htable.version.coalesce(0) + 1
+                db(htable.id == row.id).update(dirty = True,
+                                               version = version,
+                                               )
             flags["dbstatus"] = False
         return
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def track(cls, tablename, link=None, key=None):
+        """
+            Register DAL callbacks to update the hierarchy whenever records
+            are written, so that direct inserts/updates (e.g. in onaccept
+            callbacks or by S3RecordMerger) do not leave it stale
+
+            @param tablename: the name of the hierarchical table
+            @param link: the name of the link table holding the parent
+                         keys, to track writes to the link table
+            @param key: the foreign key in the link table referencing
+                        the hierarchical table (the child node)
+
+            @note: the callbacks are registered per request, i.e. this
+                   must be called whenever the table is defined
+        """
+
+        db = current.db
+
+        trackname = link or tablename
+        if trackname not in db:
+            return
+        table = db[trackname]
+        if getattr(table, "_hierarchy_tracked", False):
+            return
+        table._hierarchy_tracked = True
+
+        if link:
+            key = table[key]
+        else:
+            key = table._id
+
+        # Record IDs collected before updates/deletes, as stacks
+        # (to match the after-callbacks of nested writes)
+        updates = []
+        deletes = []
+
+        # Fields relevant for the hierarchy (introspected on demand)
+        names = set()
+
+        def watched(fields):
+            # Whether the updated fields are relevant for the hierarchy
+            if link:
+                return True
+            if not names:
+                h = cls(tablename)
+                names.update((h.pkey.name, "deleted"))
+                if not h.link:
+                    names.add(h.fkey.name)
+                if h.ckey:
+                    names.add(h.ckey)
+            return bool(names & set(fields))
+
+        def after_insert(fields, record_id):
+            if link:
+                record_id = fields.get(key.name)
+            if record_id:
+                cls.dirty(tablename, record_ids=[record_id])
+
+        def before_update(dbset, fields):
+            if watched(fields):
+                updates.append([row[key] for row in dbset.select(key)])
+            else:
+                updates.append(None)
+
+        def after_update(dbset, fields):
+            record_ids = updates.pop() if updates else None
+            if record_ids is None:
+                return
+            if link and fields.get(key.name):
+                # Child node re-linked
+                record_ids.append(fields[key.name])
+            if record_ids:
+                cls.dirty(tablename, record_ids=record_ids)
+
+        def before_delete(dbset):
+            if link:
+                node_ids = None
+                record_ids = [row[key] for row in dbset.select(key)]
+            else:
+                # Records will be gone, so look up the node IDs now
+                pkey = cls(tablename).pkey
+                node_ids = [row[pkey] for row in dbset.select(pkey)]
+                record_ids = None
+            deletes.append((node_ids, record_ids))
+
+        def after_delete(dbset):
+            if deletes:
+                node_ids, record_ids = deletes.pop()
+                if node_ids or record_ids:
+                    cls.dirty(tablename,
+                              node_ids = node_ids,
+                              record_ids = record_ids,
+                              )
+
+        table._after_insert.append(after_insert)
+        table._before_update.append(before_update)
+        table._after_update.append(after_update)
+        table._before_delete.append(before_delete)
+        table._after_delete.append(after_delete)
+
     # -------------------------------------------------------------------------
     def read(self):
         """ Rebuild this hierarchy from the target table """
@@ -868,10 +1192,27 @@ class S3Hierarchy:
             query = (table.deleted == False)
         else:
             query = (table.id > 0)
-        rows = current.db(query).select(left = self.left,
-                                        *fields)
+        db = current.db
+
+        # The version this rebuild is based on
+        htable = s3db.s3_hierarchy
+        stored = db(htable.tablename == tablename).select(htable.version,
+                                                          limitby = (0, 1),
+                                                          ).first()
+
+        # Node updates stored so far are included in the rebuilt hierarchy
+        dtable = s3db.s3_hierarchy_delta
+        applied = db(dtable.tablename == tablename).select(dtable.id)
+        self.__status(shared = None,
+                      applied = frozenset(row.id for row in applied),
+                      version = (stored.version or 0) if stored else None,
+                      )
 
-        self.__theset.clear()
+        rows = db(query).select(left = self.left,
+                                *fields)
+
+        self.__hierarchy["nodes"] = {}
+        self.__hierarchy.pop("labels", None)
 
         add = self.add
         cfield = table[ckey]
@@ -895,6 +1236,136 @@ class S3Hierarchy:
 
         return
 
+    # -------------------------------------------------------------------------
+    def refresh(self, node_ids=None, record_ids=None):
+        """
+            Update particular nodes from the target table, and store the
+            changes so that other requests can apply them to their copy
+            of the hierarchy without rebuilding it
+
+            @param node_ids: the node IDs
+            @param record_ids: the record IDs of the nodes
+
+            @returns: True if successful, False if the hierarchy needs
+                      to be rebuilt instead
+        """
+
+        tablename = self.tablename
+        if not tablename or not self.config:
+            return False
+
+        # Make sure the hierarchy is loaded
+        if self.__status("dirty"):
+            self.read()
+        if not self.__status("dbstatus"):
+            # No stored hierarchy to update
+            return False
+
+        db = current.db
+        s3db = current.s3db
+        table = s3db[tablename]
+
+        pkey = self.pkey
+        fkey = self.fkey
+        ckey = self.ckey
+
+        node_ids = set(node_ids) if node_ids else set()
+        if record_ids:
+            if pkey.name == table._id.name:
+                node_ids |= set(record_ids)
+            else:
+                query = table._id.belongs(set(record_ids))
+                rows = db(query).select(pkey)
+                node_ids |= set(row[pkey] for row in rows)
+        node_ids = set(int(node_id) for node_id in node_ids if node_id)
+        if not node_ids:
+            return True
+
+        # Read the current state of the nodes
+        fields = [pkey, fkey]
+        if ckey:
+            cfield = table[ckey]
+            fields.append(cfield)
+        query = pkey.belongs(node_ids)
+        if "deleted" in table:
+            query &= (table.deleted == False)
+        rows = db(query).select(left = self.left,
+                                *fields)
+        updates = {}
+        for row in rows:
+            updates[row[pkey]] = (row[fkey], row[cfield] if ckey else None)
+
+        # Update the nodes, and store the updates
+        dtable = s3db.s3_hierarchy_delta
+        applied = set(self.__status("applied", ()))
+        for node_id in node_ids:
+            if node_id in updates:
+                parent_id, category = updates[node_id]
+                node = self.add(node_id,
+                                parent_id = parent_id,
+                                category = category,
+                                )
+                node["c"] = category
+                delta = {"parent_id": parent_id,
+                         "category": category,
+                         }
+            else:
+                self.remove(node_id)
+                delta = {"removed": True}
+            applied.add(dtable.insert(tablename = tablename,
+                                      node_id = node_id,
+                                      **delta))
+        self.__status(applied = frozenset(applied))
+
+        # Remove subset
+        self.__roots = None
+        self.__nodes = None
+
+        return True
+
+    # -------------------------------------------------------------------------
+    def __update(self, applied):
+        """
+            Apply the node updates stored since the last version of
+            the hierarchy was saved
+
+            @param applied: the IDs of the node updates already applied
+
+            @returns: the IDs of all applied node updates
+        """
+
+        dtable = current.s3db.s3_hierarchy_delta
+        query = (dtable.tablename == self.tablename)
+        rows = current.db(query).select(dtable.id,
+                                        dtable.node_id,
+                                        dtable.parent_id,
+                                        dtable.category,
+                                        dtable.removed,
+                                        orderby = dtable.id,
+                                        )
+
+        # Updates of the same node are ordered by their IDs, but an update
+        # may become visible only after updates with higher IDs, so apply
+        # whatever has not been applied yet rather than everything after
+        # the highest ID seen
+        rows = [row for row in rows if row.id not in applied]
+        if rows:
+            applied = set(applied)
+            for row in rows:
+                node_id = row.node_id
+                if row.removed:
+                    self.remove(node_id)
+                else:
+                    node = self.add(node_id,
+                                    parent_id = row.parent_id,
+                                    category = row.category,
+                                    )
+                    node["c"] = row.category
+                applied.add(row.id)
+            applied = frozenset(applied)
+
+        return applied
+
     # -------------------------------------------------------------------------
     def __keys(self):
         """ Introspect the key fields in the hierarchical table """
@@ -1116,6 +1587,7 @@ class S3Hierarchy:
                                              )
             success = resource.delete(cascade = True)
             if success:
+                # NB S3Delete stores the update for other requests
                 self.remove(node_id)
                 total += 1
             else:
@@ -1123,9 +1595,6 @@ class S3Hierarchy:
                     current.db.rollback()
                 return None
 
-        if not cascade and total:
-            self.dirty(tablename)
-
         return total
 
     # -------------------------------------------------------------------------
@@ -1138,14 +1607,18 @@ class S3Hierarchy:
             @param category: the category
         """
 
-        theset = self.__theset
+        theset = self.__writable()
 
         if node_id in theset:
             node = theset[node_id]
             if category is not None:
                 node["c"] = category
+            # Detach from the previous parent
+            previous = node["p"]
+            if previous and previous != parent_id and previous in theset:
+                theset[previous].remove_child(node_id)
         elif node_id:
-            node = {"s": set(), "c": category}
+            node = S3HierarchyNode(c=category)
         else:
             raise SyntaxError
 
@@ -1154,7 +1627,7 @@ class S3Hierarchy:
                 parent = self.add(parent_id, None, None)
             else:
                 parent = theset[parent_id]
-            parent["s"].add(node_id)
+            parent.add_child(node_id)
         node["p"] = parent_id
 
         theset[node_id] = node
@@ -1168,7 +1641,7 @@ class S3Hierarchy:
             @param node_id: the node ID
         """
 
-        theset = self.__theset
+        theset = self.__writable()
 
         if node_id in theset:
             node = theset[node_id]
@@ -1176,9 +1649,8 @@ class S3Hierarchy:
             return False
 
         parent_id = node["p"]
-        if parent_id:
-            parent = theset[parent_id]
-            parent["s"].discard(node_id)
+        if parent_id and parent_id in theset:
+            theset[parent_id].remove_child(node_id)
         del theset[node_id]
         return True
 
@@ -1233,6 +1705,7 @@ class S3Hierarchy:
 
         self.__roots = roots
         self.__nodes = subset
+        self.__revision = self.__status("revision")
         return
 
     # -------------------------------------------------------------------------
@@ -1494,7 +1967,7 @@ class S3Hierarchy:
     def _represent(self, node_ids=None, renderer=None):
         """
             Represent nodes as labels, the labels are stored in the
-            nodes as attribute "l".
+            labels dict of the hierarchy.
 
             @param node_ids: the node IDs (None for all nodes)
             @param renderer: the representation method (falls back
@@ -1503,16 +1976,14 @@ class S3Hierarchy:
         """
 
         theset = self.theset
+        labels = self.labels
 
         if node_ids is None:
             node_ids = self.nodes.keys()
 
         pending = set()
         for node_id in node_ids:
-            node = theset.get(node_id)
-            if not node:
-                continue
-            if LABEL not in node:
+            if node_id in theset and node_id not in labels:
                 pending.add(node_id)
 
         if renderer is None:
@@ -1528,17 +1999,17 @@ class S3Hierarchy:
             else:
                 renderer = s3_str
         if hasattr(renderer, "bulk"):
-            labels = renderer.bulk(list(pending), list_type = False)
-            for node_id, label in labels.items():
+            represented = renderer.bulk(list(pending), list_type = False)
+            for node_id, label in represented.items():
                 if node_id in theset:
-                    theset[node_id][LABEL] = label
+                    labels[node_id] = label
         else:
             for node_id in pending:
                 try:
                     label = renderer(node_id)
                 except:
                     label = s3_str(node_id)
-                theset[node_id][LABEL] = label
+                labels[node_id] = label
         return
 
     # -------------------------------------------------------------------------
@@ -1551,15 +2022,16 @@ class S3Hierarchy:
         """
 
         theset = self.theset
+        labels = self.labels
         node = theset.get(node_id)
         if node:
-            if LABEL in node:
-                label = node[LABEL]
+            if node_id in labels:
+                label = labels[node_id]
             else:
                 self._represent(node_ids = [node_id],
                                 renderer = represent)
-            if LABEL in node:
-                label = node[LABEL]
+            if node_id in labels:
+                label = labels[node_id]
             if type(label) is str:
                 label = s3_str(label)
             return label
@@ -1588,11 +2060,11 @@ class S3Hierarchy:
 
         self._represent(all_parents, renderer=represent)
 
-        theset = self.theset
+        labels = self.labels
         result = {}
         for node_id, path in paths.items():
             p = (path + [None] * levels)[:levels]
-            l = [theset[parent][LABEL] if parent else "-" for parent in p]
+            l = [labels[parent] if parent else "-" for parent in p]
             result[node_id] = l
 
         return result
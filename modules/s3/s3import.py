@@ -33,10 +33,12 @@ __all__ = ("S3Importer",
            "S3ImportJob",
            "S3ImportItem",
            "S3Duplicate",
+           "S3StreamImport",
            "S3BulkImporter",
            )
 
 import datetime
+import hashlib
 import json
 import os
 import pickle
@@ -60,13 +62,13 @@ from gluon import current, redirect, URL, \
 from gluon.storage import Storage, Messages
 from gluon.tools import callback, fetch
 
-from s3dal import Field
+from s3dal import Field, Row
 from .s3datetime import s3_utc
 from .s3rest import S3Method, S3Request
 from .s3resource import S3Resource
 from .s3utils import s3_get_foreign_key, s3_has_foreign_key, \
                      s3_mark_required, s3_str, s3_options_represent
-from .s3validators import IS_JSONS3
+from .s3validators import IS_JSONS3, IS_ONE_OF_EMPTY
 
 KNOWN_SPREADSHEET_EXTENSIONS = (".csv", ".xls", ".xlsx", ".xlsm")
 
@@ -557,6 +559,12 @@ class S3Importer(S3Method):
         else:
             file_format = extension
 
+        chunk_size = current.deployment_settings.get_base_import_chunk_size()
+        if chunk_size and file_format == "csv":
+            # Import in chunks, without review
+            self._commit_stream(source, transform, chunk_size, user=user)
+            return
+
         # Insert data in the table and get the ID
         try:
             with open(source, "r") as infile:
@@ -613,6 +621,134 @@ class S3Importer(S3Method):
 
         # @todo: return the upload_id?
 
+    # -------------------------------------------------------------------------
+    def _commit_stream(self, source, stylesheet, chunk_size, user=None):
+        """
+            Import a CSV source in chunks of rows, committing each chunk
+            separately; resumes a previously interrupted import of the
+            same source from its last checkpoint
+
+            @param source: the source file path
+            @param stylesheet: the stylesheet path
+            @param chunk_size: the number of rows per chunk
+            @param user: the user ID
+        """
+
+        db = current.db
+        session = current.session
+        messages = self.messages
+
+        table = self.upload_table
+
+        # Digest of the source contents
+        try:
+            with open(source, "rb") as infile:
+                digest = S3StreamImport.digest(infile)
+        except IOError:
+            # Source not found or not readable
+            session.error = messages.file_open_error % source
+            redirect(URL(r=self.request, f=self.function))
+
+        # Look for an interrupted import of the same source
+        query = (table.controller == self.controller) & \
+                (table.function == self.function) & \
+                (table.filename == source) & \
+                (table.status != 3) & \
+                (table.checkpoint > 0)
+        rows = db(query).select(table.id,
+                                table.checkpoint,
+                                table.digest,
+                                table.summary_added,
+                                table.summary_error,
+                                orderby = ~table.id,
+                                )
+        row = None
+        stale = []
+        for upload in rows:
+            if row is None and digest and upload.digest == digest:
+                row = upload
+            else:
+                stale.append(upload.id)
+        if stale:
+            # Source has changed since => discard the checkpoints
+            db(table.id.belongs(stale)).update(checkpoint = 0)
+
+        if row:
+            upload_id = row.id
+            start = row.checkpoint
+            added = row.summary_added or 0
+            failed = row.summary_error or 0
+        else:
+            upload_id = table.insert(controller = self.controller,
+                                     function = self.function,
+                                     filename = source,
+                                     user_id = user,
+                                     status = 1,
+                                     checkpoint = 0,
+                                     digest = digest,
+                                     )
+            start = added = failed = 0
+        db.commit()
+
+        # Get the stylesheet
+        if stylesheet is None:
+            stylesheet = self._get_stylesheet()
+        if stylesheet is None:
+            session.error = self.error
+            return
+
+        # Before calling import tree ensure the db.table is the controller_table
+        self.table = self.controller_table
+        self.tablename = self.controller_tablename
+
+        # Pass stylesheet arguments
+        args = {}
+        mode = self.request.get_vars.get("xsltmode", None)
+        if mode is not None:
+            args["mode"] = mode
+
+        def checkpoint(stream):
+            db(table.id == upload_id).update(checkpoint = stream.position,
+                                             summary_added = added + stream.count,
+                                             summary_error = failed + stream.failed,
+                                             )
+
+        try:
+            with open(source, "rb") as infile:
+                stream = S3StreamImport(self.request.resource,
+                                        infile,
+                                        stylesheet = stylesheet,
+                                        chunk_size = chunk_size,
+                                        extra_data = self.csv_extra_data,
+                                        ignore_errors = True,
+                                        checkpoint = checkpoint,
+                                        **args)
+                success = stream(start=start)
+        except IOError:
+            # Source not found or not readable
+            session.error = messages.file_open_error % source
+            redirect(URL(r=self.request, f=self.function))
+
+        db(table.id == upload_id).update(status = 3 if success else 2)
+        db.commit()
+
+        if not success:
+            error = stream.error
+            session.error = error if session.error is None else session.error + error
+        if stream.errors:
+            current.response.s3.error_report = stream.errors
+
+        msg = "%s : %s %s %s" % (source,
+                                 messages.commit_total_records_imported,
+                                 messages.commit_total_errors,
+                                 messages.commit_total_records_ignored,
+                                 )
+        msg = msg % (added + stream.count, failed + stream.failed, 0)
+        if session.confirmation is None:
+            session.confirmation = msg
+        else:
+            session.confirmation += msg
+
     # -------------------------------------------------------------------------
     def commit_items(self, upload_id, items):
         """
@@ -1779,6 +1915,16 @@ $('#import-items').on('click','.toggle-item',function(){$('.importItem.item-'+$(
                                   writable = False,
                                   ),
                             Field("completed_details", "text",
+                                  readable = False,
+                                  writable = False,
+                                  ),
+                            # Rows committed by a streaming import
+                            Field("checkpoint", "integer",
+                                  readable = False,
+                                  writable = False,
+                                  ),
+                            # Digest of the source contents
+                            Field("digest", length=64,
                                   readable = False,
                                   writable = False,
                                   ))
@@ -2663,6 +2809,11 @@ class S3ImportItem(object):
             if onaccept:
                 callback(onaccept, form) # , tablename=tablename (if we ever define callbacks as a dict with tablename)
 
+            # Update the text search indexes
+            if self.id:
+                from .s3textindex import S3TextIndex
+                S3TextIndex.update(tablename, [self.id])
+
             # Restore modified_on.update
             if modified_on_update is not None:
                 modified_on.update = modified_on_update
@@ -2758,7 +2909,6 @@ class S3ImportItem(object):
         if not table:
             return
 
-        db = current.db
         items = self.job.items
         for reference in self.references:
 
@@ -2812,14 +2962,9 @@ class S3ImportItem(object):
                     else:
                         fk = item.id
             if fk and pkey != "id":
-                row = db(ktable._id == fk).select(ktable[pkey],
-                                                  limitby = (0, 1),
-                                                  ).first()
-                if not row:
-                    fk = None
+                fk = self.job.lookup_key(ktable, pkey, fk)
+                if not fk:
                     continue
-                else:
-                    fk = row[pkey]
 
             # Update record data
             if fk:
@@ -3075,6 +3220,9 @@ class S3ImportJob():
     JOB_TABLE_NAME = "s3_import_job"
     ITEM_TABLE_NAME = "s3_import_item"
 
+    # Maximum number of keys per set query
+    CHUNK_SIZE = 500
+
     # -------------------------------------------------------------------------
     def __init__(self, table,
                  tree = None,
@@ -3109,12 +3257,23 @@ class S3ImportJob():
 
         self._uidmap = None
 
+        # Cache for UID=>ID lookups of referenced records
+        self._idmap = None
+        self._keymap = {}
+
+        # Candidate indexes for bulk deduplication
+        self.duplicate_index = {}
+
+        # Foreign key validators with bulk-checked keys
+        self._prevalidated = None
+
         # Mandatory fields
         self.mandatory_fields = Storage()
 
         self.elements = Storage()
         self.items = Storage()
         self.references = []
+        self.cycles = [] # circular references between items
 
         self.job_table = None
         self.item_table = None
@@ -3215,6 +3374,254 @@ class S3ImportJob():
 
         return uidmap
 
+    # -------------------------------------------------------------------------
+    def prefetch(self):
+        """
+            Look up the record IDs for all UID references in the import
+            tree with one set query per key table, in order to populate
+            the UID=>ID map for lookahead (rather than looking up every
+            referenced record individually)
+        """
+
+        self._idmap = {}
+
+        tree = self.tree
+        if tree is None:
+            return
+
+        s3db = current.s3db
+
+        xml = current.xml
+        import_uid = xml.import_uid
+
+        ATTRIBUTE = xml.ATTRIBUTE
+        UID = xml.UID
+
+        root = tree if isinstance(tree, etree._Element) else tree.getroot()
+
+        # Collect all UIDs referenced in the tree, per key table
+        ktables = {}
+        keys = {}
+        for reference in root.iter(xml.TAG.reference):
+
+            uids = reference.get(UID)
+            if not uids:
+                continue
+
+            element = reference.getparent()
+            if element is None:
+                continue
+            tablename = element.get(ATTRIBUTE.name)
+            fieldname = reference.get(ATTRIBUTE.field)
+            if not tablename or not fieldname:
+                continue
+
+            # Determine the key table (once per table and field)
+            lookup = (tablename, fieldname)
+            if lookup in ktables:
+                ktable, multiple = ktables[lookup]
+            else:
+                ktable, multiple = None, False
+                table = s3db.table(tablename)
+                if table is not None and fieldname in table.fields:
+                    ktablename, _, multiple = s3_get_foreign_key(table[fieldname])
+                    if ktablename:
+                        ktable = s3db.table(ktablename)
+                        if ktable is not None and UID not in ktable.fields:
+                            ktable = None
+                ktables[lookup] = (ktable, multiple)
+            if ktable is None:
+                continue
+
+            if multiple:
+                try:
+                    uids = json.loads(uids)
+                except ValueError:
+                    continue
+            else:
+                uids = [uids]
+
+            ktablename = ktable._tablename
+            if ktablename not in keys:
+                keys[ktablename] = (ktable, set())
+            add = keys[ktablename][1].add
+            for uid in uids:
+                uid = import_uid(uid)
+                if uid:
+                    add(uid)
+
+        # Look them up
+        for ktablename, (ktable, uids) in keys.items():
+            self.lookup_uids(ktable, uids)
+
+    # -------------------------------------------------------------------------
+    def lookup_uids(self, ktable, uids):
+        """
+            Look up record IDs for UIDs, using the UID=>ID map of this
+            job and adding any keys not yet in the map
+
+            @param ktable: the key table
+            @param uids: iterable of (imported) UIDs
+
+            @returns: a dict {uid: record_id} for all existing records
+        """
+
+        idmap = self._idmap
+        if idmap is None:
+            self._idmap = idmap = {}
+
+        ktablename = ktable._tablename
+        if ktablename in idmap:
+            cache = idmap[ktablename]
+        else:
+            cache = idmap[ktablename] = {}
+
+        UID = current.xml.UID
+
+        # Look up all keys which are not in the map yet
+        missing = [uid for uid in set(uids) if uid not in cache]
+        if missing:
+            db = current.db
+            pkey = ktable._id
+            kfield = ktable[UID]
+            chunk_size = self.CHUNK_SIZE
+            for i in range(0, len(missing), chunk_size):
+                chunk = missing[i:i + chunk_size]
+                for uid in chunk:
+                    # Remember if a record does not exist
+                    cache[uid] = None
+                query = (kfield.belongs(chunk))
+                rows = db(query).select(pkey,
+                                        kfield,
+                                        limitby = (0, len(chunk)),
+                                        )
+                for row in rows:
+                    cache[row[kfield]] = row[pkey]
+
+        return {uid: cache[uid] for uid in uids if cache.get(uid)}
+
+    # -------------------------------------------------------------------------
+    def prevalidate(self):
+        """
+            Check all foreign key values in the import tree with one set
+            query per key validator (IS_ONE_OF), so that the validators
+            can look them up rather than running one query per field
+            per record during parsing of the items
+        """
+
+        self._prevalidated = []
+
+        tree = self.tree
+        if tree is None:
+            return
+
+        s3db = current.s3db
+
+        xml = current.xml
+        ATTRIBUTE = xml.ATTRIBUTE
+        FIELD = ATTRIBUTE.field
+        VALUE = ATTRIBUTE.value
+        NAME = ATTRIBUTE.name
+
+        root = tree if isinstance(tree, etree._Element) else tree.getroot()
+
+        # Collect all key values in the tree, per validator
+        validators = {}
+        values = {}
+        for data in root.iter(xml.TAG.data):
+
+            fieldname = data.get(FIELD)
+            element = data.getparent()
+            if not fieldname or element is None:
+                continue
+            tablename = element.get(NAME)
+            if not tablename:
+                continue
+
+            # Determine the key validators (once per table and field)
+            lookup = (tablename, fieldname)
+            if lookup in validators:
+                requires = validators[lookup]
+            else:
+                requires = validators[lookup] = []
+                table = s3db.table(tablename)
+                if table is not None and fieldname in table.fields:
+                    validator = table[fieldname].requires
+                    if not isinstance(validator, (list, tuple)):
+                        validator = [validator]
+                    for v in validator:
+                        if hasattr(v, "other"):
+                            # IS_EMPTY_OR
+                            v = v.other
+                        if isinstance(v, IS_ONE_OF_EMPTY):
+                            requires.append(v)
+            if not requires:
+                continue
+
+            value = data.get(VALUE)
+            if value is None:
+                value = data.text
+            if not value:
+                continue
+            try:
+                value = json.loads(value)
+            except (ValueError, TypeError):
+                pass
+            if not isinstance(value, list):
+                value = [value]
+
+            for v in requires:
+                key = id(v)
+                if key not in values:
+                    values[key] = (v, set())
+                add = values[key][1].add
+                for item in value:
+                    if isinstance(item, (int, str)):
+                        add(item)
+
+        # Check them
+        chunk_size = self.CHUNK_SIZE
+        for validator, keys in values.values():
+            validator.prevalidate(keys, chunk_size=chunk_size)
+            self._prevalidated.append(validator)
+
+    # -------------------------------------------------------------------------
+    def clear_prevalidated(self):
+        """
+            Discard the bulk-checked foreign keys when all items have
+            been parsed (they do not reflect any subsequent changes)
+        """
+
+        validators = self._prevalidated
+        if validators:
+            for validator in validators:
+                validator.clear_prevalidated()
+        self._prevalidated = None
+
+    # -------------------------------------------------------------------------
+    def lookup_key(self, ktable, pkey, record_id):
+        """
+            Look up the value of a (super-)key for a record in a
+            referenced table, caching the result for the job
+
+            @param ktable: the referenced table
+            @param pkey: the name of the key field
+            @param record_id: the record ID
+
+            @returns: the key value, or None if the record does not exist
+        """
+
+        keymap = self._keymap
+        lookup = (ktable._tablename, pkey, record_id)
+        if lookup in keymap:
+            return keymap[lookup]
+
+        row = current.db(ktable._id == record_id).select(ktable[pkey],
+                                                         limitby = (0, 1),
+                                                         ).first()
+        value = keymap[lookup] = row[pkey] if row else None
+        return value
+
     # -------------------------------------------------------------------------
     def add_item(self,
                  element = None,
@@ -3246,6 +3653,10 @@ class S3ImportJob():
             # element has already been added to this job
             return self.elements[element]
 
+        if parent is None and self._prevalidated is None:
+            # Check all foreign keys in the tree at once
+            self.prevalidate()
+
         # Parse the main element
         item = S3ImportItem(self)
 
@@ -3495,7 +3906,6 @@ class S3ImportJob():
                               (will be filled in by this function)
         """
 
-        db = current.db
         s3db = current.s3db
 
         xml = current.xml
@@ -3513,6 +3923,10 @@ class S3ImportJob():
             root = tree if isinstance(tree, etree._Element) else tree.getroot()
         uidmap = self.uidmap
 
+        if self._idmap is None:
+            # Look up all UID references in the tree at once
+            self.prefetch()
+
         references = [lookup] if lookup else element.findall("reference")
         for reference in references:
             if lookup:
@@ -3574,24 +3988,9 @@ class S3ImportJob():
             # Create a UID<->ID map
             id_map = {}
             if attr == UID and uids:
-                if len(uids) == 1:
-                    uid = import_uid(uids[0])
-                    query = (ktable[UID] == uid)
-                    record = db(query).select(ktable.id,
-                                              cacheable = True,
-                                              limitby = (0, 1),
-                                              ).first()
-                    if record:
-                        id_map[uid] = record.id
-                else:
-                    uids_ = [import_uid(uid) for uid in uids]
-                    query = (ktable[UID].belongs(uids_))
-                    records = db(query).select(ktable.id,
-                                               ktable[UID],
-                                               limitby = (0, len(uids_)),
-                                               )
-                    for r in records:
-                        id_map[r[UID]] = r.id
+                id_map = self.lookup_uids(ktable,
+                                          [import_uid(uid) for uid in uids],
+                                          )
 
             if not uids:
                 # Anonymous reference: <resource> inside the element
@@ -3685,28 +4084,79 @@ class S3ImportJob():
         return item_id
 
     # -------------------------------------------------------------------------
-    def resolve(self, item_id, import_list):
+    def order(self):
         """
-            Resolve the reference list of an item
+            Determine the commit order of the items in this job, i.e.
+            sort the items topologically by their references so that
+            referenced items are committed before the items referencing
+            them; circular references are recorded in self.cycles (they
+            will be resolved by a second write after commit)
 
-            @param item_id: the import item UID
-            @param import_list: the ordered list of items (UIDs) to import
+            @returns: list of item UIDs in commit order
         """
 
-        item = self.items[item_id]
-        if item.lock or item.accepted is False:
-            return False
-        references = []
-        for reference in item.references:
-            ritem_id = reference.entry.item_id
-            if ritem_id and ritem_id not in import_list:
-                references.append(ritem_id)
-        for ritem_id in references:
-            item.lock = True
-            if self.resolve(ritem_id, import_list):
-                import_list.append(ritem_id)
-            item.lock = False
-        return True
+        items = self.items
+
+        def dependencies(item):
+            """ Generator for the item UIDs an item depends on """
+            for reference in item.references:
+                ritem_id = reference.entry.item_id
+                if ritem_id:
+                    yield ritem_id
+
+        ordered = []
+        append = ordered.append
+
+        done = set()    # items already in the ordered list
+        active = set()  # items on the current path
+        cycles = []
+
+        for item_id in items:
+
+            if item_id in done:
+                continue
+
+            item = items[item_id]
+            if item.accepted is not False:
+
+                # Depth-first traversal of the reference graph
+                stack = [(item_id, dependencies(item))]
+                active.add(item_id)
+                while stack:
+                    current_id, deps = stack[-1]
+                    for ritem_id in deps:
+                        if ritem_id in done:
+                            continue
+                        if ritem_id in active:
+                            # Circular reference
+                            path = [entry[0] for entry in stack]
+                            cycles.append(path[path.index(ritem_id):])
+                            continue
+                        ritem = items.get(ritem_id)
+                        if ritem is None or ritem.accepted is False:
+                            continue
+                        active.add(ritem_id)
+                        stack.append((ritem_id, dependencies(ritem)))
+                        break
+                    else:
+                        # All dependencies in the list => append the item
+                        stack.pop()
+                        active.discard(current_id)
+                        done.add(current_id)
+                        append(current_id)
+
+            if item_id not in done:
+                done.add(item_id)
+                append(item_id)
+
+        if cycles:
+            log = current.log
+            for cycle in cycles:
+                log.debug("S3ImportJob: circular reference %s" % \
+                          " => ".join(str(items[i].tablename) for i in cycle + cycle[:1]))
+        self.cycles = cycles
+
+        return ordered
 
     # -------------------------------------------------------------------------
     def commit(self, ignore_errors=False, log_items=None):
@@ -3722,12 +4172,14 @@ class S3ImportJob():
         ATTRIBUTE = current.xml.ATTRIBUTE
         METHOD = S3ImportItem.METHOD
 
-        # Resolve references
-        import_list = []
-        for item_id in self.items:
-            self.resolve(item_id, import_list)
-            if item_id not in import_list:
-                import_list.append(item_id)
+        # All items parsed
+        self.clear_prevalidated()
+
+        # Determine the commit order
+        import_list = self.order()
+        # Pre-load candidates for bulk deduplication
+        self.prefetch_duplicates()
+
         # Commit the items
         items = self.items
         count = 0
@@ -3788,6 +4240,36 @@ class S3ImportJob():
         self.deleted = deleted
         return True
 
+    # -------------------------------------------------------------------------
+    def prefetch_duplicates(self):
+        """
+            Pre-load duplicate candidates for all items of this job
+            for which the table's deduplicator supports bulk mode
+            (i.e. S3Duplicate with bulk=True)
+        """
+
+        get_config = current.s3db.get_config
+
+        # Group the items by table and deduplicator
+        batches = {}
+        for item in self.items.values():
+            table = item.table
+            if table is None or not item.data or item.accepted is False:
+                continue
+            tablename = item.tablename
+            deduplicate = get_config(tablename, "deduplicate")
+            if not getattr(deduplicate, "bulk", False) or \
+               not hasattr(deduplicate, "prefetch"):
+                continue
+            batch = (tablename, id(deduplicate))
+            if batch not in batches:
+                batches[batch] = (deduplicate, table, [item])
+            else:
+                batches[batch][2].append(item)
+
+        for deduplicate, table, items in batches.values():
+            deduplicate.prefetch(self, table, items)
+
     # -------------------------------------------------------------------------
     def __define_tables(self):
         """
@@ -3810,11 +4292,77 @@ class S3ImportJob():
                             Field("tablename"),
                             Field("timestmp", "datetime",
                                   default = datetime.datetime.utcnow()
-                                  )
+                                  ),
+                            # Rows committed by a streaming import
+                            Field("checkpoint", "integer"),
+                            # Digest of the source contents
+                            Field("digest", length=64),
                             )
 
         return db[cls.JOB_TABLE_NAME]
 
+    # -------------------------------------------------------------------------
+    @classmethod
+    def get_checkpoint(cls, job_id, digest=None):
+        """
+            Get the checkpoint of a (streaming) import job; a checkpoint
+            recorded for a different source content is discarded
+
+            @param job_id: the job UID
+            @param digest: the digest of the source contents
+
+            @returns: the number of source rows committed, 0 if no
+                      (valid) checkpoint has been recorded
+        """
+
+        db = current.db
+
+        table = cls.define_job_table()
+        query = (table.job_id == job_id)
+        row = db(query).select(table.checkpoint,
+                               table.digest,
+                               limitby = (0, 1),
+                               ).first()
+        if not row:
+            return 0
+
+        if not digest or row.digest != digest:
+            # Source has changed => discard the checkpoint
+            db(query).delete()
+            return 0
+
+        return row.checkpoint or 0
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def set_checkpoint(cls, job_id, position, tablename=None, digest=None):
+        """
+            Record the checkpoint of a (streaming) import job; must
+            be committed together with the imported chunk
+
+            @param job_id: the job UID
+            @param position: the number of source rows committed,
+                             None to remove the checkpoint
+            @param tablename: the target table name
+            @param digest: the digest of the source contents
+        """
+
+        db = current.db
+
+        table = cls.define_job_table()
+        query = (table.job_id == job_id)
+        if position is None:
+            db(query).delete()
+        elif not db(query).update(checkpoint = position,
+                                  digest = digest,
+                                  timestmp = datetime.datetime.utcnow(),
+                                  ):
+            table.insert(job_id = job_id,
+                         tablename = tablename,
+                         checkpoint = position,
+                         digest = digest,
+                         )
+
     # -------------------------------------------------------------------------
     @classmethod
     def define_item_table(cls):
@@ -4129,6 +4677,7 @@ class S3Duplicate(object):
                  ignore_case = True,
                  ignore_deleted = False,
                  noupdate = False,
+                 bulk = False,
                  ):
         """
             Constructor
@@ -4142,6 +4691,9 @@ class S3Duplicate(object):
             @param ignore_case: ignore case for string/text fields
             @param ignore_deleted: do not match deleted records
             @param noupdate: match, but do not update
+            @param bulk: pre-load the candidates for all items of an
+                         import job with set queries, and match them
+                         in memory rather than querying per item
 
             @ToDo: Fuzzy option to do a LIKE search
         """
@@ -4159,6 +4711,8 @@ class S3Duplicate(object):
         self.ignore_deleted = ignore_deleted
         self.noupdate = noupdate
 
+        self.bulk = bulk
+
     # -------------------------------------------------------------------------
     def __call__(self, item):
         """
@@ -4175,46 +4729,50 @@ class S3Duplicate(object):
         data = item.data
         table = item.table
 
-        query = None
-        error = "Invalid field for duplicate detection: %s (%s)"
+        self.check_fields(table)
 
-        # Primary query (mandatory)
-        primary = self.primary
-        for fname in primary:
+        duplicate = None
+        duplicate_id = None
 
-            if fname not in table.fields:
-                raise SyntaxError(error % (fname, table))
-
-            field = table[fname]
-            value = data.get(fname)
+        # Try the pre-loaded candidates first
+        index = self.get_index(item)
+        if index is not None:
+            matched, duplicate_id = index.match(item)
+            if matched:
+                if duplicate_id:
+                    duplicate = Row({table._id.name: duplicate_id})
+            else:
+                index = None
 
-            q = self.match(field, value)
-            query = q if query is None else query & q
+        if index is None:
 
-        # Secondary queries (optional)
-        secondary = self.secondary
-        for fname in secondary:
+            query = None
 
-            if fname not in table.fields:
-                raise SyntaxError(error % (fname, table))
+            # Primary query (mandatory)
+            for fname in self.primary:
+                q = self.match(table[fname], data.get(fname))
+                query = q if query is None else query & q
 
-            field = table[fname]
-            value = data.get(fname)
-            if value:
-                query &= self.match(field, value)
+            # Secondary queries (optional)
+            for fname in self.secondary:
+                value = data.get(fname)
+                if value:
+                    query &= self.match(table[fname], value)
 
-        # Ignore deleted records?
-        if self.ignore_deleted and "deleted" in table.fields:
-            query &= (table.deleted == False)
+            # Ignore deleted records?
+            if self.ignore_deleted and "deleted" in table.fields:
+                query &= (table.deleted == False)
 
-        # Find a match
-        duplicate = current.db(query).select(table._id,
-                                             limitby = (0, 1),
-                                             ).first()
+            # Find a match
+            duplicate = current.db(query).select(table._id,
+                                                 limitby = (0, 1),
+                                                 ).first()
+            if duplicate:
+                duplicate_id = duplicate[table._id]
 
         if duplicate:
             # Match found: Update import item
-            item.id = duplicate[table._id]
+            item.id = duplicate_id
             if not data.deleted:
                 item.method = item.METHOD.UPDATE
             if self.noupdate:
@@ -4223,6 +4781,82 @@ class S3Duplicate(object):
         # For uses outside of imports:
         return duplicate
 
+    # -------------------------------------------------------------------------
+    def check_fields(self, table):
+        """
+            Verify that all primary/secondary fields exist in the table
+
+            @param table: the Table
+
+            @raise SyntaxError: if any of the fields doesn't exist
+        """
+
+        error = "Invalid field for duplicate detection: %s (%s)"
+
+        fields = table.fields
+        for fname in self.primary:
+            if fname not in fields:
+                raise SyntaxError(error % (fname, table))
+        for fname in self.secondary:
+            if fname not in fields:
+                raise SyntaxError(error % (fname, table))
+
+    # -------------------------------------------------------------------------
+    def prefetch(self, job, table, items):
+        """
+            Pre-load the candidate records for a batch of import items
+            (bulk mode), to be matched in-memory during deduplication
+
+            @param job: the S3ImportJob
+            @param table: the Table
+            @param items: the S3ImportItems to deduplicate
+        """
+
+        self.check_fields(table)
+
+        index = S3DuplicateIndex(self, table)
+        index.load(items)
+
+        job.duplicate_index[(table._tablename, id(self))] = index
+
+    # -------------------------------------------------------------------------
+    def get_index(self, item):
+        """
+            Get the pre-loaded candidate index for an import item
+
+            @param item: the S3ImportItem
+
+            @returns: the S3DuplicateIndex, or None if not available
+        """
+
+        if not self.bulk:
+            return None
+
+        job = getattr(item, "job", None)
+        indexes = getattr(job, "duplicate_index", None)
+        if not indexes:
+            return None
+
+        return indexes.get((item.table._tablename, id(self)))
+
+    # -------------------------------------------------------------------------
+    def fold(self, field, value):
+        """
+            Helper function to compute the comparison key of a value,
+            counterpart of match() for in-memory matching
+
+            @param field: the Field
+            @param value: the value
+
+            @return: the key
+        """
+
+        if self.ignore_case and \
+           hasattr(value, "lower") and str(field.type) in ("string", "text"):
+            return s3_str(value).lower()
+        else:
+            return value
+
     # -------------------------------------------------------------------------
     def match(self, field, value):
         """
@@ -4252,6 +4886,359 @@ class S3Duplicate(object):
 
         return query
 
+# =============================================================================
+class S3DuplicateIndex(object):
+    """
+        In-memory index of candidate records for bulk deduplication
+        with S3Duplicate, built once per table and import job
+    """
+
+    def __init__(self, deduplicator, table):
+        """
+            Constructor
+
+            @param deduplicator: the S3Duplicate instance
+            @param table: the Table
+        """
+
+        self.deduplicator = deduplicator
+        self.table = table
+
+        # Primary key => [(record ID, secondary keys, deleted)]
+        self.candidates = {}
+
+        # Primary keys covered by the pre-loaded candidates
+        self.keys = set()
+
+        # Primary key => [items] deduplicated or created by this job
+        self.items = {}
+
+    # -------------------------------------------------------------------------
+    def primary_key(self, data):
+        """
+            Get the (folded) primary key for a record
+
+            @param data: the record data (dict or Row)
+
+            @returns: a tuple of folded values, or None if any of
+                      the primary values is missing
+        """
+
+        deduplicator = self.deduplicator
+        fold = deduplicator.fold
+        table = self.table
+
+        key = []
+        for fname in deduplicator.primary:
+            value = data.get(fname)
+            if value is None:
+                return None
+            key.append(fold(table[fname], value))
+
+        return tuple(key)
+
+    # -------------------------------------------------------------------------
+    def load(self, items):
+        """
+            Load all candidate records for a batch of import items
+
+            @param items: the S3ImportItems
+        """
+
+        deduplicator = self.deduplicator
+        fold = deduplicator.fold
+        table = self.table
+
+        primary = list(deduplicator.primary)
+        secondary = list(deduplicator.secondary)
+
+        UID = current.xml.UID
+        synchronise_uuids = current.response.s3.synchronise_uuids
+
+        # Collect the primary keys of all items
+        keys = set()
+        updated = set()
+        for item in items:
+            data = item.data
+            if not data:
+                continue
+            key = self.primary_key(data)
+            if item.id:
+                # Records updated by this job (matched by UID) may change
+                # their keys => do not rely on pre-loaded candidates for them
+                updated.add(item.id)
+                self.add_item(key, item)
+            elif UID in data and not synchronise_uuids:
+                # New record which will not be deduplicated, but can be
+                # matched by subsequent items once committed
+                self.add_item(key, item)
+            elif key is not None:
+                keys.add(key)
+        if not keys:
+            return
+
+        # Select the candidates with one set query per chunk of keys,
+        # using the first primary field as filter
+        field = table[primary[0]]
+        values = list(set(key[0] for key in keys))
+        if deduplicator.ignore_case and str(field.type) in ("string", "text"):
+            expr = field.lower()
+        else:
+            expr = field
+
+        fields = [table._id] + [table[fn] for fn in primary + secondary]
+        if "deleted" in table.fields:
+            fields.append(table.deleted)
+            has_deleted = True
+        else:
+            has_deleted = False
+
+        db = current.db
+        pkey = table._id.name
+        candidates = self.candidates
+        stale = set()
+        chunk_size = S3ImportJob.CHUNK_SIZE
+        for i in range(0, len(values), chunk_size):
+            chunk = values[i:i + chunk_size]
+            rows = db(expr.belongs(chunk)).select(orderby = table._id,
+                                                  *fields)
+            for row in rows:
+                key = self.primary_key(row)
+                if key is None:
+                    continue
+                record_id = row[pkey]
+                if record_id in updated:
+                    stale.add(key)
+                skeys = dict((fn, fold(table[fn], row[fn])) for fn in secondary)
+                deleted = row.deleted if has_deleted else False
+                entry = (record_id, skeys, deleted)
+                if key in candidates:
+                    candidates[key].append(entry)
+                else:
+                    candidates[key] = [entry]
+
+        self.keys = keys - stale
+
+    # -------------------------------------------------------------------------
+    def match(self, item):
+        """
+            Find a match for an import item
+
+            @param item: the S3ImportItem
+
+            @returns: tuple (matched, record_id), where matched indicates
+                      whether the index could decide about the item (if
+                      not, the deduplicator must fall back to a query)
+        """
+
+        deduplicator = self.deduplicator
+        fold = deduplicator.fold
+        table = self.table
+
+        data = item.data
+
+        key = self.primary_key(data)
+        if key is None or key not in self.keys:
+            return False, None
+
+        # Secondary keys to match
+        skeys = {}
+        for fname in deduplicator.secondary:
+            value = data.get(fname)
+            if value:
+                skeys[fname] = fold(table[fname], value)
+
+        ignore_deleted = deduplicator.ignore_deleted
+
+        # Candidates from the database
+        record_id = None
+        for candidate_id, values, deleted in self.candidates.get(key, ()):
+            if deleted and ignore_deleted:
+                continue
+            if all(values[fn] == skeys[fn] for fn in skeys):
+                record_id = candidate_id
+                break
+
+        # Records written earlier in this job
+        if record_id is None:
+            for other in self.items.get(key, ()):
+                if other is item or not other.committed or not other.id:
+                    continue
+                odata = other.data
+                if all(fold(table[fn], odata.get(fn)) == skeys[fn] for fn in skeys):
+                    record_id = other.id
+                    break
+
+        # Remember the item for subsequent matches
+        self.add_item(key, item)
+
+        return True, record_id
+
+    # -------------------------------------------------------------------------
+    def add_item(self, key, item):
+        """
+            Register an import item which writes a record with a certain
+            primary key, so that subsequent items can be matched against it
+
+            @param key: the primary key
+            @param item: the S3ImportItem
+        """
+
+        if key is None:
+            return
+
+        items = self.items
+        if key in items:
+            items[key].append(item)
+        else:
+            items[key] = [item]
+
+# =============================================================================
+class S3StreamImport(object):
+    """
+        Import of a (large) CSV source in chunks of rows, each chunk
+        being imported as a separate job and committed in its own
+        transaction, so that memory use is bounded by the chunk size
+        and an interrupted import can be resumed from a checkpoint
+    """
+
+    def __init__(self,
+                 resource,
+                 source,
+                 stylesheet = None,
+                 chunk_size = 1000,
+                 extra_data = None,
+                 ignore_errors = False,
+                 checkpoint = None,
+                 **args):
+        """
+            Constructor
+
+            @param resource: the target S3Resource
+            @param source: the CSV source (file-like object)
+            @param stylesheet: path to the transformation stylesheet
+            @param chunk_size: the number of rows per chunk
+            @param extra_data: dict of extra cols {key:value} to add to each row
+            @param ignore_errors: skip invalid records and continue,
+                                  otherwise stop at the first failing chunk
+            @param checkpoint: callback function to record the progress,
+                               function(stream), called after each chunk
+                               and before committing it
+            @param args: parameters to pass to the transformation stylesheet
+        """
+
+        self.resource = resource
+        self.source = source
+        self.stylesheet = stylesheet
+        self.chunk_size = chunk_size
+        self.extra_data = extra_data
+        self.ignore_errors = ignore_errors
+        self.checkpoint = checkpoint
+        self.args = args
+
+        self.position = 0   # number of source rows committed
+        self.count = 0      # number of records imported
+        self.failed = 0     # number of records in error
+        self.error = None   # the last error
+        self.errors = []    # all error messages
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def digest(source):
+        """
+            Compute a digest of the contents of a source, to verify that
+            a checkpoint applies to it when resuming an import
+
+            @param source: the source (file-like object)
+
+            @returns: the digest (hex string), or None if the source is
+                      not seekable (i.e. the import can not be resumed)
+        """
+
+        try:
+            if not source.seekable():
+                return None
+            position = source.tell()
+            source.seek(0)
+        except (AttributeError, IOError, ValueError):
+            return None
+
+        sha = hashlib.sha256()
+        while True:
+            block = source.read(65536)
+            if not block:
+                break
+            if isinstance(block, str):
+                block = block.encode("utf-8")
+            sha.update(block)
+        source.seek(position)
+
+        return sha.hexdigest()
+
+    # -------------------------------------------------------------------------
+    def __call__(self, start=0):
+        """
+            Run the import
+
+            @param start: the number of source rows to skip, i.e. the
+                          checkpoint of a previous run to resume from
+
+            @returns: True if successful, otherwise False (self.error
+                      contains the last error, self.position the number
+                      of source rows committed)
+        """
+
+        db = current.db
+        xml = current.xml
+
+        resource = self.resource
+        error_path = "resource[@name='%s']" % resource.tablename
+
+        ignore_errors = self.ignore_errors
+        checkpoint = self.checkpoint
+
+        self.position = start
+
+        chunks = xml.csv2trees(self.source,
+                               extra_data = self.extra_data,
+                               chunk_size = self.chunk_size,
+                               skip = start,
+                               )
+        for position, tree in chunks:
+
+            count = resource.import_count
+            try:
+                resource.import_xml(tree,
+                                    stylesheet = self.stylesheet,
+                                    ignore_errors = ignore_errors,
+                                    **self.args)
+            except SyntaxError as e:
+                self.error = s3_str(e)
+                db.rollback()
+                return False
+
+            error = resource.error
+            if error:
+                self.error = error
+                self.errors.extend(xml.collect_errors(resource))
+                error_tree = resource.error_tree
+                if error_tree is not None:
+                    self.failed += len(error_tree.findall(error_path))
+                if not ignore_errors:
+                    # Roll back the failed chunk
+                    db.rollback()
+                    return False
+
+            self.count += resource.import_count - count
+            self.position = position
+
+            # Record the checkpoint and commit the chunk
+            if checkpoint:
+                checkpoint(self)
+            db.commit()
+
+        return True
+
 # =============================================================================
 class S3BulkImporter(object):
     """
@@ -4506,30 +5493,36 @@ class S3BulkImporter(object):
                     self.errorList.append("WARNING:5th parameter invalid, parameter %s ignored" % task[5])
             auth = current.auth
             auth.rollback = True
-            try:
-                # @todo: add extra_data and file attachments
-                resource.import_xml(csv,
-                                    format = "csv",
-                                    stylesheet = task[4],
-                                    extra_data = extra_data,
-                                    )
-            except SyntaxError as e:
-                self.errorList.append("WARNING: import error - %s (file: %s, stylesheet: %s)" %
-                                     (e, filename, task[4]))
-                auth.rollback = False
-                return
-
-            if not resource.error:
-                current.db.commit()
+            chunk_size = current.deployment_settings.get_base_import_chunk_size()
+            if chunk_size:
+                # Import in chunks, resuming from the last checkpoint
+                # of an earlier, interrupted run
+                self.import_stream(resource, csv, task, extra_data, chunk_size)
             else:
-                # Must roll back if there was an error!
-                error = resource.error
-                self.errorList.append("%s - %s: %s" % (
-                                      task[3], resource.tablename, error))
-                errors = current.xml.collect_errors(resource)
-                if errors:
-                    self.errorList.extend(errors)
-                current.db.rollback()
+                try:
+                    # @todo: add extra_data and file attachments
+                    resource.import_xml(csv,
+                                        format = "csv",
+                                        stylesheet = task[4],
+                                        extra_data = extra_data,
+                                        )
+                except SyntaxError as e:
+                    self.errorList.append("WARNING: import error - %s (file: %s, stylesheet: %s)" %
+                                         (e, filename, task[4]))
+                    auth.rollback = False
+                    return
+
+                if not resource.error:
+                    current.db.commit()
+                else:
+                    # Must roll back if there was an error!
+                    error = resource.error
+                    self.errorList.append("%s - %s: %s" % (
+                                          task[3], resource.tablename, error))
+                    errors = current.xml.collect_errors(resource)
+                    if errors:
+                        self.errorList.extend(errors)
+                    current.db.rollback()
 
             auth.rollback = False
 
@@ -4543,6 +5536,67 @@ class S3BulkImporter(object):
             self.resultList.append(msg)
             current.log.debug(msg)
 
+    # -------------------------------------------------------------------------
+    def import_stream(self, resource, source, task, extra_data, chunk_size):
+        """
+            Import a CSV source in chunks of rows, committing each chunk
+            separately, and recording a checkpoint in the job table so
+            that a failed import can be resumed from the last committed
+            chunk when the task is run again
+
+            @param resource: the target S3Resource
+            @param source: the CSV source (file-like object)
+            @param task: the import task
+            @param extra_data: extra columns to add to each row
+            @param chunk_size: the number of rows per chunk
+        """
+
+        filename, stylesheet = task[3], task[4]
+        tablename = resource.tablename
+
+        job_id = self.stream_job_id(task)
+        digest = S3StreamImport.digest(source)
+
+        def checkpoint(stream):
+            S3ImportJob.set_checkpoint(job_id,
+                                       stream.position,
+                                       tablename = tablename,
+                                       digest = digest,
+                                       )
+
+        stream = S3StreamImport(resource,
+                                source,
+                                stylesheet = stylesheet,
+                                chunk_size = chunk_size,
+                                extra_data = extra_data,
+                                checkpoint = checkpoint,
+                                )
+        start = S3ImportJob.get_checkpoint(job_id, digest=digest)
+        if stream(start=start):
+            # Completed => remove the checkpoint
+            S3ImportJob.set_checkpoint(job_id, None)
+            current.db.commit()
+        else:
+            self.errorList.append("%s - %s: %s (rows 1-%s committed)" % (
+                                  filename, tablename, stream.error, stream.position))
+            if stream.errors:
+                self.errorList.extend(stream.errors)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def stream_job_id(task):
+        """
+            Get the job UID to record the checkpoint of a chunked import
+
+            @param task: the import task
+
+            @returns: the job UID
+        """
+
+        return uuid.uuid5(uuid.NAMESPACE_URL,
+                          "%s|%s" % (task[3], task[4]),
+                          ).urn
+
     # -------------------------------------------------------------------------
     def execute_special_task(self, task):
         """
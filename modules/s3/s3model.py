@@ -467,8 +467,23 @@ class S3Model:
             table = getattr(db, tablename)
         else:
             table = db.define_table(tablename, *fields, **args)
+            S3Model.track_name_tokens(tablename)
         return table
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def track_name_tokens(tablename):
+        """
+            Keep the name token index up to date for indexed tables
+            (see S3NameTokens)
+
+            @param tablename: the table name
+        """
+
+        from .s3textindex import S3NameTokens
+        if tablename in S3NameTokens.FIELDS and S3NameTokens.active():
+            S3NameTokens.track(tablename)
+
     # -------------------------------------------------------------------------
     @staticmethod
     def get_aliased(table, alias):
@@ -525,6 +540,11 @@ class S3Model:
         if tn not in config:
             config[tn] = {}
         config[tn].update(attr)
+
+        if attr.get("hierarchy"):
+            # Keep the stored hierarchy up to date
+            from .s3hierarchy import S3Hierarchy
+            S3Hierarchy.track(tn)
         return
 
     # -------------------------------------------------------------------------
@@ -1429,6 +1449,7 @@ class S3Model:
                                 sequence_name = sequence_name,
                                 *fields,
                                 **args)
+        cls.track_name_tokens(tablename)
 
         return table
 
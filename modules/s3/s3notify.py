@@ -42,6 +42,7 @@ from urllib.error import HTTPError
 from uuid import uuid4
 
 from gluon import current, TABLE, THEAD, TBODY, TR, TD, TH, XML
+from gluon.storage import Storage
 
 from .s3datetime import s3_decode_iso_datetime, s3_encode_iso_datetime, s3_utc
 from .s3utils import s3_str, s3_truncate
@@ -65,11 +66,19 @@ class S3Notifications:
 
         subscriptions = cls._subscriptions(now)
         if subscriptions:
+            db = current.db
+            rtable = db.pr_subscription_resource
+
+            # Lock the subscriptions
+            resource_ids = [row.id for row in subscriptions]
+            db(rtable.id.belongs(resource_ids)).update(locked = True)
+
+            # Create one asynchronous notification task per group of
+            # subscriptions to the same resource and filter, so the
+            # updates need to be extracted only once per group
             run_async = current.s3task.run_async
-            for row in subscriptions:
-                # Create asynchronous notification task.
-                row.update_record(locked = True)
-                run_async("notify_notify", args=[row.id])
+            for group in cls._groups(resource_ids).values():
+                run_async("notify_notify", args=[group])
             message = "%s notifications scheduled." % len(subscriptions)
         else:
             message = "No notifications to schedule."
@@ -81,17 +90,25 @@ class S3Notifications:
     @classmethod
     def notify(cls, resource_id):
         """
-            Asynchronous task to notify a subscriber about updates,
-            runs a POST?format=msg request against the subscribed
-            controller which extracts the data and renders and sends
-            the notification message (see send()).
-
-            @param resource_id: the pr_subscription_resource record ID
+            Asynchronous task to notify subscribers about updates:
+            extracts the updates once for each group of subscriptions
+            to the same resource and filter, then renders and sends the
+            notification messages for each subscriber (see deliver()).
+            Subscriptions to resources which can only be built by their
+            controller are notified by loopback requests instead.
+
+            @param resource_id: the pr_subscription_resource record ID,
+                                or a list of record IDs
         """
 
         _debug = current.log.debug
         _debug("S3Notifications.notify(resource_id=%s)" % resource_id)
 
+        if isinstance(resource_id, (list, tuple)):
+            resource_ids = resource_id
+        else:
+            resource_ids = [resource_id]
+
         db = current.db
         s3db = current.s3db
 
@@ -103,25 +120,302 @@ class S3Notifications:
         join = stable.on(rtable.subscription_id == stable.id)
         left = ftable.on(ftable.id == stable.filter_id)
 
-        # @todo: should not need rtable.resource here
-        row = db(rtable.id == resource_id).select(stable.id,
-                                                  stable.pe_id,
-                                                  stable.frequency,
-                                                  stable.notify_on,
-                                                  stable.method,
-                                                  stable.email_format,
-                                                  stable.attachment,
-                                                  rtable.id,
-                                                  rtable.resource,
-                                                  rtable.url,
-                                                  rtable.last_check_time,
-                                                  ftable.query,
-                                                  join = join,
-                                                  left = left,
-                                                  ).first()
-        if not row:
+        rows = db(rtable.id.belongs(resource_ids)).select(stable.id,
+                                                          stable.pe_id,
+                                                          stable.frequency,
+                                                          stable.notify_on,
+                                                          stable.method,
+                                                          stable.email_format,
+                                                          stable.attachment,
+                                                          rtable.id,
+                                                          rtable.resource,
+                                                          rtable.url,
+                                                          rtable.last_check_time,
+                                                          ftable.query,
+                                                          join = join,
+                                                          left = left,
+                                                          )
+        if not rows:
             return True
 
+        # Group the subscriptions
+        groups = {}
+        for row in rows:
+            key = cls._group_key(row)
+            if key in groups:
+                groups[key].append(row)
+            else:
+                groups[key] = [row]
+
+        # Notify the subscribers, acting as each subscriber
+        auth = current.auth
+        user_id = auth.user.id if auth.user else None
+        messages = []
+        try:
+            for group in groups.values():
+                if cls._batchable(group[0]):
+                    messages.extend(cls._notify_group(group))
+                else:
+                    # Controller required to build the subscribed
+                    # request => one loopback request per subscriber
+                    for row in group:
+                        messages.append(cls._notify_loopback(row))
+        finally:
+            auth.s3_impersonate(user_id)
+
+        message = "; ".join(messages)
+        _debug(message)
+
+        # Done
+        return message
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _notify_group(cls, rows):
+        """
+            Notify a group of subscribers to the same resource and filter
+
+            @param rows: the pr_subscription/pr_subscription_resource/pr_filter
+                         Rows of the group
+
+            @returns: list of result messages
+        """
+
+        _debug = current.log.debug
+
+        db = current.db
+        s3db = current.s3db
+        auth = current.auth
+
+        first = rows[0]
+        s = getattr(first, "pr_subscription")
+        r = getattr(first, "pr_subscription_resource")
+        f = getattr(first, "pr_filter")
+
+        # Check for updates since the earliest last check of the group
+        # (records are attributed to subscribers by their own last check)
+        check_times = [row.pr_subscription_resource.last_check_time for row in rows]
+        if any(t is None for t in check_times):
+            since = None
+        else:
+            since = min(check_times)
+        if "upd" in s.notify_on:
+            tfield = "modified_on"
+        else:
+            tfield = "created_on"
+
+        # The subscribed URL and its query
+        public_url = current.deployment_settings.get_base_public_url()
+        url = r.url.lstrip("/")
+        lookup_url = "%s/%s/%s" % (public_url, current.request.application, url)
+        purl = urlparse.urlparse(url)
+        get_vars = {}
+        for k, v in urlparse.parse_qs(purl.query).items():
+            get_vars[k] = v if len(v) > 1 else v[0]
+        if since is not None:
+            get_vars["~.%s__ge" % tfield] = "%sZ" % s3_encode_iso_datetime(since)
+
+        # Filters
+        if f.query:
+            from .s3filter import S3FilterString
+            resource = s3db.resource(r.resource)
+            fstring = S3FilterString(resource, f.query)
+            for k, v in fstring.get_vars.items():
+                if v is not None:
+                    if k in get_vars:
+                        value = get_vars[k]
+                        if type(value) is list:
+                            value.append(v)
+                        else:
+                            get_vars[k] = [value, v]
+                    else:
+                        get_vars[k] = v
+            query_nice = s3_str(fstring.represent())
+        else:
+            query_nice = None
+
+        # Look up the subscribers' user accounts
+        utable = s3db.pr_person_user
+        pe_ids = set(row.pr_subscription.pe_id for row in rows)
+        users = db(utable.pe_id.belongs(pe_ids)).select(utable.pe_id,
+                                                        utable.user_id,
+                                                        )
+        users = dict((user.pe_id, user.user_id) for user in users)
+
+        path = purl.path.strip("/").split("/")
+        c, fn, args = path[0], path[1] if len(path) > 1 else "index", path[2:]
+
+        # Sub-group the subscribers by their permissions, as each
+        # sub-group may see different records (where access depends
+        # on record ownership, each subscriber separately)
+        permission = auth.permission
+        realms = {}
+        for row in rows:
+            user_id = users.get(row.pr_subscription.pe_id)
+            auth.s3_impersonate(user_id)
+            if auth.user:
+                key = json.dumps(auth.user.realms, sort_keys=True)
+                if permission.ownership_required("read", r.resource,
+                                                 c = c,
+                                                 f = fn,
+                                                 ):
+                    key = (key, user_id)
+            else:
+                key = None
+            if key in realms:
+                realms[key][1].append(row)
+            else:
+                realms[key] = (user_id, [row])
+
+        # Time stamp for the next check
+        now = datetime.datetime.utcnow()
+        intervals = s3db.pr_subscription_check_intervals
+
+        from .s3rest import s3_request
+
+        messages = []
+        for user_id, subscribers in realms.values():
+
+            # Extract the updates once for all subscribers in the sub-group
+            auth.s3_impersonate(user_id)
+            try:
+                req = s3_request(c = c,
+                                 f = fn,
+                                 args = args,
+                                 get_vars = Storage(get_vars),
+                                 extension = "msg",
+                                 http = "GET",
+                                 catch_errors = False,
+                                 )
+                req.customise_resource()
+                resource = req.component if req.component else req.resource
+                data = cls._extract(resource)
+                if data is not None:
+                    # Time stamps of the records
+                    rows = resource.select(["id", tfield],
+                                           limit = None,
+                                           as_rows = True,
+                                           )
+                    table = resource.table
+                    timestamps = dict((row[table._id], row[table[tfield]]) for row in rows)
+                    id_colname = str(table._id)
+            except:
+                exc_info = sys.exc_info()[:2]
+                message = ("%s: %s" % (exc_info[0].__name__, exc_info[1]))
+                _debug(message)
+                messages.append(message)
+                # Fall back to one loopback request per subscriber
+                for row in subscribers:
+                    messages.append(cls._notify_loopback(row))
+                continue
+
+            cache = {}
+            for row in subscribers:
+
+                s = getattr(row, "pr_subscription")
+                r = getattr(row, "pr_subscription_resource")
+
+                last_check_time = r.last_check_time
+                subscription = {"pe_id": s.pe_id,
+                                "notify_on": s.notify_on,
+                                "method": s.method,
+                                "email_format": s.email_format,
+                                "attachment": s.attachment,
+                                "resource": r.resource,
+                                "last_check_time": s3_encode_iso_datetime(last_check_time) \
+                                                   if last_check_time else None,
+                                "filter_query": query_nice,
+                                "page_url": lookup_url,
+                                "item_url": None,
+                                }
+
+                # Select the records updated since the subscriber's last check
+                if data is not None and last_check_time is not None:
+                    items = [item for item in data["rows"]
+                             if (timestamps.get(item["_row"][id_colname]) or now) >= last_check_time]
+                    updates = dict(data, rows=items, numrows=len(items))
+                else:
+                    updates = data
+
+                success = False
+                try:
+                    success, message = cls.deliver(resource,
+                                                   updates,
+                                                   subscription,
+                                                   cache = cache,
+                                                   )
+                except:
+                    exc_info = sys.exc_info()[:2]
+                    message = ("%s: %s" % (exc_info[0].__name__, exc_info[1]))
+                _debug(message)
+                messages.append(message)
+
+                # Update time stamps and unlock
+                if success or not updates or not updates["rows"]:
+                    interval = datetime.timedelta(minutes=intervals.get(s.frequency, 0))
+                    r.update_record(locked = False,
+                                    last_check_time = now,
+                                    next_check_time = now + interval,
+                                    )
+                else:
+                    r.update_record(locked = False)
+                db.commit()
+
+        return messages
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _batchable(row):
+        """
+            Check whether the subscribed request can be constructed
+            in-process, i.e. the controller function is configured as
+            batchable (settings.msg.notify_batch), serves the subscribed
+            table directly and has no customisation (otherwise the
+            resource could differ from what the controller would deliver)
+
+            @param row: the pr_subscription_resource Row (or a joined Row)
+
+            @returns: True|False
+        """
+
+        r = getattr(row, "pr_subscription_resource", row)
+        if not r.url or not r.resource:
+            return False
+
+        path = urlparse.urlparse(r.url.lstrip("/")).path.strip("/").split("/")
+        c = path[0]
+        f = path[1].split(".", 1)[0] if len(path) > 1 else "index"
+
+        settings = current.deployment_settings
+        if "%s/%s" % (c, f) not in settings.get_msg_notify_batch():
+            # Controller may filter or alter the resource in prep
+            return False
+
+        tablename = "%s_%s" % (c, f)
+        if tablename != r.resource:
+            return False
+
+        return not settings.get("customise_%s_controller" % tablename)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _notify_loopback(cls, row):
+        """
+            Notify a single subscriber by a loopback request to the
+            subscribed URL (which will then call send()), for resources
+            which require the controller
+
+            @param row: the pr_subscription/pr_subscription_resource/pr_filter
+                        Row
+
+            @returns: the result message
+        """
+
+        _debug = current.log.debug
+
+        db = current.db
+        s3db = current.s3db
+
         s = getattr(row, "pr_subscription")
         r = getattr(row, "pr_subscription_resource")
         f = getattr(row, "pr_filter")
@@ -230,7 +524,6 @@ class S3Notifications:
                             )
         db.commit()
 
-        # Done
         return message
 
     # -------------------------------------------------------------------------
@@ -248,14 +541,65 @@ class S3Notifications:
         _debug = current.log.debug
         _debug("S3Notifications.send()")
 
-        json_message = current.xml.json_message
-
         # Read subscription data
         source = r.body
         source.seek(0)
         data = source.read()
         subscription = json.loads(data)
 
+        # Authorization (pe_id must not be None)
+        if subscription["notify_on"] and subscription["method"] and \
+           not subscription["pe_id"]:
+            r.unauthorised()
+
+        success, message = cls.deliver(resource,
+                                       cls._extract(resource),
+                                       subscription,
+                                       )
+
+        return current.xml.json_message(success = success,
+                                        statuscode = 200 if success else 403,
+                                        message = message)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _extract(resource):
+        """
+            Extract the data for notifications from a resource
+
+            @param resource: the S3Resource (filtered for the updates)
+
+            @returns: the data as returned from S3Resource.select
+        """
+
+        # Fields to extract
+        fields = resource.list_fields(key="notify_fields")
+        if "created_on" not in fields:
+            fields.append("created_on")
+
+        # Extract the data
+        return resource.select(fields,
+                               represent = True,
+                               raw_data = True)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def deliver(cls, resource, data, subscription, cache=None):
+        """
+            Render the notification message(s) for a subscriber and
+            send them
+
+            @param resource: the S3Resource
+            @param data: the updates, as returned from S3Resource.select
+            @param subscription: the subscription data (dict)
+            @param cache: dict to re-use rendered contents and messages
+                          for subscribers with the same updates
+
+            @returns: tuple (success, message)
+        """
+
+        #_debug = current.log.debug
+
         #_debug("Notify PE #%s by %s on %s of %s since %s" % \
         #           (subscription["pe_id"],
         #            str(subscription["method"]),
@@ -268,30 +612,19 @@ class S3Notifications:
         notify_on = subscription["notify_on"]
         methods = subscription["method"]
         if not notify_on or not methods:
-            return json_message(message = "No notifications configured "
-                                          "for this subscription")
+            return True, "No notifications configured for this subscription"
 
         # Authorization (pe_id must not be None)
         pe_id = subscription["pe_id"]
-
         if not pe_id:
-            r.unauthorised()
-
-        # Fields to extract
-        fields = resource.list_fields(key="notify_fields")
-        if "created_on" not in fields:
-            fields.append("created_on")
+            return False, "No subscriber"
 
-        # Extract the data
-        data = resource.select(fields,
-                               represent = True,
-                               raw_data = True)
-        rows = data["rows"]
+        rows = data["rows"] if data else None
 
         # How many records do we have?
-        numrows = len(rows)
+        numrows = len(rows) if rows else 0
         if not numrows:
-            return json_message(message = "No records found")
+            return True, "No records found"
 
         #_debug("%s rows:" % numrows)
 
@@ -332,12 +665,24 @@ class S3Notifications:
         if not renderer:
             renderer = cls._render
 
+        if cache is None:
+            cache = {}
+        id_colname = str(resource._id)
+        record_ids = tuple(row["_row"][id_colname] for row in rows)
+        cache_key = (record_ids, subscription["last_check_time"])
+
+        def render(fmt):
+            key = cache_key + (fmt,)
+            if key not in cache:
+                cache[key] = renderer(resource, data, meta_data, fmt)
+            return cache[key]
+
         contents = {}
         if email_format == "html" and "EMAIL" in methods:
-            contents["html"] = renderer(resource, data, meta_data, "html")
+            contents["html"] = render("html")
             contents["default"] = contents["html"]
         if email_format != "html" or "EMAIL" not in methods or len(methods) > 1:
-            contents["text"] = renderer(resource, data, meta_data, "text")
+            contents["text"] = render("text")
             contents["default"] = contents["text"]
 
         # Subject line
@@ -385,14 +730,11 @@ class S3Notifications:
             templates = (templates,)
         prefix = resource.get_config("notify_template", "notify")
 
-        send = current.msg.send_by_pe_id
-
         success = False
         errors = []
 
-        for method in methods:
-
-            error = None
+        # Helper function to render the message for a contact method
+        def render_message(method):
 
             # Get the message template
             msg_template = None
@@ -419,16 +761,31 @@ class S3Notifications:
 
             # Render the message
             try:
-                message = current.response.render(msg_template, output)
+                return current.response.render(msg_template, output)
             except:
                 exc_info = sys.exc_info()[:2]
-                error = ("%s: %s" % (exc_info[0].__name__, exc_info[1]))
-                errors.append(error)
-                continue
+                errors.append("%s: %s" % (exc_info[0].__name__, exc_info[1]))
+                return False
             finally:
                 if hasattr(msg_template, "close"):
                     msg_template.close()
 
+        send = current.msg.send_by_pe_id
+
+        for method in methods:
+
+            error = None
+
+            # Re-use the message rendered for a previous subscriber
+            message_key = cache_key + (method, email_format)
+            if message_key in cache:
+                message = cache[message_key]
+            else:
+                message = render_message(method)
+                if message is False:
+                    continue
+                cache[message_key] = message
+
             if not message:
                 continue
 
@@ -466,9 +823,78 @@ class S3Notifications:
             message = ", ".join(errors)
         else:
             message = "Success"
-        return json_message(success = success,
-                            statuscode = 200 if success else 403,
-                            message = message)
+        return success, message
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _groups(cls, resource_ids):
+        """
+            Group subscriptions by resource, URL, notification trigger
+            and filter
+
+            @param resource_ids: the pr_subscription_resource record IDs
+
+            @returns: dict {group key: [pr_subscription_resource record ID]}
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        stable = s3db.pr_subscription
+        rtable = db.pr_subscription_resource
+        ftable = s3db.pr_filter
+
+        join = stable.on(rtable.subscription_id == stable.id)
+        left = ftable.on(ftable.id == stable.filter_id)
+        rows = db(rtable.id.belongs(resource_ids)).select(rtable.id,
+                                                          rtable.resource,
+                                                          rtable.url,
+                                                          stable.notify_on,
+                                                          ftable.query,
+                                                          join = join,
+                                                          left = left,
+                                                          )
+        groups = {}
+        for row in rows:
+            key = cls._group_key(row)
+            resource_id = row.pr_subscription_resource.id
+            if key in groups:
+                groups[key].append(resource_id)
+            else:
+                groups[key] = [resource_id]
+        return groups
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _group_key(row):
+        """
+            Get the group key for a subscription
+
+            @param row: the pr_subscription/pr_subscription_resource/pr_filter Row
+
+            @returns: tuple (resource, URL, notify_on, normalized filter query)
+        """
+
+        r = row.pr_subscription_resource
+        notify_on = row.pr_subscription.notify_on
+
+        query = row.pr_filter.query
+        if query:
+            try:
+                items = json.loads(query)
+            except ValueError:
+                pass
+            else:
+                # Filter expressions in any order, with any formatting
+                if isinstance(items, list):
+                    items = sorted(json.dumps(item, sort_keys=True) for item in items)
+                query = json.dumps(items, sort_keys=True)
+
+        return (r.resource,
+                r.url,
+                tuple(sorted(notify_on)) if notify_on else None,
+                query,
+                )
 
     # -------------------------------------------------------------------------
     @classmethod
@@ -46,8 +46,9 @@ from urllib import parse as urlparse
 from gluon import current, IS_EMPTY_OR, IS_IN_SET
 from gluon.storage import Storage
 
-from s3dal import Field, Row
+from s3dal import Field, Row, original_tablename
 from .s3fields import S3RepresentLazy
+from .s3textindex import S3TextIndex
 from .s3utils import s3_get_foreign_key, s3_str, S3TypeConverter
 
 ogetattr = object.__getattribute__
@@ -1233,9 +1234,10 @@ class S3ResourceQuery(object):
     ANYOF = "anyof"
     TYPEOF = "typeof"
     INTERSECTS = "intersects"
+    MATCH = "match"
 
     COMPARISON = [LT, LE, EQ, NE, GE, GT,
-                  LIKE, BELONGS, CONTAINS, ANYOF, TYPEOF, INTERSECTS]
+                  LIKE, BELONGS, CONTAINS, ANYOF, TYPEOF, INTERSECTS, MATCH]
 
     OPERATORS = [NOT, AND, OR] + COMPARISON
 
@@ -1412,12 +1414,68 @@ class S3ResourceQuery(object):
     # -------------------------------------------------------------------------
     def transform(self, resource):
         """
-            Placeholder for transformation method
+            Transform this query for external search engines, i.e. replace
+            text searches covered by the full-text index of the resource
+            (see S3TextIndex) by a MATCH against the index, unless the
+            index has not been built yet
 
             @param resource: the S3Resource
+
+            @returns: the transformed S3ResourceQuery
+        """
+
+        tablename = resource.tablename
+
+        selectors = S3TextIndex.config().get(tablename)
+        if not selectors or not S3TextIndex.available(tablename):
+            # Fall back to LIKE
+            return self
+
+        return self._transform(set(S3TextIndex.normalize(s) for s in selectors))
+
+    # -------------------------------------------------------------------------
+    def _transform(self, indexed):
+        """
+            Helper for transform(), replaces LIKE-subtrees covering all
+            indexed selectors by a MATCH for the indexed selectors, OR'ed
+            with LIKE for any other selectors in the subtree
+
+            @param indexed: the indexed selectors (set)
+
+            @returns: the transformed S3ResourceQuery
         """
 
-        # @todo: implement
+        op = self.op
+        l = self.left
+        r = self.right
+
+        if op in (self.OR, self.LIKE):
+            sub = self._or()
+            if sub is not None:
+                names, sop, value, invert = sub
+                if sop == self.LIKE and not invert:
+                    names = names.split("|")
+                    normalized = [S3TextIndex.normalize(n) for n in names]
+                    terms = S3TextIndex.terms(value)
+                    if terms and indexed.issubset(normalized):
+                        query = S3ResourceQuery(self.MATCH, FS("id"), terms)
+                        for name, selector in zip(names, normalized):
+                            if selector not in indexed:
+                                query |= S3ResourceQuery(self.LIKE,
+                                                         FS(name).lower(),
+                                                         value,
+                                                         )
+                        return query
+
+        if op in (self.AND, self.OR):
+            if isinstance(l, S3ResourceQuery):
+                l = l._transform(indexed)
+            if isinstance(r, S3ResourceQuery):
+                r = r._transform(indexed)
+            return S3ResourceQuery(op, l, r)
+        elif op == self.NOT and isinstance(l, S3ResourceQuery):
+            return S3ResourceQuery(op, l._transform(indexed))
+
         return self
 
     # -------------------------------------------------------------------------
@@ -1501,7 +1559,7 @@ class S3ResourceQuery(object):
             elif op == self.NE:
                 op = self.BELONGS
                 invert = True
-            elif op not in (self.BELONGS, self.TYPEOF):
+            elif op not in (self.BELONGS, self.TYPEOF, self.MATCH):
                 query = None
                 for v in rfield:
                     q = query_bare(op, lfield, v)
@@ -1558,6 +1616,8 @@ class S3ResourceQuery(object):
                 q = l.like(s3_str(r))
         elif op == self.INTERSECTS:
             q = self._query_intersects(l, r)
+        elif op == self.MATCH:
+            q = S3TextIndex(original_tablename(l.table)).query(l, r)
         elif op == self.LT:
             q = l < r
         elif op == self.LE:
@@ -2071,6 +2131,8 @@ class S3ResourceQuery(object):
                 return "(%s is a type of %s)" % (l, r)
             elif op == self.LIKE:
                 return "(%s like %s)" % (l, r)
+            elif op == self.MATCH:
+                return "(%s matches %s)" % (l, r)
             elif op == self.LT:
                 return "(%s < %s)" % (l, r)
             elif op == self.LE:
@@ -2164,7 +2226,10 @@ class S3ResourceQuery(object):
         if op == self.AND:
             return None
         elif op == self.NOT:
-            lname, lop, lval, linv = l._or()
+            lvars = l._or()
+            if lvars is None:
+                return None
+            lname, lop, lval, linv = lvars
             return (lname, lop, lval, not linv)
         elif op == self.OR:
             lvars = l._or()
@@ -50,7 +50,8 @@ from gluon.sqlhtml import OptionsWidget
 from gluon.storage import Storage
 from gluon.validators import IS_IN_SET, IS_EMPTY_OR
 
-from .s3query import FS
+from s3dal import Expression
+from .s3query import FS, S3Joins
 from .s3rest import S3Method
 from .s3utils import s3_flatlist, s3_has_foreign_key, s3_str, S3MarkupStripper, s3_represent_value
 from .s3xml import S3XMLFormat
@@ -241,28 +242,32 @@ class S3Report(S3Method):
 
             output = json.dumps(pivotdata, separators=SEPARATORS)
 
-        elif r.representation == "xls":
+        elif r.representation in ("xls", "xlsx"):
 
             if pivottable:
 
+                xlsx = r.representation == "xlsx"
+                extension = ".xlsx" if xlsx else ".xls"
+
                 # Report title
                 title = self.crud_string(r.tablename, "title_report")
                 if title is None:
                     title = current.T("Report")
 
                 # TODO: include current date?
-                filename = "%s_%s.xls" % (r.env.server_name,
-                                          s3_str(title).replace(" ", "_"),
-                                          )
+                filename = "%s_%s%s" % (r.env.server_name,
+                                        s3_str(title).replace(" ", "_"),
+                                        extension,
+                                        )
                 disposition = "attachment; filename=\"%s\"" % filename
 
                 # Response headers
                 response = current.response
-                response.headers["Content-Type"] = contenttype(".xls")
+                response.headers["Content-Type"] = contenttype(extension)
                 response.headers["Content-disposition"] = disposition
 
                 # Convert pivot table to XLS
-                stream = pivottable.xls(title)
+                stream = pivottable.xls(title, xlsx=xlsx)
                 #stream.seek(0) # already done in encoder
                 output = stream.read()
 
@@ -1727,7 +1732,21 @@ class S3PivotTableFact:
 class S3PivotTable:
     """ Class representing a pivot table of a resource """
 
-    def __init__(self, resource, rows, cols, facts, strict=True, precision=None):
+    #: Aggregation methods which can be computed by the database
+    SQL_METHODS = ("count", "sum", "min", "max", "avg")
+
+    #: Field types for which the database can compute numeric aggregates
+    SQL_NUMERIC = ("integer", "float", "double")
+
+    def __init__(self,
+                 resource,
+                 rows,
+                 cols,
+                 facts,
+                 strict = True,
+                 precision = None,
+                 sql = True,
+                 ):
         """
             Constructor - extracts all unique records, generates a
             pivot table from them with the given dimensions and
@@ -1741,6 +1760,8 @@ class S3PivotTable:
                            the resource filter
             @param precision: maximum precision of aggregate computations,
                               a dict {selector: number_of_decimals}
+            @param sql: let the database compute the aggregates where
+                        possible, rather than extracting all records
         """
 
         # Initialize ----------------------------------------------------------
@@ -1767,6 +1788,16 @@ class S3PivotTable:
                 {
                  <record_id>: <Row>
                 }
+            NB if the aggregates have been computed by the database,
+               the records are not extracted and all Rows are None
+        """
+
+        self.keys = None
+        """ The records contributing to count/sum layers, if the aggregates
+            have been computed by the database, as a dict like:
+                {
+                 (<fact>, <method>): <set_of_record_ids>, ...per layer
+                }
         """
 
         self.empty = False
@@ -1837,6 +1868,12 @@ class S3PivotTable:
                 if axis in exclude_empty:
                     resource.add_filter(FS(axis) != None)
 
+        # Let the database aggregate if possible -----------------------------
+        #
+        if sql and self._sql_supported(fields):
+            self._sql_aggregate()
+            return
+
         # Retrieve the records ------------------------------------------------
         #
         data = resource.select(list(self.rfields.keys()), limit=None)
@@ -2290,19 +2327,25 @@ class S3PivotTable:
                         elif method in ("sum", "count") and okeys is None:
                             # Include only cell records in okeys which actually
                             # contribute to the aggregate
-                            okeys = []
-                            for record_id in cell["records"]:
-                                record = self.records[record_id]
-                                try:
-                                    fvalue = record[rfield.colname]
-                                except AttributeError:
-                                    continue
-                                if method == "sum" and \
-                                   isinstance(fvalue, (int, float)) and fvalue:
-                                    okeys.append(record_id)
-                                elif method == "count" and \
-                                   fvalue is not None:
-                                    okeys.append(record_id)
+                            if self.keys is not None:
+                                keys = self.keys[fact.layer]
+                                okeys = [record_id
+                                         for record_id in cell["records"]
+                                         if record_id in keys]
+                            else:
+                                okeys = []
+                                for record_id in cell["records"]:
+                                    record = self.records[record_id]
+                                    try:
+                                        fvalue = record[rfield.colname]
+                                    except AttributeError:
+                                        continue
+                                    if method == "sum" and \
+                                       isinstance(fvalue, (int, float)) and fvalue:
+                                        okeys.append(record_id)
+                                    elif method == "count" and \
+                                       fvalue is not None:
+                                        okeys.append(record_id)
                         else:
                             # Include all cell records in okeys
                             okeys = cell["records"]
@@ -2390,11 +2433,12 @@ class S3PivotTable:
         return output
 
     # -------------------------------------------------------------------------
-    def xls(self, title):
+    def xls(self, title, xlsx=False):
         """
             Convert this pivot table into an XLS file
 
             @param title: the title of the report
+            @param xlsx: produce an XLSX file rather than XLS
 
             @returns: the XLS file as stream
         """
@@ -2402,7 +2446,7 @@ class S3PivotTable:
         from .s3codec import S3Codec
         exporter = S3Codec.get_codec("xls")
 
-        return exporter.encode_pt(self, title)
+        return exporter.encode_pt(self, title, xlsx=xlsx)
 
     # -------------------------------------------------------------------------
     def _represents(self, layers):
@@ -2746,6 +2790,269 @@ class S3PivotTable:
                                           )
         self.values[layer] = all_values
 
+    # -------------------------------------------------------------------------
+    def _sql_supported(self, fields=None):
+        """
+            Check whether the aggregates for this pivot table can be
+            computed by the database, i.e. whether all rows/cols/facts
+            are plain (non-virtual, non-list) fields in the master table
+
+            @param fields: the report_fields (always require the records)
+
+            @returns: True|False
+        """
+
+        if fields:
+            return False
+
+        # Requires an aggregate function to collect the record IDs
+        # per cell (MySQL would truncate the GROUP_CONCAT result)
+        dbtype = current.deployment_settings.get_database_type()
+        if dbtype not in ("sqlite", "postgres"):
+            return False
+
+        resource = self.resource
+        tablename = resource.table._tablename
+
+        # Virtual and extra filters must be applied to the records
+        if resource.get_filter() is not None or \
+           resource.rfilter.get_extra_filters():
+            return False
+
+        rfields = self.rfields
+
+        def plain(selector):
+            rfield = rfields.get(selector)
+            if not rfield or rfield.field is None or \
+               rfield.tname != tablename or rfield.ftype[:5] == "list:":
+                return None
+            return rfield
+
+        for selector in (self.rows, self.cols):
+            if selector and not plain(selector):
+                return False
+
+        for fact in self.facts:
+            rfield = plain(fact.selector)
+            if not rfield:
+                return False
+            method = fact.method
+            if method not in self.SQL_METHODS:
+                return False
+            if method != "count" and rfield.ftype not in self.SQL_NUMERIC:
+                return False
+
+        return True
+
+    # -------------------------------------------------------------------------
+    def _sql_aggregate(self):
+        """
+            Compute the pivot table with a GROUP BY query over the
+            resource query, producing the same cells, row/column headers
+            and totals as extracting the records and aggregating them
+            with _pivot/_add_layer; updates:
+
+                - self.records: all record IDs (without Rows)
+                - self.keys: the record IDs contributing to count/sum layers
+                - self.cell: the aggregated values per cell
+                - self.row: the totals per row
+                - self.col: the totals per column
+                - self.totals: the overall totals per layer
+        """
+
+        db = current.db
+        resource = self.resource
+        rfields = self.rfields
+
+        table = resource.table
+        pkey = table._id
+
+        # Filter the records by a subselect if the resource filter
+        # requires joins, so that every record is counted only once
+        query = resource.get_query()
+        rfilter = resource.rfilter
+        ijoins = rfilter.get_joins(left=False)
+        ljoins = rfilter.get_joins(left=True)
+        if ijoins or ljoins:
+            tablename = table._tablename
+            ijoins = S3Joins(tablename, ijoins)
+            ljoins = S3Joins(tablename, ljoins)
+            subselect = db(query)._select(pkey,
+                                          join = ijoins.as_list(prefer=ljoins),
+                                          left = ljoins.as_list(),
+                                          )
+            query = pkey.belongs(subselect)
+
+        # Group the records by their axis values
+        rows_field = rfields[self.rows].field if self.rows else None
+        cols_field = rfields[self.cols].field if self.cols else None
+        groupby = [f for f in (rows_field, cols_field) if f is not None]
+
+        expand = db._adapter.expand
+        postgres = current.deployment_settings.get_database_type() == "postgres"
+        def concat(expr):
+            # Comma-separated list of all non-null values of expr
+            if postgres:
+                sql = "string_agg(CAST(%s AS VARCHAR),',')" % expr
+            else:
+                sql = "group_concat(%s)" % expr
+            return Expression(db, sql, type="string")
+
+        first = pkey.min()
+        records = concat(expand(pkey))
+        fields = groupby + [first, records]
+
+        aggregates = []
+        for fact in self.facts:
+            method = fact.method
+            field = rfields[fact.selector].field
+            if method == "count":
+                expr = (field.count(distinct=True),)
+            elif method == "avg":
+                expr = (field.sum(), field.count())
+            else:
+                expr = (getattr(field, method)(),)
+            if method in ("count", "sum"):
+                contributes = field != None
+                if method == "sum":
+                    contributes &= field != 0
+                keys = concat("CASE WHEN %s THEN %s END" % (expand(contributes),
+                                                            expand(pkey),
+                                                            ))
+                expr += (keys,)
+            aggregates.append((fact, expr))
+            fields.extend(expr)
+
+        rows = db(query).select(*fields, groupby=groupby)
+        if not rows:
+            self.empty = True
+            return
+
+        ids = lambda v: [int(i) for i in v.split(",")] if v else []
+
+        # Order the axis values by first appearance like _pivot
+        rfirst, cfirst = {}, {}
+        for row in rows:
+            rvalue = row[rows_field] if rows_field else None
+            cvalue = row[cols_field] if cols_field else None
+            row_first = row[first]
+            if rvalue not in rfirst or row_first < rfirst[rvalue]:
+                rfirst[rvalue] = row_first
+            if cvalue not in cfirst or row_first < cfirst[cvalue]:
+                cfirst[cvalue] = row_first
+        rnames = sorted(rfirst, key=lambda v: rfirst[v])
+        cnames = sorted(cfirst, key=lambda v: cfirst[v])
+        rindex = dict((v, i) for i, v in enumerate(rnames))
+        cindex = dict((v, i) for i, v in enumerate(cnames))
+
+        numrows = len(rnames)
+        numcols = len(cnames)
+
+        self.row = [Storage({"value": v}) for v in rnames]
+        self.col = [Storage({"value": v}) for v in cnames]
+        self.numrows = numrows
+        self.numcols = numcols
+
+        # Partial aggregates per layer and cell
+        cells = self.cell = [[Storage(records=[]) for i in range(numcols)]
+                                                  for j in range(numrows)]
+        partials = dict((fact.layer, {}) for fact in self.facts)
+        keys = dict((fact.layer, set())
+                    for fact in self.facts if fact.method in ("count", "sum"))
+        all_records = []
+
+        for row in rows:
+            r = rindex[row[rows_field] if rows_field else None]
+            c = cindex[row[cols_field] if cols_field else None]
+            cell_records = sorted(ids(row[records]))
+            cells[r][c]["records"] = cell_records
+            all_records.extend(cell_records)
+
+            for fact, expr in aggregates:
+                layer = fact.layer
+                method = fact.method
+                partial = row[expr[0]]
+                if method == "avg":
+                    partial = (partial or 0, row[expr[1]])
+                elif method in ("count", "sum"):
+                    if partial is None:
+                        # SUM over no values is NULL, but 0 in Python
+                        partial = 0
+                    keys[layer].update(ids(row[expr[1]]))
+                partials[layer][(r, c)] = partial
+
+        self.records = Storage.fromkeys(sorted(all_records))
+        self.keys = keys
+
+        # Row and column records
+        for r in range(numrows):
+            self.row[r]["records"] = [i for cell in cells[r]
+                                        for i in cell["records"]]
+        for c in range(numcols):
+            self.col[c]["records"] = [i for cell in cells
+                                        for i in cell[c]["records"]]
+
+        # Compute cell values and totals
+        total = self._sql_total
+        for fact in self.facts:
+            layer = fact.layer
+            method = fact.method
+            precision = self.precision.get(fact.selector)
+            layer_partials = partials[layer]
+
+            for r in range(numrows):
+                for c in range(numcols):
+                    partial = layer_partials.get((r, c))
+                    values = [partial] if partial is not None else []
+                    cells[r][c][layer] = total(method, values, precision)
+
+            for r in range(numrows):
+                values = [layer_partials[(r, c)]
+                          for c in range(numcols) if (r, c) in layer_partials]
+                self.row[r][layer] = total(method, values, precision)
+
+            for c in range(numcols):
+                values = [layer_partials[(r, c)]
+                          for r in range(numrows) if (r, c) in layer_partials]
+                self.col[c][layer] = total(method, values, precision)
+
+            self.totals[layer] = total(method,
+                                       list(layer_partials.values()),
+                                       precision,
+                                       )
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _sql_total(method, partials, precision=None):
+        """
+            Aggregate partial aggregates from the database, in the same
+            way as S3PivotTableFact.compute would aggregate the values
+
+            @param method: the aggregation method
+            @param partials: the partial aggregates, i.e. the count or sum
+                             for count/sum, tuples (sum, count) for avg,
+                             or the extremum for min/max
+            @param precision: number of decimals for float results
+        """
+
+        if method in ("count", "sum"):
+            result = sum(partials)
+        elif method == "avg":
+            number = sum(p[1] for p in partials)
+            if not number:
+                return 0.0
+            result = sum(p[0] for p in partials) / float(number)
+        else:
+            partials = [p for p in partials if p is not None]
+            if not partials:
+                return None
+            result = min(partials) if method == "min" else max(partials)
+
+        if type(result) is float and precision is not None:
+            return round(result, precision)
+        else:
+            return result
+
     # -------------------------------------------------------------------------
     def _get_fields(self, fields=None):
         """
@@ -36,6 +36,7 @@ __all__ = ("S3AxisFilter",
            "S3ResourceFilter",
            )
 
+import hashlib
 import json
 import sys
 
@@ -467,19 +468,42 @@ class S3Resource(object):
     # -------------------------------------------------------------------------
     # Data access (new API)
     # -------------------------------------------------------------------------
-    def count(self, left=None, distinct=False):
+    def count(self, left=None, distinct=False, limit=None, approximate=False):
         """
             Get the total number of available records in this resource
 
             @param left: left outer joins, if required
             @param distinct: only count distinct rows
+            @param limit: count at most this number of records, to quickly
+                          check whether the number exceeds a threshold
+                          without counting all matching records
+            @param approximate: accept an approximate number, see
+                                S3ResourceFilter.count
         """
 
+        if limit is not None:
+            if self._length is not None:
+                return min(self._length, limit)
+            rows = self.select(["id"],
+                               limit = limit,
+                               left = left,
+                               distinct = distinct,
+                               virtual = False,
+                               as_rows = True,
+                               )
+            return len(rows)
+
         if self.rfilter is None:
             self.build_query()
         if self._length is None:
-            self._length = self.rfilter.count(left = left,
-                                              distinct = distinct)
+            length = self.rfilter.count(left = left,
+                                        distinct = distinct,
+                                        approximate = approximate,
+                                        )
+            if approximate:
+                # Do not retain approximate numbers
+                return length
+            self._length = length
         return self._length
 
     # -------------------------------------------------------------------------
@@ -498,6 +522,9 @@ class S3Resource(object):
                represent = False,
                show_links = True,
                raw_data = False,
+               after = None,
+               seek = None,
+               approximate = False,
                ):
         """
             Extract data from this resource
@@ -515,6 +542,12 @@ class S3Resource(object):
             @param as_rows: return the rows (don't extract)
             @param represent: render field value representations
             @param raw_data: include raw data in the result
+            @param after: only extract records with a primary key greater
+                          than this value (keyset pagination, use with
+                          orderby=primary key)
+            @param seek: keyset pagination for any orderby, see S3ResourceData
+            @param approximate: accept an approximate total number of
+                                records (with count), see S3ResourceData
         """
 
         data = S3ResourceData(self,
@@ -532,6 +565,9 @@ class S3Resource(object):
                               represent = represent,
                               show_links = show_links,
                               raw_data = raw_data,
+                              after = after,
+                              seek = seek,
+                              approximate = approximate,
                               )
         if as_rows:
             return data.rows
@@ -894,6 +930,8 @@ class S3Resource(object):
                   left = None,
                   orderby = None,
                   distinct = False,
+                  seek = None,
+                  approximate = False,
                   ):
         """
             Generate a data table of this resource
@@ -904,9 +942,13 @@ class S3Resource(object):
             @param left: additional left joins for DB query
             @param orderby: orderby for DB query
             @param distinct: distinct-flag for DB query
+            @param seek: keyset pagination, see S3ResourceData
+            @param approximate: accept an approximate numrows, see
+                                S3ResourceFilter.count
 
             @return: tuple (S3DataTable, numrows), where numrows represents
-                     the total number of rows in the table that match the query
+                     the total number of rows in the table that match the query,
+                     or None if the page was extracted by seeking a keyset
         """
 
         # Choose fields
@@ -949,6 +991,8 @@ class S3Resource(object):
                            count = True,
                            getids = False,
                            represent = True,
+                           seek = seek,
+                           approximate = approximate,
                            )
 
         rows = data.rows
@@ -977,8 +1021,9 @@ class S3Resource(object):
                          orderby = orderby,
                          empty = empty,
                          )
+        dt.cursors = data.cursors
 
-        return dt, data.numrows
+        return dt, None if data.seek else data.numrows
 
     # -------------------------------------------------------------------------
     def datalist(self,
@@ -1500,6 +1545,7 @@ class S3Resource(object):
                    start = None,
                    limit = None,
                    msince = None,
+                   orderby = None,
                    fields = None,
                    dereference = True,
                    maxdepth = MAXDEPTH,
@@ -1526,6 +1572,8 @@ class S3Resource(object):
 
             @param msince: export only records which have been modified
                             after this datetime
+            @param orderby: orderby-expression for the master records
+                            (default: modified_on if msince is given)
 
             @param fields: data fields to include (default: all)
 
@@ -1577,6 +1625,7 @@ class S3Resource(object):
         tree = rtree.build(start = start,
                            limit = limit,
                            msince = msince,
+                           orderby = orderby,
                            fields = fields,
                            dereference = dereference,
                            maxdepth = maxdepth,
@@ -1972,6 +2021,7 @@ class S3Resource(object):
                 if not success:
                     self.error = import_job.error
                     self.error_tree = import_job.error_tree
+            import_job.clear_prevalidated()
             if self.error and not ignore_errors:
                 return False
 
@@ -3837,6 +3887,9 @@ class S3AxisFilter(object):
 class S3ResourceFilter(object):
     """ Class representing a resource filter """
 
+    # Minimum number of records to use estimates for approximate counts
+    ESTIMATE_MIN = 10000
+
     def __init__(self,
                  resource,
                  id = None,
@@ -4338,12 +4391,16 @@ class S3ResourceFilter(object):
         return subset
 
     # -------------------------------------------------------------------------
-    def count(self, left=None, distinct=False):
+    def count(self, left=None, distinct=False, approximate=False):
         """
             Get the total number of matching records
 
             @param left: left outer joins
             @param distinct: count only distinct rows
+            @param approximate: accept an approximate number, True to use
+                                an estimate from the database statistics
+                                for large numbers of records, or a number
+                                of seconds to cache the count
         """
 
         distinct |= self.distinct
@@ -4367,14 +4424,23 @@ class S3ResourceFilter(object):
             join = ijoins.as_list(prefer=ljoins)
             left = ljoins.as_list()
 
+            dbset = current.db(self.query)
             cnt = table._id.count()
-            row = current.db(self.query).select(cnt,
-                                                join=join,
-                                                left=left).first()
-            if row:
-                return row[cnt]
-            else:
-                return 0
+            def count_rows():
+                row = dbset.select(cnt, join=join, left=left).first()
+                return row[cnt] if row else 0
+
+            if approximate:
+                sql = dbset._select(table._id, join=join, left=left)
+                if approximate is True:
+                    estimate = self.estimate(sql)
+                    if estimate is not None and estimate >= self.ESTIMATE_MIN:
+                        return estimate
+                else:
+                    key = "s3_count_%s" % hashlib.md5(sql.encode("utf-8")).hexdigest()
+                    return current.cache.ram(key, count_rows, time_expire=approximate)
+
+            return count_rows()
 
         else:
             data = resource.select([table._id.name],
@@ -4384,6 +4450,41 @@ class S3ResourceFilter(object):
                                    count=True)
             return data["numrows"]
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def estimate(sql):
+        """
+            Estimate the number of rows returned by a query from the
+            planner statistics of the database (like pg_class.reltuples,
+            but also taking the query conditions into account)
+
+            @param sql: the SQL SELECT statement
+
+            @returns: the estimated number of rows, or None if not
+                      available for the database engine
+        """
+
+        db = current.db
+        if db._dbname != "postgres":
+            return None
+
+        # Use a savepoint, so that a failing EXPLAIN does not abort
+        # the current transaction
+        db.executesql("SAVEPOINT s3_estimate")
+        try:
+            rows = db.executesql("EXPLAIN (FORMAT JSON) %s" % sql.rstrip().rstrip(";"))
+            plan = rows[0][0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]["Plan"]["Plan Rows"])
+        except Exception:
+            current.log.error("Could not estimate number of rows: %s" % sys.exc_info()[1])
+            db.executesql("ROLLBACK TO SAVEPOINT s3_estimate")
+            estimate = None
+        db.executesql("RELEASE SAVEPOINT s3_estimate")
+
+        return estimate
+
     # -------------------------------------------------------------------------
     # Utility Methods
     # -------------------------------------------------------------------------
@@ -4631,7 +4732,10 @@ class S3ResourceData(object):
                  as_rows = False,
                  represent = False,
                  show_links = True,
-                 raw_data = False
+                 raw_data = False,
+                 after = None,
+                 seek = None,
+                 approximate = False,
                  ):
         """
             Constructor, extracts (and represents) data from a resource
@@ -4650,12 +4754,30 @@ class S3ResourceData(object):
             @param as_rows: return the rows (don't extract/represent)
             @param represent: render field value representations
             @param raw_data: include raw data in the result
+            @param after: only extract records with a primary key greater
+                          than this value (keyset pagination)
+            @param seek: keyset pagination, a dict {"after": key} or
+                         {"before": key} with the key of the last record
+                         of the previous page or of the first record of
+                         the next page respectively, or an empty dict to
+                         only determine the keys of the extracted page
+                         (see cursors)
+            @param approximate: accept an approximate total number of
+                                records (with count), i.e. count them
+                                separately with S3ResourceFilter.count
+                                rather than with the filter query
 
             @note: as_rows / groupby prevent automatic splitting of
                    large multi-table joins, so use with care!
             @note: with groupby, only the groupby fields will be returned
                    (i.e. fields will be ignored), because aggregates are
                    not supported (yet)
+            @note: the key of a record is a tuple of its values for the
+                   orderby fields, followed by the record ID; keyset
+                   pagination requires all orderby fields to be in the
+                   master table, otherwise start/limit are used
+            @note: with seek, the total number of matching records is
+                   not counted (numrows is 0)
         """
 
         db = current.db
@@ -4702,6 +4824,10 @@ class S3ResourceData(object):
         # The query
         master_query = query = resource.get_query()
 
+        # Keyset pagination
+        if after is not None:
+            master_query = query = query & (table._id > after)
+
         # Joins from filters
         # @note: in components, rfilter is None until after get_query!
         rfilter = resource.rfilter
@@ -4740,6 +4866,44 @@ class S3ResourceData(object):
 
         # Resolve ORDERBY
         orderby, orderby_aggr, orderby_fields, tables = self.resolve_orderby(orderby)
+
+        # Keyset pagination
+        self.seek = backward = False
+        self.cursors = None
+        if seek is not None and not groupby and not as_rows:
+            keyset = self.keyset(orderby)
+        else:
+            keyset = None
+        if keyset:
+            key = None
+            if seek:
+                backward = "before" in seek
+                key = seek.get("before" if backward else "after")
+            if key is not None and len(key) == len(keyset):
+                master_query = query = query & self.seek_query(keyset,
+                                                               key,
+                                                               backward = backward,
+                                                               )
+                start = 0
+                count = False
+                self.seek = True
+            else:
+                backward = False
+
+            # Order by the keyset (in reverse order when seeking backward)
+            orderby = [~field if desc != backward else field
+                       for field, desc in keyset]
+            orderby, orderby_aggr, orderby_fields, tables = self.resolve_orderby(orderby)
+
+        # Approximate number of records (estimate or cached count)
+        approximate_rows = None
+        if count and approximate and not groupby:
+            approximate_rows = resource.count(left = left,
+                                              distinct = distinct,
+                                              approximate = approximate,
+                                              )
+            count = False
+
         if tables:
             filter_tables.update(tables)
 
@@ -4893,6 +5057,13 @@ class S3ResourceData(object):
                     qfields[pkey] = resource._id
                 has_id = True
 
+                # Include the keyset fields to determine the cursors
+                if keyset:
+                    for field, desc in keyset:
+                        fn = str(field)
+                        if fn not in qfields:
+                            qfields[fn] = field
+
             # Execute master query
             db = current.db
 
@@ -5032,6 +5203,8 @@ class S3ResourceData(object):
                 totalrows = len(ids)
 
         # Build the result
+        if approximate_rows is not None:
+            totalrows = approximate_rows
         self.rfields = dfields
         self.numrows = 0 if totalrows is None else totalrows
         self.ids = ids
@@ -5059,6 +5232,18 @@ class S3ResourceData(object):
                     self.ids = ids = self.getids(rows, pkey)
                 page = ids
 
+            # Determine the keys of the first and last record of the page
+            if keyset and page:
+                if backward:
+                    page = page[::-1]
+                colnames = [str(field) for field, desc in keyset]
+                first, last = page[0], page[-1]
+                keys = {}
+                for row in rows:
+                    record_id = row[pkey]
+                    if record_id == first or record_id == last:
+                        keys[record_id] = tuple(row[colname] for colname in colnames)
+                self.cursors = (keys.get(first), keys.get(last))
 
             # Execute any joined queries
             joined_fields = self.joined_fields(dfields, qfields)
@@ -5193,6 +5378,90 @@ class S3ResourceData(object):
 
         return
 
+    # -------------------------------------------------------------------------
+    def keyset(self, orderby):
+        """
+            Determine the sort keys for keyset pagination
+
+            @param orderby: the resolved orderby expression (list)
+
+            @returns: list of tuples (Field, descending), ending with the
+                      primary key, or None if keyset pagination is not
+                      possible for the orderby
+        """
+
+        table = self.table
+        tablename = table._tablename
+        pkey = str(table._id)
+
+        INVERT = S3DAL().INVERT
+
+        keyset = []
+        for item in orderby or []:
+            if isinstance(item, Field):
+                field, desc = item, False
+            elif type(item) is Expression and \
+                 item.op == INVERT and isinstance(item.first, Field):
+                field, desc = item.first, True
+            else:
+                # Aggregate or other expression
+                return None
+            fname = str(field)
+            if fname.split(".", 1)[0] != tablename:
+                # Field in joined table (could be ambiguous)
+                return None
+            keyset.append((field, desc))
+            if fname == pkey:
+                # Primary key is unique, no further keys needed
+                break
+        else:
+            keyset.append((table._id, False))
+
+        return keyset
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def seek_query(keyset, key, backward=False):
+        """
+            Construct a query for the records following (or preceding)
+            a key in keyset order
+
+            @param keyset: the keyset, list of tuples (Field, descending)
+            @param key: the key, tuple of values for the keyset fields
+            @param backward: seek the records preceding the key
+
+            @returns: the Query
+        """
+
+        # PostgreSQL sorts NULL after any value, others sort it first
+        nulls_last = current.db._dbname == "postgres"
+
+        query = equal = None
+        for (field, desc), value in zip(keyset, key):
+
+            greater = desc == backward
+            if value is None:
+                q = field != None if greater != nulls_last else None
+                e = field == None
+            else:
+                if greater:
+                    q = field > value
+                    if nulls_last:
+                        q |= field == None
+                else:
+                    q = field < value
+                    if not nulls_last:
+                        q |= field == None
+                e = field == value
+
+            if q is not None:
+                if equal is not None:
+                    q = equal & q
+                query = q if query is None else query | q
+            equal = e if equal is None else equal & e
+
+        return query
+
     # -------------------------------------------------------------------------
     def resolve_orderby(self, orderby):
         """
@@ -983,6 +983,20 @@ class S3Request:
         if target == resource.tablename:
             # Master resource targetted
             target = None
+
+        if representation == "geojson" and \
+           not target and not msince and not mdata and \
+           fields is None and "xsltmode" not in get_vars and \
+           stylesheet == os.path.join(r.folder, r.XSLT_PATH, "geojson", "export.xsl"):
+            # No custom stylesheet or options => use the native encoder if possible
+            from .s3codec import S3Codec
+            codec = S3Codec.get_codec("geojson")
+            if codec.supported(resource):
+                return codec.encode(resource,
+                                    start = start,
+                                    limit = limit,
+                                    )
+
         output = resource.export_xml(start = start,
                                      limit = limit,
                                      msince = msince,
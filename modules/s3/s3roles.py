@@ -668,6 +668,8 @@ class S3RoleManager(S3Method):
                         # Add the rule
                         table.insert(**data)
 
+            current.auth.permission.expire_acl_cache()
+
     # -------------------------------------------------------------------------
     @staticmethod
     def copy_role(r, **attr):
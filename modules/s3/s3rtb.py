@@ -88,6 +88,7 @@ class S3ResourceTree(object):
               start = 0,
               limit = None,
               msince = None,
+              orderby = None,
               sync_filters = None,
               xmlformat = None,
               fields = None,
@@ -108,6 +109,7 @@ class S3ResourceTree(object):
 
             @param msince: export only records which have been modified
                             after this datetime
+            @param orderby: orderby-expression for the master records
             @param sync_filters: additional URL filters (Sync), as dict
                                  {tablename: {url_var: string}}
 
@@ -160,6 +162,7 @@ class S3ResourceTree(object):
                                               references = references,
                                               components = mcomponents,
                                               msince = msince,
+                                              orderby = orderby,
                                               sync_filters = sync_filters,
                                               xmlformat = xmlformat,
                                               mdata = mdata,
@@ -260,6 +263,7 @@ class S3ResourceTree(object):
                         start = 0,
                         limit = None,
                         msince = None,
+                        orderby = None,
                         sync_filters = None,
                         xmlformat = None,
                         fields = None,
@@ -278,6 +282,7 @@ class S3ResourceTree(object):
 
             @param msince: export only records which have been modified
                             after this datetime
+            @param orderby: orderby-expression for the records
             @param sync_filters: additional URL filters (Sync), as dict
                                  {tablename: {url_var: string}}
 
@@ -311,6 +316,7 @@ class S3ResourceTree(object):
                           start = start,
                           limit = limit,
                           msince = msince,
+                          orderby = orderby,
                           sync_filters = sync_filters,
                           xmlformat = xmlformat,
                           target = target,
@@ -498,6 +504,7 @@ class S3ResourceTree(object):
                      start = 0,
                      limit = None,
                      msince = None,
+                     orderby = None,
                      sync_filters = None,
                      xmlformat = None,
                      target = None,
@@ -514,6 +521,8 @@ class S3ResourceTree(object):
 
             @param msince: export only records which have been modified
                             after this datetime
+            @param orderby: orderby-expression for the records
+                            (default: modified_on if msince is given)
             @param sync_filters: additional URL filters (Sync), as dict
                                  {tablename: {url_var: string}}
 
@@ -548,10 +557,8 @@ class S3ResourceTree(object):
             resource.add_filter(FS(MTIME) >= msince)
 
         # Order by modified_on if msince is requested
-        if msince and MTIME in table.fields:
+        if orderby is None and msince and MTIME in table.fields:
             orderby = "%s ASC" % table[MTIME]
-        else:
-            orderby = None
 
         # Fields to load
         if xmlformat:
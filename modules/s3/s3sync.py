@@ -40,7 +40,7 @@ from .s3datetime import s3_parse_datetime, s3_utc
 from .s3rest import S3Method
 from .s3import import S3ImportItem
 from .s3query import S3URLQuery
-from .s3utils import s3_str
+from .s3utils import s3_get_foreign_key, s3_str
 
 # =============================================================================
 class S3Sync(S3Method):
@@ -257,6 +257,17 @@ class S3Sync(S3Method):
         if msince is not None:
             msince = s3_parse_datetime(msince)
 
+        # Paging (page_size + continuation cursor)
+        page = None
+        page_size = vars_get("page_size", None)
+        if page_size is not None:
+            try:
+                page_size = int(page_size)
+            except ValueError:
+                page_size = None
+            if page_size and page_size > 0:
+                page = (page_size, vars_get("after", None))
+
         # Sync filters from peer
         filters = {}
         for k, v in get_vars.items():
@@ -289,6 +300,7 @@ class S3Sync(S3Method):
                                     msince = msince,
                                     filters = filters,
                                     mixed = mixed,
+                                    page = page,
                                     )
         except NotImplementedError:
             r.error(405, "Synchronization method not supported for repository")
@@ -502,36 +514,54 @@ class S3Sync(S3Method):
         # because msince means greater-or-equal)
         delta = datetime.timedelta(seconds=1)
 
-        success = True
-        for task in tasks:
+        # Process tasks in dependency order
+        tasks = self.sort_tasks(tasks)
 
-            # Pull
-            mtime = None
-            if task.mode in (1, 3):
-                error, mtime = connector.pull(task,
-                                              onconflict=self.onconflict,
-                                              )
-            if error:
-                success = False
-                current.log.debug("S3Sync: %s PULL error: %s" %
-                                  (task.resource_name, error))
-                continue
-            if mtime is not None:
-                task.update_record(last_pull=mtime+delta)
-
-            # Push
-            mtime = None
-            if task.mode in (2, 3):
-                error, mtime = connector.push(task)
-            if error:
-                success = False
-                current.log.debug("S3Sync: %s PUSH error: %s" %
-                                  (task.resource_name, error))
-                continue
-            if mtime is not None:
-                task.update_record(last_push=mtime+delta)
+        # Fetch data for multiple tasks concurrently, if configured
+        executor = None
+        concurrency = connector.concurrency
+        if concurrency > 1 and len(tasks) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            executor = ThreadPoolExecutor(max_workers=concurrency)
 
-            current.log.debug("S3Sync.synchronize: %s done" % task.resource_name)
+        try:
+            if executor is not None:
+                connector.prefetch(tasks, executor)
+
+            success = True
+            for task in tasks:
+
+                # Pull
+                mtime = None
+                if task.mode in (1, 3):
+                    error, mtime = connector.pull(task,
+                                                  onconflict=self.onconflict,
+                                                  )
+                if error:
+                    success = False
+                    current.log.debug("S3Sync: %s PULL error: %s" %
+                                      (task.resource_name, error))
+                    continue
+                if mtime is not None:
+                    task.update_record(last_pull=mtime+delta)
+
+                # Push
+                mtime = None
+                if task.mode in (2, 3):
+                    error, mtime = connector.push(task)
+                if error:
+                    success = False
+                    current.log.debug("S3Sync: %s PUSH error: %s" %
+                                      (task.resource_name, error))
+                    continue
+                if mtime is not None:
+                    task.update_record(last_push=mtime+delta)
+
+                current.log.debug("S3Sync.synchronize: %s done" % task.resource_name)
+        finally:
+            if executor is not None:
+                # Don't wait for prefetches of tasks that failed early
+                executor.shutdown(wait=False)
 
         s3.synchronise_uuids = False
         db(s3db.sync_repository.id == repository_id).update(
@@ -542,6 +572,74 @@ class S3Sync(S3Method):
 
         return success
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def sort_tasks(tasks):
+        """
+            Sort sync tasks in dependency order, so that referenced
+            resources are imported before the resources referencing
+            them (e.g. org_organisation before hrm_human_resource)
+
+            @param tasks: the sync tasks (sync_task Rows)
+
+            @returns: list of sync tasks, otherwise retaining their
+                      original order
+        """
+
+        s3db = current.s3db
+
+        # Which task resources provide which tables (incl. super-entities)
+        providers = {}
+        super_entities = {}
+        for task in tasks:
+            tablename = task.resource_name
+            providers.setdefault(tablename, set()).add(tablename)
+            supertables = s3db.get_config(tablename, "super_entity")
+            if not supertables:
+                continue
+            if not isinstance(supertables, (list, tuple)):
+                supertables = [supertables]
+            names = super_entities[tablename] = set()
+            for supertable in supertables:
+                if hasattr(supertable, "_tablename"):
+                    supertable = supertable._tablename
+                names.add(supertable)
+                providers.setdefault(supertable, set()).add(tablename)
+
+        # Dependencies of each task resource
+        dependencies = {}
+        for task in tasks:
+            tablename = task.resource_name
+            if tablename in dependencies:
+                continue
+            required = set()
+            table = s3db.table(tablename)
+            if table is not None:
+                # Own super-keys are no dependencies
+                own = super_entities.get(tablename, ())
+                for field in table:
+                    ktablename = s3_get_foreign_key(field, m2m=False)[0]
+                    if ktablename in providers and ktablename not in own:
+                        required |= providers[ktablename]
+            required.discard(tablename)
+            dependencies[tablename] = required
+
+        # Sort
+        ordered = []
+        pending = list(tasks)
+        while pending:
+            remaining = set(task.resource_name for task in pending)
+            ready = [task for task in pending
+                     if not dependencies[task.resource_name] & remaining]
+            if not ready:
+                # Circular dependency => proceed in original order
+                ready = pending[:1]
+            ordered.extend(ready)
+            done = set(id(task) for task in ready)
+            pending = [task for task in pending if id(task) not in done]
+
+        return ordered
+
     # -------------------------------------------------------------------------
     @classmethod
     def onconflict(cls, item, repository, resource):
@@ -889,7 +987,8 @@ class S3SyncLog(S3Method):
               action=None,
               result=None,
               remote=False,
-              message=None):
+              message=None,
+              duration=None):
         """
             Writes a new entry to the log
 
@@ -902,6 +1001,7 @@ class S3SyncLog(S3Method):
                            (SUCCESS, WARNING, ERROR or FATAL)
             @param remote: boolean, True if this is a remote error
             @param message: clear text message
+            @param duration: processing time in seconds (if measured)
         """
 
         if result not in (cls.SUCCESS, cls.WARNING, cls.ERROR, cls.FATAL):
@@ -928,6 +1028,7 @@ class S3SyncLog(S3Method):
                  "result": result,
                  "remote": remote,
                  "message": message,
+                 "duration": duration,
                  }
 
         current.s3db[cls.TABLENAME].insert(**entry)
@@ -984,6 +1085,7 @@ class S3SyncRepository:
         self.synchronise_uuids = repository.synchronise_uuids
         self.keep_source = repository.keep_source
         self.last_refresh = repository.last_refresh
+        self.concurrency = repository.concurrency or 1
 
         # Instantiate Adapter
         from . import sync_adapter
@@ -1091,6 +1193,21 @@ class S3SyncBaseAdapter:
 
         raise NotImplementedError
 
+    # -------------------------------------------------------------------------
+    def prefetch(self, tasks, executor):
+        """
+            Start fetching the data for multiple sync tasks concurrently,
+            to be picked up by subsequent pull() calls (optional)
+
+            @param tasks: the sync tasks (sync_task Rows), in the order
+                          they will be pulled
+            @param executor: a concurrent.futures.Executor to run the
+                             requests; NB the requests run in separate
+                             threads and thus must not access the database
+        """
+
+        pass
+
     # -------------------------------------------------------------------------
     def push(self, task):
         """
@@ -1114,6 +1231,7 @@ class S3SyncBaseAdapter:
              msince=None,
              filters=None,
              mixed=False,
+             page=None,
              pretty_print=False,
              ):
         """
@@ -1125,6 +1243,7 @@ class S3SyncBaseAdapter:
             @param msince: minimum modification date/time for records to send
             @param filters: URL filters for record extraction
             @param mixed: negotiate resource with peer (disregard resource)
+            @param page: tuple (page_size, cursor) to send records page-wise
             @param pretty_print: make the output human-readable
 
             @return: a dict {status, remote, message, response}, with:
@@ -0,0 +1,788 @@
+# -*- coding: utf-8 -*-
+
+""" S3 Text Search Indexes
+
+    @copyright: 2021 (c) Sahana Software Foundation
+    @license: MIT
+
+    @requires: U{B{I{gluon}} <http://web2py.com>}
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+__all__ = ("S3NameTokens",
+           "S3TextIndex",
+           )
+
+import re
+import unicodedata
+
+from gluon import current
+
+from .s3utils import s3_get_foreign_key, s3_str
+
+# Words in search terms and documents (same as the unicode61 tokenizer)
+WORDS = re.compile(r"[^\W_]+", re.UNICODE)
+
+# =============================================================================
+class S3TextIndex(object):
+    """
+        Full-text index for text search in a table, maintained as
+        SQLite FTS5 virtual table or PostgreSQL tsvector table with
+        GIN index; configured with settings.database.text_index
+    """
+
+    # Number of records per statement
+    BATCH_SIZE = 500
+
+    # Tables for which the index table is known to exist (per process)
+    created = set()
+
+    # Tables for which the index build has been scheduled (per process)
+    scheduled = set()
+
+    def __init__(self, tablename, selectors=None):
+        """
+            Constructor
+
+            @param tablename: the name of the indexed table
+            @param selectors: the indexed field selectors, defaults
+                              to the configured selectors for the table
+        """
+
+        self.tablename = tablename
+
+        if selectors is None:
+            selectors = self.config().get(tablename)
+        self.selectors = [self.normalize(s) for s in selectors or []]
+
+        self.engine = current.deployment_settings.get_database_type()
+
+        self.index_name = "%s_text_index" % tablename
+        self.key = "rowid" if self.engine == "sqlite" else "id"
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def config():
+        """
+            Get the text index configuration
+
+            @returns: dict {tablename: [selectors]}
+        """
+
+        return current.deployment_settings.get_database_text_index() or {}
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def normalize(selector):
+        """
+            Normalize a field selector (strip the master prefix)
+
+            @param selector: the field selector
+        """
+
+        return selector[2:] if selector[:2] == "~." else selector
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def terms(value):
+        """
+            Convert LIKE-patterns (as constructed by S3URLQuery from
+            text filter expressions) into search terms for the index
+
+            @param value: the LIKE-pattern, or a list of patterns
+
+            @returns: list of search terms, or None if the patterns
+                      can not be searched with the index
+        """
+
+        patterns = value if isinstance(value, (list, tuple)) else [value]
+
+        terms = []
+        for pattern in patterns:
+
+            # Only substring-patterns ("%term%") can be used
+            if not isinstance(pattern, str) or \
+               len(pattern) < 3 or pattern[0] != "%" or pattern[-1] != "%":
+                return None
+
+            chars = []
+            escaped = False
+            for c in pattern[1:-1]:
+                if escaped:
+                    chars.append(c)
+                    escaped = False
+                elif c == "\\":
+                    escaped = True
+                elif c in "%_":
+                    # Inner wildcard
+                    return None
+                else:
+                    chars.append(c)
+            if escaped:
+                # Trailing wildcard is escaped
+                return None
+
+            term = "".join(chars)
+            if not WORDS.search(term):
+                return None
+            terms.append(term)
+
+        return terms if terms else None
+
+    # -------------------------------------------------------------------------
+    def exists(self):
+        """
+            Check whether the index table exists; as the index is created
+            and built in the same transaction (see rebuild), an existing
+            index table is always complete
+
+            @returns: True|False
+        """
+
+        tablename = self.tablename
+        if tablename in self.created:
+            return True
+
+        db = current.db
+        name = self.index_name
+
+        if self.engine == "sqlite":
+            sql = "SELECT name FROM sqlite_master WHERE type='table' AND name='%s';"
+            exists = bool(db.executesql(sql % name))
+        else:
+            exists = db.executesql("SELECT to_regclass('%s');" % name)[0][0] is not None
+
+        if exists:
+            self.created.add(tablename)
+        return exists
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def available(cls, tablename):
+        """
+            Check whether the index for a table can be used for searches,
+            otherwise schedule the task to build it (once per process)
+
+            @param tablename: the name of the indexed table
+
+            @returns: True if the index can be used, otherwise False
+        """
+
+        index = cls(tablename)
+        if index.engine not in ("sqlite", "postgres"):
+            return False
+        if index.exists():
+            return True
+
+        if tablename not in cls.scheduled:
+            cls.scheduled.add(tablename)
+            current.s3task.schedule_task("s3_text_index_rebuild",
+                                         vars = {"tablename": tablename},
+                                         timeout = 3600,
+                                         user_id = False,
+                                         )
+            current.log.warning("S3TextIndex: index for %s not built yet, "
+                                "rebuild task scheduled" % tablename)
+        return False
+
+    # -------------------------------------------------------------------------
+    def _create(self):
+        """
+            Create the index table if it does not exist yet
+        """
+
+        db = current.db
+        name = self.index_name
+
+        if self.engine == "sqlite":
+            db.executesql("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(document, tokenize='unicode61');" % name)
+        else:
+            db.executesql("CREATE TABLE IF NOT EXISTS %s (id integer PRIMARY KEY, document tsvector);" % name)
+            db.executesql("CREATE INDEX IF NOT EXISTS %s_idx ON %s USING GIN (document);" % (name, name))
+
+    # -------------------------------------------------------------------------
+    def documents(self, record_ids=None, after=None, limit=None):
+        """
+            Extract the documents to index from the table
+
+            @param record_ids: the record IDs
+            @param after: extract records with a record ID greater than this
+            @param limit: the maximum number of records to extract
+
+            @returns: tuple (documents, last), where documents is a list
+                      of tuples (record_id, document), and last is the
+                      last record ID extracted
+        """
+
+        auth = current.auth
+        override, auth.override = auth.override, True
+        try:
+            resource = current.s3db.resource(self.tablename, id=record_ids)
+            table = resource.table
+
+            fields = ["id"] + [s for s in self.selectors if s != "id"]
+            data = resource.select(fields,
+                                   limit = limit,
+                                   orderby = table._id,
+                                   represent = False,
+                                   after = after,
+                                   )
+        finally:
+            auth.override = override
+
+        colnames = [rfield.colname for rfield in data.rfields]
+        pkey = colnames[0]
+
+        documents = []
+        last = None
+        for row in data.rows:
+            words = []
+            for colname in colnames[1:]:
+                value = row[colname]
+                values = value if isinstance(value, (list, tuple)) else [value]
+                words.extend(s3_str(v) for v in values if v is not None)
+            last = row[pkey]
+            documents.append((last, " ".join(words)))
+
+        return documents, last
+
+    # -------------------------------------------------------------------------
+    def write(self, documents, record_ids=None):
+        """
+            Write documents to the index
+
+            @param documents: list of tuples (record_id, document)
+            @param record_ids: record IDs to remove from the index first
+        """
+
+        db = current.db
+        name, key = self.index_name, self.key
+
+        if record_ids:
+            db.executesql("DELETE FROM %s WHERE %s IN (%s);" % \
+                          (name, key, ",".join(str(int(i)) for i in record_ids)))
+
+        if documents:
+            represent = db._adapter.represent
+            if self.engine == "sqlite":
+                value = lambda doc: represent(doc, "text")
+            else:
+                value = lambda doc: "to_tsvector('simple', %s)" % represent(doc, "text")
+            values = ",".join("(%s,%s)" % (int(record_id), value(doc))
+                              for record_id, doc in documents)
+            db.executesql("INSERT INTO %s (%s,document) VALUES %s;" % \
+                          (name, key, values))
+
+    # -------------------------------------------------------------------------
+    def refresh(self, record_ids):
+        """
+            Re-index records, removing those which no longer exist
+
+            @param record_ids: the record IDs
+        """
+
+        if not self.exists():
+            # Index not built yet (the build will include these records)
+            return
+
+        size = self.BATCH_SIZE
+        for index in range(0, len(record_ids), size):
+            batch = record_ids[index:index + size]
+            documents = self.documents(record_ids=batch)[0]
+            self.write(documents, record_ids=batch)
+
+    # -------------------------------------------------------------------------
+    def rebuild(self):
+        """
+            Rebuild the index from scratch; to be run as scheduler task
+            (s3_text_index_rebuild), committing only after the build so
+            that the index is never used while incomplete
+        """
+
+        self._create()
+        current.db.executesql("DELETE FROM %s;" % self.index_name)
+
+        size = self.BATCH_SIZE
+        total = 0
+        after = None
+        while True:
+            documents, last = self.documents(after=after, limit=size)
+            self.write(documents)
+            total += len(documents)
+            if len(documents) < size:
+                break
+            after = last
+
+        current.log.info("S3TextIndex: indexed %s records in %s" % \
+                         (total, self.tablename))
+
+    # -------------------------------------------------------------------------
+    def query(self, field, terms):
+        """
+            Construct a query for records matching any of the search terms,
+            i.e. containing the words of a term, the last one as prefix
+
+            @param field: the primary key of the (aliased) indexed table
+            @param terms: the search terms
+
+            @returns: a Query
+
+            @note: only to be used if the index is available(), otherwise
+                   the text search must fall back to LIKE
+        """
+
+        words = [WORDS.findall(s3_str(term).lower()) for term in terms]
+        words = [w for w in words if w]
+
+        represent = current.db._adapter.represent
+        name, key = self.index_name, self.key
+
+        if self.engine == "sqlite":
+            expr = " OR ".join('"%s"*' % " ".join(w) for w in words)
+            sql = "SELECT rowid FROM %s WHERE %s MATCH %s;" % \
+                  (name, name, represent(expr, "string"))
+        else:
+            expr = " | ".join("(%s:*)" % " <-> ".join(w) for w in words)
+            sql = "SELECT %s FROM %s WHERE document @@ to_tsquery('simple', %s);" % \
+                  (key, name, represent(expr, "string"))
+
+        return field.belongs(sql)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def dependents(cls, tablename):
+        """
+            Find indexed tables with joined selectors referencing a table
+
+            @param tablename: the referenced table name
+
+            @returns: list of tuples (indexed tablename, foreign key name)
+        """
+
+        s3db = current.s3db
+
+        dependents = set()
+        for indexed, selectors in cls.config().items():
+            table = s3db.table(indexed)
+            if not table:
+                continue
+            for selector in selectors:
+                fkey = cls.normalize(selector).split("$", 1)
+                if len(fkey) < 2 or fkey[0] not in table.fields:
+                    continue
+                ktablename = s3_get_foreign_key(table[fkey[0]], m2m=False)[0]
+                if ktablename == tablename:
+                    dependents.add((indexed, fkey[0]))
+
+        return list(dependents)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def update(cls, tablename, record_ids):
+        """
+            Update the indexes after records have been written or deleted,
+            including records in other tables referencing these records
+            with indexed joined selectors (one level)
+
+            @param tablename: the table name
+            @param record_ids: the record IDs
+        """
+
+        config = cls.config()
+        if not config or not record_ids:
+            return
+
+        if tablename in config:
+            cls(tablename).refresh(record_ids)
+
+        db = current.db
+        s3db = current.s3db
+        for indexed, fkey in cls.dependents(tablename):
+            table = s3db.table(indexed)
+            query = table[fkey].belongs(record_ids)
+            if "deleted" in table.fields:
+                query &= (table.deleted == False)
+            rows = db(query).select(table._id)
+            if rows:
+                cls(indexed).refresh([row[table._id] for row in rows])
+
+# =============================================================================
+class S3NameTokens(object):
+    """
+        Prefix token index for name search in autocompletes: normalized
+        (case-folded, accent-stripped) prefixes of the words in name fields,
+        stored in s3_name_token, so that the beginnings of words can be
+        looked up with indexed equality matches rather than LIKE;
+        activated with settings.search.name_tokens, and maintained by
+        DAL callbacks on the indexed tables (see track)
+    """
+
+    # Indexed fields per table
+    FIELDS = {"pr_person": ("first_name", "middle_name", "last_name", "pe_label"),
+              "org_organisation": ("name", "acronym"),
+              "org_site": ("name",),
+              }
+
+    # Maximum token length (longer search words match on this prefix)
+    MAX_LENGTH = 20
+
+    # Number of tokens per statement
+    BATCH_SIZE = 500
+
+    # Tables for which the tokens are known to be built (per process)
+    built = set()
+
+    # Tables for which the token build has been scheduled (per process)
+    scheduled = set()
+
+    def __init__(self, tablename):
+        """
+            Constructor
+
+            @param tablename: the name of the indexed table
+        """
+
+        self.tablename = tablename
+        self.fields = self.FIELDS.get(tablename, ())
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def active():
+        """
+            Whether the name token index is to be used
+        """
+
+        return current.deployment_settings.get_search_name_tokens()
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def words(value):
+        """
+            Normalize a value and split it into words
+
+            @param value: the value
+
+            @returns: list of words
+        """
+
+        if value is None:
+            return []
+
+        value = unicodedata.normalize("NFKD", s3_str(value))
+        value = "".join(c for c in value if not unicodedata.combining(c))
+
+        return WORDS.findall(value.casefold())
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tokens(cls, value):
+        """
+            Get the tokens (word prefixes) for a value
+
+            @param value: the value
+
+            @returns: set of tokens
+        """
+
+        tokens = set()
+        for word in cls.words(value):
+            word = word[:cls.MAX_LENGTH]
+            tokens.update(word[:i] for i in range(1, len(word) + 1))
+
+        return tokens
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def create_indexes(cls):
+        """
+            Create indexes for the s3_name_token table, for token lookups
+            and updates
+        """
+
+        dbtype = current.deployment_settings.get_database_type()
+
+        if dbtype in ("postgres", "sqlite"):
+            sql = "CREATE INDEX IF NOT EXISTS %(index)s ON s3_name_token (%(fields)s);"
+        else:
+            return
+
+        db = current.db
+        for name, fields in (("token", "tablename,token"),
+                             ("record", "tablename,record_id"),
+                             ):
+            db.executesql(sql % {"index": "s3_name_token_%s_idx" % name,
+                                 "fields": fields,
+                                 })
+
+    # -------------------------------------------------------------------------
+    def available(self):
+        """
+            Check whether the tokens for the table have been built (i.e.
+            the marker written by rebuild exists), otherwise schedule the
+            task to build them (once per process)
+
+            @returns: True if the tokens can be used, otherwise False
+        """
+
+        tablename = self.tablename
+        if tablename in self.built:
+            return True
+
+        ttable = current.s3db.s3_name_token
+        query = (ttable.tablename == tablename) & \
+                (ttable.record_id == 0)
+        if current.db(query).select(ttable.id, limitby=(0, 1)).first():
+            self.built.add(tablename)
+            return True
+
+        if tablename not in self.scheduled:
+            self.scheduled.add(tablename)
+            current.s3task.schedule_task("s3_name_tokens_rebuild",
+                                         vars = {"tablename": tablename},
+                                         timeout = 3600,
+                                         user_id = False,
+                                         )
+            current.log.warning("S3NameTokens: tokens for %s not built yet, "
+                                "rebuild task scheduled" % tablename)
+        return False
+
+    # -------------------------------------------------------------------------
+    def covers(self, fieldnames):
+        """
+            Check whether all of the given fields are indexed
+
+            @param fieldnames: the field names
+        """
+
+        return all(fn in self.fields for fn in fieldnames)
+
+    # -------------------------------------------------------------------------
+    def query(self, key, value, fieldnames=None):
+        """
+            Construct a query for records where every word in the search
+            string matches the beginning of a word in any of the fields
+
+            @param key: the Field referencing the indexed records
+            @param value: the search string
+            @param fieldnames: the names of the fields to match, defaults
+                               to all indexed fields
+
+            @returns: a Query, or None if the search string contains no words
+                      or the tokens have not been built yet (i.e. the search
+                      must fall back to LIKE)
+        """
+
+        # Limit to max 8 words (prevent excessively long search queries)
+        words = self.words(value)[:8]
+        if not words or not self.available():
+            return None
+
+        db = current.db
+        ttable = current.s3db.s3_name_token
+
+        base = (ttable.tablename == self.tablename)
+        if fieldnames is not None and not set(self.fields).issubset(fieldnames):
+            base &= (ttable.fieldname.belongs(list(fieldnames)))
+
+        query = None
+        for word in words:
+            token = word[:self.MAX_LENGTH]
+            q = key.belongs(db(base & (ttable.token == token))._select(ttable.record_id))
+            query = q if query is None else query & q
+
+        return query
+
+    # -------------------------------------------------------------------------
+    def write(self, rows):
+        """
+            Write the tokens for records
+
+            @param rows: the records (Rows, including the primary key
+                         and the indexed fields)
+        """
+
+        db = current.db
+        represent = db._adapter.represent
+
+        table = current.s3db.table(self.tablename)
+        pkey = table._id.name
+        fieldnames = [fn for fn in self.fields if fn in table.fields]
+
+        tablename = represent(self.tablename, "string")
+        tokens = self.tokens
+
+        values = []
+        for row in rows:
+            record_id = row[pkey]
+            for fieldname in fieldnames:
+                fn = represent(fieldname, "string")
+                for token in tokens(row[fieldname]):
+                    values.append("(%s,%s,%s,%s)" % (tablename,
+                                                     fn,
+                                                     int(record_id),
+                                                     represent(token, "string"),
+                                                     ))
+
+        size = self.BATCH_SIZE
+        for index in range(0, len(values), size):
+            db.executesql("INSERT INTO s3_name_token (tablename,fieldname,record_id,token) VALUES %s;" % \
+                          ",".join(values[index:index + size]))
+
+    # -------------------------------------------------------------------------
+    def select(self, query, limit=None):
+        """
+            Select records to index
+
+            @param query: the query
+            @param limit: the maximum number of records
+
+            @returns: Rows
+        """
+
+        table = current.s3db.table(self.tablename)
+
+        fields = [table._id] + [table[fn] for fn in self.fields if fn in table.fields]
+        if "deleted" in table.fields:
+            query &= (table.deleted == False)
+
+        return current.db(query).select(orderby = table._id,
+                                        limitby = (0, limit) if limit else None,
+                                        *fields)
+
+    # -------------------------------------------------------------------------
+    def refresh(self, record_ids):
+        """
+            Update the tokens for records, removing those of records which
+            no longer exist
+
+            @param record_ids: the record IDs
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        ttable = s3db.s3_name_token
+        db((ttable.tablename == self.tablename) & \
+           (ttable.record_id.belongs(record_ids))).delete()
+
+        table = s3db.table(self.tablename)
+        self.write(self.select(table._id.belongs(record_ids)))
+
+    # -------------------------------------------------------------------------
+    def rebuild(self):
+        """
+            Rebuild the tokens for all records in the table, and write
+            the marker (record_id 0) so that the tokens can be used; to
+            be run as scheduler task (s3_name_tokens_rebuild), committing
+            only after the build
+        """
+
+        db = current.db
+        s3db = current.s3db
+
+        ttable = s3db.s3_name_token
+        db(ttable.tablename == self.tablename).delete()
+
+        table = s3db.table(self.tablename)
+        size = 1000
+        total = 0
+        last = 0
+        while True:
+            rows = self.select(table._id > last, limit=size)
+            self.write(rows)
+            total += len(rows)
+            if len(rows) < size:
+                break
+            last = rows.last()[table._id]
+
+        ttable.insert(tablename = self.tablename,
+                      record_id = 0,
+                      )
+
+        current.log.info("S3NameTokens: indexed %s records in %s" % \
+                         (total, self.tablename))
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def track(cls, tablename):
+        """
+            Register DAL callbacks to update the tokens whenever records
+            in an indexed table are written, so that direct inserts and
+            updates (e.g. in widgets, registration or onaccept callbacks)
+            are indexed too
+
+            @param tablename: the name of the indexed table
+
+            @note: the callbacks are registered per request, i.e. this
+                   must be called whenever the table is defined
+        """
+
+        db = current.db
+
+        if tablename not in cls.FIELDS or tablename not in db:
+            return
+        table = db[tablename]
+        if getattr(table, "_name_tokens_tracked", False):
+            return
+        table._name_tokens_tracked = True
+
+        watched = set(cls.FIELDS[tablename]) | {"deleted"}
+
+        # Record IDs collected before updates/deletes, as stacks
+        # (to match the after-callbacks of nested writes)
+        updates = []
+        deletes = []
+
+        def select(dbset):
+            return [row[table._id] for row in dbset.select(table._id)]
+
+        def after_insert(fields, record_id):
+            if record_id and watched & set(fields):
+                cls(tablename).refresh([record_id])
+
+        def before_update(dbset, fields):
+            if watched & set(fields):
+                updates.append(select(dbset))
+            else:
+                updates.append(None)
+
+        def after_update(dbset, fields):
+            record_ids = updates.pop() if updates else None
+            if record_ids:
+                cls(tablename).refresh(record_ids)
+
+        def before_delete(dbset):
+            deletes.append(select(dbset))
+
+        def after_delete(dbset):
+            record_ids = deletes.pop() if deletes else None
+            if record_ids:
+                cls(tablename).refresh(record_ids)
+
+        table._after_insert.append(after_insert)
+        table._before_update.append(before_update)
+        table._after_update.append(after_update)
+        table._before_delete.append(before_delete)
+        table._after_delete.append(after_delete)
+
+# END =========================================================================
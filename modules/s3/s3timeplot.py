@@ -31,6 +31,7 @@ __all__ = ("S3TimePlot",
            "S3TimeSeries",
            "S3TimeSeriesEvent",
            "S3TimeSeriesEventFrame",
+           "S3TimeSeriesEventStore",
            "S3TimeSeriesFact",
            "S3TimeSeriesPeriod",
            )
@@ -41,6 +42,9 @@ import json
 import re
 import sys
 
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import product
 from dateutil.relativedelta import relativedelta
 from dateutil.rrule import DAILY, HOURLY, MONTHLY, WEEKLY, YEARLY, rrule
 from gluon import current
@@ -49,9 +53,10 @@ from gluon.html import FORM, INPUT, TABLE, TAG, XML
 from gluon.validators import IS_IN_SET
 from gluon.sqlhtml import OptionsWidget
 
+from s3dal import Expression
 from .s3datetime import s3_decode_iso_datetime, s3_utc
 from .s3rest import S3Method
-from .s3query import FS
+from .s3query import FS, S3Joins
 from .s3report import S3Report, S3ReportForm
 from .s3utils import s3_flatlist, s3_represent_value, s3_str, S3MarkupStripper
 
@@ -653,6 +658,9 @@ class S3TimePlotForm(S3ReportForm):
 class S3TimeSeries:
     """ Class representing a time series """
 
+    #: Aggregation methods which can be computed by the database
+    SQL_METHODS = ("count", "sum", "min", "max")
+
     def __init__(self,
                  resource,
                  start = None,
@@ -665,6 +673,7 @@ class S3TimeSeries:
                  facts = None,
                  baseline = None,
                  title = None,
+                 sql = True,
                  ):
         """
             Constructor
@@ -684,12 +693,16 @@ class S3TimeSeries:
             @param baseline: the baseline field (field selector)
 
             @param title: the time series title
+
+            @param sql: let the database aggregate the events where
+                        possible, rather than extracting all records
         """
 
         self.resource = resource
         self.rfields = {}
 
         self.title = title
+        self.sql = sql
 
         # Resolve timestamp
         self.resolve_timestamp(event_start, event_end)
@@ -816,7 +829,7 @@ class S3TimeSeries:
         if rfield.virtual:
 
             representations = []
-            append = representations.append()
+            append = representations.append
             stripper = S3MarkupStripper()
 
             represent = rfield.represent
@@ -842,6 +855,7 @@ class S3TimeSeries:
                                                  ).items()
             else:
                 representations = []
+                append = representations.append
                 for value in values:
                     append((value, s3_represent_value(field,
                                                       value,
@@ -1093,8 +1107,14 @@ class S3TimeSeries:
                     value += v
         event_frame.baseline = value
 
-        # Extract the records
-        data = resource.select(fields)
+        # Let the database aggregate if possible
+        sql = self.sql and self._sql_supported()
+        if sql:
+            data = None
+            self._sql_aggregate()
+        else:
+            # Extract the records
+            data = resource.select(fields)
 
         # Remove the filter we just added
         rfilter = resource.rfilter
@@ -1102,9 +1122,12 @@ class S3TimeSeries:
         rfilter.query = None
         rfilter.transformed = None
 
+        if sql:
+            return data
+
         # Do we need to convert dates into datetimes?
         convert_start = True if event_start.ftype == "date" else False
-        convert_end = True if event_start.ftype == "date" else False
+        convert_end = True if event_end and event_end.ftype == "date" else False
         fromordinal = datetime.datetime.fromordinal
         convert_date = lambda d: fromordinal(d.toordinal())
 
@@ -1115,11 +1138,9 @@ class S3TimeSeries:
         rows_colname = rows_rfield.colname if rows_rfield else None
         cols_colname = cols_rfield.colname if cols_rfield else None
 
-        # Create the events
-        events = []
-        add_event = events.append
-        rows_keys = set()
-        cols_keys = set()
+        # Store the events
+        store = S3TimeSeriesEventStore(fact_columns)
+        add_event = store.add
         for row in data.rows:
 
             # Extract values
@@ -1141,25 +1162,269 @@ class S3TimeSeries:
                 end = convert_date(end)
 
             # values = (base, slope)
-            event = S3TimeSeriesEvent(row[pkey],
-                                      start = start,
-                                      end = end,
-                                      values = values,
-                                      **grouping)
-            add_event(event)
-            rows_keys |= event.rows
-            cols_keys |= event.cols
-
-        # Extend the event frame with these events
-        if events:
-            event_frame.extend(events)
+            add_event(row[pkey],
+                      start = start,
+                      end = end,
+                      values = values,
+                      **grouping)
+
+        # Aggregate the events per period of the event frame
+        store.aggregate(event_frame, self.facts)
 
         # Store the grouping keys
-        self.rows_keys = rows_keys
-        self.cols_keys = cols_keys
+        self.rows_keys = store.rows_keys
+        self.cols_keys = store.cols_keys
 
         return data
 
+    # -------------------------------------------------------------------------
+    def _sql_supported(self):
+        """
+            Check whether the events can be aggregated by the database,
+            i.e. whether all facts are count/sum/min/max of plain
+            (non-virtual, non-list) fields in the master table, and the
+            start/end and axis fields are plain fields too
+
+            @returns: True|False
+        """
+
+        # Database sums of integers are Decimals in MySQL
+        dbtype = current.deployment_settings.get_database_type()
+        if dbtype not in ("sqlite", "postgres"):
+            return False
+
+        # Requires a recurrence rule for the periods
+        if not self.event_frame.rule:
+            return False
+
+        resource = self.resource
+        tablename = resource.table._tablename
+
+        # Virtual and extra filters must be applied to the records
+        if resource.get_filter() is not None or \
+           resource.rfilter.get_extra_filters():
+            return False
+
+        def plain(rfield):
+            return rfield.field is not None and \
+                   rfield.tname == tablename and \
+                   rfield.ftype[:5] != "list:"
+
+        rfields = self.rfields
+        for key in ("event_start", "event_end"):
+            rfield = rfields.get(key)
+            if rfield and \
+               (not plain(rfield) or rfield.ftype not in ("date", "datetime")):
+                return False
+        for key in ("rows", "cols"):
+            rfield = rfields.get(key)
+            if rfield and not plain(rfield):
+                return False
+
+        for fact in self.facts:
+            # Cumulative facts require the individual events
+            if fact.method not in self.SQL_METHODS:
+                return False
+            rfield = fact.base_rfield
+            if not rfield or not plain(rfield):
+                return False
+
+        return True
+
+    # -------------------------------------------------------------------------
+    def _sql_aggregate(self):
+        """
+            Aggregate the events with a GROUP BY query over the resource
+            query, where the periods in which each event starts and ends
+            are computed by the database, producing the same periods and
+            aggregates as extracting the events and distributing them
+            over the event frame; updates:
+
+                - self.rows_keys: all row axis values
+                - self.cols_keys: all column axis values
+                - the periods of the event frame (pre-aggregated)
+        """
+
+        db = current.db
+        resource = self.resource
+        rfields = self.rfields
+        event_frame = self.event_frame
+
+        table = resource.table
+        pkey = table._id
+
+        self.rows_keys = rows_keys = set()
+        self.cols_keys = cols_keys = set()
+
+        # The period boundaries
+        starts = []
+        ends = []
+        for period in event_frame:
+            starts.append(period.start)
+            ends.append(period.end)
+        numperiods = len(starts)
+        if not numperiods:
+            return
+
+        # Filter the records by a subselect if the resource filter
+        # requires joins, so that every record is counted only once
+        query = resource.get_query()
+        rfilter = resource.rfilter
+        ijoins = rfilter.get_joins(left=False)
+        ljoins = rfilter.get_joins(left=True)
+        if ijoins or ljoins:
+            tablename = table._tablename
+            ijoins = S3Joins(tablename, ijoins)
+            ljoins = S3Joins(tablename, ljoins)
+            subselect = db(query)._select(pkey,
+                                          join = ijoins.as_list(prefer=ljoins),
+                                          left = ljoins.as_list(),
+                                          )
+            query = pkey.belongs(subselect)
+
+        expand = db._adapter.expand
+        utc = dateutil.tz.tzutc()
+        day = datetime.timedelta(days=1)
+        second = datetime.timedelta(seconds=1)
+
+        def index(field, bounds, op, null):
+            # Expression for the index of the first bound for which
+            # field <op> bound is true (or len(bounds) if none)
+            ftype = field.type
+            column = expand(field)
+            cases = ["WHEN %s IS NULL THEN %s" % (column, null)]
+            for i, bound in enumerate(bounds):
+                bound = bound.astimezone(utc).replace(tzinfo=None)
+                if ftype == "date":
+                    # Dates are midnight datetimes
+                    value = bound.date()
+                    if op == "<" and bound.time() != datetime.time(0):
+                        value += day
+                else:
+                    # Stored datetimes have no fractional seconds
+                    value = bound.replace(microsecond=0)
+                    if op == "<" and bound.microsecond:
+                        value += second
+                cases.append("WHEN %s %s %s THEN %s" % (column,
+                                                        op,
+                                                        expand(value, ftype),
+                                                        i,
+                                                        ))
+            sql = "CASE %s ELSE %s END" % (" ".join(cases), len(bounds))
+            return Expression(db, sql, type="integer")
+
+        # Index of the period in which the event starts
+        start_field = rfields["event_start"].field
+        first = index(start_field, ends, "<", 0)
+        groupby = [first]
+
+        # Number of periods starting before the event ends (last) and
+        # before or when the event ends (until)
+        event_end = rfields.get("event_end")
+        if event_end:
+            end_field = event_end.field
+            last = index(end_field, starts, "<=", "NULL")
+            until = index(end_field, starts, "<", "NULL")
+            groupby.extend((last, until))
+        else:
+            last = until = None
+
+        # Group the events by their axis values
+        rows_rfield = rfields.get("rows")
+        rows_field = rows_rfield.field if rows_rfield else None
+        cols_rfield = rfields.get("cols")
+        cols_field = cols_rfield.field if cols_rfield else None
+        groupby.extend(f for f in (rows_field, cols_field) if f is not None)
+
+        aggregates = []
+        for fact in self.facts:
+            field = fact.base_rfield.field
+            aggregates.append(getattr(field, fact.method)())
+
+        rows = db(query).select(*(groupby + aggregates), groupby=groupby)
+        if not rows:
+            return
+
+        facts = self.facts
+        methods = [fact.method for fact in facts]
+        def merge(totals, values):
+            for i, value in enumerate(values):
+                if value is None:
+                    continue
+                total = totals[i]
+                method = methods[i]
+                if total is None:
+                    totals[i] = value
+                elif method in ("count", "sum"):
+                    totals[i] = total + value
+                elif method == "min":
+                    totals[i] = min(total, value)
+                else:
+                    totals[i] = max(total, value)
+        initial = [0 if method in ("count", "sum") else None
+                   for method in methods]
+
+        # Distribute the pre-aggregated groups over the periods
+        periods = [None] * numperiods
+        for row in rows:
+
+            start_index = row[first]
+            if last is not None:
+                last_index = row[last]
+                if last_index is None:
+                    # Event has no end
+                    end_index = numperiods - 1
+                elif row[until] > start_index:
+                    # Event ends at or after the start of the period in
+                    # which it starts (but counts for that period anyway)
+                    end_index = max(last_index - 1, start_index)
+                else:
+                    # Event ends before the period in which it starts
+                    end_index = -1
+            else:
+                end_index = numperiods - 1
+
+            rkey = row[rows_field] if rows_field else None
+            ckey = row[cols_field] if cols_field else None
+            if rows_field:
+                rows_keys.add(rkey)
+            if cols_field:
+                cols_keys.add(ckey)
+
+            values = [row[aggregate] for aggregate in aggregates]
+
+            for i in range(start_index, min(end_index, numperiods - 1) + 1):
+                data = periods[i]
+                if data is None:
+                    data = periods[i] = (list(initial), {}, {}, {})
+                totals, rows_data, cols_data, matrix = data
+                merge(totals, values)
+                if rows_field:
+                    if rkey not in rows_data:
+                        rows_data[rkey] = list(initial)
+                    merge(rows_data[rkey], values)
+                if cols_field:
+                    if ckey not in cols_data:
+                        cols_data[ckey] = list(initial)
+                    merge(cols_data[ckey], values)
+                if rows_field and cols_field:
+                    key = (rkey, ckey)
+                    if key not in matrix:
+                        matrix[key] = list(initial)
+                    merge(matrix[key], values)
+
+        # Store the aggregates in the event frame
+        frame_periods = event_frame.periods
+        for i, data in enumerate(periods):
+            if data is None:
+                continue
+            start = starts[i]
+            period = S3TimeSeriesPeriod(start, end=ends[i])
+            period.set_aggregates(*data)
+            frame_periods[start] = period
+
+        event_frame.empty = False
+
     # -------------------------------------------------------------------------
     def resolve_timestamp(self, event_start, event_end):
         """
@@ -1443,6 +1708,351 @@ class S3TimeSeriesEvent:
             result = this < that
         return result
 
+# =============================================================================
+class S3TimeSeriesEventStore:
+    """
+        Compact, array-backed store for the events of a time series,
+        as alternative to S3TimeSeriesEvent instances:
+
+            - event start/end as integer ordinals (microseconds since epoch)
+            - fact values as one list per column
+            - grouping keys as indexes of interned key sets
+
+        Period membership is computed by a sweep over the periods of an
+        event frame rather than by adding the events to each period.
+    """
+
+    #: Ordinals for no start/end date
+    NO_START = -(2**63)
+    NO_END = 2**63 - 1
+
+    EPOCH = tp_datetime(1970, 1, 1)
+
+    def __init__(self, columns=None):
+        """
+            Constructor
+
+            @param columns: the names of the fact columns to store
+        """
+
+        self.event_ids = []
+
+        self.starts = array("q")
+        self.ends = array("q")
+
+        self.values = dict((colname, []) for colname in (columns or ()))
+
+        # Interned sets of axis keys
+        self.key_sets = []
+        self._key_set_index = {}
+
+        self.rows = array("l")
+        self.cols = array("l")
+
+    # -------------------------------------------------------------------------
+    def __len__(self):
+
+        return len(self.event_ids)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def ordinal(cls, dt):
+        """
+            Convert a datetime into an integer ordinal
+
+            @param dt: the datetime
+        """
+
+        delta = tp_tzsafe(dt) - cls.EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def from_ordinal(cls, ordinal):
+        """
+            Convert an integer ordinal back into a datetime
+
+            @param ordinal: the ordinal
+        """
+
+        if ordinal == cls.NO_START or ordinal == cls.NO_END:
+            return None
+        return cls.EPOCH + datetime.timedelta(microseconds=ordinal)
+
+    # -------------------------------------------------------------------------
+    def intern(self, value):
+        """
+            Get the index of the interned set of series keys for a value
+
+            @param value: the field value
+        """
+
+        keys = frozenset(S3TimeSeriesEvent.series(value))
+
+        index = self._key_set_index.get(keys)
+        if index is None:
+            index = self._key_set_index[keys] = len(self.key_sets)
+            self.key_sets.append(keys)
+        return index
+
+    # -------------------------------------------------------------------------
+    def add(self,
+            event_id,
+            start = None,
+            end = None,
+            values = None,
+            row = DEFAULT,
+            col = DEFAULT,
+            ):
+        """
+            Add an event to this store
+
+            @param event_id: a unique identifier for the event (e.g. record ID)
+            @param start: start time of the event (datetime.datetime)
+            @param end: end time of the event (datetime.datetime)
+            @param values: a dict of key-value pairs with the attribute
+                           values for the event
+            @param row: the series row for this event
+            @param col: the series column for this event
+        """
+
+        self.event_ids.append(event_id)
+
+        self.starts.append(self.ordinal(start) if start else self.NO_START)
+        self.ends.append(self.ordinal(end) if end else self.NO_END)
+
+        if not values:
+            values = {}
+        for colname, column in self.values.items():
+            column.append(values.get(colname))
+
+        self.rows.append(self.intern(row))
+        self.cols.append(self.intern(col))
+
+    # -------------------------------------------------------------------------
+    @property
+    def rows_keys(self):
+        """ The set of all row axis keys of the events """
+
+        return self._keys(self.rows)
+
+    # -------------------------------------------------------------------------
+    @property
+    def cols_keys(self):
+        """ The set of all column axis keys of the events """
+
+        return self._keys(self.cols)
+
+    # -------------------------------------------------------------------------
+    def _keys(self, indexes):
+        """
+            Get all axis keys for an array of key set indexes
+
+            @param indexes: the array of key set indexes
+        """
+
+        key_sets = self.key_sets
+
+        keys = set()
+        for index in set(indexes):
+            keys |= key_sets[index]
+        return keys
+
+    # -------------------------------------------------------------------------
+    def aggregate(self, event_frame, facts):
+        """
+            Aggregate the events per period of an event frame, and store
+            the results in the periods
+
+            @param event_frame: the S3TimeSeriesEventFrame
+            @param facts: list of facts to aggregate
+        """
+
+        if not len(self):
+            return
+
+        # The periods and their boundaries
+        periods = []
+        starts = []
+        ends = []
+        ordinal = self.ordinal
+        for period in event_frame:
+            periods.append(period)
+            starts.append(ordinal(period.start))
+            ends.append(ordinal(period.end))
+        numperiods = len(periods)
+        if not numperiods:
+            return
+
+        # For every event, determine the first period when it is
+        # current (=the period in which it starts, or the first period
+        # of the frame), and when it becomes a previous event (=after
+        # the last period which starts before it ends)
+        current = [[] for _ in range(numperiods)]
+        previous = [[] for _ in range(numperiods)]
+
+        NO_END = self.NO_END
+        event_ends = self.ends
+        for i, start in enumerate(self.starts):
+
+            first = bisect_right(ends, start)
+            if first >= numperiods:
+                # Event starts after the event frame
+                continue
+
+            end = event_ends[i]
+            if end == NO_END:
+                # Event doesn't end
+                current[first].append(i)
+            elif bisect_right(starts, end) > first:
+                # Event ends at or after the start of the period in
+                # which it starts (and counts for that period anyway)
+                current[first].append(i)
+                last = max(bisect_left(starts, end) - 1, first)
+                if last + 1 < numperiods:
+                    previous[last + 1].append(i)
+            else:
+                # Event ends before the period in which it starts
+                previous[first].append(i)
+
+        cumulative = any(fact.method == "cumulate" for fact in facts)
+
+        # Sweep over the periods
+        current_events = set()
+        previous_events = set()
+        frame_periods = event_frame.periods
+        for index, period in enumerate(periods):
+
+            current_events.update(current[index])
+            for i in previous[index]:
+                current_events.discard(i)
+                previous_events.add(i)
+
+            period.set_aggregates(*self._aggregate(period,
+                                                   facts,
+                                                   current_events,
+                                                   previous_events if cumulative else None,
+                                                   ))
+            frame_periods[period.start] = period
+
+        event_frame.empty = False
+
+    # -------------------------------------------------------------------------
+    def _aggregate(self, period, facts, current_events, previous_events=None):
+        """
+            Group and aggregate the events in a period
+
+            @param period: the S3TimeSeriesPeriod
+            @param facts: list of facts to aggregate
+            @param current_events: indexes of the current events
+            @param previous_events: indexes of the previous events, if
+                                    required for cumulative facts
+
+            @returns: tuple (totals, rows, cols, matrix), see
+                      S3TimeSeriesPeriod.set_aggregates
+        """
+
+        key_sets = self.key_sets
+        event_rows = self.rows
+        event_cols = self.cols
+
+        # Group the events by their key sets
+        event_sets = [current_events]
+        if previous_events is not None:
+            event_sets.append(previous_events)
+        groups = {}
+        for index, events in enumerate(event_sets):
+            for i in events:
+                key = (event_rows[i], event_cols[i])
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = ([], [])
+                group[index].append(i)
+
+        # Collect the events per axis key
+        rows = {}
+        cols = {}
+        matrix = {}
+        def add(target, key, group):
+            item = target.get(key)
+            if item is None:
+                item = target[key] = ([], [])
+            item[0].extend(group[0])
+            item[1].extend(group[1])
+        for (row, col), group in groups.items():
+            row_keys = key_sets[row]
+            col_keys = key_sets[col]
+            for key in row_keys:
+                add(rows, key, group)
+            for key in col_keys:
+                add(cols, key, group)
+            for key in product(row_keys, col_keys):
+                add(matrix, key, group)
+
+        all_events = (list(current_events), list(previous_events or ()))
+
+        results = ({}, {}, {})
+        totals = []
+        for fact in facts:
+
+            if fact.method == "cumulate":
+                select = lambda item: item[0] + item[1]
+            else:
+                select = lambda item: item[0]
+
+            items = lambda indexes: self._items(fact, indexes)
+            aggregate = fact.aggregate_items
+
+            for source, result in zip((rows, cols, matrix), results):
+                for key, item in source.items():
+                    value = aggregate(period, items(select(item)))
+                    if key in result:
+                        result[key].append(value)
+                    else:
+                        result[key] = [value]
+
+            totals.append(aggregate(period, items(select(all_events))))
+
+        return (totals,) + results
+
+    # -------------------------------------------------------------------------
+    def _items(self, fact, indexes):
+        """
+            Generate the event data for fact aggregation
+
+            @param fact: the S3TimeSeriesFact
+            @param indexes: the indexes of the events
+
+            @returns: generator of tuples (start, end, base_value, slope_value),
+                      see S3TimeSeriesFact.aggregate_items
+        """
+
+        values = self.values
+
+        base = fact.base_column
+        base_values = values.get(base) if base else None
+
+        if fact.method == "cumulate":
+            slope = fact.slope_column
+            slope_values = values.get(slope) if slope else None
+
+            to_datetime = self.from_ordinal
+            starts = self.starts
+            ends = self.ends
+            for i in indexes:
+                yield (to_datetime(starts[i]),
+                       to_datetime(ends[i]),
+                       base_values[i] if base_values else None,
+                       slope_values[i] if slope_values else None,
+                       )
+        else:
+            for i in indexes:
+                yield (None,
+                       None,
+                       base_values[i] if base_values else None,
+                       None,
+                       )
+
 # =============================================================================
 class S3TimeSeriesFact:
     """ Class representing a fact layer """
@@ -1493,6 +2103,27 @@ class S3TimeSeriesFact:
             @param events: the events
         """
 
+        base = self.base_column
+        slope = self.slope_column if self.method == "cumulate" else None
+
+        items = ((event.start,
+                  event.end,
+                  event[base] if base else None,
+                  event[slope] if slope else None,
+                  ) for event in events)
+
+        return self.aggregate_items(period, items)
+
+    # -------------------------------------------------------------------------
+    def aggregate_items(self, period, items):
+        """
+            Aggregate values from event data
+
+            @param period: the period
+            @param items: iterable of tuples (start, end, base_value, slope_value)
+                          with the event data
+        """
+
         values = []
         append = values.append
 
@@ -1502,23 +2133,13 @@ class S3TimeSeriesFact:
         if method == "cumulate":
 
             slope = self.slope_column
-            duration = period.duration
+            duration = period.interval_count
 
-            for event in events:
+            for start, end, base_value, slope_value in items:
 
-                if event.start == None:
+                if start == None:
                     continue
 
-                if base:
-                    base_value = event[base]
-                else:
-                    base_value = None
-
-                if slope:
-                    slope_value = event[slope]
-                else:
-                    slope_value = None
-
                 if base_value is None:
                     if not slope or slope_value is None:
                         continue
@@ -1543,7 +2164,7 @@ class S3TimeSeriesFact:
 
                 interval = self.interval
                 if slope_value and interval:
-                    event_duration = duration(event, interval)
+                    event_duration = duration(start, end, interval)
                 else:
                     event_duration = 1
 
@@ -1553,8 +2174,8 @@ class S3TimeSeriesFact:
 
         elif base:
 
-            for event in events:
-                value = event[base]
+            for item in items:
+                value = item[2]
                 if value is None:
                     continue
                 elif type(value) is list:
@@ -1854,6 +2475,9 @@ class S3TimeSeriesPeriod:
         self.pevents = {}
         self.cevents = {}
 
+        # Aggregates computed by the database
+        self.preaggregated = False
+
         self._reset()
 
     # -------------------------------------------------------------------------
@@ -1875,6 +2499,28 @@ class S3TimeSeriesPeriod:
         self.cols = None
         self.totals = None
 
+    # -------------------------------------------------------------------------
+    def set_aggregates(self, totals, rows, cols, matrix):
+        """
+            Set the aggregated values for this period when they have been
+            computed elsewhere (i.e. by the database), rather than from
+            events added to this period
+
+            @param totals: the totals, a list with one value per fact
+            @param rows: the row totals, a dict {row: [value, ...]}
+            @param cols: the column totals, a dict {col: [value, ...]}
+            @param matrix: the cell values, a dict {(row, col): [value, ...]}
+        """
+
+        self._reset()
+
+        self.totals = totals
+        self.rows = rows
+        self.cols = cols
+        self.matrix = matrix
+
+        self.preaggregated = True
+
     # -------------------------------------------------------------------------
     def add_current(self, event):
         """
@@ -1989,6 +2635,9 @@ class S3TimeSeriesPeriod:
             @param facts: list of facts to aggregate
         """
 
+        if self.preaggregated:
+            return self.totals
+
         # Reset
         self._reset()
 
@@ -2070,14 +2719,27 @@ class S3TimeSeriesPeriod:
             @param interval: the interval expression (string)
         """
 
-        if event.end is None or event.end > self.end:
+        return self.interval_count(event.start, event.end, interval)
+
+    # -------------------------------------------------------------------------
+    def interval_count(self, start, end, interval):
+        """
+            Compute the total duration of an event before the end of
+            this period, in number of interval
+
+            @param start: the start of the event (datetime)
+            @param end: the end of the event (datetime)
+            @param interval: the interval expression (string)
+        """
+
+        if end is None or end > self.end:
             end_date = self.end
         else:
-            end_date = event.end
-        if event.start is None or event.start >= end_date:
+            end_date = end
+        if start is None or start >= end_date:
             result = 0
         else:
-            rule = self.get_rule(event.start, end_date, interval)
+            rule = self.get_rule(start, end_date, interval)
             if rule:
                 result = rule.count()
             else:
@@ -2204,7 +2866,8 @@ class S3TimeSeriesEventFrame:
                     break
 
             # Find all current events
-            for index, event in enumerate(events):
+            index = 0
+            for event in events:
                 if event.end and event.end < start:
                     # Event ended before this period
                     previous_events[event.event_id] = event
@@ -2214,6 +2877,7 @@ class S3TimeSeriesEventFrame:
                 else:
                     # Event starts only after this period
                     break
+                index += 1
 
             # Add current events to current period
             period = periods.get(start)
@@ -2226,11 +2890,9 @@ class S3TimeSeriesEventFrame:
 
             empty = False
 
-            # Remaining events
+            # Remaining events (current and previous events must still
+            # be added to all subsequent periods)
             events = events[index:]
-            if not events:
-                # No more events
-                break
 
             # Remove events which end during this period
             remaining = {}
@@ -820,6 +820,9 @@ class IS_ONE_OF_EMPTY(Validator):
         self.updateable = updateable
         self.instance_types = instance_types
 
+        # Keys checked in bulk, {filter: (checked, valid)}
+        self.prevalidated = None
+
     # -------------------------------------------------------------------------
     def set_self_id(self, record_id):
         """
@@ -1111,23 +1114,17 @@ class IS_ONE_OF_EMPTY(Validator):
         return query, left
 
     # -------------------------------------------------------------------------
-    # Removed as we don't want any options downloaded unnecessarily
-    #def options(self):
-
-    # -------------------------------------------------------------------------
-    def validate(self, value, record_id=None):
+    def validation_query(self, table):
         """
-            Validator
+            Get the queries to check whether a key is valid (other than
+            query(), this does not include the accessible-query)
 
-            @param value: the input value
-            @param record_id: the current record ID
+            @param table: the lookup table
 
-            @returns: the value
+            @returns: tuple (deleted_q, filter_opts_q), each a Query
+                      or False if not applicable
         """
 
-        dbset = self.dbset
-        table = dbset._db[self.ktable]
-
         # Deleted-query
         deleted_q = (table["deleted"] == False) if ("deleted" in table) else False
 
@@ -1146,6 +1143,157 @@ class IS_ONE_OF_EMPTY(Validator):
                 else:
                     filter_opts_q = (table[filterby].belongs(filter_opts))
 
+        return deleted_q, filter_opts_q
+
+    # -------------------------------------------------------------------------
+    def prevalidate(self, values, chunk_size=500):
+        """
+            Check a number of keys in bulk (e.g. all keys in an import
+            job), so that validate() can look them up instead of running
+            one query per value
+
+            @param values: iterable of key values
+            @param chunk_size: maximum number of keys per query
+
+            @note: only integer keys are checked, other keys will still
+                   be validated individually
+            @note: the results are valid only for the current filter
+                   (see set_filter), and must be discarded with
+                   clear_prevalidated() when no longer needed as they
+                   do not reflect subsequent database changes
+        """
+
+        dbset = self.dbset
+        table = dbset._db[self.ktable]
+        field = table[self.kfield]
+
+        keys = set()
+        for value in values:
+            key = self.prevalidation_key(field, value)
+            if key is not None:
+                keys.add(key)
+        if not keys:
+            return
+
+        prevalidated = self.prevalidated
+        if prevalidated is None:
+            prevalidated = self.prevalidated = {}
+        signature = self.filter_signature()
+        if signature in prevalidated:
+            checked, valid = prevalidated[signature]
+        else:
+            checked, valid = prevalidated[signature] = (set(), set())
+
+        missing = list(keys - checked)
+        if not missing:
+            return
+
+        deleted_q, filter_opts_q = self.validation_query(table)
+        for i in range(0, len(missing), chunk_size):
+            chunk = missing[i:i + chunk_size]
+            query = field.belongs([int(key) for key in chunk])
+            if filter_opts_q is not False:
+                query &= filter_opts_q
+            if deleted_q is not False:
+                query &= deleted_q
+            rows = dbset(query).select(field, distinct=True)
+            valid.update(str(row[field]) for row in rows)
+            checked.update(chunk)
+
+    # -------------------------------------------------------------------------
+    def count_prevalidated(self, table, values):
+        """
+            Count the valid records for keys which have been checked
+            in bulk before, counterpart for dbset(query).count()
+
+            @param table: the lookup table
+            @param values: the key values
+
+            @returns: the number of valid records matching the values,
+                      or None if not all values have been prevalidated
+        """
+
+        prevalidated = self.prevalidated
+        if not prevalidated or not values:
+            return None
+
+        entry = prevalidated.get(self.filter_signature())
+        if not entry:
+            return None
+        checked, valid = entry
+
+        field = table[self.kfield]
+        keys = set()
+        for value in values:
+            key = self.prevalidation_key(field, value)
+            if key is None or key not in checked:
+                return None
+            keys.add(key)
+
+        return len(keys & valid)
+
+    # -------------------------------------------------------------------------
+    def clear_prevalidated(self):
+        """
+            Discard the results of prevalidate()
+        """
+
+        self.prevalidated = None
+
+    # -------------------------------------------------------------------------
+    def filter_signature(self):
+        """
+            Get a hashable signature of the current filter for
+            bulk-validated keys
+
+            @returns: tuple
+        """
+
+        return (self.filterby, str(self.filter_opts))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def prevalidation_key(field, value):
+        """
+            Get the key of a value for bulk validation
+
+            @param field: the key Field
+            @param value: the value
+
+            @returns: the key as string, or None if the value cannot
+                      be prevalidated
+        """
+
+        ftype = str(field.type)
+        if ftype not in ("id", "integer") and ftype[:9] != "reference":
+            return None
+        if isinstance(value, (bool, float)):
+            return None
+        try:
+            return str(int(value))
+        except (ValueError, TypeError):
+            return None
+
+    # -------------------------------------------------------------------------
+    # Removed as we don't want any options downloaded unnecessarily
+    #def options(self):
+
+    # -------------------------------------------------------------------------
+    def validate(self, value, record_id=None):
+        """
+            Validator
+
+            @param value: the input value
+            @param record_id: the current record ID
+
+            @returns: the value
+        """
+
+        dbset = self.dbset
+        table = dbset._db[self.ktable]
+
+        deleted_q, filter_opts_q = self.validation_query(table)
+
         if self.multiple:
             # Multiple values
             if isinstance(value, list):
@@ -1179,7 +1327,10 @@ class IS_ONE_OF_EMPTY(Validator):
                 if deleted_q != False:
                     query = (deleted_q & (query)) \
                             if query is not None else deleted_q
-                if dbset(query).count() == len(values):
+                count = self.count_prevalidated(table, values)
+                if count is None:
+                    count = dbset(query).count()
+                if count == len(values):
                     return values
 
         elif self.theset:
@@ -1197,7 +1348,10 @@ class IS_ONE_OF_EMPTY(Validator):
                 query &= filter_opts_q
             if deleted_q is not False:
                 query &= deleted_q
-            if dbset(query).count():
+            count = self.count_prevalidated(table, [value])
+            if count is None:
+                count = dbset(query).count()
+            if count:
                 if self._and:
                     return validator_caller(self._and, value, record_id)
                 else:
@@ -36,6 +36,7 @@ import json
 import os
 import re
 import sys
+import threading
 
 from urllib import parse as urlparse
 from urllib.request import urlopen
@@ -62,6 +63,7 @@ __all__ = ("SEPARATORS", # Consistency & RAD
            "S3XML",
            #"S3EntityResolver",
            "S3XMLFormat",
+           "S3XSLTCache",
            )
 
 # =============================================================================
@@ -266,7 +268,11 @@ class S3XML(S3Codec):
         else:
             _args = None
 
-        if isinstance(stylesheet_path, (etree._ElementTree, etree._Element)):
+        cached = S3XSLTCache.cacheable(stylesheet_path)
+        if cached:
+            # Parsed and compiled by the cache
+            stylesheet = stylesheet_path
+        elif isinstance(stylesheet_path, (etree._ElementTree, etree._Element)):
             # Pre-parsed stylesheet
             stylesheet = stylesheet_path
         else:
@@ -274,8 +280,16 @@ class S3XML(S3Codec):
 
         if stylesheet is not None:
             try:
-                ac = etree.XSLTAccessControl(read_file=True, read_network=True)
-                transformer = etree.XSLT(stylesheet, access_control=ac)
+                if cached:
+                    transformer = S3XSLTCache.transformer(stylesheet,
+                                                          parse = self.parse,
+                                                          )
+                    if transformer is None:
+                        # Error parsing the XSL stylesheet
+                        return None
+                else:
+                    ac = etree.XSLTAccessControl(read_file=True, read_network=True)
+                    transformer = etree.XSLT(stylesheet, access_control=ac)
                 if _args:
                     result = transformer(tree, **_args)
                 else:
@@ -2762,6 +2776,54 @@ class S3XML(S3Codec):
             @todo: add a character encoding parameter to skip the guessing
         """
 
+        tree = None
+        for _, tree in cls.csv2trees(source,
+                                     resourcename = resourcename,
+                                     extra_data = extra_data,
+                                     hashtags = hashtags,
+                                     delimiter = delimiter,
+                                     quotechar = quotechar,
+                                     ):
+            pass
+
+        # Use this to debug the source tree if needed:
+        #if source.name[-16:] == "organisation.csv":
+        #sys.stderr.write(cls.tostring(tree, pretty_print=True).decode("utf-8"))
+
+        return tree
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def csv2trees(cls, source,
+                  resourcename = None,
+                  extra_data = None,
+                  hashtags = None,
+                  delimiter = ",",
+                  quotechar = '"',
+                  chunk_size = None,
+                  skip = 0,
+                  ):
+        """
+            Convert a table-form CSV source into a sequence of element trees
+            with at most chunk_size rows each (see csv2tree), to process
+            large sources incrementally
+
+            @param source: the source (file-like object)
+            @param resourcename: the resource name
+            @param extra_data: dict of extra cols {key:value} to add to each row
+            @param hashtags: dict of hashtags for extra cols {key:hashtag}
+            @param delimiter: delimiter for values
+            @param quotechar: quotation character
+            @param chunk_size: the maximum number of rows per tree, None
+                               to convert all rows into a single tree
+            @param skip: number of (non-empty) data rows to skip at the
+                         start of the source, e.g. to resume an import
+
+            @return: a generator of tuples (position, tree), where position
+                     is the number of data rows read from the source up to
+                     and including the rows in the tree
+        """
+
         import csv
 
         # Increase field size to be able to import WKTs
@@ -2773,11 +2835,14 @@ class S3XML(S3Codec):
         HASHTAG = ATTRIBUTE.hashtag
         TAG = cls.TAG
         COL = TAG.col
+        ROW = TAG.row
         SubElement = etree.SubElement
 
-        root = etree.Element(TAG.table)
-        if resourcename is not None:
-            root.set(ATTRIBUTE.name, resourcename)
+        def new_root():
+            root = etree.Element(TAG.table)
+            if resourcename is not None:
+                root.set(ATTRIBUTE.name, resourcename)
+            return root
 
         def add_col(row, key, value, hashtags=None):
             col = SubElement(row, COL)
@@ -2828,10 +2893,10 @@ class S3XML(S3Codec):
         hashtags = dict(hashtags) if hashtags else {}
 
         def read_from_csv(source):
+            """ Generator for the (non-empty) data rows in the source """
             try:
                 source = utf_8_encode(source)
                 reader = csv.DictReader(source, delimiter=delimiter, quotechar=quotechar)
-                ROW = TAG.row
                 for i, r in enumerate(reader):
                     # Skip empty rows
                     if not any(r.values()):
@@ -2843,23 +2908,42 @@ class S3XML(S3Codec):
                         if all(v[0] == "#" for v in items.values()):
                             hashtags.update(items)
                             continue
-                    row = SubElement(root, ROW)
-                    for k in r:
-                        if k:
-                            add_col(row, k, r[k], hashtags=hashtags)
-                    if extra_data:
-                        for key in extra_data:
-                            if key not in r:
-                                add_col(row, key, extra_data[key], hashtags=hashtags)
+                    yield r
             except csv.Error:
                 e = sys.exc_info()[1]
                 raise HTTP(400, body=cls.json_message(False, 400, e))
 
-
+        def read_chunks(source, position):
+            """ Generator for the chunks, starting after position """
+            root = new_root()
+            size = 0
+            last = position
+            for index, r in enumerate(read_from_csv(source)):
+                if index < position:
+                    continue
+                row = SubElement(root, ROW)
+                for k in r:
+                    if k:
+                        add_col(row, k, r[k], hashtags=hashtags)
+                if extra_data:
+                    for key in extra_data:
+                        if key not in r:
+                            add_col(row, key, extra_data[key], hashtags=hashtags)
+                size += 1
+                last = index + 1
+                if chunk_size and size >= chunk_size:
+                    yield last, root
+                    root = new_root()
+                    size = 0
+            if size or not chunk_size:
+                yield last, root
+
+        position = skip
         from io import StringIO
         if not isinstance(source, StringIO):
             try:
-                read_from_csv(source)
+                for position, root in read_chunks(source, position):
+                    yield position, etree.ElementTree(root)
             except UnicodeDecodeError:
                 e = sys.exc_info()[1]
                 try:
@@ -2868,19 +2952,16 @@ class S3XML(S3Codec):
                     fname = fmode = None
                 if fname and fmode and "b" not in fmode:
                     # Perhaps a file opened in text mode with wrong encoding,
-                    # => try to reopen in binary mode
+                    # => try to reopen in binary mode, and continue after
+                    #    the last complete chunk
                     with open(fname, "rb") as bsource:
-                        read_from_csv(bsource)
+                        for position, root in read_chunks(bsource, position):
+                            yield position, etree.ElementTree(root)
                 else:
                     raise HTTP(400, body=cls.json_message(False, 400, e))
         else:
-            read_from_csv(source)
-
-        # Use this to debug the source tree if needed:
-        #if source.name[-16:] == "organisation.csv":
-        #sys.stderr.write(cls.tostring(root, pretty_print=True).decode("utf-8"))
-
-        return  etree.ElementTree(root)
+            for position, root in read_chunks(source, position):
+                yield position, etree.ElementTree(root)
 
 # =============================================================================
 class S3EntityResolver(etree.Resolver):
@@ -2961,7 +3042,13 @@ class S3XMLFormat(object):
             @param stylesheet: the stylesheet (pathname or stream)
         """
 
-        self.tree = current.xml.parse(stylesheet)
+        if S3XSLTCache.cacheable(stylesheet):
+            # Use the cached stylesheet
+            self.path = stylesheet
+            self.tree = S3XSLTCache.stylesheet(stylesheet)
+        else:
+            self.path = None
+            self.tree = current.xml.parse(stylesheet)
         if not self.tree:
             current.log.error("%s parse error: %s" %
                               (stylesheet, current.xml.error))
@@ -3072,6 +3159,223 @@ class S3XMLFormat(object):
             current.log.error("XMLFormat: no stylesheet available")
             return tree
 
-        return current.xml.transform(tree, self.tree, **args)
+        return current.xml.transform(tree, self.path or self.tree, **args)
+
+# =============================================================================
+class S3XSLTCache(object):
+    """
+        Process-wide cache for XSLT stylesheets, to avoid parsing and
+        compiling the same stylesheets for every transformation
+
+        - stylesheets are keyed by their absolute path, and parsed again
+          when the file or any of its includes/imports has been modified
+        - compiled stylesheets (etree.XSLT) are reused per thread, since
+          they must not be used by multiple threads at the same time
+    """
+
+    XSLT_NS = "http://www.w3.org/1999/XSL/Transform"
+
+    _lock = threading.Lock()
+    _local = threading.local()
+
+    #: The parsed stylesheets, {path: (signature, tree)}
+    stylesheets = {}
+
+    #: Cache statistics
+    stats = {"hits": 0, "misses": 0, "compiled": 0}
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def cacheable(cls, stylesheet):
+        """
+            Check whether a stylesheet can be cached, i.e. is a file
+
+            @param stylesheet: the stylesheet (pathname, stream or tree)
+        """
+
+        return isinstance(stylesheet, str) and os.path.isfile(stylesheet)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def stylesheet(cls, path, parse=None):
+        """
+            Get the parsed stylesheet
+
+            @param path: the pathname of the stylesheet
+            @param parse: the function to parse the stylesheet,
+                          defaults to current.xml.parse
+
+            @returns: the stylesheet (ElementTree), or None if it
+                      could not be parsed
+        """
+
+        entry = cls._entry(os.path.abspath(path), parse=parse)
+        return entry[1] if entry else None
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def transformer(cls, path, parse=None):
+        """
+            Get the compiled stylesheet for the current thread
+
+            @param path: the pathname of the stylesheet
+            @param parse: the function to parse the stylesheet,
+                          defaults to current.xml.parse
+
+            @returns: the transformer (etree.XSLT), or None if the
+                      stylesheet could not be parsed
+
+            @raises: etree.XSLTParseError if the stylesheet could
+                     not be compiled
+        """
+
+        path = os.path.abspath(path)
+
+        entry = cls._entry(path, parse=parse)
+        if not entry:
+            return None
+        signature, tree = entry
+
+        transformers = getattr(cls._local, "transformers", None)
+        if transformers is None:
+            transformers = cls._local.transformers = {}
+
+        item = transformers.get(path)
+        if item and item[0] is signature:
+            transformer = item[1]
+            stat = "hits"
+        else:
+            ac = etree.XSLTAccessControl(read_file=True, read_network=True)
+            transformer = etree.XSLT(tree, access_control=ac)
+            transformers[path] = (signature, transformer)
+            stat = "compiled"
+
+        with cls._lock:
+            cls.stats[stat] += 1
+
+        return transformer
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def statistics(cls):
+        """
+            Get the cache statistics
+
+            @returns: dict {"hits": number of reused compiled stylesheets,
+                            "misses": number of parsed stylesheets,
+                            "compiled": number of compiled stylesheets,
+                            "ratio": hit ratio,
+                            "stylesheets": number of cached stylesheets,
+                            }
+        """
+
+        with cls._lock:
+            stats = dict(cls.stats)
+            stats["stylesheets"] = len(cls.stylesheets)
+
+        lookups = stats["hits"] + stats["compiled"]
+        stats["ratio"] = float(stats["hits"]) / lookups if lookups else None
+
+        return stats
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def clear(cls):
+        """ Remove all stylesheets from the cache """
+
+        with cls._lock:
+            cls.stylesheets.clear()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _entry(cls, path, parse=None):
+        """
+            Get the cache entry for a stylesheet, parse the stylesheet
+            if it isn't cached yet or has been modified
+
+            @param path: the absolute pathname of the stylesheet
+            @param parse: the function to parse the stylesheet
+
+            @returns: tuple (signature, tree), or None if the stylesheet
+                      could not be parsed
+        """
+
+        entry = cls.stylesheets.get(path)
+        if entry and cls._valid(entry[0]):
+            return entry
+
+        if parse is None:
+            parse = current.xml.parse
+        tree = parse(path)
+        if tree is None:
+            return None
+
+        entry = (cls._signature(path, tree), tree)
+        with cls._lock:
+            cls.stylesheets[path] = entry
+            cls.stats["misses"] += 1
+
+        return entry
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def _signature(cls, path, tree):
+        """
+            Get the modification times of a stylesheet and all its
+            includes/imports
+
+            @param path: the absolute pathname of the stylesheet
+            @param tree: the parsed stylesheet
+
+            @returns: tuple of tuples (pathname, mtime)
+        """
+
+        tags = ("{%s}include" % cls.XSLT_NS, "{%s}import" % cls.XSLT_NS)
+
+        signature = []
+        seen = set()
+
+        def add(path, tree=None):
+
+            if path in seen:
+                return
+            seen.add(path)
+
+            try:
+                signature.append((path, os.path.getmtime(path)))
+                if tree is None:
+                    tree = etree.parse(path)
+            except (OSError, etree.XMLSyntaxError):
+                return
+
+            directory = os.path.dirname(path)
+            for element in tree.getroot().iterchildren(*tags):
+                href = element.get("href")
+                if not href or "://" in href:
+                    continue
+                add(os.path.abspath(os.path.join(directory, href)))
+
+        add(path, tree)
+
+        return tuple(signature)
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _valid(signature):
+        """
+            Check whether none of the files in a signature has been
+            modified since the signature has been created
+
+            @param signature: the signature (see _signature)
+        """
+
+        getmtime = os.path.getmtime
+        try:
+            for path, mtime in signature:
+                if getmtime(path) != mtime:
+                    return False
+        except OSError:
+            return False
+        return True
 
 # End =========================================================================
@@ -178,6 +178,7 @@ class S3SyncAdapter(S3SyncBaseAdapter):
              msince=None,
              filters=None,
              mixed=False,
+             page=None,
              pretty_print=False):
         """
             Respond to an incoming pull from a peer repository
@@ -188,6 +189,7 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             @param msince: minimum modification date/time for records to send
             @param filters: URL filters for record extraction
             @param mixed: negotiate resource with peer (disregard resource)
+            @param page: tuple (page_size, cursor) to send records page-wise
             @param pretty_print: make the output human-readable
         """
 
@@ -30,8 +30,11 @@
 import datetime
 import json
 import sys
+import time
 import traceback
 
+from io import BytesIO
+
 try:
     from lxml import etree
 except ImportError:
@@ -44,6 +47,7 @@ from urllib.parse import quote as urllib_quote
 from gluon import current
 
 from ..s3datetime import s3_encode_iso_datetime
+from ..s3query import FS
 from ..s3sync import S3SyncBaseAdapter, S3SyncDataArchive
 from ..s3validators import JSONERRORS
 
@@ -53,6 +57,19 @@ class S3SyncAdapter(S3SyncBaseAdapter):
         Sahana Eden Synchronization Adapter (default sync adapter)
     """
 
+    # -------------------------------------------------------------------------
+    def __init__(self, repository):
+        """
+            Constructor
+
+            @param repository: the repository (S3Repository instance)
+        """
+
+        super(S3SyncAdapter, self).__init__(repository)
+
+        # Prefetched pull responses {task_id: (url, future)}
+        self.prefetched = {}
+
     # -------------------------------------------------------------------------
     def register(self):
         """
@@ -175,9 +192,10 @@ class S3SyncAdapter(S3SyncBaseAdapter):
         debug = current.log.debug
 
         repository = self.repository
-        config = repository.config
         log = repository.log
 
+        start = time.time()
+
         # Verify that the target resource exists
         resource_name = task.resource_name
         try:
@@ -213,108 +231,115 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                     use_archived = True
 
         if response is None:
-
             debug("S3Sync: pull %s from %s" % (resource_name, repository.url))
+            url = self._pull_url(task)
+        else:
+            url = None
 
-            # Construct the URL
-            url = "%s/sync/sync.xml?resource=%s&repository=%s" % \
-                  (repository.url, resource_name, config.uuid)
-            if last_pull and task.update_policy not in ("THIS", "OTHER"):
-                url += "&msince=%s" % s3_encode_iso_datetime(last_pull)
-            if task.components is False: # Allow None to remain the old default of 'Include Components'
-                url += "&mcomponents=None"
-            url += "&include_deleted=True"
-
-            # Add sync filters to URL
-            filters = current.sync.get_filters(task.id)
-            for tablename in filters:
-                prefix = "~" if not tablename or tablename == resource_name \
-                                else tablename
-                for k, v in filters[tablename].items():
-                    vlist = v if type(v) is list else [v]
-                    for value in vlist:
-                        urlfilter = "[%s]%s=%s" % (prefix, k, urllib_quote(value))
-                        url += "&%s" % urlfilter
-
-            debug("...pull from URL %s" % url)
+        # Get import strategy and update policy
+        strategy = task.strategy
+        update_policy = task.update_policy
+        conflict_policy = task.conflict_policy
 
-            # Execute the request
-            remote = False
-            action = "fetch"
-            response = None
-            output = None
+        if onconflict:
+            onconflict_callback = lambda item: onconflict(item,
+                                                          repository,
+                                                          resource,
+                                                          )
+        else:
+            onconflict_callback = None
 
-            opener = self._http_opener(url)
-            try:
-                f = opener.open(url)
+        mtime = None
+        count = 0
+        message = ""
+        cursor = None
 
-            except HTTPError as e:
-                result = log.ERROR
-                remote = True # Peer error
-                code = e.code
-                message = e.read()
-                try:
-                    # Sahana-Eden would send a JSON message,
-                    # try to extract the actual error message:
-                    message_json = json.loads(message)
-                except JSONERRORS:
-                    pass
-                else:
-                    message = message_json.get("message", message)
-                # Prefix as peer error and strip XML markup from the message
-                # @todo: better method to do this?
-                message = "<message>%s</message>" % message
-                try:
-                    markup = etree.XML(message)
-                    message = markup.xpath(".//text()")
-                    if message:
-                        message = " ".join(message)
-                    else:
-                        message = ""
-                except etree.XMLSyntaxError:
-                    pass
-                output = xml.json_message(False, code, message, tree=None)
+        while True:
 
-            except URLError as e:
-                # URL Error (network error)
-                result = log.ERROR
-                remote = True
-                message = "Peer repository unavailable (%s)" % e.reason
-                output = xml.json_message(False, 400, message)
+            if response is None:
 
-            except:
-                result = log.FATAL
-                message = sys.exc_info()[1]
-                output = xml.json_message(False, 400, message)
+                page_url = url
+                if cursor:
+                    page_url += "&after=%s" % urllib_quote(cursor)
 
-            else:
-                result = log.SUCCESS
-                response = f
+                debug("...pull from URL %s" % page_url)
 
-        # Process the response
-        mtime = None
-        if response:
+                # Execute the request (unless prefetched)
+                remote = False
+                action = "fetch"
+                output = None
+
+                prefetched = self.prefetched.pop(task.id, None)
+                try:
+                    if prefetched and prefetched[0] == page_url:
+                        f = prefetched[1].result()
+                    else:
+                        opener = self._http_opener(page_url)
+                        f = opener.open(page_url)
+
+                except HTTPError as e:
+                    result = log.ERROR
+                    remote = True # Peer error
+                    code = e.code
+                    message = e.read()
+                    try:
+                        # Sahana-Eden would send a JSON message,
+                        # try to extract the actual error message:
+                        message_json = json.loads(message)
+                    except JSONERRORS:
+                        pass
+                    else:
+                        message = message_json.get("message", message)
+                    # Prefix as peer error and strip XML markup from the message
+                    # @todo: better method to do this?
+                    message = "<message>%s</message>" % message
+                    try:
+                        markup = etree.XML(message)
+                        message = markup.xpath(".//text()")
+                        if message:
+                            message = " ".join(message)
+                        else:
+                            message = ""
+                    except etree.XMLSyntaxError:
+                        pass
+                    output = xml.json_message(False, code, message, tree=None)
+
+                except URLError as e:
+                    # URL Error (network error)
+                    result = log.ERROR
+                    remote = True
+                    message = "Peer repository unavailable (%s)" % e.reason
+                    output = xml.json_message(False, 400, message)
+
+                except:
+                    result = log.FATAL
+                    message = sys.exc_info()[1]
+                    output = xml.json_message(False, 400, message)
+
+                else:
+                    response = f
 
-            # Get import strategy and update policy
-            strategy = task.strategy
-            update_policy = task.update_policy
-            conflict_policy = task.conflict_policy
+            if not response:
+                if result == log.SUCCESS:
+                    # No data received from peer
+                    result = log.ERROR
+                    remote = True
+                    message = "No data received from peer"
+                break
 
+            # Process the response
             success = True
-            message = ""
             action = "import"
+            next_cursor = None
 
             # Import the data
-            if onconflict:
-                onconflict_callback = lambda item: onconflict(item,
-                                                              repository,
-                                                              resource,
-                                                              )
-            else:
-                onconflict_callback = None
-            count = 0
             try:
-                success = resource.import_xml(response,
+                tree = xml.parse(response)
+                if tree is None:
+                    raise SyntaxError(xml.error or "Invalid source")
+                next_cursor = tree.getroot().get("next")
+
+                success = resource.import_xml(tree,
                                               ignore_errors = True,
                                               strategy = strategy,
                                               update_policy = update_policy,
@@ -345,7 +370,8 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             # Log all validation errors
             if resource.error_tree is not None:
                 result = log.WARNING
-                message = "%s" % resource.error
+                if not message:
+                    message = "%s" % resource.error
                 for element in resource.error_tree.findall("resource"):
                     for field in element.findall("data[@error]"):
                         error_msg = field.get("error", None)
@@ -365,23 +391,34 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                     message = "%s" % resource.error
                 output = xml.json_message(False, 400, message)
                 mtime = None
+                break
 
-            # ...or report success
-            elif not message:
-                if not count:
-                    message = "No data to import (already up-to-date)"
-                else:
-                    message = "Data imported successfully (%s records%%s)" % count
-                    if use_archived:
-                        message = message % ", from archive"
-                    else:
-                        message = message % ""
+            if result == log.FATAL or url is None:
+                break
 
-        elif result == log.SUCCESS:
-            # No data received from peer
-            result = log.ERROR
-            remote = True
-            message = "No data received from peer"
+            # Continue with the next page?
+            after = self._parse_cursor(next_cursor)
+            if not after or next_cursor == cursor:
+                break
+
+            # Commit this page, so that an interrupted pull can resume
+            # from here rather than starting over
+            task.update_record(last_pull=after[0])
+            current.db.commit()
+
+            cursor = next_cursor
+            response = None
+
+        # Report success
+        if result in (log.SUCCESS, log.WARNING) and not message:
+            if not count:
+                message = "No data to import (already up-to-date)"
+            else:
+                message = "Data imported successfully (%s records%%s)" % count
+                if use_archived:
+                    message = message % ", from archive"
+                else:
+                    message = message % ""
 
         # Log the operation
         log.write(repository_id = repository.id,
@@ -392,11 +429,104 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                   remote = remote,
                   result = result,
                   message = message,
+                  duration = time.time() - start,
                   )
 
         debug("S3Sync: pull %s: %s" % (result, message))
         return (output, mtime)
 
+    # -------------------------------------------------------------------------
+    def prefetch(self, tasks, executor):
+        """
+            Start fetching the first page of data for multiple sync tasks
+            concurrently, to be picked up by subsequent pull() calls
+
+            @param tasks: the sync tasks (sync_task Rows), in the order
+                          they will be pulled
+            @param executor: a concurrent.futures.Executor to run the
+                             requests
+        """
+
+        prefetched = self.prefetched
+
+        for task in tasks:
+
+            if task.mode not in (1, 3):
+                # Push-only task
+                continue
+            if not task.last_pull and task.dataset_id:
+                # Would probably be pulled from an archive
+                continue
+            if current.s3db.table(task.resource_name) is None:
+                # Undefined resource
+                continue
+
+            # Construct the URL and opener here, because both may
+            # require database access
+            url = self._pull_url(task)
+            opener = self._http_opener(url)
+
+            prefetched[task.id] = (url, executor.submit(self._fetch, opener, url))
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _fetch(opener, url):
+        """
+            Fetch data from the peer (runs in a worker thread, so must
+            not access current or the database)
+
+            @param opener: the HTTP opener
+            @param url: the URL
+
+            @returns: the response body as file-like object
+        """
+
+        f = opener.open(url)
+        return BytesIO(f.read())
+
+    # -------------------------------------------------------------------------
+    def _pull_url(self, task):
+        """
+            Construct the URL to pull data for a sync task
+
+            @param task: the sync task (sync_task Row)
+
+            @returns: the URL (for the first page)
+        """
+
+        repository = self.repository
+        config = repository.config
+
+        resource_name = task.resource_name
+        last_pull = task.last_pull
+
+        # Construct the URL
+        url = "%s/sync/sync.xml?resource=%s&repository=%s" % \
+              (repository.url, resource_name, config.uuid)
+        if last_pull and task.update_policy not in ("THIS", "OTHER"):
+            url += "&msince=%s" % s3_encode_iso_datetime(last_pull)
+        if task.components is False: # Allow None to remain the old default of 'Include Components'
+            url += "&mcomponents=None"
+        url += "&include_deleted=True"
+
+        # Add sync filters to URL
+        filters = current.sync.get_filters(task.id)
+        for tablename in filters:
+            prefix = "~" if not tablename or tablename == resource_name \
+                            else tablename
+            for k, v in filters[tablename].items():
+                vlist = v if type(v) is list else [v]
+                for value in vlist:
+                    urlfilter = "[%s]%s=%s" % (prefix, k, urllib_quote(value))
+                    url += "&%s" % urlfilter
+
+        # Pull page-wise (peers not supporting this send everything)
+        page_size = current.deployment_settings.get_sync_page_size()
+        if page_size:
+            url += "&page_size=%s" % page_size
+
+        return url
+
     # -------------------------------------------------------------------------
     def push(self, task):
         """
@@ -416,6 +546,8 @@ class S3SyncAdapter(S3SyncBaseAdapter):
         repository = self.repository
         config = repository.config
 
+        start = time.time()
+
         resource_name = task.resource_name
         debug("S3SyncRepository.push(%s, %s)" % (repository.url, resource_name))
 
@@ -516,6 +648,7 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                   remote = remote,
                   result = result,
                   message = message,
+                  duration = time.time() - start,
                   )
 
         if output is not None:
@@ -531,6 +664,7 @@ class S3SyncAdapter(S3SyncBaseAdapter):
              msince=None,
              filters=None,
              mixed=False,
+             page=None,
              pretty_print=False):
         """
             Respond to an incoming pull from the peer repository
@@ -541,6 +675,10 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             @param msince: minimum modification date/time for records to send
             @param filters: URL filters for record extraction
             @param mixed: negotiate resource with peer (disregard resource)
+            @param page: tuple (page_size, cursor) to send records page-wise,
+                         ordered by (modified_on, uuid); if the page is full,
+                         the cursor for the next page is returned in the
+                         "next" attribute of the root element
             @param pretty_print: make the output human-readable
 
             @return: a dict {status, remote, message, response}, with:
@@ -557,14 +695,47 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                     "response": current.xml.json_message(False, 400, msg),
                     }
 
-        # Export the data as S3XML
-        output = resource.export_xml(start = start,
-                                     limit = limit,
-                                     filters = filters,
-                                     msince = msince,
-                                     pretty_print = pretty_print,
-                                     )
-        count = resource.results
+        xml = current.xml
+        table = resource.table
+        MTIME, UID = xml.MTIME, xml.UID
+
+        if page and MTIME in table.fields and UID in table.fields:
+
+            # Paged export, ordered by (modified_on, uuid)
+            page_size, cursor = page
+            after = self._parse_cursor(cursor)
+            if after:
+                mtime, uid = after
+                resource.add_filter((FS(MTIME) > mtime) |
+                                    ((FS(MTIME) == mtime) & (FS(UID) > uid)))
+
+            orderby = "%s ASC, %s ASC" % (table[MTIME], table[UID])
+            tree = resource.export_xml(start = 0,
+                                       limit = page_size,
+                                       filters = filters,
+                                       msince = msince,
+                                       orderby = orderby,
+                                       as_tree = True,
+                                       )
+            rows = resource._rows
+            if rows and len(rows) == page_size:
+                # Page is full => there may be more, tell the peer where
+                # to continue
+                last = rows[-1]
+                tree.getroot().set("next", "%s|%s" % (last[MTIME].isoformat(),
+                                                      last[UID],
+                                                      ))
+            output = xml.tostring(tree, pretty_print=pretty_print)
+            count = len(rows) if rows else 0
+        else:
+            # Export the data as S3XML
+            output = resource.export_xml(start = start,
+                                         limit = limit,
+                                         filters = filters,
+                                         msince = msince,
+                                         pretty_print = pretty_print,
+                                         )
+            count = resource.results
         msg = "Data sent to peer (%s records)" % count
 
         # Update date/time of last incoming connection
@@ -581,6 +752,32 @@ class S3SyncAdapter(S3SyncBaseAdapter):
                 "response": output,
                 }
 
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def _parse_cursor(cursor):
+        """
+            Parse a continuation cursor for paged pull
+
+            @param cursor: the cursor as string "<modified_on>|<uuid>"
+
+            @returns: tuple (modified_on, uuid), or None if the cursor
+                      is missing or invalid
+        """
+
+        if not cursor or "|" not in cursor:
+            return None
+
+        mtime, uid = cursor.split("|", 1)
+        for fmt in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+            try:
+                mtime = datetime.datetime.strptime(mtime, fmt)
+            except ValueError:
+                continue
+            else:
+                return (mtime, uid)
+
+        return None
+
     # -------------------------------------------------------------------------
     def receive(self,
                 source,
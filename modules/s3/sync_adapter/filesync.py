@@ -358,6 +358,7 @@ class S3SyncAdapter(S3SyncBaseAdapter):
              msince=None,
              filters=None,
              mixed=False,
+             page=None,
              pretty_print=False):
         """
             Respond to an incoming pull from the peer repository
@@ -368,6 +369,7 @@ class S3SyncAdapter(S3SyncBaseAdapter):
             @param msince: minimum modification date/time for records to send
             @param filters: URL filters for record extraction
             @param mixed: negotiate resource with peer (disregard resource)
+            @param page: tuple (page_size, cursor) to send records page-wise
             @param pretty_print: make the output human-readable
 
             @return: a dict {status, remote, message, response}, with:
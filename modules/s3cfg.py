@@ -1013,6 +1013,13 @@ class S3Config(Storage):
 
     def get_security_archive_not_delete(self):
         return self.security.get("archive_not_delete", True)
+    def get_security_bulk_delete(self):
+        """
+            Delete records as sets rather than one by one (processing
+            the deletion cascade per referencing table), useful for
+            deletion of records with large numbers of dependencies
+        """
+        return self.security.get("bulk_delete", False)
     def get_security_audit_read(self):
         return self.security.get("audit_read", False)
     def get_security_audit_write(self):
@@ -1029,6 +1036,21 @@ class S3Config(Storage):
         return self.security.get("strict_ownership", True)
     def get_security_map(self):
         return self.security.get("map", False)
+    def get_security_acl_cache(self):
+        """
+            Cache permission rules across requests:
+            None = cache only for the duration of a request (default)
+            "ram" = cache in each process (cache.ram)
+            "disk" = cache shared by all processes on the host (cache.disk)
+            or any cache instance with the web2py cache API (e.g. RedisCache)
+
+            NB with "ram", changes of permission rules or role assignments
+               only take effect in other processes after acl_cache_expire
+        """
+        return self.security.get("acl_cache", None)
+    def get_security_acl_cache_expire(self):
+        " Maximum lifetime of ACLs in the shared cache (seconds) "
+        return self.security.get("acl_cache_expire", 300)
 
     # -------------------------------------------------------------------------
     # Base settings
@@ -1088,6 +1110,16 @@ class S3Config(Storage):
         """For demo sites, which additional options to add to the list """
         return self.base.get("prepopulate_demo", 0)
 
+    def get_base_import_chunk_size(self):
+        """
+            Number of CSV rows to import and commit at a time for
+            prepopulate and direct (non-interactive) CSV imports, so
+            that large sources can be imported with bounded memory and
+            interrupted imports can be resumed from the last chunk
+            - None to import each source as a whole (default)
+        """
+        return self.base.get("import_chunk_size")
+
     def get_base_guided_tour(self):
         """ Whether the guided tours are enabled """
         return self.base.get("guided_tour", self.has_module("tour"))
@@ -1112,6 +1144,38 @@ class S3Config(Storage):
       """
         return self.base.get("bigtable", False)
 
+    def get_base_stream_export(self):
+        """
+            Stream unpaginated CSV/JSON exports page by page, rather than
+            building the whole response in memory
+            - True to enable, or the page size (default 1000)
+        """
+        return self.base.get("stream_export", False)
+
+    def get_base_represent_cache(self):
+        """
+            Lookup tables for which representations of foreign keys shall
+            be cached across requests (in each process), e.g.
+            ("org_organisation", "gis_location")
+            - True to cache for all lookup tables, None to disable (default)
+            - S3RepresentCache.statistics() reports the hit rates per
+              representation method, to help choose tables
+        """
+        return self.base.get("represent_cache")
+
+    def get_base_represent_cache_size(self):
+        """
+            Maximum number of representations in the shared cache
+        """
+        return self.base.get("represent_cache_size", 10000)
+
+    def get_base_represent_cache_expire(self):
+        """
+            Maximum lifetime of representations in the shared cache (seconds)
+            - changes in other processes become visible after this time
+        """
+        return self.base.get("represent_cache_expire", 300)
+
     def get_base_cdn(self):
         """
             Should we use CDNs (Content Distribution Networks) to serve some common CSS/JS?
@@ -1279,6 +1343,30 @@ class S3Config(Storage):
             airegex = False
         return airegex
 
+    def get_database_text_index(self):
+        """
+            Full-text indexes for text search, a dict {tablename: [selectors]},
+            e.g. {"pr_person": ["first_name", "middle_name", "last_name"]}
+
+            - text filters covering all indexed selectors of a table are
+              run against the index (SQLite FTS5, or PostgreSQL tsvector
+              with GIN index) rather than with LIKE
+            - unlike LIKE, the index matches words and word prefixes only,
+              i.e. "smi" finds "John Smith" but "mith" does not
+            - the index is built by the s3_text_index_rebuild task, which is
+              scheduled when first needed (requires a scheduler worker); until
+              the build is complete, text filters fall back to LIKE
+            - records are re-indexed when written through forms or imports,
+              and so are records referencing them with an indexed joined
+              selector (one level); other changes (e.g. in components or in
+              records further down a join) require a rebuild
+
+            @note: SQLite and PostgreSQL only, ignored for other databases
+        """
+        if self.get_database_type() in ("sqlite", "postgres"):
+            return self.database.get("text_index")
+        return None
+
     # -------------------------------------------------------------------------
     # Finance settings
     def get_fin_currency_writable(self):
@@ -2228,6 +2316,28 @@ class S3Config(Storage):
 
         return self.ui.get("datatables_double_scroll", True)
 
+    def get_ui_datatables_keyset(self):
+        """
+            Use keyset pagination for data tables, i.e. continue from the
+            sort keys of the previous page when paging forward/backward
+            rather than counting off all preceding rows (random page jumps
+            still use offsets)
+        """
+
+        return self.ui.get("datatables_keyset", False)
+
+    def get_ui_datatables_approximate_count(self):
+        """
+            Use approximate numbers of records in data tables:
+            - True to use estimates from the database statistics for
+              large numbers of records (PostgreSQL only)
+            - a number of seconds to cache record counts
+            - with keyset pagination, the numbers of records are retained
+              while paging forward/backward
+        """
+
+        return self.ui.get("datatables_approximate_count", False)
+
     def get_ui_auto_open_update(self):
         """
             Render "Open" action buttons in datatables without explicit
@@ -2777,6 +2887,17 @@ class S3Config(Storage):
         """
         return self.msg.get("notify_check_subscriptions", False)
 
+    def get_msg_notify_batch(self):
+        """
+            Controller functions ("c/f") whose subscriptions can be
+            notified in batches within the scheduler worker, i.e. which
+            serve the subscribed table directly, and whose controller has
+            no prep (or other logic) filtering or altering the resource;
+            all other subscriptions are notified by loopback requests
+            to the subscribed URL
+        """
+        return self.msg.get("notify_batch", ())
+
     def get_msg_notify_subject(self):
         """
             Template for the subject line in update notifications.
@@ -2856,6 +2977,19 @@ class S3Config(Storage):
         """
         return self.search.get("max_results", 200)
 
+    def get_search_name_tokens(self):
+        """
+            Use a token index (s3_name_token) for the person, organisation
+            and site autocompletes, rather than LIKE on the name fields
+            - every word of the search string matches the beginning of
+              a word in any of the name fields, case- and accent-insensitive
+            - the index is built by the s3_name_tokens_rebuild task, which
+              is scheduled when first needed (requires a scheduler worker);
+              until the build is complete, autocompletes fall back to LIKE
+            - writes to the indexed tables update the index automatically
+        """
+        return self.search.get("name_tokens", False)
+
     def get_search_dates_auto_range(self):
         """
             Date filters to apply introspective range limits (by
@@ -2947,6 +3081,17 @@ class S3Config(Storage):
 
         return self.sync.get("data_repository", False)
 
+    def get_sync_page_size(self):
+        """
+            Maximum number of records to pull from an Eden peer per
+            request (page), 0 to pull all records in a single request
+                - each page is committed separately, so that an interrupted
+                  pull can resume from the last completed page
+                - peers which do not support paging send all records at once
+        """
+
+        return self.sync.get("page_size", 1000)
+
     # =========================================================================
     # Modules
 
@@ -4804,6 +4949,15 @@ class S3Config(Storage):
         """
         return self.inv.get("stock_cards", False)
 
+    def get_inv_stock_ledger(self):
+        """
+            Maintain a ledger of stock movements per item and day (from
+            shipments and adjustments), for faster stock movement reports
+                - existing data must be backfilled with the
+                  inv_stock_ledger_rebuild task after enabling this
+        """
+        return self.inv.get("stock_ledger", False)
+
     def get_inv_recv_tab_label(self):
         label = self.inv.get("recv_tab_label")
         if not label:
@@ -1147,28 +1147,39 @@ class HRModel(S3Model):
         # (default anyway on MySQL/SQLite, but not PostgreSQL)
         value = s3_str(value).lower()
 
-        if " " in value:
-            # Multiple words
-            # - check for match of first word against first_name
-            # - & second word against either middle_name or last_name
-            value1, value2 = value.split(" ", 1)
-            value2 = value2.strip()
-            query = ((FS("person_id$first_name").lower().like(value1 + "%")) & \
-                    ((FS("person_id$middle_name").lower().like(value2 + "%")) | \
-                     (FS("person_id$last_name").lower().like(value2 + "%"))))
-        else:
-            # Single word - check for match against any of the 3 names
-            value = value.strip()
-            query = ((FS("person_id$first_name").lower().like(value + "%")) | \
-                     (FS("person_id$middle_name").lower().like(value + "%")) | \
-                     (FS("person_id$last_name").lower().like(value + "%")))
+        query = None
+        if S3NameTokens.active():
+            # Every word must match the beginning of a word in any name field
+            query = S3NameTokens("pr_person").query(resource.table.person_id,
+                                                    value,
+                                                    ("first_name",
+                                                     "middle_name",
+                                                     "last_name",
+                                                     ),
+                                                    )
+        if query is None:
+            if " " in value:
+                # Multiple words
+                # - check for match of first word against first_name
+                # - & second word against either middle_name or last_name
+                value1, value2 = value.split(" ", 1)
+                value2 = value2.strip()
+                query = ((FS("person_id$first_name").lower().like(value1 + "%")) & \
+                        ((FS("person_id$middle_name").lower().like(value2 + "%")) | \
+                         (FS("person_id$last_name").lower().like(value2 + "%"))))
+            else:
+                # Single word - check for match against any of the 3 names
+                value = value.strip()
+                query = ((FS("person_id$first_name").lower().like(value + "%")) | \
+                         (FS("person_id$middle_name").lower().like(value + "%")) | \
+                         (FS("person_id$last_name").lower().like(value + "%")))
 
         resource.add_filter(query)
 
         settings = current.deployment_settings
         limit = int(_vars.limit or 0)
         MAX_SEARCH_RESULTS = settings.get_search_max_results()
-        if (not limit or limit > MAX_SEARCH_RESULTS) and resource.count() > MAX_SEARCH_RESULTS:
+        if (not limit or limit > MAX_SEARCH_RESULTS) and resource.count(limit=MAX_SEARCH_RESULTS + 1) > MAX_SEARCH_RESULTS:
             output = [
                 {"label": str(current.T("There are more than %(max)s results, please input more characters.") % \
                     {"max": MAX_SEARCH_RESULTS}),
@@ -45,6 +45,7 @@ __all__ = ("WarehouseModel",
            "InventoryRequisitionShipmentModel",
            "InventoryRequisitionTagModel",
            "InventoryStockCardModel",
+           "InventoryStockMovementModel",
            "InventoryTrackingModel",
            "inv_adj_close",
            "inv_adj_rheader",
@@ -96,6 +97,11 @@ __all__ = ("WarehouseModel",
            #"inv_send_rheader",
            #"inv_ship_status",
            #"inv_stock_card_update",
+           "inv_stock_ledger_check",
+           "inv_stock_ledger_rebuild",
+           #"inv_stock_ledger_totals",
+           #"inv_stock_ledger_transactions",
+           "inv_stock_ledger_update",
            "inv_stock_movements",
            "inv_tabs",
            #"inv_timeline",
@@ -4782,6 +4788,57 @@ class InventoryStockCardModel(S3Model):
                                  )
         db(ctable.id == form_vars.id).update(stock_card_ref = code)
 
+# =============================================================================
+class InventoryStockMovementModel(S3Model):
+    """
+        Stock Movement Ledger: stock in/out per inventory item and day,
+        maintained from shipments and adjustments, to aggregate stock
+        movements without scanning all transactions
+
+        Used by: inv_stock_movements (if settings.inv.stock_ledger is enabled)
+    """
+
+    names = ("inv_stock_movement",
+             )
+
+    def model(self):
+
+        T = current.T
+
+        # ---------------------------------------------------------------------
+        # Stock Movements
+        #
+        tablename = "inv_stock_movement"
+        self.define_table(tablename,
+                          self.super_link("site_id", "org_site",
+                                          empty = False,
+                                          label = T(current.deployment_settings.get_inv_facility_label()),
+                                          ondelete = "CASCADE",
+                                          represent = self.org_site_represent,
+                                          readable = True,
+                                          ),
+                          self.supply_item_id(ondelete = "CASCADE"),
+                          self.inv_item_id(ondelete = "CASCADE"),
+                          s3_date(empty = False),
+                          Field("quantity_in", "double", notnull=True,
+                                default = 0.0,
+                                label = T("Quantity In"),
+                                ),
+                          Field("quantity_out", "double", notnull=True,
+                                default = 0.0,
+                                label = T("Quantity Out"),
+                                ),
+                          )
+
+        self.configure(tablename,
+                       # Never created/edited manually
+                       deletable = False,
+                       editable = False,
+                       insertable = False,
+                       )
+
+        return {}
+
 # =============================================================================
 class InventoryTrackingModel(S3Model):
     """
@@ -6352,6 +6409,11 @@ def inv_adj_close(r, **attr):
                               comments = "Adjustment",
                               )
 
+    if settings.get_inv_stock_ledger():
+        # Reload the adj_items to include newly created stock items
+        rows = db(adj_item_table.adj_id == adj_id).select(adj_item_table.inv_item_id)
+        inv_stock_ledger_update([row.inv_item_id for row in rows])
+
     # Call on_inv_adj_close hook if-configured
     #tablename = "inv_adj"
     #on_inv_adj_close = s3db.get_config(tablename, "on_inv_adj_close")
@@ -8590,10 +8652,15 @@ def inv_recv_cancel(r, **attr):
         # a mechanism to circumvent the auditing of stock
         db(stable.id == send_id).update(status = SHIP_STATUS_SENT)
 
-    if current.deployment_settings.get_inv_warehouse_free_capacity_calculated():
+    settings = current.deployment_settings
+
+    if settings.get_inv_warehouse_free_capacity_calculated():
         # Update the Warehouse Free capacity
         inv_warehouse_free_capacity(record.site_id)
 
+    if settings.get_inv_stock_ledger():
+        inv_stock_ledger_update([row.recv_inv_item_id for row in recv_items])
+
     message = T("Received Shipment canceled and items removed from Warehouse")
     current.session.confirmation = message
 
@@ -9756,14 +9823,18 @@ def inv_recv_process(r, **attr):
         # Update the Warehouse Free capacity
         inv_warehouse_free_capacity(site_id)
 
-    if stock_cards:
+    stock_ledger = settings.get_inv_stock_ledger()
+    if stock_cards or stock_ledger:
         # Reload all track_items to read the recv_inv_item_ids
         rows = db(table.recv_id == recv_id).select(table.recv_inv_item_id)
         inv_item_ids = [row.recv_inv_item_id for row in rows]
-        inv_stock_card_update(inv_item_ids,
-                              recv_id = recv_id,
-                              comments = "Shipment Received",
-                              )
+        if stock_cards:
+            inv_stock_card_update(inv_item_ids,
+                                  recv_id = recv_id,
+                                  comments = "Shipment Received",
+                                  )
+        if stock_ledger:
+            inv_stock_ledger_update(inv_item_ids)
 
     # Call on_inv_recv_process hook if-configured
     tablename = "inv_recv"
@@ -13607,10 +13678,19 @@ def inv_send_cancel(r, **attr):
     # Now change the status to cancelled
     db(tracktable.send_id == send_id).update(status = TRACK_STATUS_CANCELED)
 
-    if current.deployment_settings.get_inv_warehouse_free_capacity_calculated():
+    settings = current.deployment_settings
+
+    if settings.get_inv_warehouse_free_capacity_calculated():
         # Update the Warehouse Free capacity
         inv_warehouse_free_capacity(record.site_id)
 
+    if settings.get_inv_stock_ledger():
+        rows = db(tracktable.send_id == send_id).select(tracktable.send_inv_item_id,
+                                                        tracktable.recv_inv_item_id,
+                                                        )
+        inv_stock_ledger_update([row.send_inv_item_id for row in rows] +
+                                [row.recv_inv_item_id for row in rows])
+
     message = T("Sent Shipment canceled and items returned to Warehouse")
     current.session.confirmation = message
 
@@ -13972,7 +14052,8 @@ def inv_send_process(r, **attr):
                     tracktable.quantity,
                     tracktable.item_pack_id,
                     ]
-    if stock_cards:
+    stock_ledger = settings.get_inv_stock_ledger()
+    if stock_cards or stock_ledger:
         track_fields.append(tracktable.send_inv_item_id)
     track_items = db(tracktable.send_id == send_id).select(*track_fields)
     if not track_items:
@@ -14048,12 +14129,15 @@ def inv_send_process(r, **attr):
         # Update the Warehouse Free capacity
         inv_warehouse_free_capacity(record.site_id)
 
-    if stock_cards:
+    if stock_cards or stock_ledger:
         inv_item_ids = [row.send_inv_item_id for row in track_items]
-        inv_stock_card_update(inv_item_ids,
-                              send_id = send_id,
-                              comments = "Shipment Sent",
-                              )
+        if stock_cards:
+            inv_stock_card_update(inv_item_ids,
+                                  send_id = send_id,
+                                  comments = "Shipment Sent",
+                                  )
+        if stock_ledger:
+            inv_stock_ledger_update(inv_item_ids)
 
     # Call on_inv_send_process hook if-configured
     tablename = "inv_send"
@@ -14235,10 +14319,15 @@ def inv_send_return_complete(r, **attr):
     # Change the status for all track items in this shipment to Received
     db(tracktable.send_id == send_id).update(status = TRACK_STATUS_ARRIVED)
 
-    if current.deployment_settings.get_inv_warehouse_free_capacity_calculated():
+    settings = current.deployment_settings
+
+    if settings.get_inv_warehouse_free_capacity_calculated():
         # Update the Warehouse Free capacity
         inv_warehouse_free_capacity(record.site_id)
 
+    if settings.get_inv_stock_ledger():
+        inv_stock_ledger_update([row.send_inv_item_id for row in track_rows])
+
     redirect(URL(args = [send_id]))
 
     message = T("Return completed. Stock is back in the Warehouse and can be assigned to Bins")
@@ -14683,8 +14772,13 @@ def inv_stock_movements(resource, selectors, orderby):
 
         @note: transactions can be filtered by earliest/latest date
                using an S3DateFilter with selector="_transaction.date"
+        @note: with settings.inv.stock_ledger, quantities are read from
+               the stock movement ledger (per full day, and including
+               stock adjustments), and transactions are only read for
+               the report window
 
         @todo: does not take manual stock adjustments into account
+               (unless using the stock movement ledger)
         @todo: does not represent sites or Waybill/GRN as
                links (breaks PDF export, but otherwise it's useful)
     """
@@ -14720,6 +14814,15 @@ def inv_stock_movements(resource, selectors, orderby):
     dtstr = get_vars_get("_transaction.date__le")
     latest = convert(datetime.datetime, dtstr) if dtstr else request.utcnow
 
+    use_ledger = current.deployment_settings.get_inv_stock_ledger()
+    if use_ledger:
+        # The ledger is per day => extend the window to full days
+        earliest_date = earliest.date() if earliest else None
+        latest_date = latest.date()
+        if earliest:
+            earliest = datetime.datetime.combine(earliest_date, datetime.time.min)
+        latest = datetime.datetime.combine(latest_date, datetime.time.max)
+
     def item_dict():
         """ Stock movement data per inventory item """
 
@@ -14747,6 +14850,8 @@ def inv_stock_movements(resource, selectors, orderby):
     query = (FS("recv_inv_item_id").belongs(inv_item_ids))
     if earliest:
         query &= (FS("recv_id$date") >= earliest)
+    if use_ledger:
+        query &= (FS("recv_id$date") <= latest)
     incoming = s3db.resource("inv_track_item", filter=query)
     transactions = incoming.select(["recv_id$date",
                                     "recv_id$from_site_id",
@@ -14768,7 +14873,7 @@ def inv_stock_movements(resource, selectors, orderby):
             movements[inv_item_id] = item_data = item_dict()
         # Incoming quantities
         quantity_in = raw["inv_track_item.recv_quantity"]
-        if quantity_in:
+        if quantity_in and not use_ledger:
             if raw["inv_recv.date"] > latest:
                 item_data["quantity_in_after"] += quantity_in
                 continue
@@ -14789,6 +14894,8 @@ def inv_stock_movements(resource, selectors, orderby):
     query = (FS("send_inv_item_id").belongs(inv_item_ids))
     if earliest:
         query &= (FS("send_id$date") >= earliest)
+    if use_ledger:
+        query &= (FS("send_id$date") <= latest)
     outgoing = s3db.resource("inv_track_item", filter=query)
     transactions = outgoing.select(["send_id$date",
                                     "send_id$to_site_id",
@@ -14810,7 +14917,7 @@ def inv_stock_movements(resource, selectors, orderby):
             movements[inv_item_id] = item_data = item_dict()
         # Outgoing quantities
         quantity_in = raw["inv_track_item.quantity"]
-        if quantity_in:
+        if quantity_in and not use_ledger:
             send_date = raw["inv_send.date"]
             if send_date and send_date > latest:
                 item_data["quantity_out_after"] += quantity_in
@@ -14828,6 +14935,19 @@ def inv_stock_movements(resource, selectors, orderby):
             documents = item_data["documents"]
             documents.append(raw["inv_send.send_ref"])
 
+    if use_ledger:
+        # Read the quantities from the ledger
+        totals = inv_stock_ledger_totals(inv_item_ids, earliest_date, latest_date)
+        for inv_item_id, quantities in totals.items():
+            if inv_item_id in movements:
+                item_data = movements[inv_item_id]
+            else:
+                movements[inv_item_id] = item_data = item_dict()
+            (item_data["quantity_in"],
+             item_data["quantity_out"],
+             item_data["quantity_in_after"],
+             item_data["quantity_out_after"]) = quantities
+
     # Bulk-represent sites (stores the representations in represent)
     represent = s3db.inv_inv_item.site_id.represent
     represent.bulk(list(all_sites))
@@ -15254,43 +15374,76 @@ def inv_stock_card_update(inv_item_ids,
                           delete = False,
                           ):
     """
-        Create/Update the Stock Card
+        Create/Update the Stock Cards for inventory items (in bulk)
+
+        @param inv_item_ids: the inv_inv_item record IDs
+        @param send_id: the outgoing shipment causing the update
+        @param recv_id: the incoming shipment causing the update
+        @param comments: comments for the log entries
+        @param delete: the inventory items are being deleted
     """
 
+    inv_item_ids = set(inv_item_id for inv_item_id in inv_item_ids if inv_item_id)
+    if not inv_item_ids:
+        return
+
     db = current.db
     s3db = current.s3db
 
+    date = current.request.utcnow
+
     iitable = s3db.inv_inv_item
     ibtable = s3db.inv_inv_item_bin
 
-    # read the data for these inv_item_ids
-    len_ids = len(inv_item_ids)
-    if len_ids == 1:
-        query = (iitable.id == inv_item_ids[0])
-        #limitby = (0, 1)
-    else:
-        query = (iitable.id.belongs(inv_item_ids))
-        #limitby = (0, len_ids)
-
     left = ibtable.on(ibtable.inv_item_id == iitable.id)
+    fields = [iitable.id,
+              iitable.site_id,
+              iitable.item_id,
+              iitable.item_source_no,
+              iitable.expiry_date,
+              iitable.item_pack_id,
+              iitable.quantity,
+              ibtable.layout_id,
+              ibtable.quantity,
+              ]
 
-    rows = db(query).select(iitable.id,
-                            iitable.site_id,
-                            iitable.item_id,
-                            iitable.item_source_no,
-                            iitable.expiry_date,
-                            iitable.item_pack_id,
-                            iitable.quantity,
-                            ibtable.layout_id,
-                            ibtable.quantity,
-                            left = left,
-                            # Can't limitby as we don't know how many we split to for the left
-                            #limitby = limitby,
-                            )
+    # Read the data for these inv_item_ids
+    rows = db(iitable.id.belongs(inv_item_ids)).select(*fields, left=left)
+    if not rows:
+        return
+
+    def card_key(inv_item):
+        # Stock Cards are per site, item, source and expiry date
+        return (inv_item.site_id,
+                inv_item.item_id,
+                inv_item.item_source_no,
+                inv_item.expiry_date,
+                )
+
+    def group(rows):
+        # Group by inv_item_id
+        inv_items = {}
+        for row in rows:
+            inv_item_id = row["inv_inv_item.id"]
+            if inv_item_id in inv_items:
+                inv_items[inv_item_id].append(row)
+            else:
+                inv_items[inv_item_id] = [row]
+        return inv_items
+
+    inv_items = group(rows)
+
+    keys = set()
+    site_ids = set()
+    item_ids = set()
+    for bins in inv_items.values():
+        inv_item = bins[0].inv_inv_item
+        keys.add(card_key(inv_item))
+        site_ids.add(inv_item.site_id)
+        item_ids.add(inv_item.item_id)
 
     # Lookup Packs
     siptable = s3db.supply_item_pack
-    item_ids = [row["inv_inv_item.item_id"] for row in rows]
     packs = db(siptable.item_id.belongs(item_ids)).select(siptable.id,
                                                           siptable.item_id,
                                                           siptable.quantity,
@@ -15305,171 +15458,471 @@ def inv_stock_card_update(inv_item_ids,
             # The Pack used by the Card
             packs_by_item[row.item_id] = pack_id
 
-    # Group by inv_item_id
-    inv_items = {}
-    for row in rows:
-        inv_item_id = row["inv_inv_item.id"]
-        if inv_item_id in inv_items:
-            inv_items[inv_item_id].append(row)
-        else:
-            inv_items[inv_item_id] = [row]
+    # Read all matching inv_items (including these), and compute their
+    # quantities per bin (layout_id None = unbinned), in base units
+    query = (iitable.site_id.belongs(site_ids)) & \
+            (iitable.item_id.belongs(item_ids))
+    matches = group(db(query).select(*fields, left=left))
+
+    contributions = {}
+    totals = {}
+    for inv_item_id, match_bins in matches.items():
+        match_inv_item = match_bins[0].inv_inv_item
+        key = card_key(match_inv_item)
+        if key not in keys:
+            continue
+        pack_quantity = packs_by_id[match_inv_item.item_pack_id]
 
+        quantities = {}
+        binned_quantity = 0
+        for match in match_bins:
+            bin_record = match.inv_inv_item_bin
+            if bin_record.quantity is None:
+                continue
+            binned_quantity += bin_record.quantity
+            layout_id = bin_record.layout_id
+            quantities[layout_id] = quantities.get(layout_id, 0) + \
+                                    bin_record.quantity * pack_quantity
+        quantities[None] = (match_inv_item.quantity - binned_quantity) * pack_quantity
+        contributions[inv_item_id] = quantities
+
+        key_totals = totals.setdefault(key, {})
+        for layout_id, quantity in quantities.items():
+            key_totals[layout_id] = key_totals.get(layout_id, 0) + quantity
+
+    # Lookup all existing Stock Cards
     sctable = s3db.inv_stock_card
-    sltable = s3db.inv_stock_log
+    query = (sctable.site_id.belongs(site_ids)) & \
+            (sctable.item_id.belongs(item_ids))
+    rows = db(query).select(sctable.id,
+                            sctable.site_id,
+                            sctable.item_id,
+                            sctable.item_source_no,
+                            sctable.expiry_date,
+                            )
+    cards = {}
+    for row in rows:
+        key = card_key(row)
+        if key in keys and key not in cards:
+            cards[key] = row.id
 
-    for inv_item_id in inv_items:
-        bins = inv_items[inv_item_id]
-        inv_item = bins[0].inv_inv_item
-        site_id = inv_item.site_id
-        item_id = inv_item.item_id
-        item_source_no = inv_item.item_source_no
-        expiry_date = inv_item.expiry_date
-
-        # Search for existing Stock Card
-        query = (sctable.site_id == site_id) & \
-                (sctable.item_id == item_id) & \
-                (sctable.item_source_no == item_source_no) & \
-                (sctable.expiry_date == expiry_date)
-
-        exists = db(query).select(sctable.id,
-                                  limitby = (0, 1),
-                                  ).first()
-        if exists:
-            card_id = exists.id
-        else:
-            # Create Stock Card
-            card_id = sctable.insert(site_id = site_id,
-                                     item_id = item_id,
-                                     item_pack_id = packs_by_item[item_id],
-                                     item_source_no = item_source_no,
-                                     expiry_date = expiry_date,
+    # Lookup the latest balances of the existing Stock Cards per bin
+    sltable = s3db.inv_stock_log
+    balances = {}
+    if cards:
+        card_query = sltable.card_id.belongs(set(cards.values()))
+        latest = sltable.date.max()
+        rows = db(card_query).select(sltable.card_id,
+                                     sltable.layout_id,
+                                     latest,
+                                     groupby = (sltable.card_id,
+                                                sltable.layout_id,
+                                                ),
                                      )
-            onaccept = s3db.get_config("inv_stock_card", "create_onaccept")
+        dates = {(row.inv_stock_log.card_id, row.inv_stock_log.layout_id): row[latest]
+                 for row in rows}
+        if dates:
+            # Entries with the same date: the last one written wins
+            query = card_query & sltable.date.belongs(set(dates.values()))
+            rows = db(query).select(sltable.card_id,
+                                    sltable.layout_id,
+                                    sltable.date,
+                                    sltable.balance,
+                                    orderby = sltable.id,
+                                    )
+            for row in rows:
+                key = (row.card_id, row.layout_id)
+                if dates.get(key) == row.date:
+                    balances[key] = row.balance
+
+    # Create missing Stock Cards
+    new_cards = []
+    for inv_item_id, bins in inv_items.items():
+        key = card_key(bins[0].inv_inv_item)
+        if key not in cards and key not in new_cards:
+            new_cards.append(key)
+    if new_cards:
+        card_ids = sctable.bulk_insert([{"site_id": site_id,
+                                         "item_id": item_id,
+                                         "item_pack_id": packs_by_item[item_id],
+                                         "item_source_no": item_source_no,
+                                         "expiry_date": expiry_date,
+                                         }
+                                        for (site_id, item_id, item_source_no, expiry_date)
+                                        in new_cards])
+        onaccept = s3db.get_config("inv_stock_card", "create_onaccept")
+        for key, card_id in zip(new_cards, card_ids):
+            cards[key] = card_id
             if onaccept:
                 # Generate the Stock Card No.
                 onaccept(Storage(vars = Storage(id = card_id,
-                                                site_id = site_id,
+                                                site_id = key[0],
                                                 )
                                  ))
-            quantity_out = 0
+    new_cards = set(new_cards)
+
+    # Compute the log entries
+    logs = []
+    for inv_item_id, bins in inv_items.items():
+        inv_item = bins[0].inv_inv_item
+        key = card_key(inv_item)
+        card_id = cards[key]
+        key_totals = totals.get(key, {})
+        own = contributions.get(inv_item_id, {})
+
+        # The first inv_item of a new card creates it, subsequent
+        # ones update it
+        if key in new_cards:
+            new_cards.discard(key)
+            exists = False
+        else:
+            exists = True
 
-        pack_quantity = packs_by_id[inv_item.item_pack_id]
         inv_quantity = inv_item.quantity
         binned_quantity = sum([row["inv_inv_item_bin.quantity"] for row in bins if row["inv_inv_item_bin.quantity"] is not None])
 
+        layout_ids = [row["inv_inv_item_bin.layout_id"] for row in bins]
         if inv_quantity > binned_quantity:
             # We have some unbinned
             if binned_quantity > 0:
                 # We have some binned too, so the unbinned won't show as a separate row
-                bins.append(Storage(inv_inv_item_bin = Storage(layout_id = None)))
-
-        # Read all matching inv_items
-        query = (iitable.site_id == site_id) & \
-                (iitable.item_id == item_id) & \
-                (iitable.item_source_no == item_source_no) & \
-                (iitable.expiry_date == expiry_date) & \
-                (iitable.id != inv_item.id)
+                layout_ids.append(None)
 
-        for row in bins:
-            bin_record = row.inv_inv_item_bin
-            layout_id = bin_record.layout_id
-            if layout_id:
-                if delete:
-                    delete_quantity = bin_record.quantity * pack_quantity
-                    quantity = 0
-                else:
-                    quantity = bin_record.quantity * pack_quantity
-
-                # Need to match with all others in this bin
-                match_query = query & (ibtable.inv_item_id == iitable.id) & \
-                                      (ibtable.layout_id == layout_id)
-                matches = db(match_query).select(iitable.item_pack_id,
-                                                 ibtable.quantity,
-                                                 )
-                for match in matches:
-                    quantity += (match["inv_inv_item_bin.quantity"] * packs_by_id[match["inv_inv_item.item_pack_id"]])
-
-            else:
-                # Unbinned
-                if delete:
-                    delete_quantity = (inv_quantity - binned_quantity) * pack_quantity
-                    quantity = 0
-                else:
-                    quantity = (inv_quantity - binned_quantity) * pack_quantity
-
-                # Need to match with all other unbinned
-                matches = db(query).select(iitable.id,
-                                           iitable.quantity,
-                                           iitable.item_pack_id,
-                                           ibtable.quantity,
-                                           left = left,
-                                           )
-                # Group by inv_item_id
-                match_inv_items = {}
-                for match in matches:
-                    inv_item_id = match["inv_inv_item.id"]
-                    if inv_item_id in match_inv_items:
-                        match_inv_items[inv_item_id].append(match)
-                    else:
-                        match_inv_items[inv_item_id] = [match]
+        for layout_id in layout_ids:
 
-                for inv_item_id in match_inv_items:
-                    match_bins = match_inv_items[inv_item_id]
-                    match_inv_item = match_bins[0].inv_inv_item
-                    match_pack_quantity = packs_by_id[match_inv_item.item_pack_id]
-                    match_quantity = match_inv_item.quantity
-                    match_binned_quantity = sum([match["inv_inv_item_bin.quantity"] for match in match_bins if match["inv_inv_item_bin.quantity"] is not None])
-                    quantity += ((match_quantity - match_binned_quantity) * match_pack_quantity)
+            # Quantity in this bin (or unbinned) across all matching inv_items
+            quantity = key_totals.get(layout_id, 0)
+            if delete:
+                delete_quantity = own.get(layout_id, 0)
+                quantity -= delete_quantity
 
             if exists:
-                # Lookup Latest Log Entry for this Bin (or Unbinned)
-                log_query = (sltable.card_id == card_id) & \
-                            (sltable.layout_id == layout_id)
-                log = db(log_query).select(sltable.date,
-                                           sltable.balance,
-                                           orderby = ~sltable.date,
-                                           limitby = (0, 1),
-                                           ).first()
+                # Latest Log Entry for this Bin (or Unbinned)
+                old_balance = balances.get((card_id, layout_id))
                 if delete:
                     quantity_in = 0
                     quantity_out = delete_quantity
-                elif not log:
+                elif old_balance is None:
                     quantity_in = quantity
                     quantity_out = 0
+                elif quantity > old_balance:
+                    quantity_in = quantity - old_balance
+                    quantity_out = 0
+                elif quantity < old_balance:
+                    quantity_in = 0
+                    quantity_out = old_balance - quantity
                 else:
-                    old_balance = log.balance
-                    if quantity > old_balance:
-                        quantity_in = quantity - old_balance
-                        quantity_out = 0
-                    elif quantity < old_balance:
-                        quantity_in = 0
-                        quantity_out = old_balance - quantity
-                    else:
-                        # quantity == balance some other change
-                        quantity_in = 0
-                        quantity_out = 0
+                    # quantity == balance some other change
+                    quantity_in = 0
+                    quantity_out = 0
             else:
                 quantity_in = quantity
-                if delete:
-                    quantity_out = delete_quantity
+                quantity_out = delete_quantity if delete else 0
 
             if quantity_in == quantity_out:
                 # An untouched bin
                 continue
 
-            balance = quantity
+            balances[(card_id, layout_id)] = quantity
 
             # Add Log Entry
-            sltable.insert(card_id = card_id,
-                           date = current.request.utcnow,
-                           send_id = send_id,
-                           recv_id = recv_id,
-                           layout_id = layout_id,
-                           quantity_in = quantity_in,
-                           quantity_out = quantity_out,
-                           balance = balance,
-                           comments = comments,
-                           )
+            logs.append({"card_id": card_id,
+                         "date": date,
+                         "send_id": send_id,
+                         "recv_id": recv_id,
+                         "layout_id": layout_id,
+                         "quantity_in": quantity_in,
+                         "quantity_out": quantity_out,
+                         "balance": quantity,
+                         "comments": comments,
+                         })
+
+    if logs:
+        sltable.bulk_insert(logs)
+
+# =============================================================================
+def inv_stock_ledger_transactions(inv_item_ids):
+    """
+        Extract the stock movements of inventory items from the shipment
+        and adjustment transactions
+
+        @param inv_item_ids: the inv_inv_item record IDs
+
+        @returns: dict {(inv_item_id, date): [quantity_in, quantity_out]}
+
+        @note: transactions without date (e.g. items in shipments not
+               yet sent) and cancelled shipments are not included, returned
+               items are deducted from the outgoing quantity once the
+               return is complete
+    """
+
+    db = current.db
+    s3db = current.s3db
+
+    movements = {}
+
+    def add(inv_item_id, date, quantity_in, quantity_out):
+        if not inv_item_id or not date:
+            return
+        if isinstance(date, datetime.datetime):
+            date = date.date()
+        key = (inv_item_id, date)
+        if key in movements:
+            item = movements[key]
+            item[0] += quantity_in
+            item[1] += quantity_out
+        else:
+            movements[key] = [quantity_in, quantity_out]
+
+    tracktable = s3db.inv_track_item
+
+    # Incoming shipments
+    rtable = s3db.inv_recv
+    query = (tracktable.recv_inv_item_id.belongs(inv_item_ids)) & \
+            (tracktable.deleted == False) & \
+            (rtable.id == tracktable.recv_id) & \
+            (rtable.status != SHIP_STATUS_CANCEL)
+    rows = db(query).select(tracktable.recv_inv_item_id,
+                            tracktable.recv_quantity,
+                            rtable.date,
+                            )
+    for row in rows:
+        track_item = row.inv_track_item
+        quantity = track_item.recv_quantity
+        if quantity:
+            add(track_item.recv_inv_item_id, row.inv_recv.date, quantity, 0)
+
+    # Outgoing shipments
+    stable = s3db.inv_send
+    query = (tracktable.send_inv_item_id.belongs(inv_item_ids)) & \
+            (tracktable.deleted == False) & \
+            (stable.id == tracktable.send_id) & \
+            (stable.status != SHIP_STATUS_CANCEL)
+    rows = db(query).select(tracktable.send_inv_item_id,
+                            tracktable.quantity,
+                            tracktable.return_quantity,
+                            stable.date,
+                            stable.status,
+                            )
+    for row in rows:
+        track_item = row.inv_track_item
+        quantity = track_item.quantity
+        if quantity and track_item.return_quantity and \
+           row.inv_send.status == SHIP_STATUS_RECEIVED:
+            # Return completed
+            quantity -= track_item.return_quantity
+        if quantity:
+            add(track_item.send_inv_item_id, row.inv_send.date, 0, quantity)
+
+    # Completed adjustments
+    atable = s3db.inv_adj
+    aitable = s3db.inv_adj_item
+    query = (aitable.inv_item_id.belongs(inv_item_ids)) & \
+            (aitable.deleted == False) & \
+            (atable.id == aitable.adj_id) & \
+            (atable.status == 1) # Complete
+    rows = db(query).select(aitable.inv_item_id,
+                            aitable.old_quantity,
+                            aitable.new_quantity,
+                            atable.adjustment_date,
+                            )
+    for row in rows:
+        adj_item = row.inv_adj_item
+        if adj_item.new_quantity is None:
+            continue
+        difference = adj_item.new_quantity - (adj_item.old_quantity or 0)
+        if difference > 0:
+            add(adj_item.inv_item_id, row.inv_adj.adjustment_date, difference, 0)
+        elif difference < 0:
+            add(adj_item.inv_item_id, row.inv_adj.adjustment_date, 0, -difference)
+
+    return movements
+
+# =============================================================================
+def inv_stock_ledger_update(inv_item_ids):
+    """
+        Update the stock movement ledger for inventory items, called
+        after shipments have been sent/received/cancelled or
+        adjustments closed
+
+        @param inv_item_ids: the inv_inv_item record IDs
+    """
+
+    inv_item_ids = set(inv_item_id for inv_item_id in inv_item_ids if inv_item_id)
+    if not inv_item_ids:
+        return
+
+    db = current.db
+    s3db = current.s3db
+
+    # Re-compute the movements of these items from the transactions
+    movements = inv_stock_ledger_transactions(inv_item_ids)
+
+    ltable = s3db.inv_stock_movement
+    db(ltable.inv_item_id.belongs(inv_item_ids)).delete()
+    if not movements:
+        return
+
+    # Look up site and supply item of the inventory items
+    iitable = s3db.inv_inv_item
+    rows = db(iitable.id.belongs(inv_item_ids)).select(iitable.id,
+                                                       iitable.site_id,
+                                                       iitable.item_id,
+                                                       )
+    inv_items = {row.id: row for row in rows}
+
+    records = []
+    for (inv_item_id, date), (quantity_in, quantity_out) in movements.items():
+        inv_item = inv_items.get(inv_item_id)
+        if not inv_item:
+            continue
+        records.append({"site_id": inv_item.site_id,
+                        "item_id": inv_item.item_id,
+                        "inv_item_id": inv_item_id,
+                        "date": date,
+                        "quantity_in": quantity_in,
+                        "quantity_out": quantity_out,
+                        })
+    if records:
+        ltable.bulk_insert(records)
+
+# =============================================================================
+def inv_stock_ledger_rebuild(batch_size=500):
+    """
+        Rebuild the stock movement ledger from all transactions, e.g.
+        to backfill existing data after enabling settings.inv.stock_ledger
+
+        @param batch_size: the number of inventory items to process at once
+
+        @returns: the number of inventory items processed
+    """
+
+    db = current.db
+    s3db = current.s3db
+
+    ltable = s3db.inv_stock_movement
+    db(ltable.id > 0).delete()
+
+    iitable = s3db.inv_inv_item
+
+    count = 0
+    last = 0
+    while True:
+        rows = db(iitable.id > last).select(iitable.id,
+                                            orderby = iitable.id,
+                                            limitby = (0, batch_size),
+                                            )
+        if not rows:
+            break
+        inv_item_ids = [row.id for row in rows]
+        inv_stock_ledger_update(inv_item_ids)
+        count += len(inv_item_ids)
+        last = inv_item_ids[-1]
+
+    return count
+
+# =============================================================================
+def inv_stock_ledger_check(inv_item_ids=None, batch_size=500):
+    """
+        Consistency check of the stock movement ledger against the
+        transactions
+
+        @param inv_item_ids: the inv_inv_item record IDs to check
+                             (default: all)
+        @param batch_size: the number of inventory items to check at once
+
+        @returns: list of tuples (inv_item_id, date, ledger, transactions)
+                  for every inconsistency found, where ledger and
+                  transactions are tuples (quantity_in, quantity_out)
+    """
+
+    db = current.db
+    s3db = current.s3db
+
+    ltable = s3db.inv_stock_movement
+
+    if inv_item_ids is None:
+        iitable = s3db.inv_inv_item
+        rows = db(iitable.id > 0).select(iitable.id, orderby=iitable.id)
+        inv_item_ids = [row.id for row in rows]
+    else:
+        inv_item_ids = sorted(set(inv_item_ids))
+
+    sum_in = ltable.quantity_in.sum()
+    sum_out = ltable.quantity_out.sum()
+
+    inconsistencies = []
+    for index in range(0, len(inv_item_ids), batch_size):
+        batch = inv_item_ids[index:index + batch_size]
+
+        transactions = inv_stock_ledger_transactions(batch)
+
+        ledger = {}
+        query = (ltable.inv_item_id.belongs(batch))
+        rows = db(query).select(ltable.inv_item_id,
+                                ltable.date,
+                                sum_in,
+                                sum_out,
+                                groupby = (ltable.inv_item_id, ltable.date),
+                                )
+        for row in rows:
+            entry = row.inv_stock_movement
+            ledger[(entry.inv_item_id, entry.date)] = (row[sum_in] or 0,
+                                                       row[sum_out] or 0,
+                                                       )
+
+        for key in set(ledger) | set(transactions):
+            recorded = ledger.get(key, (0, 0))
+            expected = tuple(transactions.get(key, (0, 0)))
+            if abs(recorded[0] - expected[0]) > 1e-6 or \
+               abs(recorded[1] - expected[1]) > 1e-6:
+                inconsistencies.append((key[0], key[1], recorded, expected))
+
+    inconsistencies.sort(key = lambda item: (item[0], item[1]))
+    return inconsistencies
+
+# =============================================================================
+def inv_stock_ledger_totals(inv_item_ids, earliest, latest):
+    """
+        Total stock movements of inventory items in a date window,
+        and after it, from the stock movement ledger
+
+        @param inv_item_ids: the inv_inv_item record IDs
+        @param earliest: the earliest date of the window (or None)
+        @param latest: the latest date of the window
+
+        @returns: dict {inv_item_id: [quantity_in, quantity_out,
+                                      quantity_in_after, quantity_out_after]}
+    """
+
+    db = current.db
+
+    ltable = current.s3db.inv_stock_movement
+    sum_in = ltable.quantity_in.sum()
+    sum_out = ltable.quantity_out.sum()
+
+    base = (ltable.inv_item_id.belongs(inv_item_ids))
+    window = base & (ltable.date <= latest)
+    if earliest:
+        window &= (ltable.date >= earliest)
+
+    totals = {}
+    for query, offset in ((window, 0), (base & (ltable.date > latest), 2)):
+        rows = db(query).select(ltable.inv_item_id,
+                                sum_in,
+                                sum_out,
+                                groupby = ltable.inv_item_id,
+                                )
+        for row in rows:
+            inv_item_id = row.inv_stock_movement.inv_item_id
+            if inv_item_id in totals:
+                item = totals[inv_item_id]
+            else:
+                item = totals[inv_item_id] = [0, 0, 0, 0]
+            item[offset] = row[sum_in] or 0
+            item[offset + 1] = row[sum_out] or 0
+
+    return totals
 
 # =============================================================================
 def inv_track_item_deleting(track_item_id):
@@ -15820,24 +16273,33 @@ class inv_ReqCheckMethod(S3Method):
 
                 if len(req_items):
                     # Get inv_items from this site which haven't expired and are in good condition
+                    # - total quantities per item and pack, aggregated in the DB
                     iitable = s3db.inv_inv_item
                     query = (iitable.site_id == site_id) & \
+                            (iitable.item_id.belongs(set(req_item.item_id for req_item in req_items))) & \
                             (iitable.deleted == False) & \
                             ((iitable.expiry_date >= r.now) | ((iitable.expiry_date == None))) & \
                             (iitable.status == 0)
-                    inv_items_dict = {}
+                    total_quantity = iitable.quantity.sum()
                     inv_items = db(query).select(iitable.item_id,
-                                                 iitable.quantity,
                                                  iitable.item_pack_id,
-                                                 # VF
-                                                 #iitable.pack_quantity,
+                                                 total_quantity,
+                                                 groupby = (iitable.item_id,
+                                                            iitable.item_pack_id,
+                                                            ),
                                                  )
-                    for item in inv_items:
+                    pack_quantities = s3db.supply_item_pack_quantities(
+                                        [row.inv_inv_item.item_pack_id for row in inv_items])
+                    inv_items_dict = {}
+                    for row in inv_items:
+                        item = row.inv_inv_item
                         item_id = item.item_id
+                        quantity = (row[total_quantity] or 0) * \
+                                   pack_quantities.get(item.item_pack_id, 0)
                         if item_id in inv_items_dict:
-                            inv_items_dict[item_id] += item.quantity * item.pack_quantity()
+                            inv_items_dict[item_id] += quantity
                         else:
-                            inv_items_dict[item_id] = item.quantity * item.pack_quantity()
+                            inv_items_dict[item_id] = quantity
 
                     supply_item_represent = table.item_id.represent
                     item_pack_represent = table.item_pack_id.represent
@@ -767,25 +767,41 @@ class OrganisationModel(S3Model):
         # Respect response.s3.filter
         resource.add_filter(response.s3.filter)
 
-        query = (FS("organisation.name").lower().like(value + "%")) | \
-                (FS("organisation.acronym").lower().like(value + "%"))
-        if use_branches:
-            query |= (FS("parent.name").lower().like(value + "%")) | \
-                     (FS("parent.acronym").lower().like(value + "%"))
-        if search_l10n:
-            query |= (FS("name.name_l10n").lower().like(value + "%")) | \
-                     (FS("name.acronym_l10n").lower().like(value + "%"))
+        query = None
+        if S3NameTokens.active():
+            # Every word must match the beginning of a word in name or acronym
+            tokens = S3NameTokens("org_organisation")
+            query = tokens.query(table._id, value)
+            if query is not None:
+                if use_branches:
+                    btable = current.s3db.org_organisation_branch
+                    bquery = tokens.query(btable.organisation_id, value) & \
+                             (btable.deleted == False)
+                    query |= table._id.belongs(current.db(bquery)._select(btable.branch_id))
+                if search_l10n:
+                    query = (FS("name.name_l10n").lower().like(value + "%")) | \
+                            (FS("name.acronym_l10n").lower().like(value + "%")) | \
+                            query
+        if query is None:
+            query = (FS("organisation.name").lower().like(value + "%")) | \
+                    (FS("organisation.acronym").lower().like(value + "%"))
+            if use_branches:
+                query |= (FS("parent.name").lower().like(value + "%")) | \
+                         (FS("parent.acronym").lower().like(value + "%"))
+            if search_l10n:
+                query |= (FS("name.name_l10n").lower().like(value + "%")) | \
+                         (FS("name.acronym_l10n").lower().like(value + "%"))
+        resource.add_filter(query)
 
         if "link" in _vars:
             link_filter = S3EmbeddedComponentWidget.link_filter_query(table, _vars.link)
             if link_filter:
-                query &= link_filter
-
-        resource.add_filter(query)
+                resource.add_filter(link_filter)
 
         MAX_SEARCH_RESULTS = settings.get_search_max_results()
         limit = int(_vars.limit or MAX_SEARCH_RESULTS)
-        if (not limit or limit > MAX_SEARCH_RESULTS) and resource.count() > MAX_SEARCH_RESULTS:
+        if (not limit or limit > MAX_SEARCH_RESULTS) and \
+           resource.count(limit=MAX_SEARCH_RESULTS + 1) > MAX_SEARCH_RESULTS:
             output = [
                 {"label": str(current.T("There are more than %(max)s results, please input more characters.") % \
                     {"max": MAX_SEARCH_RESULTS})}
@@ -907,6 +923,9 @@ class OrganisationBranchModel(S3Model):
                        onvalidation = self.org_branch_onvalidation,
                        )
 
+        # Update the organisation hierarchy when branches are (un)linked
+        S3Hierarchy.track("org_organisation", link=tablename, key="branch_id")
+
     # -------------------------------------------------------------------------
     @staticmethod
     def org_branch_onvalidation(form):
@@ -3808,22 +3827,30 @@ class SiteModel(S3Model):
             r.error(400, "Missing option! Require value")
 
         # Construct query
-        query = (FS("name").lower().like(value + "%"))
+        query = None
+        if S3NameTokens.active():
+            # Every word must match the beginning of a word in the name
+            query = S3NameTokens("org_site").query(resource._id, value)
+        if query is None:
+            query = (FS("name").lower().like(value + "%"))
 
         # Add template specific search criteria
+        # - resource queries first, so they can be combined with DAL queries
         extra_fields = settings.get_org_site_autocomplete_fields()
         for field in extra_fields:
             if "addr_street" in field:
                 # Need to be able to get through the street number
-                query |= (FS(field).lower().like("%" + value + "%"))
+                fquery = (FS(field).lower().like("%" + value + "%"))
             else:
-                query |= (FS(field).lower().like(value + "%"))
+                fquery = (FS(field).lower().like(value + "%"))
+            query = fquery | query
 
         resource.add_filter(query)
 
         MAX_SEARCH_RESULTS = settings.get_search_max_results()
         limit = int(_vars.limit or MAX_SEARCH_RESULTS)
-        if (not limit or limit > MAX_SEARCH_RESULTS) and resource.count() > MAX_SEARCH_RESULTS:
+        if (not limit or limit > MAX_SEARCH_RESULTS) and \
+           resource.count(limit=MAX_SEARCH_RESULTS + 1) > MAX_SEARCH_RESULTS:
             output = [
                 {"label": str(current.T("There are more than %(max)s results, please input more characters.") % \
                     {"max": MAX_SEARCH_RESULTS})}
@@ -1618,101 +1618,109 @@ class PersonModel(S3Model):
         name_format = settings.get_pr_name_format()
         middle_name = "middle_name" in name_format
 
-        # Names could be in the wrong order
-        # Multiple Names could be in a single field
-        # Each name field could be split into words in a different order
-        # @ToDo: deployment_setting for fully loose matching?
-        # Single search term
-        # Value can be (part of) any of first_name, middle_name or last_name
-        query = (FS("first_name").lower().like(value + "%")) | \
-                (FS("last_name").lower().like(value + "%"))
-        if middle_name:
-            query |= (FS("middle_name").lower().like(value + "%"))
-        if " " in value:
-            # Two search terms
-            # Values can be (part of) any of first_name, middle_name or last_name
-            # but we must have a (partial) match on both terms
-            # We must have a (partial) match on both terms
-            value1, value2 = value.split(" ", 1)
-            query |= (((FS("first_name").lower().like(value1 + "%")) & \
-                       (FS("last_name").lower().like(value2 + "%"))) | \
-                      ((FS("first_name").lower().like(value2 + "%")) & \
-                       (FS("last_name").lower().like(value1 + "%"))))
+        query = None
+        if S3NameTokens.active():
+            # Every word must match the beginning of a word in any name field
+            fieldnames = ["first_name", "last_name"]
             if middle_name:
+                fieldnames.append("middle_name")
+            query = S3NameTokens("pr_person").query(resource._id, value, fieldnames)
+        if query is None:
+            # Names could be in the wrong order
+            # Multiple Names could be in a single field
+            # Each name field could be split into words in a different order
+            # @ToDo: deployment_setting for fully loose matching?
+            # Single search term
+            # Value can be (part of) any of first_name, middle_name or last_name
+            query = (FS("first_name").lower().like(value + "%")) | \
+                    (FS("last_name").lower().like(value + "%"))
+            if middle_name:
+                query |= (FS("middle_name").lower().like(value + "%"))
+            if " " in value:
+                # Two search terms
+                # Values can be (part of) any of first_name, middle_name or last_name
+                # but we must have a (partial) match on both terms
+                # We must have a (partial) match on both terms
+                value1, value2 = value.split(" ", 1)
                 query |= (((FS("first_name").lower().like(value1 + "%")) & \
-                           (FS("middle_name").lower().like(value2 + "%"))) | \
-                          ((FS("first_name").lower().like(value2 + "%")) & \
-                           (FS("middle_name").lower().like(value1 + "%"))) | \
-                          ((FS("middle_name").lower().like(value1 + "%")) & \
                            (FS("last_name").lower().like(value2 + "%"))) | \
-                          ((FS("middle_name").lower().like(value2 + "%")) & \
+                          ((FS("first_name").lower().like(value2 + "%")) & \
                            (FS("last_name").lower().like(value1 + "%"))))
-            if " " in value2:
-                # Three search terms
-                # Values can be (part of) any of first_name, middle_name or last_name
-                # but we must have a (partial) match on all terms
-                value21, value3 = value2.split(" ", 1)
-                value12 = "%s %s" % (value1, value21)
-                query |= (((FS("first_name").lower().like(value12 + "%")) & \
-                           (FS("last_name").lower().like(value3 + "%"))) | \
-                          ((FS("first_name").lower().like(value3 + "%")) & \
-                           (FS("last_name").lower().like(value12 + "%"))))
                 if middle_name:
                     query |= (((FS("first_name").lower().like(value1 + "%")) & \
-                               (FS("middle_name").lower().like(value21 + "%")) & \
-                               (FS("last_name").lower().like(value3 + "%"))) | \
-                              ((FS("first_name").lower().like(value1 + "%")) & \
-                               (FS("last_name").lower().like(value21 + "%")) & \
-                               (FS("middle_name").lower().like(value3 + "%"))) | \
-                              ((FS("last_name").lower().like(value1 + "%")) & \
-                               (FS("middle_name").lower().like(value21 + "%")) & \
-                               (FS("first_name").lower().like(value3 + "%"))) | \
-                              ((FS("last_name").lower().like(value1 + "%")) & \
-                               (FS("first_name").lower().like(value21 + "%")) & \
-                               (FS("middle_name").lower().like(value3 + "%"))))
-                if " " in value3:
-                    # Four search terms
+                               (FS("middle_name").lower().like(value2 + "%"))) | \
+                              ((FS("first_name").lower().like(value2 + "%")) & \
+                               (FS("middle_name").lower().like(value1 + "%"))) | \
+                              ((FS("middle_name").lower().like(value1 + "%")) & \
+                               (FS("last_name").lower().like(value2 + "%"))) | \
+                              ((FS("middle_name").lower().like(value2 + "%")) & \
+                               (FS("last_name").lower().like(value1 + "%"))))
+                if " " in value2:
+                    # Three search terms
                     # Values can be (part of) any of first_name, middle_name or last_name
                     # but we must have a (partial) match on all terms
-                    value31, value4 = value3.split(" ", 1)
-                    value13 = "%s %s %s" % (value1, value21, value31)
-                    value22 = "%s %s" % (value21, value31)
-                    query |= (((FS("first_name").lower().like(value13 + "%")) & \
-                               (FS("last_name").lower().like(value4 + "%"))) | \
-                              ((FS("first_name").lower().like(value4 + "%")) & \
-                               (FS("last_name").lower().like(value13 + "%"))))
+                    value21, value3 = value2.split(" ", 1)
+                    value12 = "%s %s" % (value1, value21)
+                    query |= (((FS("first_name").lower().like(value12 + "%")) & \
+                               (FS("last_name").lower().like(value3 + "%"))) | \
+                              ((FS("first_name").lower().like(value3 + "%")) & \
+                               (FS("last_name").lower().like(value12 + "%"))))
                     if middle_name:
                         query |= (((FS("first_name").lower().like(value1 + "%")) & \
-                                   (FS("middle_name").lower().like(value22 + "%")) & \
-                                   (FS("last_name").lower().like(value4 + "%"))) | \
+                                   (FS("middle_name").lower().like(value21 + "%")) & \
+                                   (FS("last_name").lower().like(value3 + "%"))) | \
                                   ((FS("first_name").lower().like(value1 + "%")) & \
-                                   (FS("last_name").lower().like(value22 + "%")) & \
-                                   (FS("middle_name").lower().like(value4 + "%"))) | \
+                                   (FS("last_name").lower().like(value21 + "%")) & \
+                                   (FS("middle_name").lower().like(value3 + "%"))) | \
                                   ((FS("last_name").lower().like(value1 + "%")) & \
-                                   (FS("middle_name").lower().like(value22 + "%")) & \
-                                   (FS("first_name").lower().like(value4 + "%"))) | \
+                                   (FS("middle_name").lower().like(value21 + "%")) & \
+                                   (FS("first_name").lower().like(value3 + "%"))) | \
                                   ((FS("last_name").lower().like(value1 + "%")) & \
-                                   (FS("first_name").lower().like(value22 + "%")) & \
-                                   (FS("middle_name").lower().like(value4 + "%"))) | \
-                                  ((FS("first_name").lower().like(value12 + "%")) & \
-                                   (FS("middle_name").lower().like(value31 + "%")) & \
+                                   (FS("first_name").lower().like(value21 + "%")) & \
+                                   (FS("middle_name").lower().like(value3 + "%"))))
+                    if " " in value3:
+                        # Four search terms
+                        # Values can be (part of) any of first_name, middle_name or last_name
+                        # but we must have a (partial) match on all terms
+                        value31, value4 = value3.split(" ", 1)
+                        value13 = "%s %s %s" % (value1, value21, value31)
+                        value22 = "%s %s" % (value21, value31)
+                        query |= (((FS("first_name").lower().like(value13 + "%")) & \
                                    (FS("last_name").lower().like(value4 + "%"))) | \
-                                  ((FS("first_name").lower().like(value12 + "%")) & \
-                                   (FS("last_name").lower().like(value31 + "%")) & \
-                                   (FS("middle_name").lower().like(value4 + "%"))) | \
-                                  ((FS("last_name").lower().like(value12 + "%")) & \
-                                   (FS("middle_name").lower().like(value31 + "%")) & \
-                                   (FS("first_name").lower().like(value4 + "%"))) | \
-                                  ((FS("last_name").lower().like(value12 + "%")) & \
-                                   (FS("first_name").lower().like(value31 + "%")) & \
-                                   (FS("middle_name").lower().like(value4 + "%"))))
+                                  ((FS("first_name").lower().like(value4 + "%")) & \
+                                   (FS("last_name").lower().like(value13 + "%"))))
+                        if middle_name:
+                            query |= (((FS("first_name").lower().like(value1 + "%")) & \
+                                       (FS("middle_name").lower().like(value22 + "%")) & \
+                                       (FS("last_name").lower().like(value4 + "%"))) | \
+                                      ((FS("first_name").lower().like(value1 + "%")) & \
+                                       (FS("last_name").lower().like(value22 + "%")) & \
+                                       (FS("middle_name").lower().like(value4 + "%"))) | \
+                                      ((FS("last_name").lower().like(value1 + "%")) & \
+                                       (FS("middle_name").lower().like(value22 + "%")) & \
+                                       (FS("first_name").lower().like(value4 + "%"))) | \
+                                      ((FS("last_name").lower().like(value1 + "%")) & \
+                                       (FS("first_name").lower().like(value22 + "%")) & \
+                                       (FS("middle_name").lower().like(value4 + "%"))) | \
+                                      ((FS("first_name").lower().like(value12 + "%")) & \
+                                       (FS("middle_name").lower().like(value31 + "%")) & \
+                                       (FS("last_name").lower().like(value4 + "%"))) | \
+                                      ((FS("first_name").lower().like(value12 + "%")) & \
+                                       (FS("last_name").lower().like(value31 + "%")) & \
+                                       (FS("middle_name").lower().like(value4 + "%"))) | \
+                                      ((FS("last_name").lower().like(value12 + "%")) & \
+                                       (FS("middle_name").lower().like(value31 + "%")) & \
+                                       (FS("first_name").lower().like(value4 + "%"))) | \
+                                      ((FS("last_name").lower().like(value12 + "%")) & \
+                                       (FS("first_name").lower().like(value31 + "%")) & \
+                                       (FS("middle_name").lower().like(value4 + "%"))))
 
         resource.add_filter(query)
 
         limit = int(get_vars.limit or 0)
         MAX_SEARCH_RESULTS = settings.get_search_max_results()
         if (not limit or limit > MAX_SEARCH_RESULTS) and \
-           resource.count() > MAX_SEARCH_RESULTS:
+           resource.count(limit=MAX_SEARCH_RESULTS + 1) > MAX_SEARCH_RESULTS:
             msg = current.T("There are more than %(max)s results, please input more characters.")
             output = [{"label": s3_str(msg % {"max": MAX_SEARCH_RESULTS})}]
         else:
@@ -11063,20 +11071,26 @@ class pr_PersonSearchAutocomplete(S3Method):
         if get_vars.get("label") == "1":
             search_fields.add("pe_label")
         query = None
-        for partial in partials:
-            pquery = None
-            for field in search_fields:
-                selector = FS(field).lower()
-                fquery = selector.like("%s%%" % partial) | \
-                         selector.like("%% %s%%" % partial)
-                if pquery:
-                    pquery |= fquery
+        if S3NameTokens.active():
+            # Use the name token index if it covers all search fields
+            tokens = S3NameTokens("pr_person")
+            if tokens.covers(search_fields):
+                query = tokens.query(resource._id, value, search_fields)
+        if query is None:
+            for partial in partials:
+                pquery = None
+                for field in search_fields:
+                    selector = FS(field).lower()
+                    fquery = selector.like("%s%%" % partial) | \
+                             selector.like("%% %s%%" % partial)
+                    if pquery:
+                        pquery |= fquery
+                    else:
+                        pquery = fquery
+                if query:
+                    query &= pquery
                 else:
-                    pquery = fquery
-            if query:
-                query &= pquery
-            else:
-                query = pquery
+                    query = pquery
         if query is not None:
             resource.add_filter(query)
 
@@ -11084,7 +11098,7 @@ class pr_PersonSearchAutocomplete(S3Method):
         limit = int(get_vars.limit or 0)
         MAX_SEARCH_RESULTS = settings.get_search_max_results()
         if (not limit or limit > MAX_SEARCH_RESULTS) and \
-           resource.count() > MAX_SEARCH_RESULTS:
+           resource.count(limit=MAX_SEARCH_RESULTS + 1) > MAX_SEARCH_RESULTS:
             msg = current.T("There are more than %(max)s results, please input more characters.")
             output = [{"label": s3_str(msg % {"max": MAX_SEARCH_RESULTS})}]
         else:
@@ -30,6 +30,7 @@
 __all__ = ("S3DashboardModel",
            "S3DynamicTablesModel",
            "S3HierarchyModel",
+           "S3NameTokenModel",
            "s3_table_random_name",
            "s3_table_rheader",
            "s3_scheduler_rheader",
@@ -606,6 +607,7 @@ class S3HierarchyModel(S3Model):
     """ Model for stored object hierarchies """
 
     names = ("s3_hierarchy",
+             "s3_hierarchy_delta",
              )
 
     def model(self):
@@ -620,8 +622,50 @@ class S3HierarchyModel(S3Model):
                                 default = False,
                                 ),
                           Field("hierarchy", "json"),
+                          Field("version", "integer",
+                                default = 0,
+                                ),
                           *S3MetaFields.timestamps())
 
+        # ---------------------------------------------------------------------
+        # Node updates since the last stored version of a hierarchy
+        #
+        tablename = "s3_hierarchy_delta"
+        self.define_table(tablename,
+                          Field("tablename", length=64),
+                          Field("node_id", "integer"),
+                          Field("parent_id", "integer"),
+                          Field("category", "json"),
+                          Field("removed", "boolean",
+                                default = False,
+                                ),
+                          *S3MetaFields.timestamps())
+
+        # ---------------------------------------------------------------------
+        # Return global names to s3.*
+        #
+        return {}
+
+# =============================================================================
+class S3NameTokenModel(S3Model):
+    """ Model for the name token index (see S3NameTokens) """
+
+    names = ("s3_name_token",
+             )
+
+    def model(self):
+
+        # ---------------------------------------------------------------------
+        # Name Tokens: normalized prefixes of the words in name fields
+        #
+        tablename = "s3_name_token"
+        self.define_table(tablename,
+                          Field("tablename", length=64),
+                          Field("fieldname", length=64),
+                          Field("record_id", "integer"),
+                          Field("token", length=S3NameTokens.MAX_LENGTH),
+                          )
+
         # ---------------------------------------------------------------------
         # Return global names to s3.*
         #
@@ -335,6 +335,17 @@ class SyncRepositoryModel(S3Model):
                                                 ),
                                          ),
                            ),
+                     Field("concurrency", "integer",
+                           default = 1,
+                           label = T("Parallel Requests"),
+                           requires = IS_INT_IN_RANGE(1, 17),
+                           comment = DIV(_class = "tooltip",
+                                         _title = "%s|%s" % (
+                                                T("Parallel Requests"),
+                                                T("Maximum number of synchronization tasks to fetch data for concurrently (if supported by the adapter). Data are still imported one task after another, in dependency order."),
+                                                ),
+                                         ),
+                           ),
                      # User-visible field for Admin
                      s3_datetime("last_connected",
                                  label = T("Last Connected"),
@@ -896,6 +907,11 @@ class SyncLogModel(S3Model):
                           Field("message", "text",
                                 represent = s3_strip_markup,
                                 ),
+                          Field("duration", "double",
+                                label = T("Duration (seconds)"),
+                                represent = lambda v: \
+                                            IS_FLOAT_AMOUNT.represent(v, precision=2),
+                                ),
                           *s3_meta_fields())
 
         # CRUD Strings
@@ -197,6 +197,11 @@ settings.auth.hmac_key = "akeytochange"
 #settings.search.max_results = 200
 # Maximum number of features for a Map Layer
 #settings.gis.max_features = 1000
+# Cache permission rules across requests ("ram", "disk" or a cache instance)
+#settings.security.acl_cache = "disk"
+#settings.security.acl_cache_expire = 300
+# Cache representations of foreign keys across requests
+#settings.base.represent_cache = ("org_organisation", "gis_location")
 
 # CAP Settings
 # Change for different authority and organisations
@@ -237,6 +242,9 @@ settings.import_template()
 # Production instances should set this before prepopulate is run
 #settings.base.prepopulate_demo = 0
 
+# Import large CSV files in chunks of rows (resumable if interrupted)
+#settings.base.import_chunk_size = 10000
+
 # After 1st_run, set this for Production to save 1x DAL hit/request
 #settings.base.prepopulate = 0
 
@@ -30,6 +30,12 @@ def config(settings):
     # Uncomment this to prefer scalability-optimized strategies globally
     #settings.base.bigtable = True
 
+    # Uncomment this to stream unpaginated CSV/JSON exports (constant memory)
+    #settings.base.stream_export = True
+
+    # Uncomment this to use a full-text index for text filters on persons
+    #settings.database.text_index = {"pr_person": ["first_name", "middle_name", "last_name"]}
+
     # Theme (folder to use for views/layout.html)
     #settings.base.theme = "default"
 
@@ -472,6 +478,8 @@ def config(settings):
 
     # Use 'soft' deletes
     #settings.security.archive_not_delete = False
+    # Uncomment to delete records (and their dependencies) as sets rather than one by one
+    #settings.security.bulk_delete = True
 
     # AAA Settings
 
@@ -567,6 +575,12 @@ def config(settings):
     #settings.ui.datatables_responsive = False
     # Uncomment to enable double scroll bars on non-responsive datatables
     #settings.ui.datatables_double_scroll = True
+    # Uncomment to use keyset pagination for datatables (faster paging through large tables)
+    #settings.ui.datatables_keyset = True
+    # Uncomment to use estimated numbers of records in datatables (PostgreSQL only)
+    #settings.ui.datatables_approximate_count = True
+    # Uncomment to cache the numbers of records in datatables (for 60 seconds)
+    #settings.ui.datatables_approximate_count = 60
     # Uncomment to modify the label of the Permalink
     #settings.ui.label_permalink = "Permalink"
     # Uncomment to modify the main menu logo
@@ -584,6 +598,8 @@ def config(settings):
     # Sync
     # Uncomment if this deployment exposes public data sets
     #settings.sync.data_repository = True
+    # Number of records to pull per request (0 to pull all at once)
+    #settings.sync.page_size = 1000
 
     # -------------------------------------------------------------------------
     # Asset
@@ -981,6 +997,8 @@ def config(settings):
     #settings.inv.org_dependent_warehouse_types = True
     # Uncomment to call Stock Adjustments, 'Stock Counts'
     #settings.inv.stock_count = True
+    # Uncomment to maintain a stock movement ledger (faster stock movement reports)
+    #settings.inv.stock_ledger = True
     # Use the term 'Order' instead of 'Shipment'
     #settings.inv.shipment_name = "order"
     # Uncomment to validate for Unique Warehouse Codes
@@ -1153,6 +1171,9 @@ def config(settings):
     # -------------------------------------------------------------------------
     # Filter Manager
     #settings.search.filter_manager = False
+    # Uncomment to use a token index for person/organisation/site autocompletes
+    # (run the s3_name_tokens_rebuild task to index existing records)
+    #settings.search.name_tokens = True
 
     # if you want to have videos appearing in /default/video
     #settings.base.youtube_id = [dict(id = "introduction",
@@ -1,5 +1,6 @@
 from .s3aaa import *
 from .s3cfg import *
+from .s3codecs import *
 from .s3crud import *
 from .s3dashboard import *
 from .s3datatable import *
@@ -15,6 +16,7 @@ from .s3model import *
 from .s3msg import *
 from .s3navigation import *
 from .s3query import *
+from .s3report import *
 from .s3resource import *
 from .s3rest import *
 from .s3sync import *
@@ -286,6 +286,490 @@ class S3PerformanceTests(unittest.TestCase):
 
         current.auth.override = False
 
+    def testS3ImportJobOrder(self):
+        """ Commit ordering must scale linearly with the job size """
+
+        from s3 import S3ImportItem, S3ImportJob
+
+        def job(size):
+            """ Synthetic job: trees of items referencing their parent """
+            import_job = S3ImportJob(current.s3db.org_organisation)
+            items = []
+            for i in range(size):
+                item = S3ImportItem(import_job)
+                item.tablename = "org_organisation"
+                if i:
+                    parent = items[(i - 1) // 4]
+                    entry = Storage(item_id = parent.item_id)
+                    item.references = [Storage(field = "parent", entry = entry)]
+                items.append(item)
+            # Add the items in reverse order, so that all references
+            # must be resolved by the ordering
+            for item in reversed(items):
+                import_job.items[item.item_id] = item
+            return import_job
+
+        info("")
+        timings = {}
+        for size in (10000, 100000):
+            import_job = job(size)
+            x = lambda: import_job.order()
+            mlt = min(timeit.Timer(x).repeat(repeat=3, number=1))
+            timings[size] = mlt
+            info("S3ImportJob.order (%s items) = %s ms" % (size, mlt * 1000))
+
+        # 10x the items may take at most ~2x the time per item
+        self.assertTrue(timings[100000] < timings[10000] * 20)
+
+    def testS3PivotTableEngines(self):
+        """ Pivot table aggregation in the database vs. in Python """
+
+        from s3.s3report import S3PivotTable, S3PivotTableFact
+
+        db = current.db
+        s3db = current.s3db
+
+        current.auth.override = True
+
+        # Large fixture: human resources across a number of organisations
+        otable = s3db.org_organisation
+        org_ids = [otable.insert(name="PivotBenchmarkOrg%s" % i)
+                   for i in range(20)]
+        htable = s3db.hrm_human_resource
+        size = 50000
+        for i in range(size):
+            htable.insert(organisation_id = org_ids[i % 20],
+                          type = i % 2 + 1,
+                          status = i % 3 and 1 or 2,
+                          )
+
+        resource = s3db.resource("hrm_human_resource",
+                                 filter = htable.organisation_id.belongs(org_ids),
+                                 )
+        facts = lambda: S3PivotTableFact.parse(["count(id)",
+                                                "count(organisation_id)",
+                                                "sum(type)",
+                                                "avg(status)",
+                                                ])
+        def pivot(sql):
+            return S3PivotTable(resource,
+                                "organisation_id",
+                                "type",
+                                facts(),
+                                sql = sql,
+                                ).json()
+
+        try:
+            info("")
+            timings = {}
+            for sql in (False, True):
+                x = lambda: pivot(sql)
+                mlt = min(timeit.Timer(x).repeat(repeat=3, number=1))
+                timings[sql] = mlt
+                info("S3PivotTable (%s records, %s) = %s ms" % \
+                     (size, "SQL" if sql else "Python", mlt * 1000))
+
+            # Both engines must produce the same pivot table
+            self.assertEqual(pivot(True), pivot(False))
+
+            self.assertTrue(timings[True] < timings[False])
+        finally:
+            current.auth.override = False
+            db.rollback()
+
+    def testS3TimeSeriesEngines(self):
+        """ Time series aggregation in the database vs. in Python """
+
+        import datetime
+        from s3.s3timeplot import S3TimeSeries, S3TimeSeriesFact
+
+        db = current.db
+        s3db = current.s3db
+
+        current.auth.override = True
+
+        # Large fixture: human resources with start/end dates
+        otable = s3db.org_organisation
+        org_ids = [otable.insert(name="TimePlotBenchmarkOrg%s" % i)
+                   for i in range(20)]
+        htable = s3db.hrm_human_resource
+        size = 50000
+        start = datetime.date(2015, 1, 1)
+        day = datetime.timedelta(days=1)
+        for i in range(size):
+            htable.insert(organisation_id = org_ids[i % 20],
+                          type = i % 2 + 1,
+                          start_date = start + (i % 1460) * day,
+                          end_date = start + (i % 1460 + i % 400) * day if i % 5 else None,
+                          )
+
+        resource = s3db.resource("hrm_human_resource",
+                                 filter = htable.organisation_id.belongs(org_ids),
+                                 )
+        def timeseries(sql):
+            return S3TimeSeries(resource,
+                                start = "2015-01-01",
+                                end = "2019-01-01",
+                                slots = "months",
+                                event_start = "start_date",
+                                event_end = "end_date",
+                                rows = "organisation_id",
+                                facts = [S3TimeSeriesFact("count", "id"),
+                                         S3TimeSeriesFact("sum", "type"),
+                                         ],
+                                sql = sql,
+                                ).as_dict()
+
+        try:
+            info("")
+            timings = {}
+            for sql in (False, True):
+                x = lambda: timeseries(sql)
+                mlt = min(timeit.Timer(x).repeat(repeat=3, number=1))
+                timings[sql] = mlt
+                info("S3TimeSeries (%s records, %s) = %s ms" % \
+                     (size, "SQL" if sql else "Python", mlt * 1000))
+
+            # Both engines must produce the same time series
+            self.assertEqual(timeseries(True), timeseries(False))
+
+            self.assertTrue(timings[True] < timings[False])
+        finally:
+            current.auth.override = False
+            db.rollback()
+
+    def testGISLocationTreeRebuild(self):
+        """ Bulk rebuild of the location tree vs. feature by feature """
+
+        from s3.s3gis import GIS
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        # Synthetic hierarchy: 1 L0, 10 L1, 100 L2, 1000 L3 and
+        # 5000 specific locations inheriting their Lat/Lon
+        GIS.disable_update_location_tree = True
+        L0 = table.insert(level="L0", name="TreeBenchmarkL0", lat=10.0, lon=10.0)
+        parents = [L0]
+        features = [L0]
+        for level, width in (("L1", 10), ("L2", 10), ("L3", 10), (None, 5)):
+            parents = [table.insert(level = level,
+                                    name = "TreeBenchmark%s-%s-%s" % (level, parent, i),
+                                    parent = parent,
+                                    )
+                       for parent in parents
+                       for i in range(width)
+                       ]
+            features.extend(parents)
+        GIS.disable_update_location_tree = False
+
+        fields = [table.id,
+                  table.path,
+                  table.inherited,
+                  table.lat,
+                  table.lon,
+                  table.L0,
+                  table.L1,
+                  table.L2,
+                  table.L3,
+                  ]
+        query = table.id.belongs(features)
+        def reset():
+            db(query).update(path=None, L0=None, L1=None, L2=None, L3=None)
+        def tree():
+            return db(query).select(orderby=table.id, *fields).as_list()
+
+        try:
+            info("")
+
+            # Feature by feature
+            reset()
+            start = timeit.default_timer()
+            for feature in features:
+                GIS.update_location_tree({"id": feature})
+            single = timeit.default_timer() - start
+            expected = tree()
+            info("GIS.update_location_tree (%s locations, single) = %s ms" % \
+                 (len(features), single * 1000))
+
+            # Bulk
+            reset()
+            start = timeit.default_timer()
+            GIS.rebuild_location_tree()
+            bulk = timeit.default_timer() - start
+            info("GIS.rebuild_location_tree (%s locations) = %s ms" % \
+                 (len(features), bulk * 1000))
+
+            # Both must produce the same tree
+            self.assertEqual(tree(), expected)
+
+            self.assertTrue(bulk < single)
+        finally:
+            GIS.disable_update_location_tree = False
+            db.rollback()
+
+    def testTextIndexSearch(self):
+        """ Text search with full-text index vs. LIKE """
+
+        from s3 import FS, S3TextIndex
+
+        db = current.db
+        s3db = current.s3db
+        settings = current.deployment_settings
+
+        if settings.get_database_type() not in ("sqlite", "postgres"):
+            return
+
+        current.auth.override = True
+
+        # Large fixture: persons with generated names
+        table = s3db.pr_person
+        size = 50000
+        syllables = ("al", "ber", "cas", "dor", "el", "fin", "gar", "hil")
+        name = lambda i, n: "".join(syllables[(i // 8 ** k) % 8] for k in range(n))
+        for i in range(size):
+            table.insert(first_name = name(i, 3).capitalize(),
+                         last_name = "TextIndexBenchmark%s" % name(i, 5),
+                         )
+
+        query = (FS("first_name").lower().like("%casdor%")) | \
+                (FS("last_name").lower().like("%casdor%"))
+        def search():
+            resource = s3db.resource("pr_person", filter=query)
+            return sorted(row.id for row in resource.select(["id"], as_rows=True))
+
+        text_index = settings.database.get("text_index")
+        try:
+            info("")
+
+            # LIKE
+            mlt = min(timeit.Timer(search).repeat(repeat=3, number=1))
+            info("Text search (%s records, LIKE) = %s ms" % (size, mlt * 1000))
+            like = mlt
+
+            # Index
+            settings.database.text_index = {"pr_person": ["first_name", "last_name"]}
+            start = timeit.default_timer()
+            S3TextIndex("pr_person").create()
+            info("S3TextIndex build (%s records) = %s ms" % \
+                 (size, (timeit.default_timer() - start) * 1000))
+            mlt = min(timeit.Timer(search).repeat(repeat=3, number=1))
+            info("Text search (%s records, index) = %s ms" % (size, mlt * 1000))
+
+            self.assertTrue(mlt < like)
+        finally:
+            settings.database.text_index = text_index
+            current.auth.override = False
+            db.rollback()
+            db.executesql("DROP TABLE IF EXISTS pr_person_text_index;")
+            S3TextIndex.created.discard("pr_person")
+
+    def testGeoJSONExport(self):
+        """ Native GeoJSON export vs. S3XML + XSLT """
+
+        import json
+        import os
+        from gluon import Field
+        from s3.codecs.geojson import S3GeoJSON
+
+        db = current.db
+        s3db = current.s3db
+        auth = current.auth
+
+        tablename = "gis_test_geojson_points"
+        table = db.define_table(tablename,
+                                Field("name"),
+                                Field("value", "integer"),
+                                )
+
+        # Large fixture: 50k points with popup attributes
+        size = 50000
+        latlons = {}
+        attributes = {}
+        for i in range(size):
+            record_id = table.insert(name = "Point %s" % i,
+                                     value = i,
+                                     )
+            latlons[record_id] = (i % 180 - 90 + 0.12345, i % 360 - 180 + 0.54321)
+            attributes[record_id] = {"name": "Point %s" % i,
+                                     "value": i,
+                                     }
+        location_data = {"latlons": {tablename: latlons},
+                         "attributes": {tablename: attributes},
+                         }
+
+        stylesheet = os.path.join(current.request.folder,
+                                  "static", "formats", "geojson", "export.xsl",
+                                  )
+        def xslt():
+            resource = s3db.resource(tablename)
+            return resource.export_xml(fields = [],
+                                       mcomponents = None,
+                                       references = [],
+                                       dereference = False,
+                                       stylesheet = stylesheet,
+                                       as_json = True,
+                                       location_data = location_data,
+                                       )
+        def native():
+            resource = s3db.resource(tablename)
+            return S3GeoJSON().encode(resource,
+                                      location_data = location_data,
+                                      )
+
+        fmt = auth.permission.format
+        auth.override = True
+        auth.permission.format = "geojson"
+        try:
+            info("")
+            timings = {}
+            for name, encoder in (("XSLT", xslt), ("native", native)):
+                mlt = min(timeit.Timer(encoder).repeat(repeat=3, number=1))
+                timings[name] = mlt
+                info("GeoJSON export (%s points, %s) = %s ms" % \
+                     (size, name, mlt * 1000))
+
+            # Both must produce the same features
+            # (XSLT encodes coordinates as strings)
+            expected = json.loads(xslt())["features"]
+            for feature in expected:
+                geometry = feature["geometry"]
+                geometry["coordinates"] = [float(c) for c in geometry["coordinates"]]
+            self.assertEqual(json.loads(native())["features"], expected)
+
+            self.assertTrue(timings["native"] < timings["XSLT"])
+        finally:
+            auth.permission.format = fmt
+            auth.override = False
+            db.rollback()
+            table.drop()
+
+    def testBulkDelete(self):
+        """ Bulk vs. row-by-row archiving with deletion cascade """
+
+        from gluon import Field
+        from s3.s3delete import S3Delete
+        from s3.s3fields import s3_meta_fields
+
+        db = current.db
+        s3db = current.s3db
+
+        master = s3db.define_table("del_bench_master",
+                                   Field("name"),
+                                   *s3_meta_fields())
+        component = s3db.define_table("del_bench_component",
+                                      Field("master_id", master,
+                                            ondelete = "CASCADE",
+                                            ),
+                                      *s3_meta_fields())
+        linked = s3db.define_table("del_bench_linked",
+                                   Field("master_id", master,
+                                         ondelete = "SET NULL",
+                                         ),
+                                   *s3_meta_fields())
+
+        # Fixture: 2000 master records, each with 5 component records
+        # and 5 records with SET NULL references
+        size = 2000
+        def populate():
+            for i in range(size):
+                master_id = master.insert(name = "Master %s" % i)
+                for j in range(5):
+                    component.insert(master_id = master_id)
+                    linked.insert(master_id = master_id)
+
+        current.auth.override = True
+        try:
+            info("")
+            timings = {}
+            for name, bulk in (("row-by-row", False), ("bulk", True)):
+                populate()
+                query = (master.deleted == False)
+                resource = s3db.resource("del_bench_master", filter=query)
+                start = timeit.default_timer()
+                deleted = S3Delete(resource, bulk=bulk)()
+                timings[name] = timeit.default_timer() - start
+                info("S3Delete (%s records, %s) = %s ms" % \
+                     (size, name, timings[name] * 1000))
+
+                self.assertEqual(deleted, size)
+                query = (component.deleted == False)
+                self.assertEqual(db(query).count(), 0)
+                query = (linked.master_id != None)
+                self.assertEqual(db(query).count(), 0)
+
+            self.assertTrue(timings["bulk"] < timings["row-by-row"])
+        finally:
+            current.auth.override = False
+            db.rollback()
+            linked.drop()
+            component.drop()
+            master.drop()
+
+    def testKeysetPagination(self):
+        """ Deep paging with keyset vs. offset pagination """
+
+        from gluon import Field
+        from s3.s3fields import s3_meta_fields
+
+        db = current.db
+        s3db = current.s3db
+
+        table = s3db.define_table("dt_bench_person",
+                                  Field("last_name"),
+                                  *s3_meta_fields())
+
+        # Fixture: 100k records, many duplicate sort keys
+        size = 100000
+        for i in range(size):
+            table.insert(last_name = "Name %04d" % (i % 5000))
+
+        fields = ["id", "last_name"]
+        orderby = table.last_name
+        start, limit = size - 100, 25
+
+        current.auth.override = True
+        try:
+            resource = s3db.resource("dt_bench_person")
+
+            # Cursor of the page preceding the requested page
+            data = resource.select(fields,
+                                   start = start - limit,
+                                   limit = limit,
+                                   orderby = orderby,
+                                   seek = {},
+                                   )
+            last = data.cursors[1]
+
+            def offset():
+                return resource.select(fields,
+                                       start = start,
+                                       limit = limit,
+                                       orderby = [orderby, table._id],
+                                       ).rows
+            def keyset():
+                return resource.select(fields,
+                                       limit = limit,
+                                       orderby = orderby,
+                                       seek = {"after": last},
+                                       ).rows
+
+            info("")
+            timings = {}
+            for name, extract in (("offset", offset), ("keyset", keyset)):
+                mlt = min(timeit.Timer(extract).repeat(repeat=3, number=10)) / 10
+                timings[name] = mlt
+                info("Datatable page at %s of %s records (%s) = %s ms" % \
+                     (start, size, name, mlt * 1000))
+
+            # Both must produce the same page
+            self.assertEqual(keyset(), offset())
+            self.assertTrue(timings["keyset"] < timings["offset"])
+        finally:
+            current.auth.override = False
+            db.rollback()
+            table.drop()
+
 # =============================================================================
 if __name__ == "__main__":
 
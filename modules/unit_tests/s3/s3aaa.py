@@ -1004,13 +1004,17 @@ class ACLManagementTests(unittest.TestCase):
     def setUp(self):
 
         # Stash security policy
-        self.policy = current.deployment_settings.get_security_policy()
+        settings = current.deployment_settings
+        self.policy = settings.get_security_policy()
+        self.acl_cache = settings.get_security_acl_cache()
 
     # -------------------------------------------------------------------------
     def tearDown(self):
 
         # Restore security policy
-        current.deployment_settings.security.policy = self.policy
+        settings = current.deployment_settings
+        settings.security.policy = self.policy
+        settings.security.acl_cache = self.acl_cache
         auth = current.auth
         auth.permission = S3Permission(auth)
 
@@ -1162,6 +1166,113 @@ class ACLManagementTests(unittest.TestCase):
                 del table[acl_id]
             auth.s3_delete_role(group_id)
 
+    # -------------------------------------------------------------------------
+    def testSharedACLCache(self):
+        """ Test lookup of ACLs from the shared cache """
+
+        auth = current.auth
+
+        settings = current.deployment_settings
+        settings.security.policy = 5
+        settings.security.acl_cache = "ram"
+        auth.permission = permission = S3Permission(auth)
+
+        group_id = auth.s3_create_role("Test Role", uid="TEST")
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+
+        realms = {group_id: None}
+        lookup = lambda: permission.applicable_acls(permission.READ,
+                                                    realms = realms,
+                                                    c = "test",
+                                                    f = "test",
+                                                    t = "pr_person",
+                                                    )
+        stats = S3Permission.ACL_CACHE_STATS
+        try:
+            permission.update_acl(group_id,
+                                  t = "pr_person",
+                                  uacl = permission.READ,
+                                  oacl = permission.READ,
+                                  )
+
+            # First lookup from the database, second from the cache
+            misses = stats["misses"]
+            hits = stats["hits"]
+            acls = lookup()
+            assertTrue(stats["misses"] > misses)
+            assertTrue("ANY" in acls)
+            assertEqual(lookup(), acls)
+            assertEqual(stats["hits"], hits + 1)
+
+            # Updating the ACL expires the cache
+            permission.update_acl(group_id,
+                                  t = "pr_person",
+                                  uacl = permission.NONE,
+                                  oacl = permission.NONE,
+                                  )
+            misses = stats["misses"]
+            acls = lookup()
+            assertTrue(stats["misses"] > misses)
+            assertTrue("ANY" not in acls)
+
+        finally:
+            auth.s3_delete_role(group_id)
+
+    # -------------------------------------------------------------------------
+    def testSharedACLCacheExpiry(self):
+        """ Test that the shared ACL cache is expired again after commit """
+
+        auth = current.auth
+
+        settings = current.deployment_settings
+        settings.security.acl_cache = "ram"
+        auth.permission = permission = S3Permission(auth)
+
+        assertEqual = self.assertEqual
+
+        version = lambda: permission.acl_cache(S3Permission.ACL_CACHE_VERSION,
+                                               lambda: 0,
+                                               time_expire = None,
+                                               )
+
+        response = current.response
+        custom_commit = response.custom_commit
+        acl_cache_expire = response.s3_acl_cache_expire
+
+        committed = []
+        class Adapter(object):
+            def commit(self):
+                committed.append(version())
+
+        try:
+            response.custom_commit = None
+            response.s3_acl_cache_expire = None
+
+            # Expiring increments the version immediately
+            initial = version()
+            permission.expire_acl_cache()
+            assertEqual(version(), initial + 1)
+
+            # Repeated expiry within the same request
+            permission.expire_acl_cache()
+            assertEqual(version(), initial + 2)
+
+            # Commit at the end of the request increments it once more,
+            # after the changes have been committed
+            response.custom_commit(Adapter())
+            assertEqual(committed, [initial + 2])
+            assertEqual(version(), initial + 3)
+
+            # ...but only once
+            response.custom_commit(Adapter())
+            assertEqual(version(), initial + 3)
+
+        finally:
+            response.custom_commit = custom_commit
+            response.s3_acl_cache_expire = acl_cache_expire
+
 # =============================================================================
 class HasPermissionTests(unittest.TestCase):
     """ Test permission check method """
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# Codec Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3codecs.py
+#
+import unittest
+
+from importlib.util import find_spec
+
+from gluon import *
+from s3.codecs.xls import S3XLS
+from s3.s3fields import s3_meta_fields
+
+from unit_tests import run_suite
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# XLSX encoding also requires xlrd and xlwt
+XLSX = openpyxl is not None and \
+       all(find_spec(name) is not None for name in ("xlrd", "xlwt"))
+
+# =============================================================================
+@unittest.skipIf(not XLSX, "openpyxl, xlrd or xlwt not installed")
+class S3XLSXEncodeTests(unittest.TestCase):
+    """ Tests for the XLSX output of S3XLS """
+
+    names = ("Alpha",
+             "Bravo",
+             "Charlie",
+             "Delta with a very long name",
+             "Echo",
+             )
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        s3db = current.s3db
+
+        s3db.define_table("xls_test",
+                          Field("name"),
+                          Field("value", "integer"),
+                          *s3_meta_fields())
+
+        s3db.configure("xls_test",
+                       orderby = "xls_test.name",
+                       )
+
+        table = s3db.xls_test
+        for index, name in enumerate(cls.names):
+            table.insert(name = name,
+                         value = index,
+                         )
+
+        current.db.commit()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+        db.xls_test.drop()
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        # Extract the rows in several pages
+        self.page_size = S3XLS.PAGE_SIZE
+        S3XLS.PAGE_SIZE = 2
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.auth.override = False
+        S3XLS.PAGE_SIZE = self.page_size
+
+    # -------------------------------------------------------------------------
+    def encode(self):
+        """
+            Encode the test table as XLSX, and read the result
+
+            @returns: the first worksheet
+        """
+
+        resource = current.s3db.resource("xls_test")
+        output = S3XLS().encode(resource,
+                                list_fields = ["name", "value"],
+                                as_stream = True,
+                                xlsx = True,
+                                )
+
+        book = openpyxl.load_workbook(output)
+        return book.worksheets[0]
+
+    # -------------------------------------------------------------------------
+    def testEncode(self):
+        """ Test that all rows are written, in order """
+
+        assertEqual = self.assertEqual
+
+        sheet = self.encode()
+        rows = list(sheet.iter_rows(values_only=True))
+
+        # Header row
+        assertEqual(list(rows[0][:2]), ["Name", "Value"])
+
+        # All rows from all pages, in order
+        data = [row[:2] for row in rows[1:] if any(row)]
+        assertEqual([row[0] for row in data], list(self.names))
+        assertEqual([row[1] for row in data], list(range(len(self.names))))
+
+    # -------------------------------------------------------------------------
+    def testColumnWidths(self):
+        """ Test that column widths are adjusted to the contents """
+
+        sheet = self.encode()
+
+        # Width of the name column fits the longest name
+        width = sheet.column_dimensions["A"].width
+        expected = len(self.names[3]) * S3XLS.COL_WIDTH_MULTIPLIER / 256.0
+        self.assertAlmostEqual(width, expected, 3)
+
+        # Width of the value column is the minimum width
+        width = sheet.column_dimensions["B"].width
+        self.assertAlmostEqual(width, 2000 / 256.0, 3)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        S3XLSXEncodeTests,
+    )
+
+# END ========================================================================
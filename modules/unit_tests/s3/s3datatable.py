@@ -94,11 +94,109 @@ class S3DataTableTests(unittest.TestCase):
 
         current.auth.override = False
 
+# =============================================================================
+class S3DataTableCursorTests(unittest.TestCase):
+    """ Tests for keyset pagination cursors of S3DataTable """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        s3 = current.session.s3
+
+        # Save the current cursors
+        self.dt_cursors = s3.dt_cursors
+        s3.dt_cursors = {}
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.session.s3.dt_cursors = self.dt_cursors
+
+    # -------------------------------------------------------------------------
+    def testSignature(self):
+        """ Test query signatures """
+
+        assertEqual = self.assertEqual
+        assertNotEqual = self.assertNotEqual
+
+        signature = S3DataTable.signature("query", "filter", "orderby")
+
+        assertEqual(signature, S3DataTable.signature("query", "filter", "orderby"))
+        assertNotEqual(signature, S3DataTable.signature("query", "filter", "other"))
+
+    # -------------------------------------------------------------------------
+    def testSetCursor(self):
+        """ Test storing of the cursors of a datatable page """
+
+        assertEqual = self.assertEqual
+
+        cursors = current.session.s3.dt_cursors
+
+        dt = S3DataTable([], [{}, {}, {}])
+        dt.cursors = ((1,), (3,))
+        dt.set_cursor("list", "signature", 3, (10, 10))
+
+        cursor = cursors.get("list")
+        assertEqual(cursor, {"signature": "signature",
+                             "start": 3,
+                             "end": 6,
+                             "first": (1,),
+                             "last": (3,),
+                             "numrows": (10, 10),
+                             })
+
+        # Incomplete keys => drops the cursor
+        dt.cursors = ((1,), None)
+        dt.set_cursor("list", "signature", 3, (10, 10))
+        self.assertNotIn("list", cursors)
+
+    # -------------------------------------------------------------------------
+    def testGetCursor(self):
+        """ Test seek parameters from the cursors of the previous page """
+
+        assertEqual = self.assertEqual
+
+        get_cursor = S3DataTable.get_cursor
+
+        # No cursor
+        assertEqual(get_cursor("list", "signature", 3, 3), (None, None))
+
+        current.session.s3.dt_cursors["list"] = {"signature": "signature",
+                                                 "start": 3,
+                                                 "end": 6,
+                                                 "first": (1,),
+                                                 "last": (3,),
+                                                 "numrows": (10, 10),
+                                                 }
+
+        # Next page
+        assertEqual(get_cursor("list", "signature", 6, 3),
+                    ({"after": (3,)}, (10, 10)))
+
+        # Previous page
+        assertEqual(get_cursor("list", "signature", 0, 3), (None, None))
+        current.session.s3.dt_cursors["list"]["start"] = 6
+        assertEqual(get_cursor("list", "signature", 3, 3),
+                    ({"before": (1,)}, (10, 10)))
+
+        # Random jump
+        assertEqual(get_cursor("list", "signature", 12, 3), (None, None))
+
+        # Different query signature
+        assertEqual(get_cursor("list", "other", 9, 3), (None, None))
+
+        # Different list ID
+        assertEqual(get_cursor("other", "signature", 9, 3), (None, None))
+
+        # No limit
+        assertEqual(get_cursor("list", "signature", 9, None), (None, None))
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         S3DataTableTests,
+        S3DataTableCursorTests,
     )
 
 # END ========================================================================
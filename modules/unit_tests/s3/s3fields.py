@@ -299,6 +299,53 @@ class S3RepresentTests(unittest.TestCase):
         # All that should have taken exactly 2 queries!
         self.assertEqual(r.queries, 2)
 
+    # -------------------------------------------------------------------------
+    def testSharedCache(self):
+        """ Test lookups from the shared representation cache """
+
+        settings = current.deployment_settings
+        represent_cache = settings.get_base_represent_cache()
+        settings.base.represent_cache = ("org_organisation",)
+
+        try:
+            # First instance looks up from the database
+            r = S3Represent(lookup="org_organisation")
+            self.assertEqual(r.bulk([self.id1, self.id2])[self.id1], self.name1)
+            self.assertEqual(r.queries, 1)
+
+            # Second instance (=next request) finds them in the cache
+            r = S3Represent(lookup="org_organisation")
+            self.assertEqual(r(self.id1), self.name1)
+            self.assertEqual(r(self.id2), self.name2)
+            self.assertEqual(r.queries, 0)
+
+            stats = S3RepresentCache.statistics()
+            name = [k for k in stats if k.startswith("org_organisation:S3Represent:")]
+            self.assertEqual(len(name), 1)
+            self.assertTrue(stats[name[0]]["hits"] >= 2)
+
+            # Updating the record invalidates the cache
+            otable = current.s3db.org_organisation
+            current.db(otable.id == self.id1).update(name="Renamed Organisation")
+            r = S3Represent(lookup="org_organisation")
+            self.assertEqual(r(self.id1), "Renamed Organisation")
+            self.assertEqual(r.queries, 1)
+
+            # Lambdas and closures bypass the shared cache, as they
+            # cannot be told apart by name
+            def labels(prefix):
+                return lambda row: "%s %s" % (prefix, row.name)
+            for prefix in ("A", "B"):
+                r = S3Represent(lookup="org_organisation",
+                                labels=labels(prefix))
+                self.assertEqual(r(self.id2), "%s %s" % (prefix, self.name2))
+                self.assertEqual(r.cache_name, None)
+                self.assertEqual(r.queries, 1)
+
+        finally:
+            settings.base.represent_cache = represent_cache
+            S3RepresentCache.invalidate("org_organisation")
+
     # -------------------------------------------------------------------------
     def tearDown(self):
 
@@ -7,6 +7,8 @@
 
 import unittest
 import datetime
+import json
+import os
 from gluon import *
 from gluon.storage import Storage
 from s3 import *
@@ -773,6 +775,101 @@ class S3LocationTreeTests(unittest.TestCase):
         current.auth.override = False
         current.db.rollback()
 
+# =============================================================================
+class S3LocationTreeRebuildTests(unittest.TestCase):
+    """ Tests for the bulk rebuild of the Location Tree """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.auth.override = False
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testRebuild(self):
+        """ Test rebuilding the location tree for all locations """
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+
+        db = current.db
+        table = current.s3db.gis_location
+
+        # Locations with outdated path and Lx, last modified in the past
+        past = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        L0 = "Rebuild Country"
+        L1 = "Rebuild L1"
+        L2 = "Rebuild L2"
+        L0_id = table.insert(name = L0,
+                             level = "L0",
+                             lat = 10,
+                             lon = 20,
+                             modified_on = past,
+                             )
+        L1_id = table.insert(name = L1,
+                             level = "L1",
+                             parent = L0_id,
+                             modified_on = past,
+                             )
+        L2_id = table.insert(name = L2,
+                             level = "L2",
+                             parent = L1_id,
+                             lat = 11,
+                             lon = 21,
+                             modified_on = past,
+                             )
+        location_id = table.insert(name = "Rebuild Location",
+                                   parent = L2_id,
+                                   modified_on = past,
+                                   )
+        location_ids = (L0_id, L1_id, L2_id, location_id)
+
+        cache = S3RepresentCache.instance()
+        version = cache.versions.get("gis_location", 0)
+
+        # Rebuild the tree
+        updated = GIS.rebuild_location_tree(batch_size=2)
+        assertTrue(updated >= len(location_ids))
+
+        rows = db(table.id.belongs(location_ids)).select(table.id,
+                                                         table.path,
+                                                         table.inherited,
+                                                         table.lat,
+                                                         table.lon,
+                                                         table.L0,
+                                                         table.L1,
+                                                         table.L2,
+                                                         table.modified_on,
+                                                         )
+        rows = {row.id: row for row in rows}
+
+        # Paths and Lx names
+        record = rows[location_id]
+        assertEqual(record.path, "%s/%s/%s/%s" % location_ids)
+        assertEqual(record.L0, L0)
+        assertEqual(record.L1, L1)
+        assertEqual(record.L2, L2)
+        assertEqual(rows[L1_id].path, "%s/%s" % (L0_id, L1_id))
+        assertEqual(rows[L1_id].L2, None)
+
+        # Lat/Lon inherited from the nearest parent
+        assertTrue(rows[L1_id].inherited)
+        assertEqual((rows[L1_id].lat, rows[L1_id].lon), (10, 20))
+        assertTrue(record.inherited)
+        assertEqual((record.lat, record.lon), (11, 21))
+
+        # Updated locations have been marked as modified
+        for row in rows.values():
+            assertTrue(row.modified_on > past)
+
+        # Cached representations have been invalidated
+        assertTrue(cache.versions.get("gis_location", 0) > version)
+
 # =============================================================================
 class S3NoGisConfigTests(unittest.TestCase):
     """
@@ -810,12 +907,210 @@ class S3NoGisConfigTests(unittest.TestCase):
         xml = map.xml()
         self.assertTrue(b"Map cannot display without GIS config!" in xml)
 
+# =============================================================================
+class S3GeoJSONTests(unittest.TestCase):
+    """ Tests for the native GeoJSON encoder """
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        db = current.db
+        db.define_table("gis_test_geojson",
+                        Field("name"),
+                        )
+        table = db["gis_test_geojson"]
+        cls.ids = [table.insert(name="Feature %s" % i) for i in range(3)]
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+        db.gis_test_geojson.drop()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def testSupported(self):
+        """ Test detection of resources which require the XSLT stylesheet """
+
+        from s3.codecs.geojson import S3GeoJSON
+
+        s3db = current.s3db
+
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+
+        assertTrue(S3GeoJSON.supported(s3db.resource("gis_test_geojson")))
+        assertFalse(S3GeoJSON.supported(s3db.resource("gis_location")))
+        assertFalse(S3GeoJSON.supported(s3db.resource("gis_feature_query")))
+
+    # -------------------------------------------------------------------------
+    def testFeatureCollection(self):
+        """ Test encoding of Lat/Lon features with attributes and styles """
+
+        from s3.codecs.geojson import S3GeoJSON
+
+        assertEqual = self.assertEqual
+
+        tablename = "gis_test_geojson"
+        ids = self.ids
+        location_data = {"latlons": {tablename: {ids[0]: (10.123456, 20.5),
+                                                 ids[1]: (None, None),
+                                                 ids[2]: (-1.0, 2.0),
+                                                 },
+                                     },
+                         "attributes": {tablename: {ids[0]: {"name": "A",
+                                                             "count": 3,
+                                                             "ratio": 2.0,
+                                                             },
+                                                    },
+                                        },
+                         "styles": {tablename: {ids[2]: '{"fill":"ff0000"}'}},
+                         }
+
+        resource = current.s3db.resource(tablename)
+        output = S3GeoJSON().encode(resource,
+                                    orderby = "gis_test_geojson.id",
+                                    location_data = location_data,
+                                    map_data = {"level": 1},
+                                    )
+        output = json.loads(output)
+
+        assertEqual(output["type"], "FeatureCollection")
+        assertEqual(output["s3"], {"level": 1})
+
+        # Record without coordinates is skipped
+        features = output["features"]
+        assertEqual(len(features), 2)
+
+        feature = features[0]
+        assertEqual(feature["geometry"], {"type": "Point",
+                                          "coordinates": [20.5, 10.1235],
+                                          })
+        assertEqual(feature["properties"], {"id": ids[0],
+                                             "name": "A",
+                                             "count": 3,
+                                             "ratio": 2,
+                                             })
+
+        feature = features[1]
+        assertEqual(feature["properties"], {"id": ids[2],
+                                             "style": {"fill": "ff0000"},
+                                             })
+
+    # -------------------------------------------------------------------------
+    def testSingleFeature(self):
+        """ Test encoding of a single record with pre-prepared GeoJSON """
+
+        from s3.codecs.geojson import S3GeoJSON
+
+        assertEqual = self.assertEqual
+
+        tablename = "gis_test_geojson"
+        record_id = self.ids[0]
+        polygon = '{"type":"Polygon","coordinates":[[[0,0],[1,0],[1,1],[0,0]]]}'
+        location_data = {"geojsons": {tablename: {record_id: [polygon]}},
+                         "markers": {tablename: {"image": "marker.png",
+                                                 "height": 32,
+                                                 "width": 20,
+                                                 },
+                                     },
+                         }
+
+        resource = current.s3db.resource(tablename, id=record_id)
+        output = json.loads(S3GeoJSON().encode(resource,
+                                               location_data = location_data,
+                                               ))
+
+        # Single Feature rather than a FeatureCollection
+        assertEqual(output["type"], "Feature")
+        assertEqual(output["geometry"], json.loads(polygon))
+
+        properties = output["properties"]
+        assertEqual(properties["id"], record_id)
+        assertEqual(properties["marker_height"], "32")
+        assertEqual(properties["marker_width"], "20")
+        self.assertTrue(properties["marker_url"].endswith("/static/img/markers/marker.png"))
+
+    # -------------------------------------------------------------------------
+    def testCompareXSLT(self):
+        """ Test that the output matches that of the XSLT stylesheet """
+
+        from s3.codecs.geojson import S3GeoJSON
+
+        tablename = "gis_test_geojson"
+        ids = self.ids
+        location_data = {"latlons": {tablename: {ids[0]: (10.123456, 20.5),
+                                                 ids[1]: (-1.0, 2.0),
+                                                 },
+                                     },
+                         "attributes": {tablename: {ids[0]: {"name": "A",
+                                                             "count": 3,
+                                                             "ratio": 2.5,
+                                                             "active": True,
+                                                             "closed": False,
+                                                             "status": None,
+                                                             },
+                                                    },
+                                        },
+                         "styles": {tablename: {ids[1]: '{"fill":"ff0000"}'}},
+                         }
+
+        resource = current.s3db.resource(tablename, id=ids[:2])
+        native = json.loads(S3GeoJSON().encode(resource,
+                                               orderby = "gis_test_geojson.id",
+                                               location_data = location_data,
+                                               ))
+
+        stylesheet = os.path.join(current.request.folder,
+                                  "static", "formats", "geojson", "export.xsl",
+                                  )
+        permission = current.auth.permission
+        fmt, permission.format = permission.format, "geojson"
+        try:
+            resource = current.s3db.resource(tablename, id=ids[:2])
+            xslt = json.loads(resource.export_xml(stylesheet = stylesheet,
+                                                  as_json = True,
+                                                  orderby = "gis_test_geojson.id",
+                                                  location_data = location_data,
+                                                  ))
+        finally:
+            permission.format = fmt
+
+        def normalize(feature):
+            # The XSLT stylesheet renders coordinates as strings
+            geometry = feature["geometry"]
+            geometry["coordinates"] = [round(float(c), 4) for c in geometry["coordinates"]]
+            return feature
+
+        self.assertEqual([normalize(f) for f in native["features"]],
+                         [normalize(f) for f in xslt["features"]],
+                         )
+
+        # Booleans and None as text representations of their JSON values
+        properties = native["features"][0]["properties"]
+        self.assertEqual(properties["active"], "true")
+        self.assertEqual(properties["closed"], "false")
+        self.assertEqual(properties["status"], "null")
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         S3LocationTreeTests,
+        S3LocationTreeRebuildTests,
         S3NoGisConfigTests,
+        S3GeoJSONTests,
         )
 
 # END ========================================================================
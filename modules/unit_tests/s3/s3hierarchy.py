@@ -270,6 +270,187 @@ class S3HierarchyTests(unittest.TestCase):
             # Cleanup
             db(table.uuid.like("HIERARCHY1-3%")).delete()
 
+    # -------------------------------------------------------------------------
+    def testIncrementalUpdate(self):
+        """ Test incremental update of a stored hierarchy """
+
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+        assertEqual = self.assertEqual
+
+        db = current.db
+        s3db = current.s3db
+
+        uids = self.uids
+        node_id = uids["HIERARCHY1-2-1"]
+        old_parent = uids["HIERARCHY1-2"]
+        new_parent = uids["HIERARCHY2-1"]
+
+        table = db.test_hierarchy
+        htable = s3db.s3_hierarchy
+        dtable = s3db.s3_hierarchy_delta
+
+        # Rebuild and store the hierarchy
+        h = S3Hierarchy("test_hierarchy")
+        h.dirty("test_hierarchy")
+        assertTrue(node_id in h.children(old_parent))
+
+        query = (htable.tablename == "test_hierarchy")
+        row = db(query).select(htable.dirty,
+                               htable.version,
+                               limitby = (0, 1),
+                               ).first()
+        assertFalse(row.dirty)
+        version = row.version
+
+        try:
+            # Move the node to another parent
+            db(table.id == node_id).update(parent = new_parent)
+            S3Hierarchy.dirty("test_hierarchy", record_ids=[node_id])
+
+            # Verify that the node has been moved
+            assertFalse(node_id in h.children(old_parent))
+            assertTrue(node_id in h.children(new_parent))
+            assertEqual(h.parent(node_id), new_parent)
+
+            # Verify that only the update has been stored
+            row = db(query).select(htable.dirty,
+                                   htable.version,
+                                   limitby = (0, 1),
+                                   ).first()
+            assertFalse(row.dirty)
+            assertEqual(row.version, version)
+
+            query = (dtable.tablename == "test_hierarchy") & \
+                    (dtable.node_id == node_id)
+            delta = db(query).select(dtable.parent_id,
+                                     dtable.removed,
+                                     orderby = ~dtable.id,
+                                     limitby = (0, 1),
+                                     ).first()
+            assertEqual(delta.parent_id, new_parent)
+            assertFalse(delta.removed)
+
+            # Verify that the update is applied in subsequent requests
+            current.model["hierarchies"].pop("test_hierarchy", None)
+            h = S3Hierarchy("test_hierarchy")
+            assertEqual(h.parent(node_id), new_parent)
+            assertFalse(node_id in h.children(old_parent))
+
+        finally:
+            # Restore the original parent
+            db(table.id == node_id).update(parent = old_parent)
+            S3Hierarchy.dirty("test_hierarchy")
+
+    # -------------------------------------------------------------------------
+    def testDirectUpdate(self):
+        """ Test that direct DAL writes update the stored hierarchy """
+
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+        assertEqual = self.assertEqual
+
+        db = current.db
+        hierarchies = current.model["hierarchies"]
+
+        uids = self.uids
+        node_id = uids["HIERARCHY1-1-2"]
+        old_parent = uids["HIERARCHY1-1"]
+        new_parent = uids["HIERARCHY2"]
+
+        table = db.test_hierarchy
+
+        # Rebuild and store the hierarchy
+        S3Hierarchy.dirty("test_hierarchy")
+        h = S3Hierarchy("test_hierarchy")
+        assertTrue(node_id in h.children(old_parent))
+
+        new_id = None
+        try:
+            # Update and insert without telling the hierarchy
+            db(table.id == node_id).update(parent = new_parent)
+            new_id = table.insert(name = "Type 2-2",
+                                  category = "Cat 1",
+                                  parent = new_parent,
+                                  )
+
+            # Verify that the changes are visible in subsequent requests
+            hierarchies.pop("test_hierarchy", None)
+            h = S3Hierarchy("test_hierarchy")
+            assertEqual(h.parent(node_id), new_parent)
+            assertFalse(node_id in h.children(old_parent))
+            assertEqual(h.parent(new_id), new_parent)
+            assertEqual(h.category(new_id), "Cat 1")
+
+            # Delete the new record
+            db(table.id == new_id).delete()
+            new_id = None
+
+            hierarchies.pop("test_hierarchy", None)
+            h = S3Hierarchy("test_hierarchy")
+            assertEqual(set(h.children(new_parent)),
+                        {uids["HIERARCHY2-1"], node_id})
+
+        finally:
+            # Restore the original state
+            if new_id:
+                db(table.id == new_id).delete()
+            db(table.id == node_id).update(parent = old_parent)
+            S3Hierarchy.dirty("test_hierarchy")
+
+    # -------------------------------------------------------------------------
+    def testConcurrentSave(self):
+        """ Test that a hierarchy is not saved over a newer version """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        s3db = current.s3db
+        hierarchies = current.model["hierarchies"]
+
+        htable = s3db.s3_hierarchy
+        query = (htable.tablename == "test_hierarchy")
+
+        # Rebuild and store the hierarchy
+        S3Hierarchy.dirty("test_hierarchy")
+        S3Hierarchy("test_hierarchy").nodes
+        version = db(query).select(htable.version,
+                                   limitby = (0, 1),
+                                   ).first().version
+
+        # Load the hierarchy, then let another process store a new version
+        hierarchies.pop("test_hierarchy", None)
+        h = S3Hierarchy("test_hierarchy")
+        h.nodes
+        db(query).update(version = version + 1)
+
+        # Try to save the loaded version => should be skipped
+        h.flags["dbupdate"] = True
+        h.save()
+
+        row = db(query).select(htable.version,
+                               htable.dirty,
+                               limitby = (0, 1),
+                               ).first()
+        assertEqual(row.version, version + 1)
+
+        # Marking as dirty increments the version, too
+        hierarchies.pop("test_hierarchy", None)
+        h = S3Hierarchy("test_hierarchy")
+        h.nodes
+        S3Hierarchy.dirty("test_hierarchy")
+
+        row = db(query).select(htable.version,
+                               htable.dirty,
+                               limitby = (0, 1),
+                               ).first()
+        assertEqual(row.version, version + 2)
+        self.assertTrue(row.dirty)
+
+        # Rebuild
+        hierarchies.pop("test_hierarchy", None)
+        S3Hierarchy("test_hierarchy").nodes
+
     # -------------------------------------------------------------------------
     def testDeleteBranchFailure(self):
         """
@@ -14,7 +14,7 @@ from gluon.storage import Storage
 from lxml import etree
 
 from s3 import S3Duplicate, S3ImportItem, S3ImportJob, s3_meta_fields
-from s3.s3import import S3ObjectReferences
+from s3.s3import import S3BulkImporter, S3ObjectReferences, S3StreamImport
 
 from unit_tests import run_suite
 
@@ -532,6 +532,53 @@ class DuplicateDetectionTests(unittest.TestCase):
         assertEqual(item.id, None)
         assertEqual(item.method, item.METHOD.CREATE)
 
+    # -------------------------------------------------------------------------
+    def testBulkMatch(self):
+        """ Test match with pre-loaded candidates (bulk mode) """
+
+        assertEqual = self.assertEqual
+
+        deduplicate = S3Duplicate(primary=("name",),
+                                  secondary=("secondary",),
+                                  bulk=True,
+                                  )
+
+        job = self.job
+        table = current.db.dedup_test
+        ids = self.ids
+
+        samples = (({"name": "Test0"}, ids["TEST0"]),
+                   ({"name": "Test2", "secondary": "secondaryX"}, ids["TEST2"]),
+                   ({"name": "test4", "secondary": "secondaryX"}, None),
+                   ({"name": "Test"}, None),
+                   )
+
+        items = []
+        for data, _ in samples:
+            item = S3ImportItem(job)
+            item.table = table
+            item.tablename = table._tablename
+            item.method = item.METHOD.CREATE
+            item.data = Storage(data)
+            items.append(item)
+
+        # Pre-load the candidates
+        deduplicate.prefetch(job, table, items)
+        index = deduplicate.get_index(items[0])
+        self.assertNotEqual(index, None)
+
+        for item, (_, expected) in zip(items, samples):
+
+            # Must be decided by the index
+            self.assertTrue(index.primary_key(item.data) in index.keys)
+
+            deduplicate(item)
+            assertEqual(item.id, expected)
+            if expected:
+                assertEqual(item.method, item.METHOD.UPDATE)
+            else:
+                assertEqual(item.method, item.METHOD.CREATE)
+
     # -------------------------------------------------------------------------
     def testExceptions(self):
         """ Test S3Duplicate exceptions for nonexistent fields """
@@ -1182,6 +1229,351 @@ class UIDCollisionHandlingTests(unittest.TestCase):
             assertEqual(row.type1_id, type1_id)
             assertEqual(row.type2_id, type2_id)
 
+# =============================================================================
+class ReferencePrefetchTests(unittest.TestCase):
+    """ Test job-wide prefetch of referenced records """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        s3db = current.s3db
+
+        # Create the referenced organisations
+        resource = s3db.resource("org_organisation")
+        self.org_ids = {}
+        for uid in ("RPTORG1", "RPTORG2"):
+            org_id = resource.insert(uuid = uid,
+                                     name = "Reference Prefetch %s" % uid,
+                                     )
+            self.org_ids[uid] = org_id
+
+    # -------------------------------------------------------------------------
+    def testPrefetch(self):
+        """ Test that all UID references are looked up at once """
+
+        xmlstr = """
+<s3xml>
+    <resource name="org_office">
+        <data field="name">RPTOffice1</data>
+        <reference field="organisation_id" resource="org_organisation" uuid="RPTORG1"/>
+    </resource>
+    <resource name="org_office">
+        <data field="name">RPTOffice2</data>
+        <reference field="organisation_id" resource="org_organisation" uuid="RPTORG2"/>
+    </resource>
+    <resource name="org_office">
+        <data field="name">RPTOffice3</data>
+        <reference field="organisation_id" resource="org_organisation" uuid="RPTORGX"/>
+    </resource>
+</s3xml>"""
+
+        tree = etree.ElementTree(etree.fromstring(xmlstr))
+
+        assertEqual = self.assertEqual
+
+        job = S3ImportJob(current.s3db.org_office, tree)
+        job.prefetch()
+
+        idmap = job._idmap.get("org_organisation")
+        self.assertNotEqual(idmap, None)
+        assertEqual(idmap.get("RPTORG1"), self.org_ids["RPTORG1"])
+        assertEqual(idmap.get("RPTORG2"), self.org_ids["RPTORG2"])
+        # Non-existent records are remembered as such
+        self.assertTrue("RPTORGX" in idmap)
+        assertEqual(idmap["RPTORGX"], None)
+
+        # Lookups are answered from the map
+        found = job.lookup_uids(current.s3db.org_organisation,
+                                ["RPTORG1", "RPTORGX"],
+                                )
+        assertEqual(found, {"RPTORG1": self.org_ids["RPTORG1"]})
+
+    # -------------------------------------------------------------------------
+    def testImport(self):
+        """ Test that prefetched references are resolved correctly """
+
+        xmlstr = """
+<s3xml>
+    <resource name="org_office">
+        <data field="name">RPTOffice4</data>
+        <reference field="organisation_id" resource="org_organisation" uuid="RPTORG2"/>
+    </resource>
+</s3xml>"""
+
+        tree = etree.ElementTree(etree.fromstring(xmlstr))
+
+        db = current.db
+        resource = current.s3db.resource("org_office")
+        result = json.loads(resource.import_xml(tree))
+        self.assertEqual(result["status"], "success")
+
+        table = resource.table
+        row = db(table.name == "RPTOffice4").select(table.organisation_id,
+                                                    limitby = (0, 1),
+                                                    ).first()
+        self.assertNotEqual(row, None)
+        self.assertEqual(row.organisation_id, self.org_ids["RPTORG2"])
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+# =============================================================================
+class CommitOrderTests(unittest.TestCase):
+    """ Test the commit order of import items """
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        self.job = S3ImportJob(current.s3db.org_organisation)
+
+    # -------------------------------------------------------------------------
+    def add_items(self, *names):
+        """ Add dummy items to the job """
+
+        job = self.job
+
+        items = {}
+        for name in names:
+            item = S3ImportItem(job)
+            item.tablename = name
+            items[name] = item
+            job.items[item.item_id] = item
+        return items
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def reference(item, ritem):
+        """ Add a reference from item to ritem """
+
+        entry = Storage(item_id = ritem.item_id)
+        item.references.append(Storage(field = "test", entry = entry))
+
+    # -------------------------------------------------------------------------
+    def testOrder(self):
+        """ Test that referenced items are committed first """
+
+        items = self.add_items("A", "B", "C", "D")
+        reference = self.reference
+
+        reference(items["A"], items["C"])
+        reference(items["C"], items["B"])
+        reference(items["D"], items["A"])
+
+        names = [self.job.items[item_id].tablename
+                 for item_id in self.job.order()]
+        self.assertEqual(names, ["B", "C", "A", "D"])
+        self.assertEqual(self.job.cycles, [])
+
+    # -------------------------------------------------------------------------
+    def testCycles(self):
+        """ Test detection of circular references """
+
+        items = self.add_items("A", "B", "C")
+        reference = self.reference
+
+        reference(items["A"], items["B"])
+        reference(items["B"], items["C"])
+        reference(items["C"], items["A"])
+
+        job = self.job
+        order = job.order()
+
+        # All items are still in the list, exactly once
+        self.assertEqual(len(order), 3)
+        self.assertEqual(set(order), set(item.item_id for item in items.values()))
+
+        # The cycle has been reported
+        self.assertEqual(len(job.cycles), 1)
+        cycle = [job.items[item_id].tablename for item_id in job.cycles[0]]
+        self.assertEqual(cycle, ["A", "B", "C"])
+
+    # -------------------------------------------------------------------------
+    def testRejected(self):
+        """ Test that rejected items do not affect the order """
+
+        items = self.add_items("A", "B")
+        items["B"].accepted = False
+        self.reference(items["A"], items["B"])
+
+        names = [self.job.items[item_id].tablename
+                 for item_id in self.job.order()]
+        self.assertEqual(names, ["A", "B"])
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        self.job = None
+
+# =============================================================================
+class StreamImportCheckpointTests(unittest.TestCase):
+    """ Tests for resuming chunked imports from a checkpoint """
+
+    STYLESHEET = """<?xml version="1.0" encoding="utf-8"?>
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+    <xsl:output method="xml"/>
+    <xsl:template match="/">
+        <s3xml><xsl:apply-templates select="table/row"/></s3xml>
+    </xsl:template>
+    <xsl:template match="row">
+        <resource name="import_stream_test">
+            <data field="name"><xsl:value-of select="col[@field='Name']"/></data>
+        </resource>
+    </xsl:template>
+</xsl:stylesheet>"""
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        import os
+        import tempfile
+
+        current.s3db.define_table("import_stream_test",
+                                  Field("name"),
+                                  *s3_meta_fields())
+
+        cls.folder = folder = tempfile.mkdtemp()
+
+        cls.stylesheet = os.path.join(folder, "import_stream_test.xsl")
+        with open(cls.stylesheet, "w") as stylesheet:
+            stylesheet.write(cls.STYLESHEET)
+
+        cls.filename = os.path.join(folder, "import_stream_test.csv")
+
+        current.db.commit()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        import shutil
+
+        current.db.import_stream_test.drop()
+        current.db.commit()
+
+        shutil.rmtree(cls.folder)
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        # The import task
+        self.task = [1, "default", "import_stream_test",
+                     self.filename, self.stylesheet, None,
+                     ]
+        self.job_id = S3BulkImporter.stream_job_id(self.task)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.auth.override = False
+
+        db = current.db
+        db(db.import_stream_test.id > 0).delete()
+        S3ImportJob.set_checkpoint(self.job_id, None)
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def write_source(self, names):
+        """
+            Write the CSV source file
+
+            @param names: the names to write
+        """
+
+        with open(self.filename, "w") as source:
+            source.write("Name\n")
+            for name in names:
+                source.write("%s\n" % name)
+
+    # -------------------------------------------------------------------------
+    def run_import(self):
+        """
+            Run the chunked import of the source file
+
+            @returns: the names of all imported records
+        """
+
+        resource = current.s3db.resource("import_stream_test")
+        with open(self.filename, "rb") as source:
+            S3BulkImporter().import_stream(resource, source, self.task, None, 2)
+
+        table = resource.table
+        rows = current.db(table.id > 0).select(table.name, orderby=table.id)
+        return [row.name for row in rows]
+
+    # -------------------------------------------------------------------------
+    def testDigest(self):
+        """ Test digest of the source contents """
+
+        assertEqual = self.assertEqual
+        assertNotEqual = self.assertNotEqual
+
+        self.write_source(["A", "B"])
+        with open(self.filename, "rb") as source:
+            source.read(3)
+            digest = S3StreamImport.digest(source)
+            # Source position is retained
+            assertEqual(source.tell(), 3)
+        assertNotEqual(digest, None)
+
+        # Same name, different contents => different digest
+        self.write_source(["A", "C"])
+        with open(self.filename, "rb") as source:
+            assertNotEqual(S3StreamImport.digest(source), digest)
+
+    # -------------------------------------------------------------------------
+    def testResume(self):
+        """ Test resuming an import from a checkpoint """
+
+        assertEqual = self.assertEqual
+
+        names = ["A", "B", "C", "D", "E"]
+        self.write_source(names)
+        with open(self.filename, "rb") as source:
+            digest = S3StreamImport.digest(source)
+
+        # Checkpoint of an interrupted import of the same source
+        S3ImportJob.set_checkpoint(self.job_id, 2, digest=digest)
+        assertEqual(S3ImportJob.get_checkpoint(self.job_id, digest=digest), 2)
+
+        # Only the remaining rows are imported
+        assertEqual(self.run_import(), names[2:])
+
+        # Completed import removes the checkpoint
+        assertEqual(S3ImportJob.get_checkpoint(self.job_id, digest=digest), 0)
+
+    # -------------------------------------------------------------------------
+    def testDiscard(self):
+        """ Test discarding the checkpoint of a changed source """
+
+        assertEqual = self.assertEqual
+
+        self.write_source(["A", "B", "C"])
+        with open(self.filename, "rb") as source:
+            digest = S3StreamImport.digest(source)
+        S3ImportJob.set_checkpoint(self.job_id, 2, digest=digest)
+
+        # Source has changed since the checkpoint
+        names = ["X", "Y", "Z", "A"]
+        self.write_source(names)
+
+        # All rows are imported
+        assertEqual(self.run_import(), names)
+
+        # Checkpoint without digest is discarded too
+        S3ImportJob.set_checkpoint(self.job_id, 2)
+        assertEqual(S3ImportJob.get_checkpoint(self.job_id, digest=digest), 0)
+        table = S3ImportJob.define_job_table()
+        query = (table.job_id == self.job_id)
+        assertEqual(current.db(query).count(), 0)
+
 # =============================================================================
 if __name__ == "__main__":
 
@@ -1196,6 +1588,9 @@ if __name__ == "__main__":
         ObjectReferencesTests,
         ObjectReferencesImportTests,
         UIDCollisionHandlingTests,
+        ReferencePrefetchTests,
+        CommitOrderTests,
+        StreamImportCheckpointTests,
         )
 
 # END ========================================================================
@@ -369,11 +369,165 @@ class S3OutboxTests(unittest.TestCase):
         else:
             return False
 
+# =============================================================================
+class S3NotificationsTests(unittest.TestCase):
+    """ Subscription notification tests """
+
+    # -------------------------------------------------------------------------
+    def testGroupKey(self):
+        """ Test grouping of subscriptions by resource and filter """
+
+        from s3.s3notify import S3Notifications
+
+        def row(resource, url, notify_on, query):
+            return Storage(pr_subscription = Storage(notify_on = notify_on),
+                           pr_subscription_resource = Storage(resource = resource,
+                                                              url = url,
+                                                              ),
+                           pr_filter = Storage(query = query),
+                           )
+
+        key = S3Notifications._group_key
+
+        assertEqual = self.assertEqual
+        assertNotEqual = self.assertNotEqual
+
+        # Equivalent filters in different order
+        a = row("event_incident", "event/incident", ["new", "upd"],
+                '[["~.name__like", "A*"], ["~.status", "open"]]')
+        b = row("event_incident", "event/incident", ["upd", "new"],
+                '[["~.status","open"],["~.name__like","A*"]]')
+        assertEqual(key(a), key(b))
+
+        # Different filter
+        c = row("event_incident", "event/incident", ["new", "upd"],
+                '[["~.status", "closed"]]')
+        assertNotEqual(key(a), key(c))
+
+        # Different trigger
+        d = row("event_incident", "event/incident", ["new"],
+                '[["~.name__like", "A*"], ["~.status", "open"]]')
+        assertNotEqual(key(a), key(d))
+
+        # No filter
+        e = row("event_incident", "event/incident", ["new"], None)
+        f = row("event_incident", "event/incident", ["new"], None)
+        assertEqual(key(e), key(f))
+
+    # -------------------------------------------------------------------------
+    def testLoopbackFallback(self):
+        """ Test that controller-filtered resources are notified by loopback """
+
+        from s3.s3notify import S3Notifications
+
+        db = current.db
+        s3db = current.s3db
+        settings = current.deployment_settings
+
+        assertEqual = self.assertEqual
+
+        # Record which path the subscriptions take
+        notified = []
+        def notify_group(cls, rows):
+            notified.append(("group", sorted(row.pr_subscription_resource.id for row in rows)))
+            return []
+        def notify_loopback(cls, row):
+            notified.append(("loopback", row.pr_subscription_resource.id))
+            return ""
+
+        notify_batch = settings.get_msg_notify_batch()
+        customise = settings.pop("customise_org_office_controller", None)
+
+        _notify_group = S3Notifications.__dict__["_notify_group"]
+        _notify_loopback = S3Notifications.__dict__["_notify_loopback"]
+        S3Notifications._notify_group = classmethod(notify_group)
+        S3Notifications._notify_loopback = classmethod(notify_loopback)
+
+        stable = s3db.pr_subscription
+        rtable = s3db.pr_subscription_resource
+
+        def subscribe(resource, url):
+            subscription_id = stable.insert(notify_on = ["new"],
+                                            frequency = "daily",
+                                            method = ["EMAIL"],
+                                            )
+            return rtable.insert(subscription_id = subscription_id,
+                                 resource = resource,
+                                 url = url,
+                                 )
+        try:
+            settings.msg.notify_batch = ("org/office",)
+
+            # CAP alerts: controller filters out templates in prep
+            # => one loopback request per subscriber
+            ids = [subscribe("cap_alert", "cap/alert") for _ in range(2)]
+            del notified[:]
+            S3Notifications.notify(ids)
+            assertEqual(sorted(notified), [("loopback", ids[0]),
+                                           ("loopback", ids[1]),
+                                           ])
+
+            # Whitelisted controller => batch
+            ids = [subscribe("org_office", "org/office") for _ in range(2)]
+            del notified[:]
+            S3Notifications.notify(ids)
+            assertEqual(notified, [("group", ids)])
+
+            # Not whitelisted => loopback
+            settings.msg.notify_batch = ()
+            del notified[:]
+            S3Notifications.notify(ids)
+            assertEqual(len(notified), 2)
+            self.assertTrue(all(item[0] == "loopback" for item in notified))
+
+        finally:
+            S3Notifications._notify_group = _notify_group
+            S3Notifications._notify_loopback = _notify_loopback
+            settings.msg.notify_batch = notify_batch
+            if customise is not None:
+                settings.customise_org_office_controller = customise
+            db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testBatchable(self):
+        """ Test detection of subscriptions requiring a loopback request """
+
+        from s3.s3notify import S3Notifications
+
+        def row(resource, url):
+            return Storage(pr_subscription_resource = Storage(resource = resource,
+                                                              url = url,
+                                                              ))
+
+        batchable = S3Notifications._batchable
+
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+
+        # Controller function serving the subscribed table
+        assertTrue(batchable(row("event_incident", "event/incident")))
+        assertTrue(batchable(row("event_incident", "/event/incident.html?~.status=open")))
+
+        # Tablename differs from controller/function
+        assertFalse(batchable(row("hrm_human_resource", "hrm/staff")))
+        assertFalse(batchable(row("hrm_human_resource", "hrm/volunteer")))
+        assertFalse(batchable(row("cms_post", "cms/newsfeed")))
+
+        # Customised controller
+        settings = current.deployment_settings
+        customise = settings.get("customise_event_incident_controller")
+        settings.customise_event_incident_controller = lambda **attr: attr
+        try:
+            assertFalse(batchable(row("event_incident", "event/incident")))
+        finally:
+            settings.customise_event_incident_controller = customise
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         S3OutboxTests,
+        S3NotificationsTests,
     )
 
 # END ========================================================================
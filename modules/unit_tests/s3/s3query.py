@@ -3055,6 +3055,298 @@ class AIRegexTests(unittest.TestCase):
 
         current.deployment_settings.database.airegex = switch
 
+# =============================================================================
+class TextIndexTests(unittest.TestCase):
+    """ Tests for text search with full-text index """
+
+    @classmethod
+    def setUpClass(cls):
+
+        db = current.db
+
+        # Define test table
+        db.define_table("text_index_test",
+                        Field("name"),
+                        Field("comments"),
+                        *s3_meta_fields())
+
+        # Import sample records
+        samples = (
+            {"uuid": "TEST0", "name": "John Smith", "comments": "Volunteer"},
+            {"uuid": "TEST1", "name": "Jane Smithers", "comments": None},
+            {"uuid": "TEST2", "name": "Jo Goldsmith", "comments": "Staff"},
+            {"uuid": "TEST3", "name": "Anna Johnson", "comments": "Smiling"},
+        )
+        table = db.text_index_test
+        for data in samples:
+            table.insert(**data)
+
+        current.db.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+        db.text_index_test.drop()
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+        settings = current.deployment_settings
+        self.text_index = settings.database.get("text_index")
+        settings.database.text_index = {"text_index_test": ["name"]}
+
+    def tearDown(self):
+
+        db = current.db
+        db.rollback()
+
+        db.executesql("DROP TABLE IF EXISTS text_index_test_text_index;")
+        db.commit()
+        S3TextIndex.created.discard("text_index_test")
+        S3TextIndex.scheduled.discard("text_index_test")
+
+        current.deployment_settings.database.text_index = self.text_index
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def testTerms(self):
+        """ Test conversion of LIKE-patterns into search terms """
+
+        assertEqual = self.assertEqual
+
+        terms = S3TextIndex.terms
+
+        assertEqual(terms("%smi%"), ["smi"])
+        assertEqual(terms(["%smi%", "%jo%"]), ["smi", "jo"])
+        assertEqual(terms("%john smi%"), ["john smi"])
+        assertEqual(terms("%10\\%%"), ["10%"])
+
+        # Patterns which can not be searched with the index
+        assertEqual(terms("smi%"), None)
+        assertEqual(terms("%s%i%"), None)
+        assertEqual(terms("%s_i%"), None)
+        assertEqual(terms("%-%"), None)
+        assertEqual(terms(["%smi%", "smi"]), None)
+        assertEqual(terms(1), None)
+
+    # -------------------------------------------------------------------------
+    def testTransform(self):
+        """ Test transformation of text filters into index queries """
+
+        if current.deployment_settings.get_database_type() not in ("sqlite", "postgres"):
+            return
+
+        assertEqual = self.assertEqual
+
+        resource = current.s3db.resource("text_index_test")
+
+        # Index not built yet => LIKE
+        S3TextIndex.scheduled.add("text_index_test")
+        query = FS("name").lower().like("%smi%")
+        assertEqual(query.transform(resource).op, S3ResourceQuery.LIKE)
+
+        S3TextIndex("text_index_test").rebuild()
+
+        # Text filter covering the index
+        transformed = query.transform(resource)
+        assertEqual(transformed.op, S3ResourceQuery.MATCH)
+        assertEqual(transformed.right, ["smi"])
+
+        # Additional selectors are still searched with LIKE
+        query = (FS("name").lower().like("%smi%")) | \
+                (FS("comments").lower().like("%smi%"))
+        transformed = query.transform(resource)
+        assertEqual(transformed.op, S3ResourceQuery.OR)
+        assertEqual(transformed.left.op, S3ResourceQuery.MATCH)
+        assertEqual(transformed.right.op, S3ResourceQuery.LIKE)
+
+        # Text filters not covering the index are not transformed
+        query = FS("comments").lower().like("%smi%")
+        assertEqual(query.transform(resource).op, S3ResourceQuery.LIKE)
+
+        # Inner wildcards are not transformed
+        query = FS("name").lower().like("%s%i%")
+        assertEqual(query.transform(resource).op, S3ResourceQuery.LIKE)
+
+        # Negated text filters are not transformed
+        query = ~(FS("name").lower().like("%smi%"))
+        assertEqual(query.transform(resource).left.op, S3ResourceQuery.LIKE)
+
+    # -------------------------------------------------------------------------
+    def testSearch(self):
+        """ Test text search with full-text index """
+
+        if current.deployment_settings.get_database_type() not in ("sqlite", "postgres"):
+            return
+
+        s3db = current.s3db
+
+        assertEqual = self.assertEqual
+
+        def search(query):
+            resource = s3db.resource("text_index_test", filter=query)
+            rows = resource.select(["uuid"], as_rows=True)
+            return sorted(row.uuid for row in rows)
+
+        # Index not built yet => LIKE (substring)
+        S3TextIndex.scheduled.add("text_index_test")
+        query = FS("name").lower().like("%smi%")
+        assertEqual(search(query), ["TEST0", "TEST1", "TEST2"])
+
+        # Records written before the build are not indexed separately
+        record = current.db.text_index_test(uuid="TEST0")
+        S3TextIndex.update("text_index_test", [record.id])
+        self.assertFalse(S3TextIndex("text_index_test").exists())
+
+        S3TextIndex("text_index_test").rebuild()
+
+        # Word prefixes
+        assertEqual(search(query), ["TEST0", "TEST1"])
+
+        # Match any
+        query = FS("name").lower().like(["%smi%", "%anna%"])
+        assertEqual(search(query), ["TEST0", "TEST1", "TEST3"])
+
+        # Match all
+        query = (FS("name").lower().like("%jo%")) & \
+                (FS("name").lower().like("%smi%"))
+        assertEqual(search(query), ["TEST0"])
+
+        # Additional selector
+        query = (FS("name").lower().like("%smi%")) | \
+                (FS("comments").lower().like("%smi%"))
+        assertEqual(search(query), ["TEST0", "TEST1", "TEST3"])
+
+        # Update the index
+        table = current.db.text_index_test
+        record = table(uuid="TEST3")
+        record.update_record(name="Anna Smiley")
+        S3TextIndex.update("text_index_test", [record.id])
+        query = FS("name").lower().like("%smi%")
+        assertEqual(search(query), ["TEST0", "TEST1", "TEST3"])
+
+        # Remove deleted records from the index
+        record.update_record(deleted=True)
+        S3TextIndex.update("text_index_test", [record.id])
+        assertEqual(search(query), ["TEST0", "TEST1"])
+
+# =============================================================================
+class NameTokensTests(unittest.TestCase):
+    """ Tests for the name token index for autocompletes """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+        S3NameTokens.built.discard("pr_person")
+        S3NameTokens.scheduled.discard("pr_person")
+
+    # -------------------------------------------------------------------------
+    def testTokens(self):
+        """ Test normalization and tokenization of names """
+
+        assertEqual = self.assertEqual
+
+        words = S3NameTokens.words
+        assertEqual(words("José  Ñandú-Smith"), ["jose", "nandu", "smith"])
+        assertEqual(words(None), [])
+
+        tokens = S3NameTokens.tokens
+        assertEqual(tokens("Bo Ab"), {"b", "bo", "a", "ab"})
+
+        # Long words are truncated
+        word = "x" * (S3NameTokens.MAX_LENGTH + 5)
+        assertEqual(max(len(t) for t in tokens(word)), S3NameTokens.MAX_LENGTH)
+
+    # -------------------------------------------------------------------------
+    def testQuery(self):
+        """ Test token lookups """
+
+        db = current.db
+        s3db = current.s3db
+
+        assertEqual = self.assertEqual
+
+        table = s3db.pr_person
+        person_ids = [table.insert(first_name="Tokenström", last_name="Ändersen"),
+                      table.insert(first_name="Tokenstrom", last_name="Meyer"),
+                      table.insert(first_name="Anders", last_name="Tokenstrom",
+                                   middle_name="Xaver"),
+                      ]
+        tokens = S3NameTokens("pr_person")
+        tokens.refresh(person_ids)
+
+        def search(value, fieldnames=None):
+            query = tokens.query(table._id, value, fieldnames)
+            return [row.id for row in db(query).select(table.id,
+                                                       orderby = table.id,
+                                                       )]
+
+        # Tokens not built yet => fall back to LIKE
+        S3NameTokens.scheduled.add("pr_person")
+        if not tokens.available():
+            assertEqual(tokens.query(table._id, "tokenstro"), None)
+            s3db.s3_name_token.insert(tablename = "pr_person",
+                                      record_id = 0,
+                                      )
+
+        assertEqual(search("tokenstro"), person_ids)
+        assertEqual(search("tokenstrom and"), [person_ids[0], person_ids[2]])
+        assertEqual(search("xav tokenstr"), [person_ids[2]])
+        assertEqual(search("xav tokenstr", ("first_name", "last_name")), [])
+        assertEqual(tokens.query(table._id, "--"), None)
+
+        # Deleted records are removed
+        db(table.id == person_ids[2]).update(deleted=True)
+        tokens.refresh(person_ids)
+        assertEqual(search("tokenstro"), person_ids[:2])
+
+    # -------------------------------------------------------------------------
+    def testTrack(self):
+        """ Test token maintenance for direct writes """
+
+        db = current.db
+        s3db = current.s3db
+
+        assertEqual = self.assertEqual
+
+        S3NameTokens.track("pr_person")
+
+        table = s3db.pr_person
+        ttable = s3db.s3_name_token
+
+        def tokens(person_id):
+            query = (ttable.tablename == "pr_person") & \
+                    (ttable.record_id == person_id)
+            rows = db(query).select(ttable.token)
+            return {row.token for row in rows}
+
+        # Insert
+        person_id = table.insert(first_name="Trackström")
+        self.assertTrue("trackstrom" in tokens(person_id))
+
+        # Update
+        db(table.id == person_id).update(first_name="Tracey")
+        self.assertTrue("tracey" in tokens(person_id))
+        self.assertFalse("trackstrom" in tokens(person_id))
+
+        # Update not affecting the indexed fields
+        db(table.id == person_id).update(comments="Test")
+        self.assertTrue("tracey" in tokens(person_id))
+
+        # Delete
+        db(table.id == person_id).delete()
+        assertEqual(tokens(person_id), set())
+
 # =============================================================================
 if __name__ == "__main__":
 
@@ -3077,6 +3369,8 @@ if __name__ == "__main__":
         ResourceDataAccessTests,
 
         AIRegexTests,
+        TextIndexTests,
+        NameTokensTests,
     )
 
 # END ========================================================================
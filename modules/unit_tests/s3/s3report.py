@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Report (Pivot Table) Unit Tests
+#
+# To run this script use:
+# python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3report.py
+#
+import unittest
+
+from gluon import *
+from s3.s3fields import s3_meta_fields
+from s3.s3report import S3PivotTable, S3PivotTableFact
+
+from unit_tests import run_suite
+
+# =============================================================================
+class PivotTableSQLTests(unittest.TestCase):
+    """ Tests for pivot table aggregation in the database """
+
+    test_data = (("A", 1, 10),
+                 ("A", 1, 5),
+                 ("A", 2, None),
+                 ("B", 1, 3),
+                 ("B", 2, 0),
+                 ("B", 2, 7),
+                 )
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        s3db = current.s3db
+
+        s3db.define_table("pivot_test",
+                          Field("category"),
+                          Field("status", "integer"),
+                          Field("value", "integer"),
+                          *s3_meta_fields())
+
+        table = s3db.pivot_test
+        cls.record_ids = [table.insert(category = category,
+                                       status = status,
+                                       value = value,
+                                       )
+                          for category, status, value in cls.test_data]
+
+        current.db.commit()
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+        db.pivot_test.drop()
+        db.commit()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.auth.override = False
+        current.s3db.clear_config("pivot_test", "report_fields")
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def pivot(sql=True):
+        """
+            Build the test pivot table
+
+            @param sql: let the database compute the aggregates
+        """
+
+        resource = current.s3db.resource("pivot_test")
+        facts = S3PivotTableFact.parse(["count(id)",
+                                        "sum(value)",
+                                        "max(value)",
+                                        "avg(value)",
+                                        ])
+        return S3PivotTable(resource, "category", "status", facts, sql=sql)
+
+    # -------------------------------------------------------------------------
+    def testAggregates(self):
+        """ Test cell values and totals computed by the database """
+
+        assertEqual = self.assertEqual
+
+        pt = self.pivot()
+
+        # Aggregates have been computed by the database
+        self.assertNotEqual(pt.keys, None)
+
+        # Axis values in order of first appearance
+        assertEqual([row.value for row in pt.row], ["A", "B"])
+        assertEqual([col.value for col in pt.col], [1, 2])
+
+        count = ("id", "count")
+        total = ("value", "sum")
+        maximum = ("value", "max")
+        average = ("value", "avg")
+
+        cells = pt.cell
+
+        # Counts
+        assertEqual([[cell[count] for cell in row] for row in cells],
+                    [[2, 1], [1, 2]])
+        assertEqual([row[count] for row in pt.row], [3, 3])
+        assertEqual([col[count] for col in pt.col], [3, 3])
+        assertEqual(pt.totals[count], 6)
+
+        # Sums
+        assertEqual(cells[0][0][total], 15)
+        assertEqual(cells[1][1][total], 7)
+        assertEqual([row[total] for row in pt.row], [15, 10])
+        assertEqual(pt.totals[total], 25)
+
+        # Maximum and average
+        assertEqual(cells[0][0][maximum], 10)
+        assertEqual(pt.totals[maximum], 10)
+        assertEqual(pt.totals[average], 5)
+
+        # Cell records
+        record_ids = self.record_ids
+        assertEqual(cells[0][0]["records"], record_ids[:2])
+        assertEqual(cells[1][1]["records"], record_ids[4:])
+        assertEqual(sorted(pt.records.keys()), record_ids)
+
+        # Only records with a non-zero value contribute to the sum
+        assertEqual(pt.keys[total],
+                    {record_ids[0], record_ids[1], record_ids[3], record_ids[5]})
+
+    # -------------------------------------------------------------------------
+    def testEngines(self):
+        """ Test that both engines produce the same pivot table """
+
+        self.assertEqual(self.pivot(sql=True).json(),
+                         self.pivot(sql=False).json())
+
+    # -------------------------------------------------------------------------
+    def testFallback(self):
+        """ Test fallback to the Python engine where records are required """
+
+        current.s3db.configure("pivot_test",
+                               report_fields = ["category", "status"],
+                               )
+
+        pt = self.pivot()
+
+        # Records have been extracted
+        self.assertEqual(pt.keys, None)
+        self.assertEqual(pt.totals[("id", "count")], 6)
+
+# =============================================================================
+if __name__ == "__main__":
+
+    run_suite(
+        PivotTableSQLTests,
+    )
+
+# END ========================================================================
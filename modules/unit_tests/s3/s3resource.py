@@ -16,6 +16,7 @@ from gluon.storage import Storage
 
 from s3 import *
 from s3dal import Row
+from s3.s3delete import S3Delete
 
 from unit_tests import run_suite
 
@@ -2146,6 +2147,190 @@ class ResourceSelectTests(unittest.TestCase):
         for index, row in enumerate(rows):
             assertEqual(row["select_master.id"], ids[index])
 
+    # -------------------------------------------------------------------------
+    def testSelectKeyset(self):
+        """ Test selection with keyset pagination """
+
+        s3db = current.s3db
+
+        assertEqual = self.assertEqual
+
+        resource = s3db.resource("select_master")
+        table = resource.table
+
+        # Expected order of names
+        names = [item[0] for item in self.test_data]
+
+        # Page through the resource
+        seen = []
+        last = None
+        while True:
+            data = resource.select(["id", "name"],
+                                   limit = 3,
+                                   orderby = table._id,
+                                   after = last,
+                                   )
+            rows = data.rows
+            if not rows:
+                break
+            ids = [row["select_master.id"] for row in rows]
+            # - pages are in primary key order
+            assertEqual(ids, sorted(ids))
+            if last is not None:
+                # - ...and start after the last record of the previous page
+                self.assertTrue(ids[0] > last)
+            seen.extend(row["select_master.name"] for row in rows)
+            last = ids[-1]
+
+        # - all records seen exactly once
+        assertEqual(seen, names)
+
+        # Pages from S3Exporter.pages are the same
+        seen = []
+        for data in S3Exporter.pages(resource, ["name"], 4):
+            seen.extend(row["select_master.name"] for row in data.rows)
+        assertEqual(seen, names)
+
+    # -------------------------------------------------------------------------
+    def testSelectSeek(self):
+        """ Test selection with keyset pagination for an orderby """
+
+        s3db = current.s3db
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+
+        resource = s3db.resource("select_master")
+        table = resource.table
+
+        # Status descending, ties broken by ID
+        orderby = ~table.status
+        expected = resource.select(["id"],
+                                   orderby = [~table.status, table._id],
+                                   as_rows = True,
+                                   )
+        expected = [row["select_master.id"] for row in expected]
+
+        # Page forward through the resource
+        seen = []
+        seek = {}
+        while True:
+            data = resource.select(["id", "status"],
+                                   limit = 3,
+                                   orderby = orderby,
+                                   seek = seek,
+                                   )
+            rows = data.rows
+            if not rows:
+                break
+            # - all pages after the first one are extracted by seeking
+            assertEqual(data.seek, bool(seek))
+            ids = [row["select_master.id"] for row in rows]
+            first, last = data.cursors
+            assertEqual(first[-1], ids[0])
+            assertEqual(last[-1], ids[-1])
+            seen.extend(ids)
+            seek = {"after": last}
+
+        # - all records seen exactly once, in orderby order
+        assertEqual(seen, expected)
+
+        # Page backward from the last page
+        data = resource.select(["id", "status"],
+                               start = 7,
+                               limit = 3,
+                               orderby = orderby,
+                               seek = {},
+                               )
+        assertTrue(not data.seek)
+        seen = [row["select_master.id"] for row in data.rows]
+        while True:
+            data = resource.select(["id", "status"],
+                                   limit = 3,
+                                   orderby = orderby,
+                                   seek = {"before": data.cursors[0]},
+                                   )
+            rows = data.rows
+            if not rows:
+                break
+            seen = [row["select_master.id"] for row in rows] + seen
+        assertEqual(seen, expected)
+
+        # Key not matching the orderby => falls back to start/limit
+        data = resource.select(["id"],
+                               start = 3,
+                               limit = 3,
+                               orderby = orderby,
+                               seek = {"after": (0,)},
+                               )
+        assertTrue(not data.seek)
+        assertEqual([row["select_master.id"] for row in data.rows],
+                    expected[3:6])
+
+    # -------------------------------------------------------------------------
+    def testSelectApproximateCount(self):
+        """ Test selection with approximate counting """
+
+        s3db = current.s3db
+
+        assertEqual = self.assertEqual
+
+        resource = s3db.resource("select_master")
+        numitems = len(self.test_data)
+
+        # Estimate below ESTIMATE_MIN (or not available) => exact count
+        data = resource.select(["id", "name"],
+                               limit = 3,
+                               count = True,
+                               approximate = True,
+                               )
+        assertEqual(len(data.rows), 3)
+        assertEqual(data.numrows, numitems)
+
+        # Cached count
+        data = resource.select(["id", "name"],
+                               start = 3,
+                               limit = 3,
+                               count = True,
+                               approximate = 60,
+                               )
+        assertEqual(len(data.rows), 3)
+        assertEqual(data.numrows, numitems)
+
+        # Filtered resource
+        query = FS("status") == "A"
+        resource = s3db.resource("select_master", filter=query)
+        expected = len([item for item in self.test_data if item[1] == "A"])
+        data = resource.select(["id", "name"],
+                               limit = 2,
+                               count = True,
+                               approximate = 60,
+                               )
+        assertEqual(len(data.rows), 2)
+        assertEqual(data.numrows, expected)
+
+    # -------------------------------------------------------------------------
+    def testEstimate(self):
+        """ Test estimation of the number of rows from planner statistics """
+
+        db = current.db
+
+        table = db.select_master
+        sql = db(table.id > 0)._select(table.id)
+
+        estimate = S3ResourceFilter.estimate(sql)
+        if db._dbname == "postgres":
+            self.assertTrue(isinstance(estimate, int))
+            self.assertTrue(estimate >= 0)
+
+            # Failing EXPLAIN => no estimate, but transaction still usable
+            estimate = S3ResourceFilter.estimate("SELECT nonexistent FROM select_master")
+            self.assertEqual(estimate, None)
+            self.assertEqual(db(table.id > 0).count(), len(self.test_data))
+        else:
+            # Not available for other database engines
+            self.assertEqual(estimate, None)
+
     # -------------------------------------------------------------------------
     def testSelectSubset(self):
         """ Test selection of unfiltered subset (pagination) """
@@ -3719,6 +3904,292 @@ class ResourceDeleteTests(unittest.TestCase):
         finally:
             table.drop()
 
+    # -------------------------------------------------------------------------
+    def testArchiveBulk(self):
+        """
+            Test bulk archiving of multiple super-entity instance records
+            which are referenced by other records with CASCADE constraint
+        """
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+
+        s3db = current.s3db
+
+        # Create more master records and link them to the SE
+        table = s3db.del_master
+        master_ids = [self.master_id]
+        for i in range(3):
+            master_id = table.insert()
+            s3db.update_super(table, {"id": master_id})
+            master_ids.append(master_id)
+
+        rows = current.db(table._id.belongs(master_ids)).select(table.del_super_id)
+        super_ids = [row.del_super_id for row in rows]
+
+        # Define component table
+        s3db.define_table("del_component",
+                          Field("del_master_id",
+                                s3db.del_master,
+                                ondelete="CASCADE"),
+                          *s3_meta_fields())
+        component = s3db["del_component"]
+        s3db.add_components("del_master",
+                            del_component="del_master_id")
+
+        try:
+            # Create two component records for each master record
+            component_ids = {}
+            for master_id in master_ids:
+                for i in range(2):
+                    component_id = component.insert(del_master_id=master_id)
+                    component_ids[component_id] = master_id
+            current.db.commit()
+
+            # Delete all master records as set
+            resource = s3db.resource("del_master", id=master_ids)
+            delete = S3Delete(resource, bulk=True)
+            success = delete()
+            assertEqual(success, len(master_ids))
+            assertEqual(resource.error, None)
+
+            # Master records are deleted and unlinked
+            for master_id in master_ids:
+                record = table[master_id]
+                assertTrue(record.deleted)
+                assertEqual(record.del_super_id, None)
+
+            # Super-records are deleted
+            stable = s3db.del_super
+            for super_id in super_ids:
+                assertTrue(stable[super_id].deleted)
+
+            # Component records are deleted and unlinked, and remember
+            # their respective master record
+            for component_id, master_id in component_ids.items():
+                component_record = component[component_id]
+                assertTrue(component_record.deleted)
+                assertEqual(component_record.del_master_id, None)
+                assertEqual(json.loads(component_record.deleted_fk),
+                            {"del_master_id": master_id})
+
+            # Check callbacks
+            assertTrue(self.master_deleted in master_ids)
+            assertTrue(self.super_deleted in super_ids)
+            assertTrue(self.component_deleted in component_ids)
+
+        finally:
+            component.drop()
+            del current.model["components"]["del_master"]["component"]
+
+    # -------------------------------------------------------------------------
+    def create_masters(self, number=3):
+        """
+            Create more master records for bulk tests
+
+            @param number: the number of records to create
+
+            @returns: list of all master record IDs
+        """
+
+        s3db = current.s3db
+
+        table = s3db.del_master
+        master_ids = [self.master_id]
+        for i in range(number):
+            master_id = table.insert()
+            s3db.update_super(table, {"id": master_id})
+            master_ids.append(master_id)
+
+        current.db.commit()
+        return master_ids
+
+    # -------------------------------------------------------------------------
+    def testArchiveBulkRestrict(self):
+        """
+            Test bulk archiving of multiple records one of which is
+            referenced by another record with RESTRICT constraint
+        """
+
+        assertEqual = self.assertEqual
+        assertFalse = self.assertFalse
+
+        s3db = current.s3db
+
+        master_ids = self.create_masters()
+
+        # Define component table
+        s3db.define_table("del_component",
+                          Field("del_master_id",
+                                s3db.del_master,
+                                ondelete="RESTRICT"),
+                          *s3_meta_fields())
+        component = s3db["del_component"]
+        s3db.add_components("del_master",
+                            del_component="del_master_id")
+
+        try:
+            # Create a component record for one of the master records
+            component_id = component.insert(del_master_id=master_ids[1])
+            current.db.commit()
+
+            # Delete all master records as set
+            resource = s3db.resource("del_master", id=master_ids)
+            delete = S3Delete(resource, bulk=True)
+            success = delete()
+            assertEqual(success, 0)
+            assertEqual(resource.error, current.ERROR.INTEGRITY_ERROR)
+
+            # Error is reported for the referenced record
+            assertEqual(list(delete.errors.keys()), [("del_master", master_ids[1])])
+
+            # No master record is deleted (entire set fails)
+            table = s3db.del_master
+            for master_id in master_ids:
+                assertFalse(table[master_id].deleted)
+
+            # Component record is not deleted and still linked
+            component_record = component[component_id]
+            assertFalse(component_record.deleted)
+            assertEqual(component_record.del_master_id, master_ids[1])
+
+            # Check callbacks
+            assertEqual(self.master_deleted, 0)
+
+        finally:
+            component.drop()
+            del current.model["components"]["del_master"]["component"]
+
+    # -------------------------------------------------------------------------
+    def testArchiveBulkPermission(self):
+        """
+            Test permission checks for bulk archiving, including
+            records outside of the accessible query (e.g. unapproved)
+        """
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+
+        s3db = current.s3db
+        s3db.clear_config("del_master", "super_entity")
+
+        auth = current.auth
+        table = s3db.del_master
+
+        master_ids = self.create_masters()
+
+        # Records 1 and 2 are outside of the accessible query,
+        # but record 2 is accessible when checked individually
+        denied = set(master_ids[1:2])
+        s3_accessible_query = auth.s3_accessible_query
+        def accessible_query(method, table, c=None, f=None):
+            query = s3_accessible_query(method, table, c=c, f=f)
+            if method == "delete":
+                query &= ~(table._id.belongs(master_ids[1:3]))
+            return query
+        def has_permission(method, table=None, record_id=None, **attr):
+            return record_id not in denied
+
+        auth.s3_accessible_query = accessible_query
+        auth.s3_has_permission = has_permission
+        try:
+            # Delete all master records as set
+            resource = s3db.resource("del_master", id=master_ids)
+            delete = S3Delete(resource, bulk=True)
+            success = delete()
+
+            # Permission error for record 1 fails the entire set
+            assertEqual(success, 0)
+            assertEqual(resource.error, current.ERROR.NOT_PERMITTED)
+            assertEqual(list(delete.errors.keys()), [("del_master", master_ids[1])])
+            for master_id in master_ids:
+                assertFalse(table[master_id].deleted)
+
+            # Permit record 1 individually
+            denied.clear()
+
+            resource = s3db.resource("del_master", id=master_ids)
+            delete = S3Delete(resource, bulk=True)
+            success = delete()
+
+            # All records are deleted
+            assertEqual(success, len(master_ids))
+            assertEqual(resource.error, None)
+            for master_id in master_ids:
+                assertTrue(table[master_id].deleted)
+
+        finally:
+            del auth.s3_accessible_query
+            del auth.s3_has_permission
+
+    # -------------------------------------------------------------------------
+    def testArchiveBulkCascadeErrors(self):
+        """
+            Test that errors in the bulk deletion cascade are reported
+            for the respective master record
+        """
+
+        assertEqual = self.assertEqual
+        assertTrue = self.assertTrue
+        assertFalse = self.assertFalse
+
+        s3db = current.s3db
+        s3db.clear_config("del_master", "super_entity")
+
+        master_ids = self.create_masters()
+
+        # Define component table
+        s3db.define_table("del_component",
+                          Field("del_master_id",
+                                s3db.del_master,
+                                ondelete="CASCADE"),
+                          *s3_meta_fields())
+        component = s3db["del_component"]
+        s3db.add_components("del_master",
+                            del_component="del_master_id")
+
+        try:
+            # Create a component record for each master record
+            component_ids = [component.insert(del_master_id=master_id)
+                             for master_id in master_ids]
+            current.db.commit()
+
+            # Component of master record 2 can not be deleted
+            undeletable = component_ids[2]
+            def prepare(row):
+                if row.id == undeletable:
+                    raise RuntimeError("Undeletable")
+            s3db.configure("del_component",
+                           ondelete_cascade = prepare,
+                           )
+
+            # Delete all master records as set
+            resource = s3db.resource("del_master", id=master_ids)
+            delete = S3Delete(resource, bulk=True)
+            success = delete()
+            assertEqual(success, 0)
+            assertEqual(resource.error, current.ERROR.INTEGRITY_ERROR)
+
+            # Error is reported for master record 2, with the
+            # component record error as sub-error
+            errors = delete.errors
+            assertEqual(list(errors.keys()), [("del_master", master_ids[2])])
+            error = errors[("del_master", master_ids[2])]
+            assertTrue(("del_component", undeletable) in error)
+
+            # Neither master nor component records are deleted
+            table = s3db.del_master
+            for master_id in master_ids:
+                assertFalse(table[master_id].deleted)
+            for component_id in component_ids:
+                assertFalse(component[component_id].deleted)
+
+        finally:
+            s3db.clear_config("del_component", "ondelete_cascade")
+            component.drop()
+            del current.model["components"]["del_master"]["component"]
+
     ## -------------------------------------------------------------------------
     #def testDeleteSimple(self):
         #""" Test hard deletion of a record """
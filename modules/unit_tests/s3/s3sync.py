@@ -5,15 +5,17 @@
 # To run this script use:
 # python web2py.py -S eden -M -R applications/eden/modules/unit_tests/s3/s3sync.py
 #
+import datetime
 import json
 import unittest
 
 from gluon import current
+from gluon.storage import Storage
 from lxml import etree
 
 from unit_tests import run_suite
 
-from s3 import S3SyncDataArchive
+from s3 import S3Sync, S3SyncDataArchive, S3SyncRepository
 from s3compat import PY2
 
 # =============================================================================
@@ -463,6 +465,134 @@ class DataArchiveTests(unittest.TestCase):
         extracted = archive.extract("test2.xml").read()
         assertEqual(extracted, xmlstr2)
 
+# =============================================================================
+class PagedSendTests(unittest.TestCase):
+    """ Tests for paged pull (continuation cursor) """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        xmlstr = """
+<s3xml>
+    <resource name="org_organisation" uuid="TESTPAGEDSEND3">
+        <data field="name">TestPagedSend3</data>
+    </resource>
+    <resource name="org_organisation" uuid="TESTPAGEDSEND1">
+        <data field="name">TestPagedSend1</data>
+    </resource>
+    <resource name="org_organisation" uuid="TESTPAGEDSEND2">
+        <data field="name">TestPagedSend2</data>
+    </resource>
+    <resource name="org_organisation" uuid="TESTPAGEDSEND5">
+        <data field="name">TestPagedSend5</data>
+    </resource>
+    <resource name="org_organisation" uuid="TESTPAGEDSEND4">
+        <data field="name">TestPagedSend4</data>
+    </resource>
+</s3xml>"""
+
+        xmltree = etree.ElementTree(etree.fromstring(xmlstr))
+        resource = current.s3db.resource("org_organisation")
+        resource.import_xml(xmltree)
+
+        # Same modified_on for all records, so that the uuid decides
+        table = current.s3db.org_organisation
+        self.msince = datetime.datetime(2090, 1, 1, 12, 0, 0, 250000)
+        query = (table.uuid.like("TESTPAGEDSEND%"))
+        current.db(query).update(modified_on = self.msince)
+
+    def testPagedSend(self):
+        """ Test that all records are sent page by page, in order """
+
+        assertEqual = self.assertEqual
+
+        connector = S3SyncRepository(Storage(id = None,
+                                             name = "unknown",
+                                             apitype = "eden",
+                                             ))
+
+        cursor = None
+        uuids = []
+        pages = 0
+        while True:
+            resource = current.s3db.resource("org_organisation")
+            result = connector.send(resource,
+                                    msince = self.msince,
+                                    page = (2, cursor),
+                                    )
+            tree = etree.ElementTree(etree.fromstring(result["response"]))
+            uuids.extend(tree.xpath("resource[@name='org_organisation']/@uuid"))
+            pages += 1
+
+            cursor = tree.getroot().get("next")
+            if not cursor:
+                break
+            self.assertTrue(pages < 5)
+
+        assertEqual(pages, 3)
+        assertEqual(uuids, ["TESTPAGEDSEND%s" % i for i in range(1, 6)])
+
+    def testParseCursor(self):
+        """ Test parsing of continuation cursors """
+
+        assertEqual = self.assertEqual
+
+        connector = S3SyncRepository(Storage(id = None,
+                                             name = "unknown",
+                                             apitype = "eden",
+                                             ))
+        parse = connector._parse_cursor
+
+        assertEqual(parse("2090-01-01T12:00:00.250000|TEST"),
+                    (datetime.datetime(2090, 1, 1, 12, 0, 0, 250000), "TEST"))
+        assertEqual(parse("2090-01-01T12:00:00|TEST|X"),
+                    (datetime.datetime(2090, 1, 1, 12, 0, 0), "TEST|X"))
+        assertEqual(parse("2090-01-01|TEST"), None)
+        assertEqual(parse("TEST"), None)
+        assertEqual(parse(None), None)
+
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+# =============================================================================
+class SortTasksTests(unittest.TestCase):
+    """ Tests for dependency ordering of sync tasks """
+
+    def testSortTasks(self):
+        """ Test that referenced resources are synchronized first """
+
+        names = ["hrm_human_resource",
+                 "inv_inv_item",
+                 "org_office",
+                 "org_organisation",
+                 ]
+        tasks = [Storage(id=i, resource_name=name)
+                 for i, name in enumerate(names)]
+
+        ordered = [task.resource_name for task in S3Sync.sort_tasks(tasks)]
+        self.assertEqual(len(ordered), len(names))
+
+        index = ordered.index
+        # Referenced directly
+        self.assertTrue(index("org_organisation") < index("org_office"))
+        self.assertTrue(index("org_organisation") < index("hrm_human_resource"))
+        # Referenced via super-entity (site_id)
+        self.assertTrue(index("org_office") < index("hrm_human_resource"))
+        self.assertTrue(index("org_office") < index("inv_inv_item"))
+
+    def testSortTasksOriginalOrder(self):
+        """ Test that independent tasks retain their original order """
+
+        names = ["org_organisation_type", "pr_person"]
+        tasks = [Storage(id=i, resource_name=name)
+                 for i, name in enumerate(names)]
+
+        ordered = [task.resource_name for task in S3Sync.sort_tasks(tasks)]
+        self.assertEqual(ordered, names)
+
 # =============================================================================
 if __name__ == "__main__":
 
@@ -474,6 +604,8 @@ if __name__ == "__main__":
         ImportMergeWithExistingDuplicate,
         ImportMergeWithoutExistingRecords,
         DataArchiveTests,
+        PagedSendTests,
+        SortTasksTests,
         )
 
 # END ========================================================================
@@ -1128,6 +1128,74 @@ class EventFrameTests(unittest.TestCase):
                                        ])
             assertEqual(result, expected_result)
 
+    # -------------------------------------------------------------------------
+    def testEventStore(self):
+        """ Test aggregation of events from the compact event store """
+
+        facts = [S3TimeSeriesFact("sum", "test"),
+                 S3TimeSeriesFact("count", "test"),
+                 S3TimeSeriesFact("max", "test"),
+                 S3TimeSeriesFact("cumulate",
+                                  None,
+                                  slope="test",
+                                  interval="months",
+                                  ),
+                 ]
+
+        rows = {1: "A", 2: "B", 3: "A", 4: None, 5: "B", 6: "A", 7: "C"}
+        cols = {1: 1, 2: [1, 2], 3: 2, 5: 1, 6: 3, 7: 3, 8: 2}
+
+        # Event frames with and without period boundaries at event ends
+        for start, end, slots in (((2012, 1, 1), (2012, 12, 15), "3 months"),
+                                  ((2012, 1, 14), (2012, 12, 1), "weeks"),
+                                  ((2012, 2, 1), (2013, 2, 1), "months"),
+                                  ):
+
+            # Event frame with events
+            ef = S3TimeSeriesEventFrame(tp_datetime(*start),
+                                        tp_datetime(*end),
+                                        slots=slots)
+            events = []
+            for event in self.events:
+                event_id = event.event_id
+                events.append(S3TimeSeriesEvent(event_id,
+                                                start = event.start,
+                                                end = event.end,
+                                                values = event.values,
+                                                row = rows.get(event_id),
+                                                col = cols.get(event_id),
+                                                ))
+            ef.extend(events)
+
+            # Event frame with event store
+            store_ef = S3TimeSeriesEventFrame(tp_datetime(*start),
+                                              tp_datetime(*end),
+                                              slots=slots)
+            store = S3TimeSeriesEventStore(["test"])
+            for event in events:
+                store.add(event.event_id,
+                          start = event.start,
+                          end = event.end,
+                          values = event.values,
+                          row = event.row,
+                          col = event.col,
+                          )
+            store.aggregate(store_ef, facts)
+
+            self.assertEqual(store.rows_keys, set(rows.values()) | {None})
+            self.assertEqual(store.cols_keys, {1, 2, 3, None})
+
+            # Compare the results
+            rkeys = ["A", "B", "C", None]
+            ckeys = [1, 2, 3, None]
+            expected = []
+            for period in ef:
+                period.aggregate(facts)
+                expected.append(period.as_dict(rows=rkeys, cols=ckeys))
+            result = [period.as_dict(rows=rkeys, cols=ckeys)
+                      for period in store_ef]
+            self.assertEqual(result, expected)
+
     # -------------------------------------------------------------------------
     def testPeriodsDays(self):
         """ Test iteration over periods (days) """
@@ -1848,6 +1916,101 @@ class FactParserTests(unittest.TestCase):
                                 msg = "Expression %s/%s - incorrect interval: %s != %s" %
                                 (i, j, fact.interval, interval))
 
+# =============================================================================
+class TimeSeriesSQLTests(unittest.TestCase):
+    """ Tests for database-side aggregation in S3TimeSeries """
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def setUpClass(cls):
+
+        db = current.db
+        db.define_table("tp_test_sql_events",
+                        Field("event_start", "date"),
+                        Field("event_end", "date"),
+                        Field("value", "integer"),
+                        Field("amount", "double"),
+                        Field("category"),
+                        )
+        table = db["tp_test_sql_events"]
+
+        events = (("A", (2012, 1, 1), (2012, 1, 8), 3, 0.5),
+                  ("A", (2012, 1, 8), (2012, 1, 8), 2, None),
+                  ("A", (2012, 1, 10), (2012, 2, 5), None, 1.5),
+                  ("B", None, (2012, 1, 15), 7, 2.0),
+                  ("B", (2011, 12, 20), None, 1, 0.25),
+                  ("B", (2012, 2, 1), (2012, 1, 29), 4, 4.0),
+                  ("C", (2012, 1, 22), (2012, 3, 1), 5, None),
+                  (None, (2012, 1, 29), (2012, 1, 30), 6, 3.0),
+                  (None, (2012, 3, 12), None, 8, 1.0),
+                  )
+
+        for category, start, end, value, amount in events:
+            table.insert(category = category,
+                         event_start = datetime.date(*start) if start else None,
+                         event_end = datetime.date(*end) if end else None,
+                         value = value,
+                         amount = amount,
+                         )
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def tearDownClass(cls):
+
+        db = current.db
+        db.tp_test_sql_events.drop()
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        current.auth.override = True
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.auth.override = False
+
+    # -------------------------------------------------------------------------
+    def testEquivalence(self):
+        """ Test that database and Python aggregation produce the same output """
+
+        s3db = current.s3db
+
+        assertEqual = self.assertEqual
+
+        facts = [S3TimeSeriesFact("count", "id"),
+                 S3TimeSeriesFact("count", "amount"),
+                 S3TimeSeriesFact("sum", "value"),
+                 S3TimeSeriesFact("min", "amount"),
+                 S3TimeSeriesFact("max", "value"),
+                 ]
+
+        options = ({"start": "2012-01-01", "end": "2012-03-01", "slots": "weeks"},
+                   {"start": "2012-01-03", "end": "2012-02-20", "slots": "5 days"},
+                   {"start": "2011-12-01", "end": "2012-04-01", "slots": "months"},
+                   {"end": "2012-03-15", "slots": "2 weeks"},
+                   )
+
+        for i, opts in enumerate(options):
+            for rows, cols in ((None, None), ("category", None), ("category", "value")):
+
+                output = []
+                for sql in (True, False):
+                    resource = s3db.resource("tp_test_sql_events")
+                    ts = S3TimeSeries(resource,
+                                      event_start = "event_start",
+                                      event_end = "event_end",
+                                      rows = rows,
+                                      cols = cols,
+                                      facts = facts,
+                                      sql = sql,
+                                      **opts)
+                    assertEqual(ts._sql_supported(), True)
+                    output.append(ts.as_dict())
+
+                assertEqual(output[0], output[1],
+                            msg = "Options %s (%s/%s): outputs differ" % (i, rows, cols))
+
 # =============================================================================
 if __name__ == "__main__":
 
@@ -1859,6 +2022,7 @@ if __name__ == "__main__":
         EventFrameTests,
         DtParseTests,
         TimeSeriesTests,
+        TimeSeriesSQLTests,
         FactParserTests,
     )
 
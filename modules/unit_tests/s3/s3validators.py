@@ -340,6 +340,72 @@ class ISONEOFLazyRepresentationTests(unittest.TestCase):
             assertEqual(options[str(org.id)], org.name)
         assertEqual(renderer.queries, 0) # using default query
 
+# =============================================================================
+class ISONEOFPrevalidationTests(unittest.TestCase):
+    """ Tests for bulk validation of foreign keys in IS_ONE_OF """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        table = current.s3db.org_organisation
+        self.ids = [table.insert(name="ISONEOFPRE%s" % i, acronym="P%s" % i)
+                    for i in range(3)]
+
+        # Mark the last one as deleted
+        current.db(table.id == self.ids[-1]).update(deleted=True)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.auth.override = False
+        current.db.rollback()
+
+    # -------------------------------------------------------------------------
+    def testPrevalidation(self):
+        """ Test that bulk-checked keys produce the same results """
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        table = current.s3db.org_organisation
+
+        valid, other, deleted = self.ids
+        invalid = max(self.ids) + 1000
+        values = [valid, str(other), deleted, invalid]
+
+        validator = IS_ONE_OF(db, "org_organisation.id")
+        expected = [validator(v)[1] is None for v in values]
+        assertEqual(expected, [True, True, False, False])
+
+        validator.prevalidate(values + ["invalid"])
+
+        # Keys are looked up from the bulk check
+        count = validator.count_prevalidated
+        assertEqual(count(table, [valid]), 1)
+        assertEqual(count(table, [str(deleted)]), 0)
+        assertEqual(count(table, [invalid]), 0)
+        assertEqual(count(table, [valid, other, other]), 2)
+
+        # Non-integer keys are not prevalidated
+        assertEqual(count(table, ["invalid"]), None)
+
+        # Same results as without bulk check
+        assertEqual([validator(v)[1] is None for v in values], expected)
+
+        # Changing the filter invalidates the bulk check
+        validator.set_filter(filterby="acronym", filter_opts=["P1"])
+        assertEqual(count(table, [valid]), None)
+        assertEqual(validator(valid)[1] is None, False)
+        assertEqual(validator(other)[1] is None, True)
+
+        # Clearing discards the bulk check
+        validator.set_filter(filterby="acronym", filter_opts=None)
+        validator.prevalidate(values)
+        assertEqual(count(table, [valid]), 1)
+        validator.clear_prevalidated()
+        assertEqual(count(table, [valid]), None)
+
 # =============================================================================
 class IS_PHONE_NUMBER_Tests(unittest.TestCase):
     """ Test IS_PHONE_NUMBER_SINGLE validator """
@@ -1787,6 +1853,7 @@ if __name__ == "__main__":
         ISLatTest,
         ISLonTest,
         ISONEOFLazyRepresentationTests,
+        ISONEOFPrevalidationTests,
         IS_PHONE_NUMBER_Tests,
         IS_UTC_DATETIME_Tests,
         IS_UTC_DATE_Tests,
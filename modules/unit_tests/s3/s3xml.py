@@ -1099,6 +1099,159 @@ class EntityResolverTests(unittest.TestCase):
         with self.assertRaises(SyntaxError):
             resource.import_xml(BytesIO(self.forbidden.encode("utf-8")))
 
+# =============================================================================
+class CSVChunkTests(unittest.TestCase):
+    """ Test conversion of CSV sources into chunks of rows """
+
+    source = b"""Name,Acronym
+#org+name,#org+acronym
+Org1,O1
+,
+Org2,O2
+Org3,O3
+Org4,O4
+Org5,O5
+"""
+
+    # -------------------------------------------------------------------------
+    def chunks(self, **args):
+        """ Get the chunks as list of (position, [names]) """
+
+        chunks = current.xml.csv2trees(BytesIO(self.source), **args)
+
+        output = []
+        for position, tree in chunks:
+            names = [col.text for col in tree.getroot().findall("row/col[@field='Name']")]
+            output.append((position, names))
+        return output
+
+    # -------------------------------------------------------------------------
+    def testSingleTree(self):
+        """ Test that csv2tree still returns all rows in one tree """
+
+        tree = current.xml.csv2tree(BytesIO(self.source))
+        rows = tree.getroot().findall("row")
+        self.assertEqual(len(rows), 5)
+
+        # Hashtags have been detected
+        col = rows[0].find("col[@field='Name']")
+        self.assertEqual(col.get("hashtag"), "#org+name")
+
+    # -------------------------------------------------------------------------
+    def testChunks(self):
+        """ Test conversion in chunks """
+
+        self.assertEqual(self.chunks(chunk_size=2),
+                         [(2, ["Org1", "Org2"]),
+                          (4, ["Org3", "Org4"]),
+                          (5, ["Org5"]),
+                          ])
+
+    # -------------------------------------------------------------------------
+    def testResume(self):
+        """ Test resumption after a checkpoint """
+
+        self.assertEqual(self.chunks(chunk_size=2, skip=3),
+                         [(5, ["Org4", "Org5"]),
+                          ])
+        self.assertEqual(self.chunks(chunk_size=2, skip=5), [])
+
+# =============================================================================
+class XSLTCacheTests(unittest.TestCase):
+    """ Tests for the XSLT stylesheet cache """
+
+    STYLESHEET = """<?xml version="1.0" encoding="utf-8"?>
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+    <xsl:include href="include.xsl"/>
+    <xsl:template match="/">
+        <result><xsl:call-template name="value"/></result>
+    </xsl:template>
+</xsl:stylesheet>"""
+
+    INCLUDE = """<?xml version="1.0" encoding="utf-8"?>
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+    <xsl:template name="value">%s</xsl:template>
+</xsl:stylesheet>"""
+
+    # -------------------------------------------------------------------------
+    def setUp(self):
+
+        import tempfile
+
+        # Stylesheets must be in the static folder to allow the include
+        static = os.path.join(current.request.folder, "static")
+        self.folder = folder = tempfile.mkdtemp(dir=static)
+
+        self.path = os.path.join(folder, "test.xsl")
+        with open(self.path, "w") as f:
+            f.write(self.STYLESHEET)
+        self.write_include("first", mtime=1000000000)
+
+    # -------------------------------------------------------------------------
+    def tearDown(self):
+
+        import shutil
+        shutil.rmtree(self.folder)
+
+    # -------------------------------------------------------------------------
+    def write_include(self, value, mtime):
+        """ Write the include, with a defined modification time """
+
+        path = os.path.join(self.folder, "include.xsl")
+        with open(path, "w") as f:
+            f.write(self.INCLUDE % value)
+        os.utime(path, (mtime, mtime))
+
+    # -------------------------------------------------------------------------
+    def transform(self):
+        """ Transform a document with the test stylesheet """
+
+        tree = etree.ElementTree(etree.Element("test"))
+        result = current.xml.transform(tree, self.path)
+        return result.getroot().text
+
+    # -------------------------------------------------------------------------
+    def testCache(self):
+        """ Test reuse of compiled stylesheets """
+
+        from s3 import S3XSLTCache
+
+        assertEqual = self.assertEqual
+
+        before = S3XSLTCache.statistics()
+
+        assertEqual(self.transform(), "first")
+        assertEqual(self.transform(), "first")
+
+        stats = S3XSLTCache.statistics()
+        assertEqual(stats["misses"] - before["misses"], 1)
+        assertEqual(stats["compiled"] - before["compiled"], 1)
+        assertEqual(stats["hits"] - before["hits"], 1)
+
+        transformer = S3XSLTCache.transformer(self.path)
+        assertEqual(S3XSLTCache.transformer(self.path) is transformer, True)
+
+        # Pre-parsed stylesheet in S3XMLFormat is shared
+        xmlformat = S3XMLFormat(self.path)
+        assertEqual(xmlformat.tree is S3XSLTCache.stylesheet(self.path), True)
+
+    # -------------------------------------------------------------------------
+    def testInvalidation(self):
+        """ Test invalidation when an include is modified """
+
+        from s3 import S3XSLTCache
+
+        assertEqual = self.assertEqual
+
+        assertEqual(self.transform(), "first")
+
+        self.write_include("second", mtime=1000000100)
+
+        before = S3XSLTCache.statistics()
+        assertEqual(self.transform(), "second")
+        stats = S3XSLTCache.statistics()
+        assertEqual(stats["misses"] - before["misses"], 1)
+
 # =============================================================================
 if __name__ == "__main__":
 
@@ -1110,6 +1263,8 @@ if __name__ == "__main__":
         S3JSONParsingTests,
         LookupListRepresentTests,
         EntityResolverTests,
+        CSVChunkTests,
+        XSLTCacheTests,
     )
 
 # END ========================================================================
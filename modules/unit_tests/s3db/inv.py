@@ -32,11 +32,289 @@ class InvTests(unittest.TestCase):
         current.db.rollback()
         current.auth.override = False
 
+# =============================================================================
+class StockLedgerTests(unittest.TestCase):
+    """ Tests for the stock movement ledger """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        s3db = current.s3db
+
+        # Warehouse
+        wtable = s3db.inv_warehouse
+        warehouse = {"name": "Stock Ledger Test Warehouse"}
+        warehouse["id"] = wtable.insert(**warehouse)
+        s3db.update_super(wtable, warehouse)
+        site_id = warehouse["site_id"]
+
+        # Supply item and pack
+        item_id = s3db.supply_item.insert(name = "Stock Ledger Test Item",
+                                          um = "pc",
+                                          )
+        pack_id = s3db.supply_item_pack.insert(item_id = item_id,
+                                               name = "pc",
+                                               quantity = 1,
+                                               )
+
+        # Stock item
+        inv_item_id = s3db.inv_inv_item.insert(site_id = site_id,
+                                               item_id = item_id,
+                                               item_pack_id = pack_id,
+                                               quantity = 40,
+                                               )
+        self.inv_item_id = inv_item_id
+
+        rtable = s3db.inv_recv
+        stable = s3db.inv_send
+        ttable = s3db.inv_track_item
+
+        # Received 60 on Jan 1
+        recv_id = rtable.insert(site_id = site_id,
+                                date = datetime.datetime(2020, 1, 1, 10, 0, 0),
+                                status = 1, # Received
+                                )
+        ttable.insert(item_id = item_id,
+                      item_pack_id = pack_id,
+                      quantity = 60,
+                      recv_quantity = 60,
+                      recv_id = recv_id,
+                      recv_inv_item_id = inv_item_id,
+                      )
+
+        # Sent 20 on Jan 5
+        send_id = stable.insert(site_id = site_id,
+                                date = datetime.datetime(2020, 1, 5, 12, 0, 0),
+                                status = 2, # Sent
+                                )
+        ttable.insert(item_id = item_id,
+                      item_pack_id = pack_id,
+                      quantity = 20,
+                      send_id = send_id,
+                      send_inv_item_id = inv_item_id,
+                      )
+
+        # Sent 5 on Jan 6, but cancelled
+        send_id = stable.insert(site_id = site_id,
+                                date = datetime.datetime(2020, 1, 6, 12, 0, 0),
+                                status = 3, # Cancelled
+                                )
+        ttable.insert(item_id = item_id,
+                      item_pack_id = pack_id,
+                      quantity = 5,
+                      send_id = send_id,
+                      send_inv_item_id = inv_item_id,
+                      )
+
+    # -------------------------------------------------------------------------
+    def testTotals(self):
+        """ Test range sums from the ledger """
+
+        from s3db.inv import inv_stock_ledger_totals, inv_stock_ledger_update
+
+        assertEqual = self.assertEqual
+
+        inv_item_id = self.inv_item_id
+        inv_stock_ledger_update([inv_item_id])
+
+        totals = inv_stock_ledger_totals([inv_item_id],
+                                         None,
+                                         datetime.date(2020, 1, 31),
+                                         )
+        assertEqual(totals[inv_item_id], [60, 20, 0, 0])
+
+        totals = inv_stock_ledger_totals([inv_item_id],
+                                         None,
+                                         datetime.date(2020, 1, 3),
+                                         )
+        assertEqual(totals[inv_item_id], [60, 0, 0, 20])
+
+        totals = inv_stock_ledger_totals([inv_item_id],
+                                         datetime.date(2020, 1, 2),
+                                         datetime.date(2020, 1, 31),
+                                         )
+        assertEqual(totals[inv_item_id], [0, 20, 0, 0])
+
+    # -------------------------------------------------------------------------
+    def testCheck(self):
+        """ Test the consistency check """
+
+        from s3db.inv import inv_stock_ledger_check, inv_stock_ledger_update
+
+        assertEqual = self.assertEqual
+
+        inv_item_id = self.inv_item_id
+        inv_stock_ledger_update([inv_item_id])
+
+        # Ledger is consistent
+        assertEqual(inv_stock_ledger_check([inv_item_id]), [])
+
+        # Corrupt the ledger
+        ltable = current.s3db.inv_stock_movement
+        query = (ltable.inv_item_id == inv_item_id) & \
+                (ltable.date == datetime.date(2020, 1, 1))
+        current.db(query).update(quantity_in = 50)
+
+        inconsistencies = inv_stock_ledger_check([inv_item_id])
+        assertEqual(len(inconsistencies), 1)
+        assertEqual(inconsistencies[0], (inv_item_id,
+                                         datetime.date(2020, 1, 1),
+                                         (50, 0),
+                                         (60, 0),
+                                         ))
+
+    #--------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
+# =============================================================================
+class StockCardTests(unittest.TestCase):
+    """ Tests for the (bulk) stock card update """
+
+    def setUp(self):
+
+        current.auth.override = True
+
+        s3db = current.s3db
+
+        # Warehouse
+        wtable = s3db.inv_warehouse
+        warehouse = {"name": "Stock Card Test Warehouse"}
+        warehouse["id"] = wtable.insert(**warehouse)
+        s3db.update_super(wtable, warehouse)
+        site_id = warehouse["site_id"]
+
+        # Supply item and packs
+        item_id = s3db.supply_item.insert(name = "Stock Card Test Item",
+                                          um = "pc",
+                                          )
+        ptable = s3db.supply_item_pack
+        pack_id = ptable.insert(item_id = item_id,
+                                name = "pc",
+                                quantity = 1,
+                                )
+        box_id = ptable.insert(item_id = item_id,
+                               name = "box",
+                               quantity = 10,
+                               )
+
+        # Two stock items for the same card
+        iitable = s3db.inv_inv_item
+        self.inv_item_ids = [iitable.insert(site_id = site_id,
+                                            item_id = item_id,
+                                            item_pack_id = pack_id,
+                                            quantity = 5,
+                                            ),
+                             iitable.insert(site_id = site_id,
+                                            item_id = item_id,
+                                            item_pack_id = box_id,
+                                            quantity = 2,
+                                            ),
+                             ]
+
+    # -------------------------------------------------------------------------
+    def testBulkUpdate(self):
+        """ Test creation and update of stock cards in bulk """
+
+        from s3db.inv import inv_stock_card_update
+
+        assertEqual = self.assertEqual
+
+        db = current.db
+        s3db = current.s3db
+
+        inv_item_ids = self.inv_item_ids
+        inv_stock_card_update(inv_item_ids, comments="Test")
+
+        # One card for both items, one log entry with the total in base units
+        ctable = s3db.inv_stock_card
+        ltable = s3db.inv_stock_log
+        join = ctable.on(ctable.id == ltable.card_id)
+        query = (ctable.item_id == s3db.inv_inv_item[inv_item_ids[0]].item_id)
+        rows = db(query).select(ltable.quantity_in,
+                                ltable.quantity_out,
+                                ltable.balance,
+                                join = join,
+                                orderby = ltable.id,
+                                )
+        assertEqual(len(rows), 1)
+        assertEqual((rows[0].quantity_in, rows[0].quantity_out, rows[0].balance),
+                    (25, 0, 25))
+        assertEqual(db(query).count(), 1)
+
+        # Reduce one item, update just that one
+        iitable = s3db.inv_inv_item
+        db(iitable.id == inv_item_ids[1]).update(quantity = 1)
+        inv_stock_card_update(inv_item_ids[1:], comments="Test")
+
+        rows = db(query).select(ltable.quantity_in,
+                                ltable.quantity_out,
+                                ltable.balance,
+                                join = join,
+                                orderby = ltable.id,
+                                )
+        assertEqual(len(rows), 2)
+        assertEqual((rows[1].quantity_in, rows[1].quantity_out, rows[1].balance),
+                    (0, 10, 15))
+
+    # -------------------------------------------------------------------------
+    def testLatestBalance(self):
+        """ Test that updates are based on the latest balance by date """
+
+        from s3db.inv import inv_stock_card_update
+
+        db = current.db
+        s3db = current.s3db
+
+        inv_item_ids = self.inv_item_ids
+        inv_stock_card_update(inv_item_ids, comments="Test")
+
+        ctable = s3db.inv_stock_card
+        ltable = s3db.inv_stock_log
+        join = ctable.on(ctable.id == ltable.card_id)
+        query = (ctable.item_id == s3db.inv_inv_item[inv_item_ids[0]].item_id)
+        log = db(query).select(ltable.ALL, join=join).first()
+
+        # Back-dated entry written later (e.g. by a correction)
+        ltable.insert(card_id = log.card_id,
+                      date = log.date - datetime.timedelta(days=1),
+                      quantity_in = 0,
+                      quantity_out = 5,
+                      balance = 20,
+                      )
+
+        # Increase one item, update just that one
+        iitable = s3db.inv_inv_item
+        db(iitable.id == inv_item_ids[0]).update(quantity = 6)
+        inv_stock_card_update(inv_item_ids[:1], comments="Test")
+
+        # Difference to the latest balance by date (25), not by ID (20)
+        row = db(query).select(ltable.quantity_in,
+                               ltable.quantity_out,
+                               ltable.balance,
+                               join = join,
+                               orderby = ~ltable.id,
+                               limitby = (0, 1),
+                               ).first()
+        self.assertEqual((row.quantity_in, row.quantity_out, row.balance),
+                         (1, 0, 26))
+
+    #--------------------------------------------------------------------------
+    def tearDown(self):
+
+        current.db.rollback()
+        current.auth.override = False
+
 # =============================================================================
 if __name__ == "__main__":
 
     run_suite(
         InvTests,
+        StockLedgerTests,
+        StockCardTests,
     )
 
 # END ========================================================================